@@ -0,0 +1,48 @@
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import db_utils
+
+
+def is_main_channel_exists_sql(main_channel_id):
+	# equivalent of is_main_channel_exists before the channel registry was added
+	with db_utils._DB_WRITE_LOCK:
+		db_utils._POOL.cursor.execute("SELECT id FROM main_channels WHERE channel_id=(?)", (main_channel_id,))
+		return bool(db_utils._POOL.cursor.fetchone())
+
+
+def measure(name, channel_filter, updates):
+	start = time.perf_counter()
+	for update in updates:
+		channel_filter(update)
+	elapsed = time.perf_counter() - start
+	print(f"  {name:<20} {elapsed / len(updates) * 1_000_000:8.2f} us/update")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Cost of the main channel update filter per update")
+	parser.add_argument("--updates", type=int, default=100_000)
+	parser.add_argument("--channels", type=int, default=50)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		db_utils._POOL = db_utils.ConnectionPool(os.path.join(directory, "bench.db"))
+		db_utils.run_migrations(db_utils._POOL.connection)
+		for channel_id in range(args.channels):
+			db_utils.insert_main_channel(-1001000000000 - channel_id)
+			db_utils.insert_individual_channel(-1002000000000 - channel_id, "{}", channel_id)
+
+		updates = [SimpleNamespace(chat=SimpleNamespace(id=-1001000000000 - i % (args.channels * 2)))
+				   for i in range(args.updates)]
+
+		print(f"Filtering {args.updates} updates, {args.channels} main channels")
+		measure("SQL query", lambda message_data: is_main_channel_exists_sql(message_data.chat.id), updates)
+		measure("channel registry", lambda message_data: db_utils.is_main_channel_exists(message_data.chat.id), updates)
+		db_utils._POOL.close_all()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import utils  # imported first to avoid a circular import between the bot modules
+import core_api
+import user_utils
+
+
+class SimulatedClient:
+	# stands in for pyrogram.Client when there are no credentials, connecting costs connect_delay seconds
+	def __init__(self, name, connect_delay, request_delay):
+		self.name = name
+		self.connect_delay = connect_delay
+		self.request_delay = request_delay
+		self.is_connected = False
+
+	async def start(self):
+		await asyncio.sleep(self.connect_delay)
+		self.is_connected = True
+
+	async def stop(self):
+		self.is_connected = False
+
+	async def __aenter__(self):
+		await self.start()
+		return self
+
+	async def __aexit__(self, *args):
+		await self.stop()
+
+	async def get_users(self, identifier):
+		await asyncio.sleep(self.request_delay)
+		return SimpleNamespace(id=identifier, first_name="User", last_name=None, username=None)
+
+	async def get_chat_members(self, chat_id):
+		await asyncio.sleep(self.request_delay)
+		for user_id in range(3):
+			yield SimpleNamespace(user=SimpleNamespace(id=user_id))
+
+
+def call_with_new_client(func, *args):
+	# equivalent of thread_async_to_sync before the client pool, a new client is connected for every call
+	async def run():
+		async with core_api.create_client(func.__name__) as client:
+			return await func.__wrapped__(*args, client=client)
+	return asyncio.run(run())
+
+
+def measure(name, func, repeats):
+	start = time.perf_counter()
+	for _ in range(repeats):
+		func()
+	elapsed = time.perf_counter() - start
+	print(f"  {name:<48} {elapsed / repeats * 1000:10.1f} ms/call")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Latency of core api calls with a new client per call and with the client pool")
+	parser.add_argument("--repeats", type=int, default=5)
+	parser.add_argument("--channels", type=int, nargs="*", default=[], help="channel ids for set_member_ids_channels")
+	parser.add_argument("--user", default="me", help="user id or username for get_user")
+	parser.add_argument("--simulate", action="store_true", help="use a simulated client instead of connecting to telegram")
+	parser.add_argument("--connect-delay", type=float, default=1.0, help="simulated connect and auth time in seconds")
+	parser.add_argument("--request-delay", type=float, default=0.05, help="simulated request time in seconds")
+	args = parser.parse_args()
+
+	patches = [patch("logging.error")]
+	if args.simulate:
+		patches.append(patch("core_api.create_client",
+							 side_effect=lambda name=None: SimulatedClient(name, args.connect_delay, args.request_delay)))
+		args.channels = args.channels or [-1001, -1002]
+	for patcher in patches:
+		patcher.start()
+
+	# a mocked bot makes get_user fall back to the core api, which is the path being measured
+	mock_bot = SimpleNamespace(get_chat=lambda user: (_ for _ in ()).throw(
+		user_utils.ApiTelegramException("getChat", None, {"error_code": 400, "description": "Bad Request: chat not found"})))
+
+	print("New client per call:")
+	measure("core_api.get_user", lambda: call_with_new_client(core_api.get_user, args.user), args.repeats)
+	measure("core_api.get_members (set_member_ids_channels)",
+			lambda: call_with_new_client(core_api.get_members, args.channels), args.repeats)
+
+	core_api.start_client_pool()
+	print("Client pool:")
+	measure("user_utils.get_user", lambda: user_utils.get_user(mock_bot, args.user), args.repeats)
+	measure("user_utils.set_member_ids_channels", lambda: user_utils.set_member_ids_channels(args.channels), args.repeats)
+	core_api.stop_client_pool()
+
+	for patcher in patches:
+		patcher.stop()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,76 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import db_utils
+
+MAIN_CHANNEL_ID = -1001000000001
+SUBCHANNEL_IDS = [-1002000000000 - i for i in range(10)]
+DISCUSSION_CHAT_ID = -1003000000001
+
+
+def fill_database(connection, rows):
+	cursor = connection.cursor()
+	cursor.executemany(
+		"INSERT INTO copied_messages (main_message_id, main_channel_id, copied_message_id, copied_channel_id) VALUES (?, ?, ?, ?)",
+		((i // len(SUBCHANNEL_IDS), MAIN_CHANNEL_ID, i, SUBCHANNEL_IDS[i % len(SUBCHANNEL_IDS)]) for i in range(rows))
+	)
+	cursor.executemany(
+		"INSERT INTO comment_messages (discussion_chat_id, message_id, reply_to_message_id, sender_id) VALUES (?, ?, ?, ?)",
+		((DISCUSSION_CHAT_ID, i, i - 1 if i % 5 else rows + i, i % 100) for i in range(rows))
+	)
+	cursor.executemany(
+		"INSERT INTO main_messages (main_channel_id, main_message_id, sender_id) VALUES (?, ?, ?)",
+		((MAIN_CHANNEL_ID, i, i % 100) for i in range(rows))
+	)
+	connection.commit()
+
+
+def measure(name, func, args_list):
+	start = time.perf_counter()
+	for args in args_list:
+		func(*args)
+	elapsed = time.perf_counter() - start
+	print(f"  {name:<32} {elapsed / len(args_list) * 1000:10.3f} ms/lookup")
+
+
+def run_lookups(rows, lookups):
+	copied_ids = [random.randrange(rows) for _ in range(lookups)]
+	measure("get_copied_message_data", db_utils.get_copied_message_data,
+			[(i // len(SUBCHANNEL_IDS), MAIN_CHANNEL_ID) for i in copied_ids])
+	measure("get_main_message_from_copied", db_utils.get_main_message_from_copied,
+			[(i, SUBCHANNEL_IDS[i % len(SUBCHANNEL_IDS)]) for i in copied_ids])
+	measure("get_comment_top_parent", db_utils.get_comment_top_parent,
+			[(i, DISCUSSION_CHAT_ID) for i in copied_ids])
+	measure("is_main_message_exists", db_utils.is_main_message_exists,
+			[(MAIN_CHANNEL_ID, i) for i in copied_ids])
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Lookup latency before and after the index migration")
+	parser.add_argument("--rows", type=int, default=1_000_000)
+	parser.add_argument("--lookups", type=int, default=20)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		db_utils._POOL = db_utils.ConnectionPool(os.path.join(directory, "bench.db"))
+		connection = db_utils._POOL.connection
+
+		db_utils.run_migrations(connection, target_version=2)
+		print(f"Filling database with {args.rows} rows per table")
+		fill_database(connection, args.rows)
+
+		print("Without indexes:")
+		run_lookups(args.rows, args.lookups)
+
+		db_utils.run_migrations(connection)
+		print("With indexes:")
+		run_lookups(args.rows, args.lookups)
+
+		db_utils._POOL.close_all()
+
+
+if __name__ == "__main__":
+	main()
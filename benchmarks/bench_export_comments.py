@@ -0,0 +1,68 @@
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import utils  # imported first to avoid a circular import between the bot modules
+import db_utils
+import messages_export_utils
+
+DISCUSSION_CHAT_ID = -1003000000001
+
+
+def generate_comments(count):
+	messages = []
+	for message_id in range(2, count + 2):
+		messages.append(SimpleNamespace(
+			id=message_id, empty=False, sender_chat=None,
+			reply_to_message=SimpleNamespace(id=message_id - 1 if message_id % 10 else 1),
+			from_user=SimpleNamespace(id=message_id % 100)
+		))
+	return messages
+
+
+def export_with_commit_per_comment(messages):
+	# equivalent of export_chat_comments before writes were grouped into one transaction
+	for message in messages:
+		db_utils.insert_comment_message(message.reply_to_message.id, message.id, DISCUSSION_CHAT_ID, message.from_user.id)
+
+
+def export_with_transaction(messages):
+	with patch("messages_export_utils.export_messages", return_value=messages), patch("logging.info"):
+		messages_export_utils.export_chat_comments(DISCUSSION_CHAT_ID)
+
+
+def run(name, export_function, messages, synchronous):
+	with tempfile.TemporaryDirectory() as directory:
+		db_utils._POOL = db_utils.ConnectionPool(os.path.join(directory, "bench.db"))
+		db_utils.run_migrations(db_utils._POOL.connection)
+		db_utils._POOL.connection.execute(f"PRAGMA synchronous={synchronous}")
+		db_utils.insert_or_update_last_msg_id(len(messages) + 1, DISCUSSION_CHAT_ID)
+
+		start = time.perf_counter()
+		export_function(messages)
+		elapsed = time.perf_counter() - start
+
+		db_utils._POOL.cursor.execute("SELECT COUNT(*) FROM comment_messages")
+		exported_count = db_utils._POOL.cursor.fetchone()[0]
+		db_utils._POOL.close_all()
+
+	print(f"  {name:<24} {elapsed:8.2f} s, {exported_count / elapsed:10.0f} comments/s")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Exporting comments with a commit per comment and in one transaction")
+	parser.add_argument("--comments", type=int, default=100_000)
+	parser.add_argument("--synchronous", default="NORMAL", help="value of the synchronous pragma, e.g. NORMAL or FULL")
+	args = parser.parse_args()
+
+	messages = generate_comments(args.comments)
+	print(f"Exporting {args.comments} comments, synchronous={args.synchronous}")
+	run("commit per comment", export_with_commit_per_comment, messages, args.synchronous)
+	run("single transaction", export_with_transaction, messages, args.synchronous)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,94 @@
+import argparse
+import contextlib
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from telebot.types import InlineKeyboardMarkup
+
+import utils  # imported first to avoid a circular import between the bot modules
+import forwarding_utils
+import rate_limiter
+from tests import test_helper
+
+
+class FakeBot:
+	# stands in for telebot.TeleBot, every request takes a token from the rate limiter and costs request_delay seconds
+	def __init__(self, request_delay, limiter):
+		self.request_delay = request_delay
+		self.limiter = limiter
+		self.requests_count = 0
+
+	def _request(self, chat_id):
+		if self.limiter:
+			self.limiter.acquire(chat_id)
+		time.sleep(self.request_delay)
+		self.requests_count += 1
+
+	def send_message(self, chat_id, text, entities=None, reply_markup=None):
+		self._request(chat_id)
+		return SimpleNamespace(message_id=1000, chat=SimpleNamespace(id=chat_id))
+
+	def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+		self._request(chat_id)
+
+
+def forward(bot, subchannels_count, concurrency):
+	subchannel_ids = [-1002000 - i for i in range(subchannels_count)]
+	post_data = test_helper.create_mock_message("ticket", [], -1001, 100)
+	hashtag_data = SimpleNamespace(is_closed=lambda: False, get_hashtag_list=lambda: [])
+
+	# only the requests to telegram are measured, database and ticket parsing are replaced with stubs
+	patches = [
+		patch("config_utils.FORWARDING_CONCURRENCY", concurrency),
+		patch("daily_reminder.update_ticket_data"),
+		patch("utils.add_channel_id_to_post_data"),
+		patch("forwarding_utils.get_subchannel_ids_from_hashtags", return_value=set(subchannel_ids)),
+		patch("forwarding_utils.filter_subchannels_by_members", return_value=subchannel_ids),
+		patch("forwarding_utils.get_unchanged_posts", return_value={}),
+		patch("forwarding_utils.generate_control_buttons", side_effect=lambda *args: InlineKeyboardMarkup()),
+		patch("channel_manager.get_ticket_settings_buttons", side_effect=lambda *args: InlineKeyboardMarkup()),
+		patch("db_utils.get_newest_copied_message", return_value=999),
+		patch("db_utils.transaction", contextlib.nullcontext),
+		patch("db_utils.insert_copied_message"),
+		patch("db_utils.insert_or_update_last_msg_id"),
+		patch("utils.edit_message_keyboard", side_effect=lambda bot_item, post, markup, chat_id, message_id:
+			  bot_item.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup)),
+		patch("forwarding_utils.update_copied_message", side_effect=lambda bot_item, chat_id, message_id:
+			  bot_item.edit_message_reply_markup(chat_id=chat_id, message_id=message_id)),
+	]
+	with contextlib.ExitStack() as stack:
+		for patcher in patches:
+			stack.enter_context(patcher)
+		forwarding_utils.forward_to_subchannel(bot, post_data, hashtag_data)
+
+
+def measure(name, subchannels_count, concurrency, args):
+	limiter = None
+	if not args.no_limiter:
+		limiter = rate_limiter.RateLimiter(args.global_rate, rate_limiter.RATE_LIMIT_PER_CHAT, rate_limiter.RATE_LIMIT_CHAT_BURST)
+	bot = FakeBot(args.request_delay, limiter)
+
+	start = time.perf_counter()
+	forward(bot, subchannels_count, concurrency)
+	elapsed = time.perf_counter() - start
+	print(f"  {name:<12} {elapsed:8.3f} s, {bot.requests_count} requests")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Wall time of forwarding one ticket to subchannels one by one and at the same time")
+	parser.add_argument("--subchannels", type=int, nargs="+", default=[1, 5, 15, 30])
+	parser.add_argument("--concurrency", type=int, default=8)
+	parser.add_argument("--request-delay", type=float, default=0.1, help="simulated request time in seconds")
+	parser.add_argument("--global-rate", type=float, default=rate_limiter.RATE_LIMIT_GLOBAL, help="requests per second")
+	parser.add_argument("--no-limiter", action="store_true", help="don't pace requests with the rate limiter")
+	args = parser.parse_args()
+
+	for subchannels_count in args.subchannels:
+		print(f"{subchannels_count} subchannels:")
+		measure("sequential", subchannels_count, 1, args)
+		measure("fan-out", subchannels_count, args.concurrency, args)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,96 @@
+import argparse
+import contextlib
+import copy
+import random
+import re
+import time
+from unittest.mock import patch
+
+from telebot.types import Message
+
+import utils  # imported first to avoid a circular import between the bot modules
+from hashtag_data import HashtagData, ParsedTicketCache, OPENED_TAG, CLOSED_TAG, PRIORITY_TAG, SCHEDULED_TAG
+
+MAIN_CHANNEL_ID = -1001000
+WORDS = ["fix", "report", "check", "deploy", "server", "invoice", "client", "update", "backup", "meeting"]
+
+
+def generate_ticket(message_id, user_tags, lines_count):
+	# ticket link, a few lines of text with mentioned users and other hashtags, service tags in the last line
+	lines = [f"{message_id}. " + " ".join(random.choices(WORDS, k=8))]
+	for _ in range(lines_count - 1):
+		words = random.choices(WORDS, k=10)
+		if random.random() < 0.3:
+			words.append("#" + random.choice(user_tags))
+		if random.random() < 0.2:
+			words.append("#" + random.choice(WORDS))
+		lines.append(" ".join(words))
+
+	service_tags = [random.choice([OPENED_TAG, CLOSED_TAG])]
+	service_tags += random.sample(user_tags, random.randint(1, 3))
+	service_tags.append(PRIORITY_TAG + random.choice(["1", "2", "3"]))
+	if random.random() < 0.3:
+		service_tags.append(f"{SCHEDULED_TAG} 2026-{random.randint(1, 12):02d}-{random.randint(1, 28):02d} 10:00")
+	lines.append(" ".join("#" + tag for tag in service_tags))
+	text = "\n".join(lines)
+
+	entities = [{"type": "text_link", "offset": 0, "length": len(str(message_id)), "url": f"https://t.me/c/1000/{message_id}"}]
+	entities += [{"type": "hashtag", "offset": match.start(), "length": match.end() - match.start()}
+				 for match in re.finditer(r"#\w+", text)]
+	return Message.de_json({
+		"message_id": message_id, "date": 1700000000, "text": text, "entities": entities,
+		"chat": {"id": MAIN_CHANNEL_ID, "type": "channel", "title": "Main"},
+		"sender_chat": {"id": MAIN_CHANNEL_ID, "type": "channel", "title": "Main"},
+	})
+
+
+def measure(name, tickets, update, repeats=1):
+	start = time.perf_counter()
+	for post_data in tickets:
+		# the same ticket is parsed several times while one event is handled
+		for _ in range(repeats):
+			hashtag_data = HashtagData(post_data, MAIN_CHANNEL_ID)
+			if update:
+				hashtag_data.get_updated_post_data()
+	elapsed = time.perf_counter() - start
+	print(f"  {name:<22} {elapsed / len(tickets) * 1_000_000:10.1f} us/ticket")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Parsing tickets with HashtagData")
+	parser.add_argument("--tickets", type=int, default=2000)
+	parser.add_argument("--users", type=int, default=30)
+	parser.add_argument("--lines", type=int, nargs="+", default=[2, 10])
+	parser.add_argument("--repeats", type=int, default=4, help="how many times every ticket is parsed")
+	args = parser.parse_args()
+
+	user_tags = {f"user{i}": 1000 + i for i in range(args.users)}
+	# members are already cached in real bot, so only the lookups in HashtagData are measured
+	with patch("config_utils.USER_TAGS", user_tags), \
+			patch("user_utils.get_member_ids_channel", return_value=list(user_tags.values())):
+		for lines_count in args.lines:
+			tickets = [generate_ticket(i, list(user_tags), lines_count) for i in range(1, args.tickets + 1)]
+			print(f"{args.tickets} tickets, {lines_count} lines, {args.users} users")
+			for update in [False, True]:
+				suffix = " + update" if update else ""
+				# parsed tickets cache without entries, so every ticket is parsed
+				with patch("hashtag_data.PARSED_TICKETS", ParsedTicketCache(max_size=0, log_interval=3600)):
+					# previous behaviour: whole message is deep-copied and user tags are computed for every check,
+					# faster whitespace replacement and entity alignment are used in both cases
+					with patch("utils.copy_post_data", copy.deepcopy), patch("user_utils.user_tags_snapshot", contextlib.nullcontext):
+						measure("deepcopy" + suffix, tickets, update)
+					measure("targeted copy" + suffix, tickets, update)
+
+			print(f"  every ticket parsed {args.repeats} times:")
+			for update in [False, True]:
+				suffix = " + update" if update else ""
+				parsed_tickets = ParsedTicketCache(max_size=args.tickets, log_interval=3600)
+				with patch("hashtag_data.PARSED_TICKETS", ParsedTicketCache(max_size=0, log_interval=3600)):
+					measure("without cache" + suffix, tickets, update, args.repeats)
+				with patch("hashtag_data.PARSED_TICKETS", parsed_tickets):
+					measure("with cache" + suffix, tickets, update, args.repeats)
+			print(f"  cache hit rate: {parsed_tickets.hit_count / (parsed_tickets.hit_count + parsed_tickets.miss_count):.1%}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,54 @@
+import argparse
+import random
+import time
+
+from id_ranges import IdRangeSet
+
+
+def generate_known_ids(last_id, known_share):
+	# known ids come in runs, like tickets copied to a channel one after another
+	known_ids = []
+	message_id = 1
+	while message_id <= last_id:
+		run_length = random.randint(1, 50)
+		if random.random() < known_share:
+			known_ids += range(message_id, min(message_id + run_length, last_id + 1))
+		message_id += run_length
+	return known_ids
+
+
+def missing_ids_with_lists(known_ids, last_id, sample_size):
+	# equivalent of the list filters before IdRangeSet, only the first sample_size ids are checked
+	# because checking all of them takes hours on large chats
+	return [i for i in range(1, min(sample_size, last_id) + 1) if i not in known_ids]
+
+
+def missing_ids_with_ranges(known_ids, last_id):
+	return list(IdRangeSet(known_ids).missing_ids(1, last_id))
+
+
+def measure(name, func, ids_count):
+	start = time.perf_counter()
+	result = func()
+	elapsed = time.perf_counter() - start
+	print(f"  {name:<16} {elapsed:10.3f} s, {elapsed / ids_count * 1_000_000_000:12.1f} ns/id, {len(result)} ids to fetch")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Computing message ids to fetch with lists and with IdRangeSet")
+	parser.add_argument("--ids", type=int, nargs="+", default=[1_000_000, 10_000_000])
+	parser.add_argument("--known-share", type=float, default=0.5, help="share of message ids that are already known")
+	parser.add_argument("--list-sample", type=int, default=200, help="amount of ids checked with the list filter")
+	args = parser.parse_args()
+
+	for last_id in args.ids:
+		known_ids = generate_known_ids(last_id, args.known_share)
+		id_ranges = IdRangeSet(known_ids)
+		print(f"{last_id} message ids, {len(known_ids)} known in {len(id_ranges.ranges())} ranges")
+		sample_size = min(args.list_sample, last_id)
+		measure("lists", lambda: missing_ids_with_lists(known_ids, last_id, sample_size), sample_size)
+		measure("IdRangeSet", lambda: missing_ids_with_ranges(known_ids, last_id), last_id)
+
+
+if __name__ == "__main__":
+	main()
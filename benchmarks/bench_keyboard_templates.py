@@ -0,0 +1,77 @@
+import argparse
+import random
+import time
+from unittest.mock import patch
+
+import utils  # imported first to avoid a circular import between the bot modules
+import forwarding_utils
+import hashtag_data as hashtag_data_utils
+
+
+def generate_callbacks(channels_count, user_tags, callbacks_count):
+	# ticket state of every callback, tickets of the same channel share assigned users, priorities and followers
+	callbacks = []
+	for _ in range(callbacks_count):
+		main_channel_id = -1001000 - random.randrange(channels_count)
+		assigned_user = random.choice(user_tags)
+		priority = random.choice(hashtag_data_utils.POSSIBLE_PRIORITIES)
+		followed_users = frozenset(random.sample(user_tags, random.randint(0, 2)))
+		callbacks.append((main_channel_id, random.random() < 0.8, assigned_user, priority, followed_users))
+	return callbacks
+
+
+def handle_uncached(callback):
+	main_channel_id, is_opened, assigned_user, priority, followed_users = callback
+	forwarding_utils._generate_control_buttons_template(is_opened, assigned_user, priority)
+	forwarding_utils._generate_subchannel_buttons_template(main_channel_id, f"{assigned_user} {priority}")
+	forwarding_utils._generate_priority_buttons_template(priority)
+	forwarding_utils._generate_cc_buttons_template(main_channel_id, assigned_user, followed_users)
+
+
+def handle_cached(callback):
+	# same keys as in generate_control_buttons, generate_subchannel_buttons, generate_priority_buttons and generate_cc_buttons
+	main_channel_id, is_opened, assigned_user, priority, followed_users = callback
+	templates = forwarding_utils.KEYBOARD_TEMPLATES
+	subchannel_name = f"{assigned_user} {priority}"
+	templates.get((main_channel_id, "control", is_opened, assigned_user, priority),
+				  lambda: forwarding_utils._generate_control_buttons_template(is_opened, assigned_user, priority))
+	templates.get((main_channel_id, "subchannels", subchannel_name),
+				  lambda: forwarding_utils._generate_subchannel_buttons_template(main_channel_id, subchannel_name))
+	templates.get((main_channel_id, "priorities", priority),
+				  lambda: forwarding_utils._generate_priority_buttons_template(priority))
+	templates.get((main_channel_id, "cc", assigned_user, followed_users),
+				  lambda: forwarding_utils._generate_cc_buttons_template(main_channel_id, assigned_user, followed_users))
+
+
+def measure(name, handle, callbacks):
+	start = time.perf_counter()
+	for callback in callbacks:
+		handle(callback)
+	elapsed = time.perf_counter() - start
+	print(f"  {name:<10} {elapsed:8.3f} s, {len(callbacks) / elapsed:10.0f} callbacks/s")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Generating ticket keyboards with and without template cache")
+	parser.add_argument("--users", type=int, nargs="+", default=[10, 50])
+	parser.add_argument("--channels", type=int, default=5)
+	parser.add_argument("--callbacks", type=int, default=50_000)
+	args = parser.parse_args()
+
+	for users_count in args.users:
+		user_tags = {f"user{i}": 1000 + i for i in range(users_count)}
+		callbacks = generate_callbacks(args.channels, list(user_tags), args.callbacks)
+
+		# members are already cached in real bot, so channel members lookup isn't measured
+		with patch("config_utils.USER_TAGS", user_tags), \
+				patch("user_utils.get_member_ids_channel", return_value=list(user_tags.values())):
+			forwarding_utils.KEYBOARD_TEMPLATES.invalidate()
+			print(f"{users_count} users, {args.channels} channels, {args.callbacks} callbacks")
+			measure("uncached", handle_uncached, callbacks)
+			measure("cached", handle_cached, callbacks)
+			print(f"  {len(forwarding_utils.KEYBOARD_TEMPLATES)} cached keyboard variants")
+			forwarding_utils.KEYBOARD_TEMPLATES.invalidate()
+
+
+if __name__ == "__main__":
+	main()
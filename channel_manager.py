@@ -435,6 +435,7 @@ def _call_settings_button(bot: telebot.TeleBot, call: CallbackQuery,
 			forwarding_utils.get_keyboard_from_channel_message(bot, call, newest_message_id),
 			ticket_keyboard
 		)
+		utils.KEYBOARD_MARKUP_STORE.invalidate(post_data.chat.id, newest_message_id)
 		bot.edit_message_reply_markup(chat_id=post_data.chat.id, message_id=newest_message_id,
 									  reply_markup=ticket_keyboard)
 
@@ -445,9 +446,14 @@ def update_settings_message(bot: telebot.TeleBot, channel_id: int, message_id: i
 	if keyboard is None:
 		keyboard = get_button_settings_keyboard()
 
+	if utils.KEYBOARD_MARKUP_STORE.is_sent(channel_id, message_id, keyboard, text):
+		return
+
 	try:
 		bot.edit_message_text(text=text, reply_markup=keyboard, chat_id=channel_id, message_id=message_id)
+		utils.KEYBOARD_MARKUP_STORE.save(channel_id, message_id, keyboard, text)
 	except ApiTelegramException as E:
+		utils.KEYBOARD_MARKUP_STORE.invalidate(channel_id, message_id)
 		logging.error(f"Error during channel settings message update - {E}")
 
 
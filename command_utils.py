@@ -186,6 +186,8 @@ def handle_user_change(bot: telebot.TeleBot, msg_data: telebot.types.Message, ar
 		prev_user = user_tags[tag] if tag in user_tags else None
 		config_utils.USER_TAGS[tag] = user
 		config_utils.update_config({"USER_TAGS": config_utils.USER_TAGS})
+		forwarding_utils.KEYBOARD_TEMPLATES.invalidate()
+		hashtag_data.PARSED_TICKETS.invalidate()
 		comment_detach = "", None
 
 		if config_utils.DISCUSSION_CHAT_DATA:
@@ -237,6 +239,8 @@ def handle_user_change(bot: telebot.TeleBot, msg_data: telebot.types.Message, ar
 		prev_user = user_utils.get_user_tags()[tag]
 		del config_utils.USER_TAGS[tag]
 		config_utils.update_config({"USER_TAGS": config_utils.USER_TAGS})
+		forwarding_utils.KEYBOARD_TEMPLATES.invalidate()
+		hashtag_data.PARSED_TICKETS.invalidate()
 		channel_manager.remove_user_tag_from_channels(bot, tag)
 		user_utils.load_users(bot)
 
@@ -311,6 +315,7 @@ def handle_change_button_text(bot: telebot.TeleBot, msg_data: telebot.types.Mess
 	else:
 		bot.send_message(chat_id=msg_data.chat.id, text=f"Unknown button name.")
 		return
+	forwarding_utils.KEYBOARD_TEMPLATES.invalidate()
 	bot.send_message(chat_id=msg_data.chat.id, text=f"Successfully updated button text.")
 	interval_updating_utils.start_interval_updating(bot)
 	config_utils.update_config({"BUTTON_TEXTS": config_utils.BUTTON_TEXTS})
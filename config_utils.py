@@ -23,9 +23,19 @@ DISCUSSION_CHAT_DATA: dict[str, int] = {}
 DEFAULT_USER_DATA: dict[str, str] = {}
 USER_TAGS: dict = {}
 UPDATE_INTERVAL: int = 60
+INTERVAL_UPDATE_CONCURRENCY: int = 2  # amount of channels checked at the same time
+FULL_UPDATE_INTERVAL: int = 60 * 24  # minutes between checks of all tickets, changed tickets are checked every UPDATE_INTERVAL
 INTERVAL_UPDATE_START_DELAY: int = 10
+DISCUSSION_RECHECK_INTERVAL: int = 60 * 24 * 7  # minutes between checks of all comments, only new comments are checked in between
 MAX_BUTTONS_IN_ROW: int = 3
-DELAY_AFTER_ONE_SCAN: int = 4
+RATE_LIMIT_GLOBAL: float = 30  # requests per second to telegram api
+RATE_LIMIT_PER_CHAT: float = 1  # requests per second to one chat
+RATE_LIMIT_CHAT_BURST: int = 20  # requests that can be sent to one chat at once
+WRITE_BEHIND_INTERVAL: int = 5  # seconds, 0 disables delayed database writes
+CORE_API_CLIENT_POOL_SIZE: int = 2
+EXPORT_CONCURRENCY: int = 2  # amount of chats exported at the same time
+FORWARDING_CONCURRENCY: int = 8  # amount of subchannels that receive the same ticket at the same time
+MAIN_MESSAGE_CACHE_TTL: int = 60 * 60 * 24  # seconds, stored ticket contents older than that are fetched again
 SUPPORTED_CONTENT_TYPES_TICKET: list = ["animation", "audio", "photo", "voice", "video", "document", "text"]
 SUPPORTED_CONTENT_TYPES_COMMENT: list = ["text", "audio", "document", "animation", "game", "photo", "sticker",
 										 "video", "video_note", "voice", "location", "contact", "venue", "dice",
@@ -48,6 +58,7 @@ ADMIN_USERS: list = []
 TO_DELETE_MSG_TEXT = "#to_delete"
 REMINDER_TIME_WITHOUT_INTERACTION: int = 60 * 24  # 24 hours
 LAST_DAILY_REMINDER_TIME: int = 0
+LAST_FULL_UPDATE_TIME: int = 0
 
 EMPTY_CALLBACK_DATA_BUTTON = "_"
 
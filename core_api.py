@@ -1,16 +1,20 @@
 import asyncio
+import atexit
+import contextlib
 import functools
+import itertools
 import logging
 import sqlite3
-from math import floor
-from typing import Union
+import threading
+from typing import Iterable, Iterator, Sized, Union
 
 import pyrogram
 from pyrogram import Client, utils
 from pyrogram.errors import FloodWait
 from pyrogram.types import User
 
-from config_utils import BOT_TOKEN, APP_API_ID, APP_API_HASH
+import rate_limiter
+from config_utils import BOT_TOKEN, APP_API_ID, APP_API_HASH, CORE_API_CLIENT_POOL_SIZE
 
 '''
 This is a fix for get_peer_type in Pyrogram module.
@@ -44,8 +48,8 @@ def thread_error(func):
 		try:
 			return await func(*args, **kwargs)
 		except FloodWait as E:
-			logging.info(f"Wait {E.value} seconds")
-			await asyncio.sleep(E.value)
+			rate_limiter.LIMITER.report_retry_after(E.value)
+			await rate_limiter.LIMITER.acquire_async()
 			return await inner_function(*args, **kwargs)
 		except sqlite3.OperationalError as E:
 			if str(E) == "database is locked":
@@ -59,49 +63,219 @@ def thread_error(func):
 	return inner_function
 
 
+class ClientPool:
+	# long-lived clients shared by all core api calls, they are connected once and reused
+	def __init__(self, size: int):
+		self.size = size
+		self._clients = None
+
+	def _get_clients(self) -> asyncio.Queue:
+		if self._clients is None:
+			self._clients = asyncio.Queue()
+			for i in range(self.size):
+				self._clients.put_nowait(create_client(f"pool_{i}"))
+		return self._clients
+
+	@staticmethod
+	async def _connect(client: pyrogram.Client):
+		if not client.is_connected:
+			logging.info(f"Connecting core api client {client.name}")
+			await client.start()
+
+	@staticmethod
+	async def _disconnect(client: pyrogram.Client):
+		if client.is_connected:
+			try:
+				await client.stop()
+			except Exception as E:
+				logging.error(f"Error while stopping core api client {client.name} - {E}")
+
+	@contextlib.asynccontextmanager
+	async def acquire(self):
+		clients = self._get_clients()
+		client = await clients.get()
+		try:
+			await self._connect(client)
+			yield client
+		except (OSError, ConnectionError):
+			# the client is reconnected on the next use
+			await self._disconnect(client)
+			raise
+		finally:
+			clients.put_nowait(client)
+
+	async def warm_up(self):
+		clients = [await self._get_clients().get() for _ in range(self.size)]
+		try:
+			await asyncio.gather(*[self._connect(client) for client in clients])
+		finally:
+			for client in clients:
+				self._get_clients().put_nowait(client)
+
+	async def close(self):
+		if self._clients is None:
+			return
+		clients = [await self._clients.get() for _ in range(self.size)]
+		await asyncio.gather(*[self._disconnect(client) for client in clients])
+		self._clients = None
+
+
+_CLIENT_POOL = ClientPool(CORE_API_CLIENT_POOL_SIZE)
+_EVENT_LOOP = None
+_EVENT_LOOP_LOCK = threading.Lock()
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+	global _EVENT_LOOP
+
+	with _EVENT_LOOP_LOCK:
+		if _EVENT_LOOP is None:
+			_EVENT_LOOP = asyncio.new_event_loop()
+			threading.Thread(target=_EVENT_LOOP.run_forever, name="core_api_loop", daemon=True).start()
+			atexit.register(stop_client_pool)
+		return _EVENT_LOOP
+
+
+def _run_in_event_loop(coroutine, timeout: float = None):
+	return asyncio.run_coroutine_threadsafe(coroutine, _get_event_loop()).result(timeout)
+
+
+def start_client_pool():
+	try:
+		_run_in_event_loop(_CLIENT_POOL.warm_up())
+	except Exception as E:
+		logging.error(f"Error while connecting core api clients - {E}")
+
+
+def stop_client_pool():
+	if _EVENT_LOOP is None or not _EVENT_LOOP.is_running():
+		return
+	try:
+		_run_in_event_loop(_CLIENT_POOL.close(), timeout=30)
+	except Exception as E:
+		logging.error(f"Error while stopping core api clients - {E}")
+
+
 def thread_async_to_sync(func):
+	@functools.wraps(func)
 	def inner_function(*args, **kwargs):
 		@thread_error
 		@functools.wraps(func)
 		async def inner_function_async(*args, **kwargs):
 			if "client" not in kwargs:
-				async with create_client(func.__name__) as client:
+				async with _CLIENT_POOL.acquire() as client:
 					kwargs["client"] = client
 					return await func(*args, **kwargs)
 			return await func(*args, **kwargs)
-		return asyncio.run(inner_function_async(*args, **kwargs))
+		return _run_in_event_loop(inner_function_async(*args, **kwargs))
 	return inner_function
 
 
+def _is_stop_requested(stop_flag: dict) -> bool:
+	return bool(stop_flag and "stop" in stop_flag and stop_flag["stop"])
+
+
+async def _get_messages_batch(chat_id: int, message_ids: list, client: pyrogram.Client = None) -> list:
+	if client:
+		return await client.get_messages(chat_id, message_ids)
+	async with _CLIENT_POOL.acquire() as pool_client:
+		return await pool_client.get_messages(chat_id, message_ids)
+
+
+async def _fetch_message_batches(chat_id: int, message_ids: Iterable[int], limit: int, client: pyrogram.Client = None,
+								 stop_flag: dict = None, cursor: int = 0):
+	# yields position of the next batch in message_ids together with fetched messages,
+	# message_ids can be a lazy iterator or a range, only ids of the current batch are kept in memory,
+	# without client a pool client is taken for every batch, so it isn't held while the batch is processed
+	total = f"/{len(message_ids)}" if isinstance(message_ids, Sized) else ""
+	remaining_ids = itertools.islice(message_ids, cursor, None)
+	read_counter = cursor
+	batch = list(itertools.islice(remaining_ids, limit))
+	while batch:
+		if _is_stop_requested(stop_flag):
+			logging.info(f"Stopping export progress, count exported: {read_counter}")
+			return
+
+		await rate_limiter.LIMITER.acquire_async(chat_id)
+		try:
+			messages = await _get_messages_batch(chat_id, batch, client)
+		except FloodWait as E:
+			rate_limiter.LIMITER.report_retry_after(E.value, chat_id)
+			continue
+
+		read_counter += len(batch)
+		logging.info(f"Exporting progress: {read_counter}{total}")
+		yield read_counter, messages
+		batch = list(itertools.islice(remaining_ids, limit))
+
+
 @thread_async_to_sync
 async def get_messages(chat_id: int, last_msg_id: int, limit: int, /, client: pyrogram.Client,
 					   message_ids: list = None, stop_flag: dict = None) -> list | None:
-	COUNT_FOR_SLEEP_MORE = 350
 	if not message_ids:
-		message_ids = list(range(1, last_msg_id + 1))
-	read_counter = 0
-	time_sleep: float = limit / 10 if len(message_ids) > (floor(COUNT_FOR_SLEEP_MORE / limit) * limit) else 1
+		message_ids = range(1, last_msg_id + 1)
 	exported_messages= []
 
-	while read_counter < len(message_ids):
-		if stop_flag and "stop" in stop_flag and stop_flag["stop"]:
-			logging.info(f"Stopping export progress, count exported: {read_counter}")
-			return None
+	async for _, messages in _fetch_message_batches(chat_id, message_ids, limit, client, stop_flag):
+		exported_messages += messages
+
+	if _is_stop_requested(stop_flag):
+		return None
+	return exported_messages
 
+
+# amount of fetched batches waiting to be processed, fetching is paused when the consumer falls behind
+_STREAM_PREFETCH_BATCHES = 2
+_STREAM_END = object()
+
+
+def stream_messages(chat_id: int, message_ids: Iterable[int], limit: int, stop_flag: dict = None,
+					client: pyrogram.Client = None, cursor: int = 0) -> Iterator[tuple[int, list]]:
+	# messages are fetched in the core api event loop while the caller processes previous batches,
+	# exception raised during fetching is raised in the caller.
+	# each batch is yielded with a cursor, passing it back as the cursor argument continues from the next batch
+	batches = asyncio.Queue(_STREAM_PREFETCH_BATCHES)
+
+	async def produce():
 		try:
-			exported_messages += await client.get_messages(chat_id, message_ids[read_counter:read_counter + limit])
-		except FloodWait as E:
-			logging.info(f"Wait {E.value} seconds")
-			await asyncio.sleep(E.value)
-			continue
+			# pool client isn't held while waiting for the consumer, because the consumer can call core api too
+			async for batch in _fetch_message_batches(chat_id, message_ids, limit, client, stop_flag, cursor):
+				await batches.put(batch)
+		except Exception as E:
+			logging.error(f"Core api stream_messages({chat_id}) exception - {E}")
+			await batches.put(E)
+			return
+		await batches.put(_STREAM_END)
 
-		read_counter += limit
-		logging.info(f"Exporting progress: {min(read_counter, len(message_ids))}/{len(message_ids)}")
+	loop = _get_event_loop()
+	producer = asyncio.run_coroutine_threadsafe(produce(), loop)
+	try:
+		while True:
+			item = asyncio.run_coroutine_threadsafe(batches.get(), loop).result()
+			if item is _STREAM_END:
+				return
+			if isinstance(item, Exception):
+				raise item
+			yield item
+	finally:
+		producer.cancel()
 
-		if read_counter < len(message_ids):
-			await asyncio.sleep(time_sleep)
 
-	return exported_messages
+# maximum amount of message ids that can be requested in one messages.getMessages/channels.getMessages call
+_MAX_MESSAGES_PER_REQUEST = 200
+
+
+@thread_async_to_sync
+async def get_messages_by_ids(message_ids_by_chat: dict, /, client: pyrogram.Client) -> dict | None:
+	messages = {}
+	for chat_id, message_ids in message_ids_by_chat.items():
+		for start in range(0, len(message_ids), _MAX_MESSAGES_PER_REQUEST):
+			chunk = message_ids[start:start + _MAX_MESSAGES_PER_REQUEST]
+			await rate_limiter.LIMITER.acquire_async(chat_id)
+			for message in await client.get_messages(chat_id, chunk):
+				messages[(chat_id, message.id)] = message
+
+	return messages
 
 
 @thread_async_to_sync
@@ -109,9 +283,9 @@ async def get_members(chat_ids: list, /, client: pyrogram.Client) -> dict | None
 	users = {}
 
 	for chat_id in chat_ids:
+		await rate_limiter.LIMITER.acquire_async(chat_id)
 		members = await __get_members_for_chat(chat_id, client=client)
 		users[chat_id] = members if members is not None else []
-		await asyncio.sleep(0.5)
 
 	return users
 
@@ -128,5 +302,6 @@ async def __get_members_for_chat(chat_id: int, /, client: pyrogram.Client) -> li
 
 @thread_async_to_sync
 async def get_user(identifier: Union[str, int], /, client: pyrogram.Client) -> User | None:
+	await rate_limiter.LIMITER.acquire_async()
 	return await client.get_users(identifier)
 
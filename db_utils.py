@@ -1,45 +1,371 @@
+import atexit
+import contextlib
 import logging
 import sqlite3
 import threading
+import time
+
+from id_ranges import IdRangeSet
 
 DB_FILENAME = "taskhelper_data.db"
 
-DB_CONNECTION = sqlite3.connect(DB_FILENAME, check_same_thread=False)
-CURSOR = DB_CONNECTION.cursor()
 
-_DB_LOCK = threading.RLock()
+class ConnectionPool:
+	def __init__(self, filename: str, timeout: float = 30, cache_size_kib: int = 16384):
+		self.filename = filename
+		self.timeout = timeout
+		self.cache_size_kib = cache_size_kib
+		self._local = threading.local()
+		self._connections = []
+		self._connections_lock = threading.Lock()
+
+	def _create_connection(self) -> sqlite3.Connection:
+		connection = sqlite3.connect(self.filename, timeout=self.timeout, check_same_thread=False)
+		connection.execute("PRAGMA journal_mode=WAL")
+		connection.execute("PRAGMA synchronous=NORMAL")
+		connection.execute(f"PRAGMA cache_size=-{self.cache_size_kib}")
+		connection.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+		return connection
+
+	@property
+	def connection(self) -> sqlite3.Connection:
+		connection = getattr(self._local, "connection", None)
+		if connection is None:
+			connection = self._create_connection()
+			self._local.connection = connection
+			with self._connections_lock:
+				self._connections.append(connection)
+		return connection
+
+	@property
+	def cursor(self) -> sqlite3.Cursor:
+		cursor = getattr(self._local, "cursor", None)
+		if cursor is None:
+			cursor = self.connection.cursor()
+			self._local.cursor = cursor
+		return cursor
+
+	def close_all(self):
+		with self._connections_lock:
+			for connection in self._connections:
+				try:
+					connection.close()
+				except sqlite3.Error:
+					pass
+			self._connections.clear()
+		self._local = threading.local()
+
+
+_POOL = ConnectionPool(DB_FILENAME)
+
+# sqlite allows only one writer at a time, readers use their own connections and don't wait for it
+_DB_WRITE_LOCK = threading.RLock()
+
+
+# delays idempotent writes and commits them periodically in one transaction,
+# writes with the same key are coalesced and only the latest one is executed
+class WriteBehindQueue:
+	def __init__(self):
+		self._pending = {}
+		self._lock = threading.Lock()
+		self._stop_event = threading.Event()
+		self._thread = None
+
+	def is_running(self):
+		return self._thread is not None
+
+	def put(self, key, func, *args):
+		with self._lock:
+			self._pending.pop(key, None)
+			self._pending[key] = (func, args)
+
+	def get(self, key):
+		with self._lock:
+			pending_write = self._pending.get(key)
+		if pending_write:
+			return pending_write[1]
+
+	def flush(self):
+		with self._lock:
+			pending_writes = list(self._pending.items())
+		if not pending_writes:
+			return
+
+		is_written = False
+		with transaction():
+			for key, (func, args) in pending_writes:
+				func(*args)
+			is_written = True
+
+		if not is_written:
+			return
+
+		# pending writes stay visible to readers until they are committed
+		with self._lock:
+			for key, pending_write in pending_writes:
+				if self._pending.get(key) is pending_write:
+					del self._pending[key]
+
+	def start(self, interval: float):
+		if self.is_running():
+			return
+
+		self._stop_event.clear()
+		self._thread = threading.Thread(target=self._flush_thread, args=(interval,), daemon=True)
+		self._thread.start()
+		atexit.register(self.stop)
+
+	def stop(self):
+		if not self.is_running():
+			return
+
+		self._stop_event.set()
+		self._thread.join()
+		self._thread = None
+		self.flush()
+
+	def _flush_thread(self, interval: float):
+		while not self._stop_event.wait(interval):
+			try:
+				self.flush()
+			except Exception as E:
+				logging.error(f"Error while flushing delayed database writes: {E}")
+
+
+WRITE_BEHIND_QUEUE = WriteBehindQueue()
+
+
+# in-memory copy of main channels and individual channel settings, it's checked for every incoming update,
+# so it is loaded once and kept up to date by the functions that change these tables
+class ChannelRegistry:
+	def __init__(self):
+		self._lock = threading.RLock()
+		self._main_channel_ids = None
+		self._individual_channels = None
+		self._listeners = []
+
+	def add_listener(self, listener):
+		# listener is called with id of the changed individual channel or with None when all channels are reloaded
+		self._listeners.append(listener)
+
+	def notify_changed(self, channel_id=None):
+		for listener in self._listeners:
+			listener(channel_id)
+
+	def _ensure_loaded(self) -> tuple:
+		# returns loaded main channels and individual channels, callers use the returned references,
+		# because the attributes can be reset by invalidate at any time
+		with self._lock:
+			if self._individual_channels is not None:
+				return self._main_channel_ids, self._individual_channels
+
+		with _DB_WRITE_LOCK, self._lock:
+			if self._individual_channels is not None:
+				return self._main_channel_ids, self._individual_channels
+
+			cursor = _POOL.cursor
+			cursor.execute("SELECT channel_id FROM main_channels")
+			main_channel_ids = {row[0]: None for row in cursor.fetchall()}
+			cursor.execute("SELECT channel_id, settings, priorities, user_id FROM individual_channel_settings")
+			individual_channels = {}
+			for channel_id, settings, priorities, user_id in cursor.fetchall():
+				individual_channels[channel_id] = {"settings": settings, "priorities": priorities, "user_id": user_id}
+
+			self._main_channel_ids = main_channel_ids
+			self._individual_channels = individual_channels
+			return main_channel_ids, individual_channels
+
+	def invalidate(self):
+		with self._lock:
+			self._main_channel_ids = None
+			self._individual_channels = None
+		self.notify_changed()
+
+	def get_main_channel_ids(self) -> list:
+		main_channel_ids, _ = self._ensure_loaded()
+		with self._lock:
+			return list(main_channel_ids)
+
+	def is_main_channel(self, channel_id) -> bool:
+		main_channel_ids, _ = self._ensure_loaded()
+		with self._lock:
+			return channel_id in main_channel_ids
+
+	def add_main_channel(self, channel_id):
+		with self._lock:
+			if self._main_channel_ids is not None:
+				self._main_channel_ids[channel_id] = None
+
+	def remove_main_channel(self, channel_id):
+		with self._lock:
+			if self._main_channel_ids is not None:
+				self._main_channel_ids.pop(channel_id, None)
+
+	def is_individual_channel(self, channel_id) -> bool:
+		_, individual_channels = self._ensure_loaded()
+		with self._lock:
+			return channel_id in individual_channels
+
+	def get_individual_channel(self, channel_id):
+		_, individual_channels = self._ensure_loaded()
+		with self._lock:
+			channel_data = individual_channels.get(channel_id)
+			return channel_data.copy() if channel_data else None
+
+	def get_individual_channels(self) -> list:
+		_, individual_channels = self._ensure_loaded()
+		with self._lock:
+			return [(channel_id, channel_data.copy()) for channel_id, channel_data in individual_channels.items()]
+
+	def add_individual_channel(self, channel_id, settings, user_id):
+		with self._lock:
+			if self._individual_channels is not None:
+				self._individual_channels[channel_id] = {"settings": settings, "priorities": None, "user_id": user_id}
+		self.notify_changed(channel_id)
+
+	def update_individual_channel(self, channel_id, **fields):
+		with self._lock:
+			if self._individual_channels is not None and channel_id in self._individual_channels:
+				self._individual_channels[channel_id].update(fields)
+		self.notify_changed(channel_id)
+
+	def remove_individual_channel(self, channel_id):
+		with self._lock:
+			if self._individual_channels is not None:
+				self._individual_channels.pop(channel_id, None)
+		self.notify_changed(channel_id)
+
+
+CHANNEL_REGISTRY = ChannelRegistry()
+
+
+_TRANSACTION_STATE = threading.local()
+
+
+def _get_transaction_depth():
+	return getattr(_TRANSACTION_STATE, "depth", 0)
+
+
+def _commit():
+	if _get_transaction_depth() == 0:
+		_POOL.connection.commit()
+
+
+@contextlib.contextmanager
+def transaction():
+	# groups several writes into a single commit, nested transactions are merged into the outermost one
+	with _DB_WRITE_LOCK:
+		depth = _get_transaction_depth()
+		_TRANSACTION_STATE.depth = depth + 1
+		try:
+			yield
+			if depth == 0:
+				_POOL.connection.commit()
+		except sqlite3.Error as E:
+			if depth > 0:
+				raise
+			_POOL.connection.rollback()
+			CHANNEL_REGISTRY.invalidate()
+			logging.error(f"SQLite error in transaction, changes were rolled back, error: {E.args}")
+		except BaseException:
+			if depth == 0:
+				_POOL.connection.rollback()
+				CHANNEL_REGISTRY.invalidate()
+			raise
+		finally:
+			_TRANSACTION_STATE.depth = depth
 
 
 def db_thread_lock(func):
 	def inner_function(*args, **kwargs):
-		with _DB_LOCK:
+		with _DB_WRITE_LOCK:
 			try:
 				return func(*args, **kwargs)
 			except sqlite3.Error as E:
+				if _get_transaction_depth() > 0:
+					raise
+				_POOL.connection.rollback()
+				CHANNEL_REGISTRY.invalidate()
 				logging.error(f"SQLite error in {func.__name__} function, error: {E.args}")
 	return inner_function
 
 
+def db_read_only(func):
+	def inner_function(*args, **kwargs):
+		try:
+			return func(*args, **kwargs)
+		except sqlite3.Error as E:
+			logging.error(f"SQLite error in {func.__name__} function, error: {E.args}")
+	return inner_function
+
+
 def initialize_db():
-	create_tables()
+	with _DB_WRITE_LOCK:
+		run_migrations(_POOL.connection)
 
 
 def is_table_exists(table_name):
+	return _is_table_exists(_POOL.cursor, table_name)
+
+
+def is_column_exists(table_name, column_name):
+	return _is_column_exists(_POOL.cursor, table_name, column_name)
+
+
+def _is_table_exists(cursor: sqlite3.Cursor, table_name):
 	sql = "SELECT count(name) FROM sqlite_master WHERE type='table' AND name=(?)"
-	CURSOR.execute(sql, (table_name,))
-	result = CURSOR.fetchone()[0]
+	cursor.execute(sql, (table_name,))
+	result = cursor.fetchone()[0]
 	return bool(result)
 
 
-def is_column_exists(table_name, column_name):
+def _is_column_exists(cursor: sqlite3.Cursor, table_name, column_name):
 	sql = "SELECT count(name) FROM pragma_table_info(?) WHERE name=(?)"
-	CURSOR.execute(sql, (table_name,column_name))
-	result = CURSOR.fetchone()[0]
+	cursor.execute(sql, (table_name, column_name))
+	result = cursor.fetchone()[0]
 	return bool(result)
 
 
-def create_tables():
-	if not is_table_exists("discussion_messages"):
+def get_schema_version(connection: sqlite3.Connection):
+	cursor = connection.cursor()
+	if not _is_table_exists(cursor, "schema_version"):
+		return 0
+
+	cursor.execute("SELECT MAX(version) FROM schema_version")
+	result = cursor.fetchone()[0]
+	return result or 0
+
+
+def run_migrations(connection: sqlite3.Connection, target_version: int = None):
+	cursor = connection.cursor()
+	cursor.execute('''
+		CREATE TABLE IF NOT EXISTS "schema_version" (
+			"version"	INTEGER PRIMARY KEY,
+			"applied_at"	INT NOT NULL
+		); ''')
+	connection.commit()
+
+	current_version = get_schema_version(connection)
+	if target_version is None:
+		target_version = len(_MIGRATIONS)
+
+	for version, migration in enumerate(_MIGRATIONS, start=1):
+		if version <= current_version or version > target_version:
+			continue
+
+		logging.info(f"Applying database migration {version}: {migration.__name__}")
+		try:
+			migration(cursor)
+			cursor.execute("INSERT INTO schema_version (version, applied_at) VALUES (?, ?)", (version, int(time.time())))
+			connection.commit()
+		except sqlite3.Error:
+			connection.rollback()
+			logging.exception(f"Database migration {version} failed")
+			raise
+
+
+def _create_tables(cursor: sqlite3.Cursor):
+	if not _is_table_exists(cursor, "discussion_messages"):
 		discussion_messages_table_sql = '''
 			CREATE TABLE "discussion_messages" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -48,9 +374,9 @@ def create_tables():
 				"discussion_message_id"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(discussion_messages_table_sql)
+		cursor.execute(discussion_messages_table_sql)
 
-	if not is_table_exists("copied_messages"):
+	if not _is_table_exists(cursor, "copied_messages"):
 		copied_messages_table_sql = '''
 			CREATE TABLE "copied_messages" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -60,9 +386,9 @@ def create_tables():
 				"copied_channel_id"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(copied_messages_table_sql)
+		cursor.execute(copied_messages_table_sql)
 
-	if not is_table_exists("last_message_ids"):
+	if not _is_table_exists(cursor, "last_message_ids"):
 		last_message_ids_table_sql = '''
 			CREATE TABLE "last_message_ids" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -70,9 +396,9 @@ def create_tables():
 				"last_message_id"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(last_message_ids_table_sql)
+		cursor.execute(last_message_ids_table_sql)
 
-	if not is_table_exists("comment_messages"):
+	if not _is_table_exists(cursor, "comment_messages"):
 		comment_messages_table_sql = '''
 			CREATE TABLE "comment_messages" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -82,9 +408,9 @@ def create_tables():
 				"sender_id"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(comment_messages_table_sql)
+		cursor.execute(comment_messages_table_sql)
 
-	if not is_table_exists("scheduled_messages"):
+	if not _is_table_exists(cursor, "scheduled_messages"):
 		scheduled_messages_table_sql = '''
 			CREATE TABLE "scheduled_messages" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -95,9 +421,9 @@ def create_tables():
 				"send_time"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(scheduled_messages_table_sql)
+		cursor.execute(scheduled_messages_table_sql)
 
-	if not is_table_exists("sent_scheduled_messages"):
+	if not _is_table_exists(cursor, "sent_scheduled_messages"):
 		sent_scheduled_messages_table_sql = '''
 			CREATE TABLE "sent_scheduled_messages" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -106,9 +432,9 @@ def create_tables():
 				"sent_at"   INT NOT NULL
 			); '''
 
-		CURSOR.execute(sent_scheduled_messages_table_sql)
+		cursor.execute(sent_scheduled_messages_table_sql)
 
-	if not is_table_exists("interval_updates_status"):
+	if not _is_table_exists(cursor, "interval_updates_status"):
 		interval_updates_status_table_sql = '''
 			CREATE TABLE "interval_updates_status" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -116,9 +442,9 @@ def create_tables():
 				"current_message_id"    INT NOT NULL
 			); '''
 
-		CURSOR.execute(interval_updates_status_table_sql)
+		cursor.execute(interval_updates_status_table_sql)
 
-	if not is_table_exists("individual_channel_settings"):
+	if not _is_table_exists(cursor, "individual_channel_settings"):
 		individual_channel_settings_table_sql = '''
 			CREATE TABLE "individual_channel_settings" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -128,22 +454,18 @@ def create_tables():
 				"user_id"           INT
 			); '''
 
-		CURSOR.execute(individual_channel_settings_table_sql)
-	elif is_column_exists("individual_channel_settings", "main_channel_id"):
-		individual_channel_settings_drop_column_sql = "ALTER TABLE individual_channel_settings DROP COLUMN main_channel_id"
-		CURSOR.execute(individual_channel_settings_drop_column_sql)
+		cursor.execute(individual_channel_settings_table_sql)
 
-
-	if not is_table_exists("main_channels"):
+	if not _is_table_exists(cursor, "main_channels"):
 		main_channels_table_sql = '''
 			CREATE TABLE "main_channels" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
 				"channel_id"    INT NOT NULL
 			); '''
 
-		CURSOR.execute(main_channels_table_sql)
+		cursor.execute(main_channels_table_sql)
 
-	if not is_table_exists("main_messages"):
+	if not _is_table_exists(cursor, "main_messages"):
 		main_messages_table_sql = '''
 			CREATE TABLE "main_messages" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -152,9 +474,9 @@ def create_tables():
 				"sender_id"         INT
 			); '''
 
-		CURSOR.execute(main_messages_table_sql)
+		cursor.execute(main_messages_table_sql)
 
-	if not is_table_exists("next_action_comments"):
+	if not _is_table_exists(cursor, "next_action_comments"):
 		next_action_comments_table_sql = '''
 			CREATE TABLE "next_action_comments" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -164,9 +486,9 @@ def create_tables():
 				"current_comment_text"  TEXT
 			); '''
 
-		CURSOR.execute(next_action_comments_table_sql)
+		cursor.execute(next_action_comments_table_sql)
 
-	if not is_table_exists("tickets_data"):
+	if not _is_table_exists(cursor, "tickets_data"):
 		tickets_data_table_sql = '''
 			CREATE TABLE "tickets_data" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -178,9 +500,9 @@ def create_tables():
 				"update_time"           INT
 			); '''
 
-		CURSOR.execute(tickets_data_table_sql)
+		cursor.execute(tickets_data_table_sql)
 
-	if not is_table_exists("user_reminder_data"):
+	if not _is_table_exists(cursor, "user_reminder_data"):
 		user_interactions_table_sql = '''
 			CREATE TABLE "user_reminder_data" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -188,12 +510,9 @@ def create_tables():
 				"last_interaction_time"     INT
 			); '''
 
-		CURSOR.execute(user_interactions_table_sql)
-	elif is_column_exists("user_reminder_data", "main_channel_id"):
-		user_reminder_data_drop_column_sql = "ALTER TABLE user_reminder_data DROP COLUMN main_channel_id"
-		CURSOR.execute(user_reminder_data_drop_column_sql)
+		cursor.execute(user_interactions_table_sql)
 
-	if not is_table_exists("reminded_tickets"):
+	if not _is_table_exists(cursor, "reminded_tickets"):
 		reminded_tickets_table_sql = '''
 			CREATE TABLE "reminded_tickets" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -203,9 +522,9 @@ def create_tables():
 				"reminded_at"               INT NOT NULL
 			); '''
 
-		CURSOR.execute(reminded_tickets_table_sql)
+		cursor.execute(reminded_tickets_table_sql)
 
-	if not is_table_exists("custom_channel_hashtags"):
+	if not _is_table_exists(cursor, "custom_channel_hashtags"):
 		custom_channel_hashtags_table_sql = '''
 			CREATE TABLE "custom_channel_hashtags" (
 				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -213,9 +532,9 @@ def create_tables():
 				"custom_hashtag"       TEXT
 			); '''
 
-		CURSOR.execute(custom_channel_hashtags_table_sql)
+		cursor.execute(custom_channel_hashtags_table_sql)
 
-	if not is_table_exists("comment_deleted_messages"):
+	if not _is_table_exists(cursor, "comment_deleted_messages"):
 		comment_deleted_messages_table_sql = '''
 					CREATE TABLE "comment_deleted_messages" (
 						"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -225,9 +544,187 @@ def create_tables():
 						"sender_id"	INT
 					); '''
 
-		CURSOR.execute(comment_deleted_messages_table_sql)
+		cursor.execute(comment_deleted_messages_table_sql)
+
+
+def _drop_legacy_main_channel_columns(cursor: sqlite3.Cursor):
+	for table_name in ["individual_channel_settings", "user_reminder_data"]:
+		if _is_column_exists(cursor, table_name, "main_channel_id"):
+			cursor.execute(f"ALTER TABLE {table_name} DROP COLUMN main_channel_id")
+
+
+_INDEXES = {
+	"idx_discussion_messages_main": ("discussion_messages", ["main_channel_id", "main_message_id", "discussion_message_id"]),
+	"idx_discussion_messages_discussion": ("discussion_messages", ["main_channel_id", "discussion_message_id", "main_message_id"]),
+	"idx_copied_messages_main": ("copied_messages", ["main_channel_id", "main_message_id", "copied_channel_id", "copied_message_id"]),
+	"idx_copied_messages_copied": ("copied_messages", ["copied_channel_id", "copied_message_id", "main_channel_id", "main_message_id"]),
+	"idx_last_message_ids_chat": ("last_message_ids", ["chat_id", "last_message_id"]),
+	"idx_comment_messages_message": ("comment_messages", ["discussion_chat_id", "message_id", "reply_to_message_id", "sender_id"]),
+	"idx_comment_messages_reply": ("comment_messages", ["discussion_chat_id", "reply_to_message_id", "message_id", "sender_id"]),
+	"idx_comment_deleted_messages_message": ("comment_deleted_messages", ["discussion_chat_id", "message_id"]),
+	"idx_scheduled_messages_main": ("scheduled_messages", ["main_channel_id", "main_message_id"]),
+	"idx_sent_scheduled_messages_main": ("sent_scheduled_messages", ["main_channel_id", "main_message_id"]),
+	"idx_interval_updates_status_channel": ("interval_updates_status", ["main_channel_id", "current_message_id"]),
+	"idx_individual_channel_settings_channel": ("individual_channel_settings", ["channel_id"]),
+	"idx_individual_channel_settings_user": ("individual_channel_settings", ["user_id"]),
+	"idx_main_channels_channel": ("main_channels", ["channel_id"]),
+	"idx_main_messages_main": ("main_messages", ["main_channel_id", "main_message_id", "sender_id"]),
+	"idx_next_action_comments_main": ("next_action_comments", ["main_channel_id", "main_message_id"]),
+	"idx_tickets_data_main": ("tickets_data", ["main_channel_id", "main_message_id"]),
+	"idx_user_reminder_data_user": ("user_reminder_data", ["user_tag"]),
+	"idx_reminded_tickets_main": ("reminded_tickets", ["main_channel_id", "main_message_id", "user_tag"]),
+	"idx_custom_channel_hashtags_channel": ("custom_channel_hashtags", ["channel_id"]),
+}
+
+
+def _create_indexes(cursor: sqlite3.Cursor):
+	for index_name, (table_name, columns) in _INDEXES.items():
+		columns_sql = ", ".join(f'"{column}"' for column in columns)
+		cursor.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({columns_sql})')
+	cursor.execute("ANALYZE")
+
+
+def _create_main_message_contents_table(cursor: sqlite3.Cursor):
+	cursor.execute('''
+		CREATE TABLE IF NOT EXISTS "main_message_contents" (
+			"main_channel_id"	INT NOT NULL,
+			"main_message_id"	INT NOT NULL,
+			"content"	TEXT NOT NULL,
+			"edit_date"	INT,
+			"update_time"	INT NOT NULL,
+			PRIMARY KEY("main_channel_id", "main_message_id")
+		); ''')
+
+
+def _create_export_checkpoints_table(cursor: sqlite3.Cursor):
+	cursor.execute('''
+		CREATE TABLE IF NOT EXISTS "export_checkpoints" (
+			"chat_id"	INT NOT NULL PRIMARY KEY,
+			"last_exported_message_id"	INT NOT NULL,
+			"update_time"	INT NOT NULL
+		); ''')
+
+
+def _create_dirty_tickets_table(cursor: sqlite3.Cursor):
+	# tickets that need to be checked during the next interval update
+	cursor.execute('''
+		CREATE TABLE IF NOT EXISTS "dirty_tickets" (
+			"main_channel_id"	INT NOT NULL,
+			"main_message_id"	INT NOT NULL,
+			"marked_at"	REAL NOT NULL,
+			PRIMARY KEY("main_channel_id","main_message_id")
+		); ''')
+
+
+def _add_comment_deleted_ranges(cursor: sqlite3.Cursor):
+	# deleted comments without saved data are stored as ranges from message_id to last_message_id,
+	# comments with saved data keep their own rows with equal message_id and last_message_id
+	if not _is_column_exists(cursor, "comment_deleted_messages", "last_message_id"):
+		cursor.execute('ALTER TABLE comment_deleted_messages ADD COLUMN "last_message_id" INT')
+	cursor.execute("UPDATE comment_deleted_messages SET last_message_id=message_id WHERE last_message_id IS NULL")
+
+	cursor.execute('''SELECT discussion_chat_id, message_id, last_message_id FROM comment_deleted_messages
+					  WHERE reply_to_message_id IS NULL AND sender_id IS NULL''')
+	deleted_ranges = {}
+	for discussion_chat_id, first_message_id, last_message_id in cursor.fetchall():
+		deleted_ranges.setdefault(discussion_chat_id, IdRangeSet()).add_range(first_message_id, last_message_id)
+
+	cursor.execute("DELETE FROM comment_deleted_messages WHERE reply_to_message_id IS NULL AND sender_id IS NULL")
+	cursor.executemany(
+		"INSERT INTO comment_deleted_messages (discussion_chat_id, message_id, last_message_id) VALUES (?, ?, ?)",
+		((chat_id, first, last) for chat_id, id_ranges in deleted_ranges.items() for first, last in id_ranges.ranges())
+	)
+	cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_comment_deleted_messages_range"
+					  ON "comment_deleted_messages" ("discussion_chat_id", "message_id", "last_message_id")''')
+
+	# discussion messages up to verified_message_id were checked, verified_at is the time
+	# when the check was started from the first message
+	cursor.execute('''
+		CREATE TABLE IF NOT EXISTS "discussion_check_progress" (
+			"discussion_chat_id"	INT NOT NULL PRIMARY KEY,
+			"verified_message_id"	INT NOT NULL,
+			"verified_at"	INT NOT NULL
+		); ''')
+
+
+def _replace_channel_priorities(cursor: sqlite3.Cursor, channel_id, priorities):
+	cursor.execute("DELETE FROM individual_channel_priorities WHERE channel_id=(?)", (channel_id,))
+	priorities = set(priorities.split(",")) if priorities else set()
+	cursor.executemany("INSERT INTO individual_channel_priorities (channel_id, priority) VALUES (?, ?)",
+					   [(channel_id, priority) for priority in priorities if priority])
+
+
+def _create_individual_channel_priorities_table(cursor: sqlite3.Cursor):
+	# priorities of individual channels, kept in sync with the priorities column
+	cursor.execute('''
+		CREATE TABLE IF NOT EXISTS "individual_channel_priorities" (
+			"channel_id"	INT NOT NULL,
+			"priority"	TEXT NOT NULL,
+			PRIMARY KEY("channel_id", "priority")
+		); ''')
+	cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_individual_channel_priorities_priority"
+					  ON "individual_channel_priorities" ("priority", "channel_id")''')
+
+	cursor.execute("SELECT channel_id, priorities FROM individual_channel_settings")
+	for channel_id, priorities in cursor.fetchall():
+		_replace_channel_priorities(cursor, channel_id, priorities)
+
+
+_TICKET_USER_ROLES = ["assigned", "followed"]
+
+
+def _replace_ticket_users(cursor: sqlite3.Cursor, main_message_id, main_channel_id, user_tags):
+	# user_tags is a comma separated list where the first user is assigned and the rest are followers
+	cursor.execute("DELETE FROM ticket_users WHERE main_message_id=(?) AND main_channel_id=(?)", (main_message_id, main_channel_id))
+	if not user_tags:
+		return
 
-	DB_CONNECTION.commit()
+	assigned_user, *followed_users = user_tags.split(",")
+	rows = {(main_channel_id, main_message_id, assigned_user, _TICKET_USER_ROLES[0])}
+	rows.update((main_channel_id, main_message_id, user_tag, _TICKET_USER_ROLES[1]) for user_tag in followed_users if user_tag)
+	cursor.executemany("INSERT OR IGNORE INTO ticket_users (main_channel_id, main_message_id, user_tag, role) VALUES (?, ?, ?, ?)", rows)
+
+
+def _create_ticket_users_table(cursor: sqlite3.Cursor):
+	# users of the ticket by role, kept in sync with the user_tags column of tickets_data
+	cursor.execute('''
+		CREATE TABLE IF NOT EXISTS "ticket_users" (
+			"main_channel_id"	INT NOT NULL,
+			"main_message_id"	INT NOT NULL,
+			"user_tag"	TEXT NOT NULL,
+			"role"	TEXT NOT NULL,
+			PRIMARY KEY("main_channel_id", "main_message_id", "role", "user_tag")
+		); ''')
+	cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_ticket_users_user_tag"
+					  ON "ticket_users" ("main_channel_id", "user_tag")''')
+	cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_ticket_users_role"
+					  ON "ticket_users" ("main_channel_id", "role", "user_tag")''')
+
+	cursor.execute("SELECT main_message_id, main_channel_id, user_tags FROM tickets_data")
+	for main_message_id, main_channel_id, user_tags in cursor.fetchall():
+		_replace_ticket_users(cursor, main_message_id, main_channel_id, user_tags)
+
+
+def _add_copied_message_content_hash(cursor: sqlite3.Cursor):
+	# hash of the ticket content that was sent to the subchannel, NULL for copies sent before hashes were saved
+	if not _is_column_exists(cursor, "copied_messages", "content_hash"):
+		cursor.execute('ALTER TABLE copied_messages ADD COLUMN "content_hash" TEXT')
+
+
+# Append new migrations to the end of the list, never reorder or remove existing ones,
+# the position of the migration in the list is its schema version
+_MIGRATIONS = [
+	_create_tables,
+	_drop_legacy_main_channel_columns,
+	_create_indexes,
+	_create_main_message_contents_table,
+	_create_export_checkpoints_table,
+	_create_dirty_tickets_table,
+	_add_comment_deleted_ranges,
+	_create_individual_channel_priorities_table,
+	_create_ticket_users_table,
+	_add_copied_message_content_hash,
+]
 
 
 @db_thread_lock
@@ -237,72 +734,86 @@ def insert_or_update_discussion_message(main_message_id, main_channel_id, discus
 	else:
 		sql = "INSERT INTO discussion_messages (discussion_message_id, main_message_id, main_channel_id) VALUES (?, ?, ?)"
 
-	CURSOR.execute(sql, (discussion_message_id, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (discussion_message_id, main_message_id, main_channel_id, ))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_discussion_message_id(main_message_id, main_channel_id):
 	sql = "SELECT discussion_message_id FROM discussion_messages WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_main_from_discussion_message(discussion_message_id, main_channel_id):
 	sql = "SELECT main_message_id FROM discussion_messages WHERE discussion_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (discussion_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (discussion_message_id, main_channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
 
 @db_thread_lock
-def insert_copied_message(main_message_id, main_channel_id, copied_message_id, copied_channel_id):
-	sql = "INSERT INTO copied_messages (copied_message_id, copied_channel_id, main_message_id, main_channel_id) VALUES (?, ?, ?, ?)"
-	CURSOR.execute(sql, (copied_message_id, copied_channel_id, main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+def insert_copied_message(main_message_id, main_channel_id, copied_message_id, copied_channel_id, content_hash=None):
+	sql = "INSERT INTO copied_messages (copied_message_id, copied_channel_id, main_message_id, main_channel_id, content_hash) VALUES (?, ?, ?, ?, ?)"
+	_POOL.cursor.execute(sql, (copied_message_id, copied_channel_id, main_message_id, main_channel_id, content_hash,))
+	_commit()
+
+
+@db_thread_lock
+def update_copied_message_content_hash(copied_message_id, copied_channel_id, content_hash):
+	sql = "UPDATE copied_messages SET content_hash=(?) WHERE copied_message_id=(?) AND copied_channel_id=(?)"
+	_POOL.cursor.execute(sql, (content_hash, copied_message_id, copied_channel_id,))
+	_commit()
 
 
 @db_thread_lock
 def delete_copied_message(copied_message_id, copied_channel_id):
 	sql = "DELETE FROM copied_messages WHERE copied_message_id=(?) and copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_message_id, copied_channel_id))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (copied_message_id, copied_channel_id))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def is_copied_message_exists(copied_message_id, copied_channel_id):
 	sql = "SELECT id FROM copied_messages WHERE copied_message_id=(?) and copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_message_id, copied_channel_id))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (copied_message_id, copied_channel_id))
+	result = _POOL.cursor.fetchone()
 	return bool(result)
 
 
-@db_thread_lock
+@db_read_only
 def get_copied_message_data(main_message_id, main_channel_id):
 	sql = "SELECT copied_message_id, copied_channel_id FROM copied_messages WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = _POOL.cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
+def get_copied_messages_with_hash(main_message_id, main_channel_id):
+	sql = "SELECT copied_message_id, copied_channel_id, content_hash FROM copied_messages WHERE main_message_id=(?) and main_channel_id=(?)"
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	return _POOL.cursor.fetchall()
+
+
+@db_read_only
 def get_main_message_from_copied(copied_message_id, copied_channel_id):
 	sql = "SELECT main_message_id, main_channel_id FROM copied_messages WHERE copied_message_id=(?) and copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_message_id, copied_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (copied_message_id, copied_channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result
 
 
-@db_thread_lock
+@db_read_only
 def get_oldest_copied_message(copied_channel_id):
 	sql = "SELECT min(copied_message_id) FROM copied_messages WHERE copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (copied_channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
@@ -310,15 +821,15 @@ def get_oldest_copied_message(copied_channel_id):
 @db_thread_lock
 def update_copied_message_id(copied_message_id, copied_channel_id, updated_message_id):
 	sql = "UPDATE copied_messages SET copied_message_id=(?) WHERE copied_message_id=(?) AND copied_channel_id=(?)"
-	CURSOR.execute(sql, (updated_message_id, copied_message_id, copied_channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (updated_message_id, copied_message_id, copied_channel_id,))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_copied_messages_from_main(main_message_id, main_channel_id):
 	sql = "SELECT copied_message_id, copied_channel_id FROM copied_messages WHERE main_message_id=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = _POOL.cursor.fetchall()
 	return result
 
 
@@ -326,37 +837,54 @@ def get_copied_messages_existing_main_from_copied_channel(copied_channel_id):
 	sql = '''SELECT c.copied_message_id FROM copied_messages c
 			 LEFT JOIN main_messages m ON m.main_message_id = c.main_message_id
 	 		 WHERE c.copied_channel_id=(?) and m.id IS NOT NULL'''
-	CURSOR.execute(sql, (copied_channel_id,))
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, (copied_channel_id,))
+	result = _POOL.cursor.fetchall()
 	if result:
 		return [row[0] for row in result]
 	return []
 
-@db_thread_lock
+@db_read_only
 def get_newest_copied_message(copied_channel_id):
 	sql = "SELECT max(copied_message_id) FROM copied_messages WHERE copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (copied_channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
 def insert_or_update_last_msg_id(last_message_id, chat_id):
-	if get_last_message_id(chat_id):
+	if WRITE_BEHIND_QUEUE.is_running():
+		WRITE_BEHIND_QUEUE.put(("last_message_ids", chat_id), _insert_or_update_last_msg_id, last_message_id, chat_id)
+		return
+
+	_insert_or_update_last_msg_id(last_message_id, chat_id)
+
+
+@db_thread_lock
+def _insert_or_update_last_msg_id(last_message_id, chat_id):
+	if _get_stored_last_message_id(chat_id):
 		sql = "UPDATE last_message_ids SET last_message_id=(?) WHERE chat_id=(?)"
 	else:
 		sql = "INSERT INTO last_message_ids (last_message_id, chat_id) VALUES (?, ?)"
 
-	CURSOR.execute(sql, (last_message_id, chat_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (last_message_id, chat_id,))
+	_commit()
 
 
-@db_thread_lock
 def get_last_message_id(chat_id):
+	pending_write = WRITE_BEHIND_QUEUE.get(("last_message_ids", chat_id))
+	if pending_write:
+		last_message_id, _ = pending_write
+		return last_message_id
+
+	return _get_stored_last_message_id(chat_id)
+
+
+@db_read_only
+def _get_stored_last_message_id(chat_id):
 	sql = "SELECT last_message_id FROM last_message_ids WHERE chat_id=(?)"
-	CURSOR.execute(sql, (chat_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (chat_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
@@ -367,36 +895,36 @@ def insert_comment_message(reply_to_message_id, discussion_message_id, discussio
 		return
 
 	sql = "INSERT INTO comment_messages (reply_to_message_id, message_id, discussion_chat_id, sender_id) VALUES (?, ?, ?, ?)"
-	CURSOR.execute(sql, (reply_to_message_id, discussion_message_id, discussion_chat_id, sender_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (reply_to_message_id, discussion_message_id, discussion_chat_id, sender_id,))
+	_commit()
 
 
 @db_thread_lock
 def delete_comment_message(discussion_message_id, discussion_chat_id):
 	insert_comment_deleted_message(discussion_message_id, discussion_chat_id)
 	sql = "DELETE FROM comment_messages WHERE message_id = (?) and discussion_chat_id = (?)"
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (discussion_message_id, discussion_chat_id))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def is_comment_exist(discussion_message_id, discussion_chat_id):
 	sql = "SELECT id FROM comment_messages WHERE message_id=(?) and discussion_chat_id=(?)"
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (discussion_message_id, discussion_chat_id,))
+	result = _POOL.cursor.fetchone()
 	return bool(result)
 
 
-@db_thread_lock
+@db_read_only
 def get_reply_comment_message(discussion_message_id, discussion_chat_id):
 	sql = "SELECT reply_to_message_id FROM comment_messages WHERE message_id=(?) and discussion_chat_id=(?)"
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (discussion_message_id, discussion_chat_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_comments_count(discussion_message_id, discussion_chat_id, ignored_sender_id=0):
 	sql = '''
 		WITH RECURSIVE
@@ -409,12 +937,12 @@ def get_comments_count(discussion_message_id, discussion_chat_id, ignored_sender
 		SELECT count(comment_id) - 1 FROM reply_messages;
 	'''
 
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
+	result = _POOL.cursor.fetchone()
 	return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_comment_top_parent(discussion_message_id, discussion_chat_id):
 	sql = '''
 		WITH RECURSIVE
@@ -427,12 +955,12 @@ def get_comment_top_parent(discussion_message_id, discussion_chat_id):
 		SELECT MIN(comment_id) FROM reply_messages;	
 	'''
 
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (discussion_message_id, discussion_chat_id,))
+	result = _POOL.cursor.fetchone()
 	return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_last_comment(discussion_message_id, discussion_chat_id, ignored_sender_id=0):
 	sql = '''
 		WITH RECURSIVE
@@ -445,8 +973,8 @@ def get_last_comment(discussion_message_id, discussion_chat_id, ignored_sender_i
 		SELECT MAX(comment_id) FROM reply_messages;
 	'''
 
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
+	result = _POOL.cursor.fetchone()
 	return result[0]
 
 
@@ -456,97 +984,113 @@ def insert_comment_deleted_message(discussion_message_id, discussion_chat_id):
 		return
 
 	if is_comment_exist(discussion_message_id, discussion_chat_id):
-		sql = ''' INSERT INTO comment_deleted_messages(discussion_chat_id, message_id, reply_to_message_id, sender_id)
-					SELECT discussion_chat_id, message_id, reply_to_message_id, sender_id FROM comment_messages
+		sql = ''' INSERT INTO comment_deleted_messages(discussion_chat_id, message_id, last_message_id, reply_to_message_id, sender_id)
+					SELECT discussion_chat_id, message_id, message_id, reply_to_message_id, sender_id FROM comment_messages
 					WHERE discussion_chat_id = (?) and message_id = (?) '''
-	else:
-		sql = "INSERT INTO comment_deleted_messages(discussion_chat_id, message_id) VALUES (?, ?)"
+		_POOL.cursor.execute(sql, (discussion_chat_id, discussion_message_id))
+		_commit()
+		return
 
-	CURSOR.execute(sql, (discussion_chat_id, discussion_message_id))
-	DB_CONNECTION.commit()
+	insert_comment_deleted_range(discussion_chat_id, discussion_message_id, discussion_message_id)
 
 
 @db_thread_lock
+def insert_comment_deleted_range(discussion_chat_id, first_message_id, last_message_id):
+	# ranges without comment data that overlap or touch the new range are merged with it
+	sql = ''' SELECT id, message_id, last_message_id FROM comment_deleted_messages
+			  WHERE discussion_chat_id=(?) and message_id<=(?) and last_message_id>=(?)
+			  and reply_to_message_id IS NULL and sender_id IS NULL '''
+	_POOL.cursor.execute(sql, (discussion_chat_id, last_message_id + 1, first_message_id - 1))
+	merged_ranges = _POOL.cursor.fetchall()
+	for _, merged_first, merged_last in merged_ranges:
+		first_message_id = min(first_message_id, merged_first)
+		last_message_id = max(last_message_id, merged_last)
+
+	_POOL.cursor.executemany("DELETE FROM comment_deleted_messages WHERE id=(?)", [(row[0],) for row in merged_ranges])
+	sql = "INSERT INTO comment_deleted_messages(discussion_chat_id, message_id, last_message_id) VALUES (?, ?, ?)"
+	_POOL.cursor.execute(sql, (discussion_chat_id, first_message_id, last_message_id))
+	_commit()
+
+
+@db_read_only
 def is_comment_deleted_exist(discussion_message_id, discussion_chat_id):
-	sql = "SELECT id FROM comment_deleted_messages WHERE message_id=(?) and discussion_chat_id=(?)"
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id,))
-	result = CURSOR.fetchone()
+	sql = "SELECT id FROM comment_deleted_messages WHERE discussion_chat_id=(?) and message_id<=(?) and last_message_id>=(?)"
+	_POOL.cursor.execute(sql, (discussion_chat_id, discussion_message_id, discussion_message_id,))
+	result = _POOL.cursor.fetchone()
 	return bool(result)
 
 
-@db_thread_lock
-def get_comment_deleted_message_ids(discussion_chat_id: int, discussion_message_id: list):
-	format_string = ",".join(["?"] * len(discussion_message_id))
-	sql = "SELECT message_id FROM comment_deleted_messages WHERE discussion_chat_id=(?) and message_id IN (%s)"
-	CURSOR.execute(sql % format_string, (discussion_chat_id,) + tuple(discussion_message_id))
-	result = CURSOR.fetchall()
-	if result:
-		return [row[0] for row in result]
-	return []
+@db_read_only
+def get_comment_deleted_ranges(discussion_chat_id: int, first_message_id: int, last_message_id: int) -> list:
+	# ranges of deleted comments that intersect with the given range of message ids
+	sql = ''' SELECT message_id, last_message_id FROM comment_deleted_messages
+			  WHERE discussion_chat_id=(?) and message_id<=(?) and last_message_id>=(?) '''
+	_POOL.cursor.execute(sql, (discussion_chat_id, last_message_id, first_message_id,))
+	return _POOL.cursor.fetchall()
 
 
 @db_thread_lock
 def insert_scheduled_message(main_message_id, main_channel_id, scheduled_message_id, scheduled_channel_id, send_time):
 	sql = "INSERT INTO scheduled_messages (main_message_id, main_channel_id, scheduled_message_id, scheduled_channel_id, send_time) VALUES (?, ?, ?, ?, ?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id, scheduled_message_id, scheduled_channel_id, send_time,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id, scheduled_message_id, scheduled_channel_id, send_time,))
+	_commit()
 
 
 @db_thread_lock
 def update_scheduled_message(main_message_id, main_channel_id, send_time):
 	sql = "UPDATE scheduled_messages SET send_time=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (send_time, main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (send_time, main_message_id, main_channel_id,))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_scheduled_message_send_time(main_message_id, main_channel_id):
 	sql = "SELECT send_time FROM scheduled_messages WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def is_message_scheduled(main_message_id, main_channel_id):
 	sql = "SELECT id FROM scheduled_messages WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = _POOL.cursor.fetchone()
 	return bool(result)
 
 
 @db_thread_lock
 def delete_scheduled_message_main(main_message_id, main_channel_id):
 	sql = "DELETE FROM scheduled_messages WHERE main_message_id=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_all_scheduled_messages():
 	sql = "SELECT main_message_id, main_channel_id, send_time FROM scheduled_messages"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, ())
+	result = _POOL.cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def get_finished_update_channels() -> list:
 	sql = "SELECT main_channel_id FROM interval_updates_status WHERE current_message_id <= 0"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, ())
+	result = _POOL.cursor.fetchall()
 	if result:
 		return [row[0] for row in result]
 	else:
 		return []
 
 
-@db_thread_lock
+@db_read_only
 def get_unfinished_update_channels() -> dict:
 	sql = "SELECT main_channel_id, current_message_id FROM interval_updates_status WHERE current_message_id > 0"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, ())
+	result = _POOL.cursor.fetchall()
 	if result:
 		return {row[0]: row[1] for row in result}
 	else:
@@ -559,15 +1103,15 @@ def insert_or_update_channel_update_progress(main_channel_id, current_message_id
 		sql = "UPDATE interval_updates_status SET current_message_id=(?) WHERE main_channel_id=(?)"
 	else:
 		sql = "INSERT INTO interval_updates_status(current_message_id, main_channel_id) VALUES (?, ?)"
-	CURSOR.execute(sql, (current_message_id, main_channel_id))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (current_message_id, main_channel_id))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_update_in_progress_channel(main_channel_id):
 	sql = "SELECT current_message_id FROM interval_updates_status WHERE main_channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result
 
@@ -575,52 +1119,45 @@ def get_update_in_progress_channel(main_channel_id):
 @db_thread_lock
 def clear_updates_in_progress():
 	sql = "DELETE FROM interval_updates_status"
-	CURSOR.execute(sql, ())
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, ())
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_main_channel_ids() -> list:
-	sql = "SELECT channel_id FROM main_channels"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
-	if result:
-		return [row[0] for row in result]
-	else:
-		return []
+	return CHANNEL_REGISTRY.get_main_channel_ids()
 
 
-@db_thread_lock
+@db_read_only
 def is_main_channel_exists(main_channel_id):
-	sql = "SELECT id FROM main_channels WHERE channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	result = CURSOR.fetchone()
-	return bool(result)
+	return CHANNEL_REGISTRY.is_main_channel(main_channel_id)
 
 
 @db_thread_lock
 def insert_main_channel(main_channel_id):
 	sql = "INSERT INTO main_channels(channel_id) VALUES (?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (main_channel_id,))
+	_commit()
+	CHANNEL_REGISTRY.add_main_channel(main_channel_id)
 
 
 @db_thread_lock
 def delete_main_channel(main_channel_id):
 	sql = "DELETE FROM main_channels WHERE channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (main_channel_id,))
+	_commit()
+	CHANNEL_REGISTRY.remove_main_channel(main_channel_id)
 
 
-@db_thread_lock
+@db_read_only
 def is_users_table_exists():
 	return is_table_exists("users")
 
 def delete_users_table():
 	table_name = "users"
 	sql = f"DROP TABLE IF EXISTS {table_name}"
-	CURSOR.execute(sql)
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql)
+	_commit()
 
 
 @db_thread_lock
@@ -631,59 +1168,95 @@ def insert_main_channel_message(main_channel_id, main_message_id, sender_id):
 			(main_channel_id, main_message_id, sender_id)
 			VALUES (?, ?, ?)
 		'''
-		CURSOR.execute(sql, (main_channel_id, main_message_id, sender_id,))
-		DB_CONNECTION.commit()
+		_POOL.cursor.execute(sql, (main_channel_id, main_message_id, sender_id,))
+		_commit()
 
 
 @db_thread_lock
 def delete_main_channel_message(main_channel_id, main_message_id):
 	sql = "DELETE FROM main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, main_message_id, ))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id, ))
+	sql = "DELETE FROM main_message_contents WHERE main_channel_id=(?) AND main_message_id=(?)"
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id, ))
+	sql = "DELETE FROM dirty_tickets WHERE main_channel_id=(?) AND main_message_id=(?)"
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id, ))
+	_commit()
+
+
+@db_thread_lock
+def insert_or_update_main_message_content(main_channel_id, main_message_id, content, edit_date):
+	sql = '''
+		INSERT INTO main_message_contents (main_channel_id, main_message_id, content, edit_date, update_time)
+		VALUES (?, ?, ?, ?, ?) ON CONFLICT(main_channel_id, main_message_id) DO UPDATE SET
+		content=excluded.content, edit_date=excluded.edit_date, update_time=excluded.update_time
+	'''
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id, content, edit_date, int(time.time()),))
+	_commit()
+
+
+@db_read_only
+def get_main_message_content(main_channel_id, main_message_id, max_age=None):
+	sql = "SELECT content, update_time FROM main_message_contents WHERE main_channel_id=(?) AND main_message_id=(?)"
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id,))
+	result = _POOL.cursor.fetchone()
+	if not result:
+		return
+
+	content, update_time = result
+	if max_age is not None and update_time < time.time() - max_age:
+		return
+	return content
 
 
 @db_thread_lock
+def delete_main_message_content(main_channel_id, main_message_id):
+	sql = "DELETE FROM main_message_contents WHERE main_channel_id=(?) AND main_message_id=(?)"
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id,))
+	_commit()
+
+
+@db_read_only
 def get_main_message_sender(main_channel_id, main_message_id):
 	sql = "SELECT sender_id FROM main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 	return None
 
 
-@db_thread_lock
+@db_read_only
 def is_main_message_exists(main_channel_id, main_message_id):
 	sql = "SELECT id FROM main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id,))
+	result = _POOL.cursor.fetchone()
 	return bool(result)
 
 
-@db_thread_lock
+@db_read_only
 def get_main_message_ids(main_channel_id) -> list:
 	sql = "SELECT main_message_id FROM main_messages WHERE main_channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, (main_channel_id,))
+	result = _POOL.cursor.fetchall()
 	if result:
 		return [row[0] for row in result]
 	else:
 		return []
 
 
-@db_thread_lock
+@db_read_only
 def get_all_users():
 	sql = "SELECT main_channel_id, user_id, user_tag FROM users"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, ())
+	result = _POOL.cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def get_next_action_text(main_message_id, main_channel_id):
 	sql = "SELECT current_comment_text FROM next_action_comments WHERE main_channel_id=(?) AND main_message_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
@@ -695,15 +1268,15 @@ def insert_or_update_current_next_action(main_message_id, main_channel_id, comme
 	else:
 		sql = "INSERT INTO next_action_comments (current_comment_text, main_message_id, main_channel_id) VALUES (?, ?, ?)"
 
-	CURSOR.execute(sql, (comment_text, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (comment_text, main_message_id, main_channel_id, ))
+	_commit()
 
 
 @db_thread_lock
 def update_previous_next_action(main_message_id, main_channel_id, comment_text):
 	sql = "UPDATE next_action_comments SET previous_comment_text=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (comment_text, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (comment_text, main_message_id, main_channel_id, ))
+	_commit()
 
 
 @db_thread_lock
@@ -713,51 +1286,54 @@ def insert_or_update_ticket_data(main_message_id, main_channel_id, is_opened, us
 	else:
 		sql = "INSERT INTO tickets_data(is_opened, user_tags, priority, main_message_id, main_channel_id) VALUES (?, ?, ?, ?, ?)"
 	is_opened = 1 if is_opened else 0
-	CURSOR.execute(sql, (is_opened, user_tags, priority, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (is_opened, user_tags, priority, main_message_id, main_channel_id, ))
+	_replace_ticket_users(_POOL.cursor, main_message_id, main_channel_id, user_tags)
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_ticket_data(main_message_id, main_channel_id):
 	sql = "SELECT user_tags, priority, update_time FROM tickets_data WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id, ))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id, ))
+	result = _POOL.cursor.fetchone()
 	return result
 
 
 @db_thread_lock
 def set_ticket_update_time(main_message_id, main_channel_id, update_time):
 	sql = "UPDATE tickets_data SET update_time=(?) WHERE main_message_id=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (update_time, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (update_time, main_message_id, main_channel_id, ))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_assigned_users_by_channel(main_channel_id) -> list:
-	sql = '''SELECT count(td.user_tags) count_tickets,
-	 				iif(instr(td.user_tags, ","),substr(td.user_tags, 1, instr(td.user_tags, ",") - 1), td.user_tags) user_tag
-	 		 FROM tickets_data td
-			 LEFT JOIN main_messages mm ON mm.main_message_id = td.main_message_id and mm.main_channel_id = td.main_channel_id
-			 WHERE td.main_channel_id = (?) and mm.id IS NOT NULL
-			 GROUP BY user_tag
+	sql = '''SELECT count(*) count_tickets, tu.user_tag
+			 FROM ticket_users tu
+			 JOIN main_messages mm ON mm.main_message_id = tu.main_message_id and mm.main_channel_id = tu.main_channel_id
+			 WHERE tu.main_channel_id = (?) and tu.role = (?)
+			 GROUP BY tu.user_tag
 			 ORDER BY count_tickets DESC'''
-	CURSOR.execute(sql, (main_channel_id, ))
-	return CURSOR.fetchall()
+	_POOL.cursor.execute(sql, (main_channel_id, _TICKET_USER_ROLES[0], ))
+	return _POOL.cursor.fetchall()
 
 
-@db_thread_lock
+@db_read_only
 def get_user_highest_priority(main_channel_id, user_tag):
-	sql = "SELECT min(priority) FROM tickets_data WHERE user_tags LIKE '%' || ? || '%' AND main_channel_id=(?)"
-	CURSOR.execute(sql, (user_tag, main_channel_id,))
-	result = CURSOR.fetchone()
+	sql = '''SELECT min(td.priority) FROM ticket_users tu
+			 JOIN tickets_data td ON td.main_message_id = tu.main_message_id AND td.main_channel_id = tu.main_channel_id
+			 WHERE tu.main_channel_id=(?) AND tu.user_tag=(?)'''
+	_POOL.cursor.execute(sql, (main_channel_id, user_tag,))
+	result = _POOL.cursor.fetchone()
 	return result[0]
 
 
 @db_thread_lock
 def delete_ticket_data(main_message_id, main_channel_id):
 	sql = "DELETE FROM tickets_data WHERE main_message_id=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	_replace_ticket_users(_POOL.cursor, main_message_id, main_channel_id, None)
+	_commit()
 
 
 @db_thread_lock
@@ -765,14 +1341,20 @@ def delete_invalid_ticket_data():
 	sql = '''SELECT td.id FROM tickets_data td
 			 LEFT JOIN main_messages mm ON mm.main_message_id = td.main_message_id and mm.main_channel_id = td.main_channel_id
 			 WHERE mm.id IS NULL'''
-	CURSOR.execute(sql)
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql)
+	result = _POOL.cursor.fetchall()
 	if result:
 		result = [row[0] for row in result]
 		format_string = ",".join(["?"] * len(result))
 		sql ="DELETE FROM tickets_data WHERE id IN (%s)"
-		CURSOR.execute(sql % format_string, tuple(result))
-	DB_CONNECTION.commit()
+		_POOL.cursor.execute(sql % format_string, tuple(result))
+
+	sql = '''DELETE FROM ticket_users WHERE NOT EXISTS (
+				SELECT 1 FROM tickets_data td
+				WHERE td.main_message_id = ticket_users.main_message_id AND td.main_channel_id = ticket_users.main_channel_id
+			 )'''
+	_POOL.cursor.execute(sql)
+	_commit()
 
 
 
@@ -782,32 +1364,32 @@ def insert_or_update_last_user_interaction(user_tag, interaction_time):
 		sql = "UPDATE user_reminder_data SET last_interaction_time=(?) WHERE user_tag=(?)"
 	else:
 		sql = "INSERT INTO user_reminder_data(last_interaction_time, user_tag) VALUES (?, ?)"
-	CURSOR.execute(sql, (interaction_time, user_tag))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (interaction_time, user_tag))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_last_interaction_time(user_tag):
 	sql = "SELECT last_interaction_time FROM user_reminder_data WHERE user_tag=(?)"
-	CURSOR.execute(sql, (user_tag,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (user_tag,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def is_user_reminder_data_exists(user_tag):
 	sql = "SELECT id FROM user_reminder_data WHERE user_tag=(?)"
-	CURSOR.execute(sql, (user_tag,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (user_tag,))
+	result = _POOL.cursor.fetchone()
 	return bool(result)
 
 
-@db_thread_lock
+@db_read_only
 def get_ticket_remind_time(main_message_id, main_channel_id, user_tag):
 	sql = "SELECT reminded_at FROM reminded_tickets WHERE main_message_id=(?) AND main_channel_id=(?) AND user_tag=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id, user_tag,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id, user_tag,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
@@ -818,24 +1400,24 @@ def insert_or_update_remind_time(main_message_id, main_channel_id, user_tag, rem
 		sql = "UPDATE reminded_tickets SET reminded_at=(?) WHERE user_tag=(?) AND main_channel_id=(?) AND main_message_id=(?)"
 	else:
 		sql = "INSERT INTO reminded_tickets(reminded_at, user_tag, main_channel_id, main_message_id) VALUES (?, ?, ?, ?)"
-	CURSOR.execute(sql, (remind_time, user_tag, main_channel_id, main_message_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (remind_time, user_tag, main_channel_id, main_message_id,))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def get_custom_hashtag(channel_id):
 	sql = "SELECT custom_hashtag FROM custom_channel_hashtags WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def is_custom_hashtag_exists(channel_id):
 	sql = "SELECT id FROM custom_channel_hashtags WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (channel_id,))
+	result = _POOL.cursor.fetchone()
 	return bool(result)
 
 
@@ -845,31 +1427,34 @@ def insert_or_update_custom_hashtag(channel_id, custom_hashtag):
 		sql = "UPDATE custom_channel_hashtags SET custom_hashtag=(?) WHERE channel_id=(?)"
 	else:
 		sql = "INSERT INTO custom_channel_hashtags(custom_hashtag, channel_id) VALUES (?, ?)"
-	CURSOR.execute(sql, (custom_hashtag, channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (custom_hashtag, channel_id,))
+	_commit()
+	CHANNEL_REGISTRY.notify_changed(channel_id)
 
 
-@db_thread_lock
+@db_read_only
+def get_custom_hashtags() -> dict:
+	sql = "SELECT channel_id, custom_hashtag FROM custom_channel_hashtags WHERE custom_hashtag IS NOT NULL"
+	_POOL.cursor.execute(sql)
+	return dict(_POOL.cursor.fetchall())
+
+
+@db_read_only
 def is_individual_channel_exists(channel_id):
-	sql = "SELECT id FROM individual_channel_settings WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
-	return bool(result)
+	return CHANNEL_REGISTRY.is_individual_channel(channel_id)
 
 
-@db_thread_lock
+@db_read_only
 def get_individual_channel_settings(channel_id):
-	sql = "SELECT settings, priorities FROM individual_channel_settings WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
-	return result
+	channel_data = CHANNEL_REGISTRY.get_individual_channel(channel_id)
+	if channel_data:
+		return channel_data["settings"], channel_data["priorities"]
 
-@db_thread_lock
+@db_read_only
 def get_individual_channel_user_id(channel_id):
-	sql = "SELECT user_id FROM individual_channel_settings WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
-	return result
+	channel_data = CHANNEL_REGISTRY.get_individual_channel(channel_id)
+	if channel_data:
+		return channel_data["user_id"],
 
 
 @db_thread_lock
@@ -877,61 +1462,63 @@ def insert_individual_channel(channel_id, settings, user_id):
 	if is_individual_channel_exists(channel_id):
 		return
 	sql = "INSERT INTO individual_channel_settings (channel_id, settings, user_id) VALUES (?, ?, ?)"
-	CURSOR.execute(sql, (channel_id, settings, user_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (channel_id, settings, user_id,))
+	_commit()
+	CHANNEL_REGISTRY.add_individual_channel(channel_id, settings, user_id)
 
 
 @db_thread_lock
 def update_individual_channel_settings(channel_id, settings):
 	sql = "UPDATE individual_channel_settings SET settings=(?) WHERE channel_id=(?)"
-	CURSOR.execute(sql, (settings, channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (settings, channel_id,))
+	_commit()
+	CHANNEL_REGISTRY.update_individual_channel(channel_id, settings=settings)
 
 
 @db_thread_lock
 def update_individual_channel(channel_id, settings, priority):
 	sql = "UPDATE individual_channel_settings SET settings=(?), priorities=(?) WHERE channel_id=(?)"
-	CURSOR.execute(sql, (settings, priority, channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (settings, priority, channel_id,))
+	_replace_channel_priorities(_POOL.cursor, channel_id, priority)
+	_commit()
+	CHANNEL_REGISTRY.update_individual_channel(channel_id, settings=settings, priorities=priority)
 
 
 @db_thread_lock
 def delete_individual_channel(channel_id):
 	sql = "DELETE FROM individual_channel_settings WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (channel_id,))
+	_POOL.cursor.execute("DELETE FROM individual_channel_priorities WHERE channel_id=(?)", (channel_id,))
+	_commit()
+	CHANNEL_REGISTRY.remove_individual_channel(channel_id)
 
 
-@db_thread_lock
+@db_read_only
 def get_individual_channels_by_priority(priority):
-	sql = "SELECT channel_id, settings FROM individual_channel_settings WHERE priorities LIKE '%' || ? || '%'"
-	CURSOR.execute(sql, (priority,))
-	result = CURSOR.fetchall()
-	if result:
-		return result
-	else:
-		return []
+	sql = '''
+		SELECT s.channel_id, s.settings FROM individual_channel_priorities p
+		JOIN individual_channel_settings s ON s.channel_id = p.channel_id
+		WHERE p.priority = (?)
+	'''
+	_POOL.cursor.execute(sql, (str(priority),))
+	return _POOL.cursor.fetchall()
 
 
 @db_thread_lock
 def update_individual_channel_user(channel_id, user_id):
 	sql = "UPDATE individual_channel_settings SET user_id=(?) WHERE channel_id=(?)"
-	CURSOR.execute(sql, (user_id, channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (user_id, channel_id,))
+	_commit()
+	CHANNEL_REGISTRY.update_individual_channel(channel_id, user_id=user_id)
 
 
-@db_thread_lock
+@db_read_only
 def get_user_individual_channels(user_id):
-	sql = "SELECT channel_id, settings FROM individual_channel_settings WHERE user_id=(?)"
-	CURSOR.execute(sql, (user_id,))
-	result = CURSOR.fetchall()
-	if result:
-		return result
-	else:
-		return []
+	return [(channel_id, channel_data["settings"]) for channel_id, channel_data in CHANNEL_REGISTRY.get_individual_channels()
+			if user_id is not None and str(channel_data["user_id"]) == str(user_id)]
 
 
-@db_thread_lock
+@db_read_only
 def get_tickets_for_reminding(user_id, user_tag):
 	# finds all forwarded tickets from every channel where user is channel's owner
 	# that match priority and is opened (deferred tickets is ignored)
@@ -952,59 +1539,54 @@ def get_tickets_for_reminding(user_id, user_tag):
 		) AND tickets_data.is_opened=1;
 	'''
 
-	CURSOR.execute(sql, (user_tag, user_id))
-	result = CURSOR.fetchall()
+	_POOL.cursor.execute(sql, (user_tag, user_id))
+	result = _POOL.cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def find_copied_message_from_main(main_message_id, main_channel_id, user_id, priority):
 	sql = '''
 		SELECT copied_message_id, copied_channel_id FROM copied_messages WHERE copied_channel_id IN (
-			SELECT channel_id FROM individual_channel_settings WHERE user_id=(?)
-			AND priorities LIKE '%' || ? || '%'
+			SELECT s.channel_id FROM individual_channel_settings s
+			JOIN individual_channel_priorities p ON p.channel_id = s.channel_id AND p.priority = (?)
+			WHERE s.user_id=(?)
 		) AND main_message_id=(?) AND main_channel_id=(?)
 	'''
-	CURSOR.execute(sql, (user_id, priority, main_message_id, main_channel_id))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (str(priority), user_id, main_message_id, main_channel_id))
+	result = _POOL.cursor.fetchone()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def find_copied_message_in_channel(individual_channel_id, main_message_id):
 	sql = "SELECT copied_message_id FROM copied_messages WHERE copied_channel_id = (?) AND main_message_id = (?)"
-	CURSOR.execute(sql, (individual_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (individual_channel_id, main_message_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_all_individual_channels():
-	sql = "SELECT channel_id, settings FROM individual_channel_settings"
-	CURSOR.execute(sql)
-	result = CURSOR.fetchall()
-	if result:
-		return result
-	else:
-		return []
+	return [(channel_id, channel_data["settings"]) for channel_id, channel_data in CHANNEL_REGISTRY.get_individual_channels()]
 
 
-@db_thread_lock
+@db_read_only
 def get_all_copied_messages(main_channel_id, main_message_id):
 	sql = '''
 		SELECT copied_channel_id, copied_message_id FROM copied_messages
 		WHERE main_channel_id = (?) AND main_message_id = (?)
 	'''
-	CURSOR.execute(sql, (main_channel_id, main_message_id))
-	return CURSOR.fetchall()
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id))
+	return _POOL.cursor.fetchall()
 
 
-@db_thread_lock
+@db_read_only
 def get_sent_scheduled_message_time(main_message_id, main_channel_id):
 	sql = "SELECT sent_at FROM sent_scheduled_messages WHERE main_message_id = (?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = _POOL.cursor.fetchone()
 	if result:
 		return result[0]
 
@@ -1016,13 +1598,101 @@ def insert_or_update_sent_scheduled_message(main_message_id, main_channel_id, se
 	else:
 		sql = "INSERT INTO sent_scheduled_messages (sent_at, main_message_id, main_channel_id) VALUES (?, ?, ?)"
 
-	CURSOR.execute(sql, (sent_at, main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	_POOL.cursor.execute(sql, (sent_at, main_message_id, main_channel_id,))
+	_commit()
 
 
-@db_thread_lock
+@db_read_only
 def is_message_was_scheduled(main_message_id, main_channel_id):
 	sql = "SELECT sent_at FROM sent_scheduled_messages WHERE main_message_id = (?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	_POOL.cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = _POOL.cursor.fetchone()
 	return bool(result)
+
+
+@db_read_only
+def get_export_checkpoint(chat_id):
+	sql = "SELECT last_exported_message_id FROM export_checkpoints WHERE chat_id=(?)"
+	_POOL.cursor.execute(sql, (chat_id,))
+	result = _POOL.cursor.fetchone()
+	if result:
+		return result[0]
+
+
+@db_thread_lock
+def insert_or_update_export_checkpoint(chat_id, last_exported_message_id):
+	sql = '''
+		INSERT INTO export_checkpoints (chat_id, last_exported_message_id, update_time) VALUES (?, ?, ?)
+		ON CONFLICT(chat_id) DO UPDATE SET last_exported_message_id=excluded.last_exported_message_id,
+		update_time=excluded.update_time
+	'''
+	_POOL.cursor.execute(sql, (chat_id, last_exported_message_id, int(time.time()),))
+	_commit()
+
+
+@db_thread_lock
+def delete_export_checkpoint(chat_id):
+	sql = "DELETE FROM export_checkpoints WHERE chat_id=(?)"
+	_POOL.cursor.execute(sql, (chat_id,))
+	_commit()
+
+
+@db_thread_lock
+def mark_ticket_dirty(main_channel_id, main_message_id):
+	sql = '''
+		INSERT INTO dirty_tickets (main_channel_id, main_message_id, marked_at) VALUES (?, ?, ?)
+		ON CONFLICT(main_channel_id, main_message_id) DO UPDATE SET marked_at=excluded.marked_at
+	'''
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id, time.time(),))
+	_commit()
+
+
+@db_thread_lock
+def mark_channel_tickets_dirty(main_channel_id):
+	sql = '''
+		INSERT INTO dirty_tickets (main_channel_id, main_message_id, marked_at)
+		SELECT main_channel_id, main_message_id, ? FROM main_messages WHERE main_channel_id=(?)
+		ON CONFLICT(main_channel_id, main_message_id) DO UPDATE SET marked_at=excluded.marked_at
+	'''
+	_POOL.cursor.execute(sql, (time.time(), main_channel_id,))
+	_commit()
+
+
+@db_read_only
+def get_dirty_ticket_ids(main_channel_id) -> list:
+	sql = "SELECT main_message_id FROM dirty_tickets WHERE main_channel_id=(?)"
+	_POOL.cursor.execute(sql, (main_channel_id,))
+	return [row[0] for row in _POOL.cursor.fetchall()]
+
+
+@db_thread_lock
+def delete_dirty_ticket(main_channel_id, main_message_id, marked_before):
+	# tickets marked after the check has started have to be checked again
+	sql = "DELETE FROM dirty_tickets WHERE main_channel_id=(?) AND main_message_id=(?) AND marked_at<=(?)"
+	_POOL.cursor.execute(sql, (main_channel_id, main_message_id, marked_before,))
+	_commit()
+
+
+@db_thread_lock
+def delete_dirty_tickets(main_channel_id, marked_before):
+	sql = "DELETE FROM dirty_tickets WHERE main_channel_id=(?) AND marked_at<=(?)"
+	_POOL.cursor.execute(sql, (main_channel_id, marked_before,))
+	_commit()
+
+
+@db_read_only
+def get_discussion_check_progress(discussion_chat_id):
+	sql = "SELECT verified_message_id, verified_at FROM discussion_check_progress WHERE discussion_chat_id=(?)"
+	_POOL.cursor.execute(sql, (discussion_chat_id,))
+	return _POOL.cursor.fetchone()
+
+
+@db_thread_lock
+def insert_or_update_discussion_check_progress(discussion_chat_id, verified_message_id, verified_at):
+	sql = '''
+		INSERT INTO discussion_check_progress (discussion_chat_id, verified_message_id, verified_at) VALUES (?, ?, ?)
+		ON CONFLICT(discussion_chat_id) DO UPDATE SET verified_message_id=excluded.verified_message_id,
+		verified_at=excluded.verified_at
+	'''
+	_POOL.cursor.execute(sql, (discussion_chat_id, verified_message_id, verified_at,))
+	_commit()
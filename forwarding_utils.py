@@ -1,3 +1,4 @@
+import collections
 import copy
 import json
 import logging
@@ -17,7 +18,10 @@ from comment_utils import comment_dispatcher
 import config_utils
 import daily_reminder
 import db_utils
+from id_ranges import IdRangeSet
+import routing_index
 from scheduled_messages_utils import scheduled_message_dispatcher
+import threading_utils
 import user_utils
 import utils
 import hashtag_data as hashtag_data_utils
@@ -27,7 +31,10 @@ from config_utils import DISCUSSION_CHAT_DATA
 
 CALLBACK_PREFIX = "FWRD"
 
-_FORWARDING_LOCK = threading.RLock()
+# edits of one ticket are done one after another, tickets are locked before subchannels
+_FORWARDING_LOCKS = threading_utils.KeyedLockManager()
+_TICKET_LOCK_LEVEL = 0
+_SUBCHANNEL_LOCK_LEVEL = 1
 
 CHANNEL_TICKET_KEYBOARD_TYPE = {}
 
@@ -47,14 +54,19 @@ def get_unchanged_posts(bot: telebot.TeleBot, post_data: telebot.types.Message,
 	main_channel_id = post_data.chat.id
 	message_id = post_data.message_id
 
-	forwarded_messages = db_utils.get_copied_message_data(message_id, main_channel_id)
-	unchanged_posts = {}
-	for forwarded_message in forwarded_messages:
-		forwarded_msg_id, forwarded_channel_id = forwarded_message
-		forwarded_msg_data = utils.get_message_content_by_id(bot, forwarded_channel_id, forwarded_msg_id)
+	forwarded_messages = db_utils.get_copied_messages_with_hash(message_id, main_channel_id)
+	content_hash = utils.get_post_content_hash(post_data)
+	# newest messages in subchannels are read later to move the settings button from them,
+	# copies without saved hash are read to compare them with the post
+	newest_messages = [(subchannel_id, db_utils.get_newest_copied_message(subchannel_id)) for subchannel_id in subchannel_ids]
+	unhashed_messages = [(channel_id, msg_id) for msg_id, channel_id, copy_hash in forwarded_messages
+						 if copy_hash is None and channel_id in subchannel_ids]
+	utils.prefetch_message_contents(unhashed_messages + newest_messages)
 
+	unchanged_posts = {}
+	for forwarded_msg_id, forwarded_channel_id, forwarded_hash in forwarded_messages:
 		in_subchannels = forwarded_channel_id in subchannel_ids
-		if forwarded_msg_data and utils.is_post_data_equal(forwarded_msg_data, post_data) and in_subchannels:
+		if in_subchannels and is_copy_unchanged(bot, post_data, content_hash, forwarded_channel_id, forwarded_msg_id, forwarded_hash):
 			unchanged_posts[forwarded_channel_id] = forwarded_msg_id  # ignore unchanged posts
 			continue
 		try:
@@ -68,21 +80,49 @@ def get_unchanged_posts(bot: telebot.TeleBot, post_data: telebot.types.Message,
 	return unchanged_posts
 
 
+def is_copy_unchanged(bot: telebot.TeleBot, post_data: telebot.types.Message, content_hash: str,
+					  copied_channel_id: int, copied_message_id: int, copied_content_hash: str = None) -> bool:
+	if copied_content_hash is not None:
+		return copied_content_hash == content_hash
+
+	copied_msg_data = utils.get_message_content_by_id(bot, copied_channel_id, copied_message_id)
+	if copied_msg_data and utils.is_post_data_equal(copied_msg_data, post_data):
+		db_utils.update_copied_message_content_hash(copied_message_id, copied_channel_id, content_hash)
+		return True
+	return False
+
+
+def get_ticket_lock_key(main_channel_id: int, main_message_id: int) -> tuple:
+	return _TICKET_LOCK_LEVEL, main_channel_id, main_message_id
+
+
+def get_subchannel_lock_key(subchannel_id: int) -> tuple:
+	# held while the newest message of the subchannel is read and changed
+	return _SUBCHANNEL_LOCK_LEVEL, subchannel_id
+
+
 def forwarding_thread_lock(func):
-	def inner_function(*args, **kwargs):
-		with _FORWARDING_LOCK:
+	def inner_function(bot: telebot.TeleBot, post_data: telebot.types.Message, *args, **kwargs):
+		with _FORWARDING_LOCKS.lock(get_ticket_lock_key(post_data.chat.id, post_data.message_id)):
 			try:
-				return func(*args, **kwargs)
+				return func(bot, post_data, *args, **kwargs)
 			except Exception as E:
 				logging.exception(f"Error in {func.__name__} forwarding function, error: {E}")
 	return inner_function
 
 
+def message_content_cache(func):
+	def inner_function(*args, **kwargs):
+		with utils.message_content_cache():
+			return func(*args, **kwargs)
+	return inner_function
+
+
 @forwarding_thread_lock
+@message_content_cache
 def forward_to_subchannel(bot: telebot.TeleBot, post_data: telebot.types.Message, hashtag_data: HashtagData):
 	main_channel_id = post_data.chat.id
 	main_message_id = post_data.message_id
-	copied_message = None
 	subchannel_ids = []
 
 	daily_reminder.update_ticket_data(main_message_id, main_channel_id, hashtag_data)
@@ -98,40 +138,72 @@ def forward_to_subchannel(bot: telebot.TeleBot, post_data: telebot.types.Message
 		logging.warning(f"Subchannels not found {hashtag_data.get_hashtag_list()}, {main_channel_id}")
 		return
 
-	for subchannel_id in subchannel_ids:
-		if subchannel_id in unchanged_posts:
-			call = CallbackQuery(0, User(0, True, "Bot"), "", "", "", message=post_data)
-			keyboard_markup = get_keyboard(call, subchannel_id, unchanged_posts[subchannel_id])
-			utils.edit_message_keyboard(bot, post_data, keyboard_markup, chat_id=subchannel_id, message_id=unchanged_posts[subchannel_id])
-			continue
+	subchannel_ids = list(subchannel_ids)
+	subchannel_lock_keys = [get_subchannel_lock_key(subchannel_id) for subchannel_id in subchannel_ids]
+	# subchannels are locked until the copies are saved and keyboards are updated,
+	# requests to different subchannels are sent at the same time, requests to one subchannel keep their order
+	with _FORWARDING_LOCKS.lock(*subchannel_lock_keys):
+		send_to_subchannel = utils.share_message_content_cache(
+			lambda subchannel_id: _send_to_subchannel(bot, post_data, hashtag_data, subchannel_id,
+													  unchanged_posts[subchannel_id] if subchannel_id in unchanged_posts else None)
+		)
+		sent_copies = threading_utils.fan_out(send_to_subchannel, subchannel_ids, config_utils.FORWARDING_CONCURRENCY, "forwarding")
+		sent_copies = [sent_copy for sent_copy in sent_copies if sent_copy]
+		if not sent_copies:
+			return
 
-		newest_message_id = db_utils.get_newest_copied_message(subchannel_id)
-		keyboard_markup = utils.merge_keyboard_markup(
-			generate_control_buttons(hashtag_data, post_data),
-			channel_manager.get_ticket_settings_buttons(subchannel_id)
+		# copied messages should be saved before editing keyboards, because the settings button is added to the newest copied message
+		content_hash = utils.get_post_content_hash(post_data)
+		with db_utils.transaction():
+			for subchannel_id, copied_message_id, _ in sent_copies:
+				db_utils.insert_copied_message(main_message_id, main_channel_id, copied_message_id, subchannel_id, content_hash)
+				db_utils.insert_or_update_last_msg_id(copied_message_id, subchannel_id)
+
+		update_keyboards = utils.share_message_content_cache(
+			lambda sent_copy: _update_subchannel_keyboards(bot, post_data, hashtag_data, *sent_copy)
 		)
+		threading_utils.fan_out(update_keyboards, sent_copies, config_utils.FORWARDING_CONCURRENCY, "forwarding")
 
-		try:
-			text, entities = utils.get_post_content(post_data)
-			copied_message = bot.send_message(chat_id=subchannel_id, text=text, entities=entities, reply_markup=keyboard_markup)
-			logging.info(f"Successfully forwarded post [{main_message_id}, {main_channel_id}] to {subchannel_id} subchannel by tags: {hashtag_data.get_hashtag_list()}")
-			db_utils.insert_copied_message(main_message_id, main_channel_id, copied_message.message_id, subchannel_id)
-			db_utils.insert_or_update_last_msg_id(copied_message.message_id, subchannel_id)
-		except ApiTelegramException as E:
-			if not copied_message is None:
-				delete_forwarded_message(bot, subchannel_id, copied_message.message_id)
 
-			if E.error_code == 429:
-				raise E
-			if E.error_code == 403 and E.description.endswith(utils.KICKED_FROM_CHANNEL_ERROR):
-				db_utils.delete_individual_channel(subchannel_id)
-			logging.warning(f"Exception during forwarding post to subchannel {hashtag_data.get_hashtag_list()} - {E}")
-			continue
+def _send_to_subchannel(bot: telebot.TeleBot, post_data: telebot.types.Message, hashtag_data: HashtagData,
+						subchannel_id: int, unchanged_message_id: int = None) -> tuple | None:
+	# returns subchannel id, id of the new copy and id of the previous newest copy, the copy is saved by the caller
+	main_channel_id = post_data.chat.id
+	main_message_id = post_data.message_id
+
+	if unchanged_message_id:
+		# get_keyboard modifies keyboard of the message, post_data is shared with other subchannels
+		call = CallbackQuery(0, User(0, True, "Bot"), "", "", "", message=copy.deepcopy(post_data))
+		keyboard_markup = get_keyboard(call, subchannel_id, unchanged_message_id)
+		utils.edit_message_keyboard(bot, post_data, keyboard_markup, chat_id=subchannel_id, message_id=unchanged_message_id)
+		return None
+
+	newest_message_id = db_utils.get_newest_copied_message(subchannel_id)
+	keyboard_markup = utils.merge_keyboard_markup(
+		generate_control_buttons(hashtag_data, post_data),
+		channel_manager.get_ticket_settings_buttons(subchannel_id)
+	)
 
-		# add to the newest settings button and remove it from previous message
-		keyboard_markup = generate_control_buttons(hashtag_data, post_data)
-		utils.edit_message_keyboard(bot, post_data, keyboard_markup, chat_id=subchannel_id, message_id=copied_message.message_id)
-		update_copied_message(bot, subchannel_id, newest_message_id)
+	try:
+		text, entities = utils.get_post_content(post_data)
+		copied_message = bot.send_message(chat_id=subchannel_id, text=text, entities=entities, reply_markup=keyboard_markup)
+	except ApiTelegramException as E:
+		if E.error_code == 403 and E.description.endswith(utils.KICKED_FROM_CHANNEL_ERROR):
+			db_utils.delete_individual_channel(subchannel_id)
+		logging.warning(f"Exception during forwarding post to subchannel {hashtag_data.get_hashtag_list()} - {E}")
+		return None
+
+	utils.KEYBOARD_MARKUP_STORE.save(subchannel_id, copied_message.message_id, keyboard_markup)
+	logging.info(f"Successfully forwarded post [{main_message_id}, {main_channel_id}] to {subchannel_id} subchannel by tags: {hashtag_data.get_hashtag_list()}")
+	return subchannel_id, copied_message.message_id, newest_message_id
+
+
+def _update_subchannel_keyboards(bot: telebot.TeleBot, post_data: telebot.types.Message, hashtag_data: HashtagData,
+								 subchannel_id: int, copied_message_id: int, newest_message_id: int):
+	# add to the newest settings button and remove it from previous message
+	keyboard_markup = generate_control_buttons(hashtag_data, post_data)
+	utils.edit_message_keyboard(bot, post_data, keyboard_markup, chat_id=subchannel_id, message_id=copied_message_id)
+	update_copied_message(bot, subchannel_id, newest_message_id)
 
 
 def update_copied_message(bot: telebot.TeleBot, copied_channel_id: int, copied_message_id: int):
@@ -161,6 +233,13 @@ def delete_all_forwarded_messages(bot: telebot.TeleBot, main_channel_id: int, ma
 
 
 def delete_forwarded_message(bot: telebot.TeleBot, chat_id: int, message_id: int):
+	# deleting a copy changes the newest and the oldest messages of the subchannel, so it's done under the subchannel lock,
+	# callers can already hold a ticket lock or the lock of the same subchannel
+	with _FORWARDING_LOCKS.lock(get_subchannel_lock_key(chat_id)):
+		_delete_locked_forwarded_message(bot, chat_id, message_id)
+
+
+def _delete_locked_forwarded_message(bot: telebot.TeleBot, chat_id: int, message_id: int):
 	is_update_needed = False
 	if db_utils.get_newest_copied_message(chat_id) == message_id:
 		is_update_needed = True
@@ -199,6 +278,7 @@ def delete_forwarded_message(bot: telebot.TeleBot, chat_id: int, message_id: int
 				# if oldest message not found in main channel then just replace current message text with delete message
 				utils.edit_message_content(bot, msg_to_delete_data, text=config_utils.TO_DELETE_MSG_TEXT, chat_id=chat_id,
 				                           message_id=message_id, entities=[])
+				db_utils.update_copied_message_content_hash(message_id, chat_id, None)
 				return
 			main_message_id, main_channel_id = oldest_message_main_data
 			new_settings_message_id = message_id
@@ -263,108 +343,28 @@ def delete_main_message(bot: telebot.TeleBot, main_channel_id: int, main_message
 		logging.info(f"Deleted ticket {main_message_id, main_channel_id} that doesn't exists in main channel anymore")
 
 
-def deferred_filter(channel):
-	channel_id, settings = channel
-	if not settings:
-		return False
-	if channel_manager.SETTING_TYPES.DEFERRED not in settings:
-		return False
-	return settings[channel_manager.SETTING_TYPES.DEFERRED]
-
-
-def due_filter(channel):
-	channel_id, settings = channel
-	if not settings:
-		return False
-	if channel_manager.SETTING_TYPES.DUE not in settings:
-		return False
-	return settings[channel_manager.SETTING_TYPES.DUE]
-
-
-def filter_due_deferred_tickets(main_channel_id: int, main_message_id: int, hashtag_data: HashtagData, channel_data: List):
+def is_deferred_ticket(main_channel_id: int, main_message_id: int, hashtag_data: HashtagData) -> bool:
 	if hashtag_data.is_scheduled():
 		send_time = db_utils.get_scheduled_message_send_time(main_message_id, main_channel_id)
 		if send_time and send_time > time.time():
-			return list(filter(deferred_filter, channel_data))
-
-	return list(filter(due_filter, channel_data))
+			return True
+	return False
 
 
-def get_subchannel_ids_from_hashtags(main_channel_id: int, main_message_id: int, hashtag_data: HashtagData) -> set:
-	subchannel_ids = set()
-	priority = hashtag_data.get_priority_number_or_default()
-	channel_data = db_utils.get_individual_channels_by_priority(priority)
-	channel_data = [[channel_id, json.loads(settings)] for channel_id, settings in channel_data]
-
-	channel_data = filter_due_deferred_tickets(main_channel_id, main_message_id, hashtag_data, channel_data)
-
-	assigned_user_subchannels = filter_assigned_user_channels(channel_data, hashtag_data)
-	if assigned_user_subchannels:
-		subchannel_ids.update(assigned_user_subchannels)
-
-	followed_user_subchannels = filter_followed_user_channels(channel_data, hashtag_data)
-	if followed_user_subchannels:
-		subchannel_ids.update(followed_user_subchannels)
-
-	creator_subchannels = filter_creator_channels(channel_data, main_channel_id, main_message_id)
-	if creator_subchannels:
-		subchannel_ids.update(creator_subchannels)
-
-	result_subchannel_ids = set()
-
-	for subchannel_id in subchannel_ids:
-		custom_hashtag = db_utils.get_custom_hashtag(subchannel_id)
-		if custom_hashtag and custom_hashtag not in hashtag_data.other_hashtags:
-			continue
-		result_subchannel_ids.add(subchannel_id)
-
-	return result_subchannel_ids
-
-
-def filter_assigned_user_channels(channel_data: List, hashtag_data: HashtagData):
-	user_tag = hashtag_data.get_assigned_user()
-	if not user_tag:
-		return
-
-	result_channels = []
-	for channel in channel_data:
-		channel_id, settings = channel
-		assigned_users = settings.get(channel_manager.SETTING_TYPES.ASSIGNED) or []
-		if user_tag in assigned_users:
-			result_channels.append(channel_id)
-
-	return result_channels
-
-
-def filter_followed_user_channels(channel_data: List, hashtag_data: HashtagData):
-	user_tags = hashtag_data.get_followed_users()
-	if not user_tags:
-		return
-
-	result_channels = []
-	for channel in channel_data:
-		channel_id, settings = channel
-		followed_users = settings.get(channel_manager.SETTING_TYPES.FOLLOWED) or []
-		for followed_user_tag in user_tags:
-			if followed_user_tag in followed_users:
-				result_channels.append(channel_id)
-
-	return result_channels
-
-
-def filter_creator_channels(channel_data: List, main_channel_id: int, main_message_id: int):
+def get_creator_user_tags(main_channel_id: int, main_message_id: int) -> list:
 	sender_id = db_utils.get_main_message_sender(main_channel_id, main_message_id)
-	user_tags = utils.get_keys_by_value(user_utils.get_user_tags(main_channel_id), sender_id) or []
+	return utils.get_keys_by_value(user_utils.get_user_tags(main_channel_id), sender_id) or []
 
-	result_channels = []
-	for channel in channel_data:
-		channel_id, settings = channel
-		creator_users = settings.get(channel_manager.SETTING_TYPES.REPORTED) or []
-		for creator_user_tag in user_tags:
-			if creator_user_tag in creator_users:
-				result_channels.append(channel_id)
 
-	return result_channels
+def get_subchannel_ids_from_hashtags(main_channel_id: int, main_message_id: int, hashtag_data: HashtagData) -> set:
+	return routing_index.ROUTING_INDEX.get_subchannel_ids(
+		hashtag_data.get_priority_number_or_default(),
+		is_deferred_ticket(main_channel_id, main_message_id, hashtag_data),
+		hashtag_data.get_assigned_user(),
+		hashtag_data.get_followed_users(),
+		get_creator_user_tags(main_channel_id, main_message_id),
+		hashtag_data.other_hashtags
+	)
 
 
 def filter_subchannels_by_members(main_channel_id: int, subchannel_ids: set) -> list:
@@ -380,11 +380,84 @@ def filter_subchannels_by_members(main_channel_id: int, subchannel_ids: set) ->
 	return result_subchannels
 
 
+class KeyboardTemplateCache:
+	# rows of generated keyboards as (text, callback_data, url) tuples, keyed by main channel, keyboard type and ticket state,
+	# templates of a channel are removed when its members change and all templates when button texts or user tags change
+	def __init__(self, max_size: int):
+		self._lock = threading.Lock()
+		self._templates = collections.OrderedDict()
+		self._max_size = max_size
+
+	@staticmethod
+	def _to_template(keyboard_markup: InlineKeyboardMarkup) -> tuple:
+		return tuple(tuple((button.text, button.callback_data, button.url) for button in row) for row in keyboard_markup.keyboard)
+
+	@staticmethod
+	def _from_template(template: tuple) -> InlineKeyboardMarkup:
+		# new buttons are created every time, because callers change keyboards that they receive
+		return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=callback_data, url=url)
+									  for text, callback_data, url in row] for row in template])
+
+	def get(self, key: tuple, generate_keyboard: Callable[[], InlineKeyboardMarkup | None]) -> InlineKeyboardMarkup | None:
+		with self._lock:
+			template = self._templates.get(key)
+			if template is not None:
+				self._templates.move_to_end(key)
+
+		if template is None:
+			keyboard_markup = generate_keyboard()
+			if keyboard_markup is None:
+				return None
+			template = self._to_template(keyboard_markup)
+			with self._lock:
+				self._templates[key] = template
+				if len(self._templates) > self._max_size:
+					self._templates.popitem(last=False)
+
+		return self._from_template(template)
+
+	def invalidate(self, main_channel_id: int = None):
+		with self._lock:
+			if main_channel_id is None:
+				self._templates.clear()
+				return
+			for key in [key for key in self._templates if key[0] == main_channel_id]:
+				del self._templates[key]
+
+	def __len__(self) -> int:
+		with self._lock:
+			return len(self._templates)
+
+
+KEYBOARD_TEMPLATES = KeyboardTemplateCache(max_size=10_000)
+user_utils.add_members_listener(KEYBOARD_TEMPLATES.invalidate)
+user_utils.add_members_listener(hashtag_data_utils.PARSED_TICKETS.invalidate)
+
+
 def generate_control_buttons(hashtag_data: HashtagData, post_data: telebot.types.Message):
 	main_channel_id = post_data.chat.id
 	main_message_id = post_data.message_id
 
-	if hashtag_data.is_opened():
+	ticket_state = (hashtag_data.is_opened(), hashtag_data.get_assigned_user(), hashtag_data.get_priority_number())
+	keyboard_markup = KEYBOARD_TEMPLATES.get((main_channel_id, "control", *ticket_state),
+											 lambda: _generate_control_buttons_template(*ticket_state))
+
+	main_channel_id_str = str(main_channel_id)
+	if main_channel_id_str in DISCUSSION_CHAT_DATA and DISCUSSION_CHAT_DATA[main_channel_id_str] is not None:
+		discussion_chat_id = DISCUSSION_CHAT_DATA[main_channel_id_str]
+		discussion_message_id = db_utils.get_discussion_message_id(main_message_id, main_channel_id)
+		if discussion_message_id:
+			discussion_chat_id_str = str(discussion_chat_id)[4:]
+			comments_url = f"tg://privatepost?channel={discussion_chat_id_str}&post={discussion_message_id}&thread={discussion_message_id}"
+			comments_amount_text = f"({db_utils.get_comments_count(discussion_message_id, discussion_chat_id)})"
+			comments_button = InlineKeyboardButton(comments_amount_text, url=comments_url)
+			keyboard_markup.keyboard[0].append(comments_button)
+
+	return keyboard_markup
+
+
+def _generate_control_buttons_template(is_opened: bool, assigned_user: str, priority: str):
+	if is_opened:
 		state_switch_callback_data = utils.create_callback_str(CALLBACK_PREFIX, CB_TYPES.CLOSE)
 		state_btn_text = config_utils.BUTTON_TEXTS["OPENED_TICKET"]
 		state_switch_button = InlineKeyboardButton(state_btn_text, callback_data=state_switch_callback_data)
@@ -394,12 +467,12 @@ def generate_control_buttons(hashtag_data: HashtagData, post_data: telebot.types
 		state_switch_button = InlineKeyboardButton(state_btn_text, callback_data=state_switch_callback_data)
 
 	reassign_callback_data = utils.create_callback_str(CALLBACK_PREFIX, CB_TYPES.SHOW_SUBCHANNELS)
-	current_user = hashtag_data.get_assigned_user() or "-"
+	current_user = assigned_user or "-"
 	reassign_button_text = config_utils.BUTTON_TEXTS["ASSIGNED_USER_PREFIX"] + " " + current_user
 	reassign_button = InlineKeyboardButton(reassign_button_text, callback_data=reassign_callback_data)
 
 	priority_callback_data = utils.create_callback_str(CALLBACK_PREFIX, CB_TYPES.SHOW_PRIORITIES)
-	current_priority = hashtag_data.get_priority_number() or "-"
+	current_priority = priority or "-"
 
 	priority_text = current_priority
 	if current_priority in config_utils.BUTTON_TEXTS["PRIORITIES"]:
@@ -419,17 +492,6 @@ def generate_control_buttons(hashtag_data: HashtagData, post_data: telebot.types
 		schedule_button
 	]
 
-	main_channel_id_str = str(main_channel_id)
-	if main_channel_id_str in DISCUSSION_CHAT_DATA and DISCUSSION_CHAT_DATA[main_channel_id_str] is not None:
-		discussion_chat_id = DISCUSSION_CHAT_DATA[main_channel_id_str]
-		discussion_message_id = db_utils.get_discussion_message_id(main_message_id, main_channel_id)
-		if discussion_message_id:
-			discussion_chat_id_str = str(discussion_chat_id)[4:]
-			comments_url = f"tg://privatepost?channel={discussion_chat_id_str}&post={discussion_message_id}&thread={discussion_message_id}"
-			comments_amount_text = f"({db_utils.get_comments_count(discussion_message_id, discussion_chat_id)})"
-			comments_button = InlineKeyboardButton(comments_amount_text, url=comments_url)
-			buttons.append(comments_button)
-
 	keyboard_markup = InlineKeyboardMarkup([buttons])
 
 	return keyboard_markup
@@ -437,13 +499,18 @@ def generate_control_buttons(hashtag_data: HashtagData, post_data: telebot.types
 def generate_subchannel_buttons(post_data: telebot.types.Message):
 	main_channel_id = post_data.chat.id
 
-	forwarding_data = get_subchannels_forwarding_data(main_channel_id)
-
 	hashtag_data = HashtagData(post_data, main_channel_id)
 	current_subchannel = hashtag_data.get_assigned_user() or ""
 	current_priority = hashtag_data.get_priority_number() or ""
 	current_subchannel_name = f"{current_subchannel} {current_priority}"
 
+	return KEYBOARD_TEMPLATES.get((main_channel_id, "subchannels", current_subchannel_name),
+								  lambda: _generate_subchannel_buttons_template(main_channel_id, current_subchannel_name))
+
+
+def _generate_subchannel_buttons_template(main_channel_id: int, current_subchannel_name: str):
+	forwarding_data = get_subchannels_forwarding_data(main_channel_id)
+
 	subchannel_buttons = []
 	for subchannel_name in forwarding_data:
 		callback_str = utils.create_callback_str(CALLBACK_PREFIX, CB_TYPES.CHANGE_SUBCHANNEL, subchannel_name)
@@ -465,6 +532,11 @@ def generate_priority_buttons(post_data: telebot.types.Message):
 	hashtag_data = HashtagData(post_data, main_channel_id)
 	current_priority = hashtag_data.get_priority_number()
 
+	return KEYBOARD_TEMPLATES.get((main_channel_id, "priorities", current_priority),
+								  lambda: _generate_priority_buttons_template(current_priority))
+
+
+def _generate_priority_buttons_template(current_priority: str):
 	priority_buttons = []
 
 	for priority in hashtag_data_utils.POSSIBLE_PRIORITIES:
@@ -486,8 +558,13 @@ def generate_cc_buttons(post_data: telebot.types.Message):
 
 	hashtag_data = HashtagData(post_data, main_channel_id)
 	current_subchannel_user = hashtag_data.get_assigned_user()
-	followed_users = hashtag_data.get_followed_users()
+	followed_users = frozenset(hashtag_data.get_followed_users())
+
+	return KEYBOARD_TEMPLATES.get((main_channel_id, "cc", current_subchannel_user, followed_users),
+								  lambda: _generate_cc_buttons_template(main_channel_id, current_subchannel_user, followed_users))
 
+
+def _generate_cc_buttons_template(main_channel_id: int, current_subchannel_user: str, followed_users: frozenset):
 	main_channel_user_tags = user_utils.get_user_tags(main_channel_id).keys()
 
 	if not main_channel_user_tags:
@@ -852,24 +929,36 @@ def get_invalid_ticket_ids(bot: telebot.TeleBot):
 			continue
 
 		logging.info(f"Checking channel {channel_id}")
-		copied_messages = db_utils.get_copied_messages_existing_main_from_copied_channel(channel_id)
-		main_messages = db_utils.get_main_message_ids(channel_id)
-		message_ids = [i for i in range(1, last_msg_id + 1) if i not in copied_messages and i not in main_messages and
-					   i != settings.get(channel_manager.SETTING_TYPES.SETTINGS_MESSAGE_ID)]
-		messages = core_api.get_messages(channel_id, 0, 50, message_ids=message_ids)
-		if not messages:
-			logging.info(f"Can't get messages in channel {channel_id}, scanning of invalid tickets is skipped")
-			continue
+		known_messages = IdRangeSet(db_utils.get_copied_messages_existing_main_from_copied_channel(channel_id))
+		for main_message_id in db_utils.get_main_message_ids(channel_id):
+			known_messages.add(main_message_id)
+		settings_message_id = settings.get(channel_manager.SETTING_TYPES.SETTINGS_MESSAGE_ID)
+		if settings_message_id:
+			known_messages.add(settings_message_id)
+		message_ids = known_messages.missing_ids(1, last_msg_id)
+		batches = core_api.stream_messages(channel_id, message_ids, 50)
+		while True:
+			# fetching errors stop the scanning of the channel, deleting errors are logged for every ticket
+			try:
+				_, messages = next(batches)
+			except StopIteration:
+				break
+			except Exception as E:
+				logging.info(f"Can't get messages in channel {channel_id}, scanning of invalid tickets is stopped - {E}")
+				break
 
-		for message in messages:
-			if message.empty or message.service or not message.reply_markup or utils.get_forwarded_from_id(message):
-				continue
+			for message in messages:
+				if message.empty or message.service or not message.reply_markup or utils.get_forwarded_from_id(message):
+					continue
 
-			utils.update_forwarded_fields(message)
-			delete_forwarded_message(bot, channel_id, message.id)
-			count_invalid += 1
-			logging.info(f"Deleted invalid ticket {message.id} in channel {channel_id}")
-			time.sleep(config_utils.DELAY_AFTER_ONE_SCAN)
+				utils.update_forwarded_fields(message)
+				try:
+					delete_forwarded_message(bot, channel_id, message.id)
+				except Exception:
+					logging.exception(f"Can't delete invalid ticket {message.id} in channel {channel_id}")
+					continue
+				count_invalid += 1
+				logging.info(f"Deleted invalid ticket {message.id} in channel {channel_id}")
 
 		logging.info(f"Count deleted invalid tickets in channel {channel_id} is {count_invalid}")
 
@@ -886,6 +975,7 @@ def handle_edited_post(bot: telebot.TeleBot, post_data: telebot.types.Message):
 	if (post_data.edit_date - post_data.date) > 5:
 		utils.add_comment_to_ticket(bot, post_data, "A user edited the ticket.")
 		interval_updating_utils.set_updating_message(post_data.chat.id, post_data.message_id)
+		db_utils.mark_ticket_dirty(post_data.chat.id, post_data.message_id)
 
 	post_link_utils.update_post_link(bot, post_data)
 	forward_and_add_inline_keyboard(bot, post_data)
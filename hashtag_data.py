@@ -1,4 +1,9 @@
+import collections
 import copy
+import hashlib
+import json
+import logging
+import threading
 import time
 import typing
 from typing import List
@@ -25,36 +30,144 @@ SCHEDULED_DATETIME_FORMAT = "%Y-%m-%d %H:%M"
 POSSIBLE_PRIORITIES = ["1", "2", "3"]
 
 
+class ParsedTicketCache:
+	# state of parsed tickets keyed by main channel, message, content digest and settings that change parsing,
+	# every HashtagData gets its own copy of the state, so cached state is never changed by callers
+	def __init__(self, max_size: int, log_interval: int):
+		self._lock = threading.Lock()
+		self._states = collections.OrderedDict()
+		self._max_size = max_size
+		self._log_interval = log_interval
+		self._last_log_time = time.monotonic()
+		self.hit_count = 0
+		self.miss_count = 0
+
+	@staticmethod
+	def get_content_digest(post_data: telebot.types.Message) -> str:
+		text, entities = utils.get_post_content(post_data)
+		entities = [[e.type, e.offset, e.length, e.url] for e in entities or []]
+		content = json.dumps([text, entities], ensure_ascii=False)
+		return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+	@staticmethod
+	def copy_state(state: dict) -> dict:
+		state = dict(state)
+		text, entities = state["content"]
+		state["content"] = text, [copy.copy(entity) for entity in entities]
+		state["hashtag_indexes"] = copy.deepcopy(state["hashtag_indexes"])
+		for name in ["user_tags", "other_hashtags", "mentioned_users"]:
+			state[name] = list(state[name])
+		return state
+
+	def get(self, key: tuple) -> dict | None:
+		with self._lock:
+			state = self._states.get(key)
+			if state is None:
+				self.miss_count += 1
+			else:
+				self._states.move_to_end(key)
+				self.hit_count += 1
+			self._log_counters()
+		return self.copy_state(state) if state is not None else None
+
+	def save(self, key: tuple, state: dict):
+		state = self.copy_state(state)
+		with self._lock:
+			self._states[key] = state
+			self._states.move_to_end(key)
+			if len(self._states) > self._max_size:
+				self._states.popitem(last=False)
+
+	def invalidate(self, main_channel_id: int = None):
+		with self._lock:
+			if main_channel_id is None:
+				self._states.clear()
+				return
+			for key in [key for key in self._states if key[0] == main_channel_id]:
+				del self._states[key]
+
+	def __len__(self) -> int:
+		with self._lock:
+			return len(self._states)
+
+	def _log_counters(self):
+		now = time.monotonic()
+		if now - self._last_log_time >= self._log_interval:
+			self._last_log_time = now
+			requests_count = self.hit_count + self.miss_count
+			logging.info(f"Parsed tickets cache hits: {self.hit_count}, misses: {self.miss_count}, "
+						 f"hit rate: {self.hit_count / requests_count:.1%}")
+
+
+PARSED_TICKETS = ParsedTicketCache(max_size=10_000, log_interval=60 * 60)
+
+
 class HashtagData:
 	def __init__(self, post_data: telebot.types.Message, main_channel_id: int, insert_default_tags: bool = False,
 				 invalid_user_tag_to_default: bool = False):
 		self.ignore_comments = False
 		self.comment: tuple = None
 		self.hashtag_indexes = []
-		self.post_data = copy.deepcopy(post_data)
+		self.post_data = utils.copy_post_data(post_data)
 		self.main_channel_id = main_channel_id
 
-		self.update_scheduled_tag_entities()
-		self.is_hashtag_line_present = self.check_last_line()
-		self.remove_strikethrough_entities()
+		cache_key = self._get_cache_key(self.post_data, main_channel_id, insert_default_tags, invalid_user_tag_to_default)
+		state = PARSED_TICKETS.get(cache_key) if cache_key else None
+		if state is not None:
+			self._set_state(state)
+			return
+
+		# user tags are read once for all passes over the ticket
+		with user_utils.user_tags_snapshot():
+			self.update_scheduled_tag_entities()
+			self.is_hashtag_line_present = self.check_last_line()
+			self.remove_strikethrough_entities()
+
+			hashtags = self.extract_hashtags(self.post_data, main_channel_id, invalid_user_tag_to_default)
+			scheduled_tag, status_tag, user_tags, priority_tag = hashtags
+			self.scheduled_tag = scheduled_tag
+			self.status_tag = status_tag
+			self.user_tags = user_tags
+			self.priority_tag = priority_tag
+			self.is_sent = None
+
+			text_hashtags = self.parse_text_hashtags()  # hashtags in ticket's text are classified once
+			self.other_hashtags = self.extract_other_hashtags(text_hashtags)  # all tags found in ticket's text
+			self.mentioned_users = self.copy_users_from_text(text_hashtags)  # user tags in ticket's text
 
-		hashtags = self.extract_hashtags(self.post_data, main_channel_id, invalid_user_tag_to_default)
-		scheduled_tag, status_tag, user_tags, priority_tag = hashtags
-		self.scheduled_tag = scheduled_tag
-		self.status_tag = status_tag
-		self.user_tags = user_tags
-		self.priority_tag = priority_tag
-		self.is_sent = None
+			missing_tags = self.get_assigned_user() is None or self.get_priority_number() is None or self.is_status_missing()
+			if insert_default_tags and missing_tags:
+				self.insert_default_tags()
 
-		self.other_hashtags = self.extract_other_hashtags()  # all tags found in ticket's text
-		self.mentioned_users = self.copy_users_from_text()  # user tags in ticket's text
+			self.remove_found_hashtags()
+			self.copy_tags_from_other_hashtags()
 
-		missing_tags = self.get_assigned_user() is None or self.get_priority_number() is None or self.is_status_missing()
-		if insert_default_tags and missing_tags:
-			self.insert_default_tags()
+		if cache_key:
+			PARSED_TICKETS.save(cache_key, self._get_state())
 
-		self.remove_found_hashtags()
-		self.copy_tags_from_other_hashtags()
+	@staticmethod
+	def _get_cache_key(post_data: telebot.types.Message, main_channel_id: int, insert_default_tags: bool,
+					   invalid_user_tag_to_default: bool) -> tuple | None:
+		# default assigned user is taken from tickets in the database and tags are parsed differently during hashtag renaming,
+		# so such tickets aren't cached
+		if invalid_user_tag_to_default or config_utils.HASHTAGS_BEFORE_UPDATE:
+			return None
+
+		hashtags = (OPENED_TAG, CLOSED_TAG, SCHEDULED_TAG, PRIORITY_TAG)
+		default_user_data = DEFAULT_USER_DATA.get(str(main_channel_id)) if insert_default_tags else None
+		return (main_channel_id, post_data.chat.id, post_data.message_id, ParsedTicketCache.get_content_digest(post_data),
+				insert_default_tags, default_user_data, hashtags)
+
+	def _get_state(self) -> dict:
+		state = {name: value for name, value in vars(self).items() if name not in ["post_data", "main_channel_id"]}
+		state["content"] = utils.get_post_content(self.post_data)
+		return state
+
+	def _set_state(self, state: dict):
+		# parsed content is applied to the copy of the current message, because other fields of the message could be changed
+		text, entities = state.pop("content")
+		vars(self).update(state)
+		utils.set_post_content(self.post_data, text, entities)
 
 	def is_last_line_contains_only_hashtags(self):
 		return self.is_hashtag_line_present
@@ -172,8 +285,9 @@ class HashtagData:
 	def get_updated_post_data(self):
 		hashtags = self.get_hashtags_for_insertion()
 		hashtag_utils.insert_hashtags(self.post_data, hashtags, self.is_hashtag_line_present)
-		self.is_hashtag_line_present = self.check_last_line()
-		self.post_data = self.remove_duplicates(self.post_data)
+		with user_utils.user_tags_snapshot():
+			self.is_hashtag_line_present = self.check_last_line()
+			self.post_data = self.remove_duplicates(self.post_data)
 		self.update_scheduled_status()
 		self.post_data = self.add_strikethrough_entities(self.post_data)
 		return self.post_data
@@ -357,27 +471,30 @@ class HashtagData:
 
 		return None
 
-	def extract_other_hashtags(self):
+	def parse_text_hashtags(self):
+		# returns (tag, is_user_tag) for every hashtag that isn't one of the found service tags
 		text, entities = utils.get_post_content(self.post_data)
 		if not entities:
 			return []
-		hashtags = []
 		scheduled_tag_index, status_tag_index, user_tag_indexes, priority_tag_index = self.hashtag_indexes
-		ignored_indexes = [scheduled_tag_index, status_tag_index, priority_tag_index]
-		ignored_indexes += user_tag_indexes
+		ignored_indexes = {scheduled_tag_index, status_tag_index, priority_tag_index, *user_tag_indexes}
 
-		for entity_index in range(len(entities)):
-			entity = entities[entity_index]
+		text_hashtags = []
+		for entity_index, entity in enumerate(entities):
 			if entity_index in ignored_indexes or entity.type != "hashtag":
 				continue
 
-			entity_text = self.get_tag_from_entity(entity, text)
-
-			if self.check_scheduled_tag(entity_text, SCHEDULED_TAG):
-				entity_text = self.extract_scheduled_tag_from_text(text, entity)
+			tag = self.get_tag_from_entity(entity, text)
+			is_user_tag = HashtagData.check_user_tag(tag, self.main_channel_id)
+			if self.check_scheduled_tag(tag, SCHEDULED_TAG):
+				tag = self.extract_scheduled_tag_from_text(text, entity)
+			text_hashtags.append((tag, is_user_tag))
+		return text_hashtags
 
-			hashtags.append("#" + entity_text)
-		return hashtags
+	def extract_other_hashtags(self, text_hashtags: list = None):
+		if text_hashtags is None:
+			text_hashtags = self.parse_text_hashtags()
+		return ["#" + tag for tag, _ in text_hashtags]
 
 	def extract_scheduled_tag_from_text(self, text, entity):
 		entity_text = self.get_tag_from_entity(entity, text)
@@ -434,19 +551,12 @@ class HashtagData:
 			user, priority = DEFAULT_USER_DATA[main_channel_id_str].split()
 			return priority
 
-	def copy_users_from_text(self):
-		text, entities = utils.get_post_content(self.post_data)
+	def copy_users_from_text(self, text_hashtags: list = None):
+		if text_hashtags is None:
+			text_hashtags = self.parse_text_hashtags()
 		mentioned_users = []
-		scheduled_tag_index, status_tag_index, user_tag_indexes, priority_tag_index = self.hashtag_indexes
-		ignored_indexes = [scheduled_tag_index, status_tag_index, priority_tag_index]
-		ignored_indexes += user_tag_indexes
-
-		for entity_index in range(len(entities)):
-			if entity_index in ignored_indexes or entities[entity_index].type != "hashtag":
-				continue
-
-			tag = self.get_tag_from_entity(entities[entity_index], text)
-			if HashtagData.check_user_tag(tag, self.main_channel_id):
+		for tag, is_user_tag in text_hashtags:
+			if is_user_tag:
 				mentioned_users.append(tag)
 				self.add_user(tag)
 		return mentioned_users
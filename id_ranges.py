@@ -0,0 +1,75 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator
+
+
+class IdRangeSet:
+	# set of message ids stored as sorted non-overlapping inclusive ranges,
+	# consecutive ids take the same memory as one id and lookups are binary searches
+	def __init__(self, ids: Iterable[int] = ()):
+		self._starts = []
+		self._ends = []
+		for message_id in sorted(set(ids)):
+			if self._ends and self._ends[-1] + 1 == message_id:
+				self._ends[-1] = message_id
+			else:
+				self._starts.append(message_id)
+				self._ends.append(message_id)
+
+	@classmethod
+	def from_ranges(cls, ranges: Iterable[tuple[int, int]]) -> "IdRangeSet":
+		id_ranges = cls()
+		for start, end in ranges:
+			id_ranges.add_range(start, end)
+		return id_ranges
+
+	def add(self, message_id: int):
+		self.add_range(message_id, message_id)
+
+	def add_range(self, start: int, end: int):
+		if start > end:
+			return
+		# ranges that overlap or touch the new one are merged into it
+		first = bisect_left(self._ends, start - 1)
+		last = bisect_right(self._starts, end + 1)
+		if first < last:
+			start = min(start, self._starts[first])
+			end = max(end, self._ends[last - 1])
+		self._starts[first:last] = [start]
+		self._ends[first:last] = [end]
+
+	def __contains__(self, message_id: int) -> bool:
+		index = bisect_right(self._starts, message_id) - 1
+		return index >= 0 and message_id <= self._ends[index]
+
+	def __len__(self) -> int:
+		return sum(end - start + 1 for start, end in zip(self._starts, self._ends))
+
+	def ranges(self) -> list[tuple[int, int]]:
+		return list(zip(self._starts, self._ends))
+
+	def missing_ranges(self, first_id: int, last_id: int) -> list[tuple[int, int]]:
+		# ranges of ids between first_id and last_id that are not in the set
+		missing = []
+		current_id = first_id
+		index = max(bisect_right(self._starts, first_id) - 1, 0)
+		while current_id <= last_id and index < len(self._starts):
+			start, end = self._starts[index], self._ends[index]
+			if start > last_id:
+				break
+			if start > current_id:
+				missing.append((current_id, start - 1))
+			current_id = max(current_id, end + 1)
+			index += 1
+
+		if current_id <= last_id:
+			missing.append((current_id, last_id))
+		return missing
+
+	def missing_ids(self, first_id: int, last_id: int, reverse: bool = False) -> Iterator[int]:
+		missing = self.missing_ranges(first_id, last_id)
+		if reverse:
+			for start, end in reversed(missing):
+				yield from range(end, start - 1, -1)
+		else:
+			for start, end in missing:
+				yield from range(start, end + 1)
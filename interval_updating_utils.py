@@ -1,5 +1,7 @@
 import logging
+import queue
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pyrogram
 import telebot
@@ -15,11 +17,14 @@ import forwarding_utils
 import post_link_utils
 import threading
 
-from config_utils import DISCUSSION_CHAT_DATA, DELAY_AFTER_ONE_SCAN
+from config_utils import DISCUSSION_CHAT_DATA
+from id_ranges import IdRangeSet
 
 __STOP_STATUS_KEY = "stop"
 _CHECK_DEFAULT_USER_MEMBER = {}
 _EXPORT_BATCH_SIZE = 50
+# amount of tickets checked in one channel before the next channel gets its turn
+_CHECK_SLICE_SIZE = 200
 _INTERVAL_UPDATING_THREAD: threading.Thread = None
 _STATUS: dict = {
 	__STOP_STATUS_KEY: True
@@ -78,45 +83,43 @@ def update_older_message(bot: telebot.TeleBot, main_channel_id: int, main_messag
 	return forwarded_message.id
 
 
-def _get_messages_by_core(channel_id: int, message_ids: list) -> list | None:
-	messages = core_api.get_messages(channel_id, 0, _EXPORT_BATCH_SIZE, message_ids=message_ids,
-									 stop_flag=_STATUS)
-	if messages is None and not _STATUS[__STOP_STATUS_KEY]:
-		logging.info(f"Check chat {channel_id} was skipped because can't get messages")
-
-	return messages
-
-
-def update_by_core(bot: telebot.TeleBot, main_channel_id: int, message_ids: list) -> bool:
-	messages = _get_messages_by_core(main_channel_id, message_ids)
-	if messages is None:
+def update_by_core(bot: telebot.TeleBot, main_channel_id: int, message_ids: list, dirty_before: float = None) -> bool:
+	# next batches are fetched while current batch is processed, only a few batches are kept in memory
+	try:
+		for _, messages in core_api.stream_messages(main_channel_id, message_ids, _EXPORT_BATCH_SIZE, stop_flag=_STATUS):
+			for message in messages:
+				if not _update_interval_message(bot, main_channel_id, message.id, message=message, dirty_before=dirty_before):
+					return False
+	except Exception:
+		logging.info(f"Check chat {main_channel_id} was skipped because can't get messages")
 		return False
 
-	for message in messages:
-		if not _update_interval_message(bot, main_channel_id, message.id, message=message):
-			return False
-	return True
+	return not _STATUS[__STOP_STATUS_KEY]
 
 
-def update_by_bot(bot: telebot.TeleBot, main_channel_id: int, message_ids: list):
+def update_by_bot(bot: telebot.TeleBot, main_channel_id: int, message_ids: list, dirty_before: float = None):
 	for current_msg_id in message_ids:
-		if not _update_interval_message(bot, main_channel_id, current_msg_id):
+		if not _update_interval_message(bot, main_channel_id, current_msg_id, dirty_before=dirty_before):
 			return False
 	return True
 
 
-def _update_interval_message(bot: telebot.TeleBot, main_channel_id: int, current_msg_id: int, message: pyrogram.types.Message = None):
-	time.sleep(DELAY_AFTER_ONE_SCAN)
+def _update_interval_message(bot: telebot.TeleBot, main_channel_id: int, current_msg_id: int, message: pyrogram.types.Message = None,
+							 dirty_before: float = None):
+	# dirty_before is set when only changed tickets are checked, progress of the full check is not saved then
 	try:
 		if _STATUS[__STOP_STATUS_KEY]:
 			raise Exception("Interval update stop requested")
 
 		update_older_message(bot, main_channel_id, current_msg_id, forwarded_message=message)
-		db_utils.insert_or_update_channel_update_progress(main_channel_id, current_msg_id)
+		if dirty_before is None:
+			db_utils.insert_or_update_channel_update_progress(main_channel_id, current_msg_id)
+		else:
+			db_utils.delete_dirty_ticket(main_channel_id, current_msg_id, dirty_before)
 	except ApiTelegramException as E:
 		if E.error_code == 429:
+			# next requests will wait in the rate limiter
 			logging.warning(f"Too many requests - {E}")
-			time.sleep(20)
 			return True
 		logging.error(f"Telegram error during main channel check ({main_channel_id, current_msg_id}) - {E}")
 	except Exception as E:
@@ -132,7 +135,6 @@ def _store_discussion_message(bot: telebot.TeleBot, main_channel_id: int, messag
 
 	if message.empty:
 		comment_utils.comment_dispatcher.delete_comment(bot, main_channel_id, discussion_chat_id, current_msg_id)
-		time.sleep(DELAY_AFTER_ONE_SCAN)
 		return
 
 	if message is None:
@@ -148,7 +150,7 @@ def _store_discussion_message(bot: telebot.TeleBot, main_channel_id: int, messag
 	return main_channel_message_id
 
 
-def start_interval_updating(bot: telebot.TeleBot, start_delay: int = 0):
+def start_interval_updating(bot: telebot.TeleBot, start_delay: int = 0, full_update: bool = True):
 	global _STATUS, _INTERVAL_UPDATING_THREAD
 
 	if not _STATUS[__STOP_STATUS_KEY]:
@@ -156,11 +158,17 @@ def start_interval_updating(bot: telebot.TeleBot, start_delay: int = 0):
 		_INTERVAL_UPDATING_THREAD.join()
 
 	_STATUS[__STOP_STATUS_KEY] = False
-	_INTERVAL_UPDATING_THREAD = threading.Thread(target=interval_update_thread, args=(bot, start_delay,))
+	_INTERVAL_UPDATING_THREAD = threading.Thread(target=interval_update_thread, args=(bot, start_delay, full_update,))
 	_INTERVAL_UPDATING_THREAD.start()
 
 
-def interval_update_thread(bot: telebot.TeleBot, start_delay: int = 0):
+def _is_full_update_required() -> bool:
+	if config_utils.HASHTAGS_BEFORE_UPDATE or db_utils.get_unfinished_update_channels():
+		return True
+	return time.time() - config_utils.LAST_FULL_UPDATE_TIME > config_utils.FULL_UPDATE_INTERVAL * 60
+
+
+def interval_update_thread(bot: telebot.TeleBot, start_delay: int = 0, full_update: bool = True):
 	start_time = time.time()
 	last_update_time = 0
 	while not _STATUS[__STOP_STATUS_KEY]:
@@ -170,14 +178,87 @@ def interval_update_thread(bot: telebot.TeleBot, start_delay: int = 0):
 		if (time.time() - last_update_time) < (config_utils.UPDATE_INTERVAL * 60):
 			continue
 
-		_check_all_messages(bot)
+		# all tickets are checked rarely, between full checks only changed tickets are checked
+		if full_update or _is_full_update_required():
+			_check_all_messages(bot)
+			if not _STATUS[__STOP_STATUS_KEY]:
+				full_update = False
+				config_utils.LAST_FULL_UPDATE_TIME = int(time.time())
+				config_utils.update_config({"LAST_FULL_UPDATE_TIME": config_utils.LAST_FULL_UPDATE_TIME})
+		else:
+			_check_changed_messages(bot)
 		last_update_time = time.time()
 
 
+def _run_channel_checks(channel_checks: list):
+	# each channel check is a generator that yields after every slice of tickets, channels are checked in turns
+	# by a pool of workers, so a big workspace doesn't delay others and one channel is never checked by two workers
+	checks = queue.Queue()
+	for channel_check in channel_checks:
+		checks.put(channel_check)
+
+	def worker():
+		while not _STATUS[__STOP_STATUS_KEY]:
+			try:
+				channel_check = checks.get_nowait()
+			except queue.Empty:
+				# remaining checks are held by other workers
+				return
+			try:
+				next(channel_check)
+			except StopIteration:
+				continue
+			except Exception as E:
+				logging.exception(f"Error during interval check - {E}")
+				continue
+			checks.put(channel_check)
+
+	workers_count = min(max(config_utils.INTERVAL_UPDATE_CONCURRENCY, 1), len(channel_checks))
+	if not workers_count:
+		return
+	with ThreadPoolExecutor(max_workers=workers_count, thread_name_prefix="interval_update") as executor:
+		for _ in range(workers_count):
+			executor.submit(worker)
+
+
+def _update_in_slices(bot: telebot.TeleBot, main_channel_id: int, main_message_ids: list, dirty_before: float = None):
+	for start in range(0, len(main_message_ids), _CHECK_SLICE_SIZE):
+		message_ids = main_message_ids[start:start + _CHECK_SLICE_SIZE]
+		if len(message_ids) > 5:
+			result = update_by_core(bot, main_channel_id, message_ids, dirty_before=dirty_before)
+		else:
+			result = update_by_bot(bot, main_channel_id, message_ids, dirty_before=dirty_before)
+
+		if not result:
+			return False
+		yield
+	return True
+
+
+def _check_changed_messages(bot: telebot.TeleBot):
+	channel_ids = db_utils.get_main_channel_ids()
+	_run_channel_checks([_check_changed_main_messages(bot, channel_id) for channel_id in channel_ids])
+
+
+def _check_changed_main_messages(bot: telebot.TeleBot, main_channel_id: int):
+	main_message_ids = db_utils.get_dirty_ticket_ids(main_channel_id)
+	if not main_message_ids:
+		return
+
+	check_start_time = time.time()
+	main_message_ids.sort(reverse=True)
+	_clear_updating_channel(main_channel_id)
+	result = yield from _update_in_slices(bot, main_channel_id, main_message_ids, dirty_before=check_start_time)
+
+	if result:
+		logging.info(f"Changed tickets check completed in {main_channel_id}, checked: {len(main_message_ids)}")
+
+
 def _check_all_messages(bot: telebot.TeleBot):
 	unfinished_channels = db_utils.get_unfinished_update_channels()
 	finished_channels = db_utils.get_finished_update_channels()
 
+	channel_checks = []
 	channel_ids = db_utils.get_main_channel_ids()
 	for channel_id in channel_ids:
 		if channel_id in finished_channels:
@@ -194,12 +275,9 @@ def _check_all_messages(bot: telebot.TeleBot):
 			del _CHECK_DEFAULT_USER_MEMBER[channel_id]
 
 		start_message = unfinished_channels.get(channel_id)
-		_check_main_messages(bot, channel_id, start_message)
+		channel_checks.append(_check_channel_messages(bot, channel_id, start_message))
 
-		channel_id_str = str(channel_id)
-		if channel_id_str in DISCUSSION_CHAT_DATA:
-			discussion_chat_id = DISCUSSION_CHAT_DATA[channel_id_str]
-			_check_discussion_messages(bot, channel_id, discussion_chat_id)
+	_run_channel_checks(channel_checks)
 
 	if _STATUS[__STOP_STATUS_KEY]:
 		logging.info(f"Interval check stopped prematurely")
@@ -211,7 +289,18 @@ def _check_all_messages(bot: telebot.TeleBot):
 		config_utils.HASHTAGS_BEFORE_UPDATE = None
 		config_utils.update_config({"HASHTAGS_BEFORE_UPDATE": None})
 
+
+def _check_channel_messages(bot: telebot.TeleBot, main_channel_id: int, start_from_message: int = None):
+	yield from _check_main_messages(bot, main_channel_id, start_from_message)
+
+	channel_id_str = str(main_channel_id)
+	if channel_id_str in DISCUSSION_CHAT_DATA:
+		discussion_chat_id = DISCUSSION_CHAT_DATA[channel_id_str]
+		yield from _check_discussion_messages(bot, main_channel_id, discussion_chat_id)
+
+
 def _check_main_messages(bot: telebot.TeleBot, main_channel_id: int, start_from_message: int = None):
+	check_start_time = time.time()
 	main_message_ids = db_utils.get_main_message_ids(main_channel_id)
 	if start_from_message:
 		main_message_ids = [message_id for message_id in main_message_ids if start_from_message >= message_id]
@@ -221,46 +310,72 @@ def _check_main_messages(bot: telebot.TeleBot, main_channel_id: int, start_from_
 
 	main_message_ids.sort(reverse=True)
 	_clear_updating_channel(main_channel_id)
-	if len(main_message_ids) > 5:
-		result = update_by_core(bot, main_channel_id, main_message_ids)
-	else:
-		result = update_by_bot(bot, main_channel_id, main_message_ids)
+	result = yield from _update_in_slices(bot, main_channel_id, main_message_ids)
 
 	if result:
 		db_utils.insert_or_update_channel_update_progress(main_channel_id, 0)
+		if not start_from_message:
+			db_utils.delete_dirty_tickets(main_channel_id, check_start_time)
 		logging.info(f"Main channel check completed in {main_channel_id}")
 
 
+def _check_discussion_message(bot: telebot.TeleBot, main_channel_id: int, discussion_chat_id: int,
+							  message: pyrogram.types.Message, deleted_messages: IdRangeSet) -> bool:
+	if message.id in deleted_messages:
+		logging.info(f"Check comment {message.id} in chat {discussion_chat_id} was skipped because it's in db as deleted")
+		return True
+
+	try:
+		if _STATUS[__STOP_STATUS_KEY]:
+			raise Exception("Interval update stop requested")
+		_store_discussion_message(bot, main_channel_id, message, discussion_chat_id)
+	except ApiTelegramException as E:
+		if E.error_code == 429:
+			# remaining comments aren't checked, so the check progress isn't saved
+			logging.warning(f"Discussion channel check stopped ({discussion_chat_id, message.id}), too many requests - {E}")
+			return False
+		logging.error(f"Telegram error during discussion channel check ({discussion_chat_id, message.id}) - {E}")
+	except Exception as E:
+		logging.error(f"Discussion channel check stopped ({discussion_chat_id, message.id}) - {E}")
+		return False
+	return True
+
+
 def _check_discussion_messages(bot: telebot.TeleBot, main_channel_id: int, discussion_chat_id: int = None):
 	start_msg_id = utils.get_last_message(bot, discussion_chat_id)
 	if start_msg_id is None:
 		return
 
-	logging.info(f"Starting to check discussion channel: {discussion_chat_id}")
-	deleted_messages = db_utils.get_comment_deleted_message_ids(discussion_chat_id, list(range(1, start_msg_id + 1)))
-	message_ids = [id for id in range(start_msg_id, 0, -1) if id not in deleted_messages]
-	messages = _get_messages_by_core(discussion_chat_id, message_ids)
-	if messages is None:
+	# only messages newer than the last verified one are checked, all messages are checked again
+	# after DISCUSSION_RECHECK_INTERVAL to find comments that were deleted later
+	check_start_time = int(time.time())
+	first_msg_id, verified_at = 1, check_start_time
+	check_progress = db_utils.get_discussion_check_progress(discussion_chat_id)
+	if check_progress and check_start_time - check_progress[1] < config_utils.DISCUSSION_RECHECK_INTERVAL * 60:
+		first_msg_id, verified_at = check_progress[0] + 1, check_progress[1]
+	if first_msg_id > start_msg_id:
 		return
 
-	for message in messages:
-		if message.id in deleted_messages:
-			logging.info(f"Check comment {message.id} in chat {discussion_chat_id} was skipped because it's in db as deleted")
-			continue
+	logging.info(f"Starting to check discussion channel: {discussion_chat_id}")
+	deleted_messages = IdRangeSet.from_ranges(db_utils.get_comment_deleted_ranges(discussion_chat_id, first_msg_id, start_msg_id))
+	message_ids = deleted_messages.missing_ids(first_msg_id, start_msg_id, reverse=True)
+	checked_count = 0
+	try:
+		for _, messages in core_api.stream_messages(discussion_chat_id, message_ids, _EXPORT_BATCH_SIZE, stop_flag=_STATUS):
+			for message in messages:
+				if not _check_discussion_message(bot, main_channel_id, discussion_chat_id, message, deleted_messages):
+					return
+				checked_count += 1
+				# comments are checked in slices like tickets, so other channels are checked in between
+				if checked_count % _CHECK_SLICE_SIZE == 0:
+					yield
+	except Exception:
+		logging.info(f"Check chat {discussion_chat_id} was skipped because can't get messages")
+		return
 
-		try:
-			if _STATUS[__STOP_STATUS_KEY]:
-				raise Exception("Interval update stop requested")
-			_store_discussion_message(bot, main_channel_id, message, discussion_chat_id)
-		except ApiTelegramException as E:
-			if E.error_code == 429:
-				logging.warning(f"Too many requests - {E}")
-				time.sleep(20)
-				continue
-			logging.error(f"Telegram error during discussion channel check ({discussion_chat_id, message.id}) - {E}")
-		except Exception as E:
-			logging.error(f"Discussion channel check stopped ({discussion_chat_id, message.id}) - {E}")
-			return
+	if _STATUS[__STOP_STATUS_KEY]:
+		return
 
+	db_utils.insert_or_update_discussion_check_progress(discussion_chat_id, start_msg_id, verified_at)
 	logging.info(f"Discussion channel check completed in {discussion_chat_id}")
 
@@ -10,23 +10,29 @@ import channel_manager
 import command_utils
 from comment_utils import comment_dispatcher
 import config_utils
+import core_api
 import daily_reminder
 import forwarding_utils
 import interval_updating_utils
 import post_link_utils
 import db_utils
+import rate_limiter
 from scheduled_messages_utils import scheduled_message_dispatcher
 import user_utils
 import utils
 
 import messages_export_utils
 from config_utils import (BOT_TOKEN, DISCUSSION_CHAT_DATA, SUPPORTED_CONTENT_TYPES_TICKET,
-						  SUPPORTED_CONTENT_TYPES_COMMENT, INTERVAL_UPDATE_START_DELAY)
+						  SUPPORTED_CONTENT_TYPES_COMMENT, INTERVAL_UPDATE_START_DELAY, WRITE_BEHIND_INTERVAL)
 
 db_utils.initialize_db()
+if WRITE_BEHIND_INTERVAL:
+	db_utils.WRITE_BEHIND_QUEUE.start(WRITE_BEHIND_INTERVAL)
 logging.basicConfig(format='%(asctime)s - {%(pathname)s:%(lineno)d} %(levelname)s: %(message)s', level=logging.INFO)
 
+rate_limiter.install_bot_api_limiter()
 bot = telebot.TeleBot(BOT_TOKEN, num_threads=1)
+core_api.start_client_pool()
 
 config_utils.BOT_ID = bot.user.id
 config_utils.load_discussion_chat_ids(bot)
@@ -40,12 +46,21 @@ scheduled_message_dispatcher.start_scheduled_thread(bot)
 
 daily_reminder.start_reminder_thread(bot)
 
-messages_export_utils.start_exporting()
+
+
+def start_updating_after_export():
+	# subchannel copies of tickets that aren't exported yet would be deleted as invalid
+	if messages_export_utils.is_main_channels_exported():
+		forwarding_utils.get_invalid_ticket_ids(bot)
+	else:
+		logging.info("Not all main channels are exported, scanning of invalid tickets is skipped")
+
+	interval_updating_utils.start_interval_updating(bot, INTERVAL_UPDATE_START_DELAY, full_update=False)
+
+
 user_utils.update_all_channel_members()
 user_utils.check_members_on_main_channels(bot)
-forwarding_utils.get_invalid_ticket_ids(bot)
-
-interval_updating_utils.start_interval_updating(bot, INTERVAL_UPDATE_START_DELAY)
+messages_export_utils.start_exporting(start_updating_after_export)
 
 main_channel_filter = lambda message_data: db_utils.is_main_channel_exists(message_data.chat.id)
 subchannel_filter = lambda message_data: db_utils.is_individual_channel_exists(message_data.chat.id)
@@ -53,12 +68,14 @@ subchannel_filter = lambda message_data: db_utils.is_individual_channel_exists(m
 
 @bot.channel_post_handler(func=main_channel_filter, content_types=SUPPORTED_CONTENT_TYPES_TICKET)
 def handle_post(post_data: telebot.types.Message):
-	db_utils.insert_or_update_last_msg_id(post_data.message_id, post_data.chat.id)
-	if post_data.media_group_id:
-		return
+	with db_utils.transaction():
+		db_utils.insert_or_update_last_msg_id(post_data.message_id, post_data.chat.id)
+		if post_data.media_group_id:
+			return
 
-	user_id = user_utils.find_user_by_signature(post_data.author_signature)
-	db_utils.insert_main_channel_message(post_data.chat.id, post_data.message_id, user_id)
+		user_id = user_utils.find_user_by_signature(post_data.author_signature)
+		db_utils.insert_main_channel_message(post_data.chat.id, post_data.message_id, user_id)
+		utils.store_main_message_content(post_data)
 
 	main_channel_id_str = str(post_data.chat.id)
 	if DISCUSSION_CHAT_DATA[main_channel_id_str] is None:
@@ -115,6 +132,7 @@ def handle_edit_channel_title(post_data: telebot.types.Message):
 
 @bot.edited_channel_post_handler(func=main_channel_filter, content_types=SUPPORTED_CONTENT_TYPES_TICKET)
 def handle_edited_post(post_data: telebot.types.Message):
+	utils.store_main_message_content(post_data)
 	forwarding_utils.handle_edited_post(bot, post_data)
 
 
@@ -1,5 +1,8 @@
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
 
 import config_utils
 import db_utils
@@ -9,9 +12,37 @@ from config_utils import DISCUSSION_CHAT_DATA, EXPORTED_CHATS
 
 _EXPORT_BATCH_SIZE = 50
 
+_EXPORT_THREAD: threading.Thread = None
 
-def export_messages(chat_id: int, last_message_id: int) -> list:
-	return core_api.get_messages(chat_id, last_message_id, _EXPORT_BATCH_SIZE)
+
+def export_messages(chat_id: int, last_message_id: int, first_message_id: int = 1) -> Iterator[tuple[int, list]]:
+	# yields batches of messages together with id of the last message in the batch
+	message_ids = range(first_message_id, last_message_id + 1)
+	for cursor, messages in core_api.stream_messages(chat_id, message_ids, _EXPORT_BATCH_SIZE):
+		yield message_ids[cursor - 1], messages
+
+
+def export_chat_messages(chat_id: int, last_message_id: int, save_messages: Callable[[list], None]) -> bool:
+	# checkpoint is updated after each batch is saved, so if export is interrupted
+	# it will be continued from the last saved batch
+	checkpoint = db_utils.get_export_checkpoint(chat_id) or 0
+	if checkpoint:
+		logging.info(f"Continuing export of {chat_id} from message {checkpoint + 1}")
+
+	batches = export_messages(chat_id, last_message_id, checkpoint + 1)
+	while True:
+		# only fetching errors interrupt the export of the chat, saving errors are raised
+		try:
+			exported_message_id, messages = next(batches)
+		except StopIteration:
+			return True
+		except Exception as E:
+			logging.error(f"Export of {chat_id} is interrupted - {E}")
+			return False
+
+		with db_utils.transaction():
+			save_messages(messages)
+			db_utils.insert_or_update_export_checkpoint(chat_id, exported_message_id)
 
 
 def export_chat_comments(discussion_chat_id: int) -> bool:
@@ -20,43 +51,54 @@ def export_chat_comments(discussion_chat_id: int) -> bool:
 		logging.info(f"Can't find last message in {discussion_chat_id}, export skipped")
 		return False
 
-	messages = export_messages(discussion_chat_id, last_msg_id)
-	if not messages:
+	def save_comments(messages: list):
+		for message in messages:
+			if message.empty and message.id <= last_msg_id:
+				db_utils.delete_comment_message(message.id, discussion_chat_id)
+				continue
+			if message.reply_to_message is None:
+				continue
+
+			discussion_message_id = message.id
+
+			reply_to_message_id = message.reply_to_message.id
+			if message.sender_chat:
+				sender_id = message.sender_chat.id
+			else:
+				sender_id = message.from_user.id
+
+			db_utils.insert_comment_message(reply_to_message_id, discussion_message_id, discussion_chat_id, sender_id)
+			logging.info(f"Exported comment [{reply_to_message_id}, {discussion_message_id}, {discussion_chat_id}]")
+
+	if not export_chat_messages(discussion_chat_id, last_msg_id, save_comments):
 		logging.info(f"Can't export messages in {discussion_chat_id}, export skipped")
 		return False
+	return True
 
-	for message in messages:
-		if message.empty and message.id <= last_msg_id:
-			db_utils.delete_comment_message(message.id, discussion_chat_id)
-			continue
-		if message.reply_to_message is None:
-			continue
 
-		discussion_message_id = message.id
+def _export_chats(chat_ids: list, export_function: Callable[[int], bool]) -> list:
+	# chats are exported concurrently, amount of simultaneous requests is also limited by core api client pool
+	with ThreadPoolExecutor(max_workers=max(config_utils.EXPORT_CONCURRENCY, 1)) as executor:
+		return list(executor.map(export_function, chat_ids))
 
-		reply_to_message_id = message.reply_to_message.id
-		if message.sender_chat:
-			sender_id = message.sender_chat.id
-		else:
-			sender_id = message.from_user.id
 
-		db_utils.insert_comment_message(reply_to_message_id, discussion_message_id, discussion_chat_id, sender_id)
-		logging.info(f"Exported comment [{reply_to_message_id}, {discussion_message_id}, {discussion_chat_id}]")
-	return True
+def _mark_chat_exported(chat_id: int):
+	EXPORTED_CHATS.append(chat_id)
+	config_utils.update_config({"EXPORTED_CHATS": EXPORTED_CHATS})
+	db_utils.delete_export_checkpoint(chat_id)
 
 
 def export_comments_from_discussion_chats():
 	discussion_chat_ids = list(DISCUSSION_CHAT_DATA.values())
-	discussion_chat_ids = [chat_id for chat_id in discussion_chat_ids if chat_id]
+	discussion_chat_ids = [chat_id for chat_id in discussion_chat_ids if chat_id and chat_id not in EXPORTED_CHATS]
 	for chat_id in discussion_chat_ids:
-		if chat_id in EXPORTED_CHATS:
-			continue
-
 		logging.info(f"Exporting comments from {chat_id}")
-		export_chat_comments(chat_id)
-		EXPORTED_CHATS.append(chat_id)
-		config_utils.update_config({"EXPORTED_CHATS": EXPORTED_CHATS})
-		logging.info(f"Successfully exported comments from {chat_id}")
+
+	results = _export_chats(discussion_chat_ids, export_chat_comments)
+	for chat_id, is_exported in zip(discussion_chat_ids, results):
+		if is_exported:
+			_mark_chat_exported(chat_id)
+			logging.info(f"Successfully exported comments from {chat_id}")
 
 
 def export_main_channel_messages(main_channel_id: int) -> bool:
@@ -65,35 +107,59 @@ def export_main_channel_messages(main_channel_id: int) -> bool:
 		logging.info(f"Can't find last message in {main_channel_id}, export skipped")
 		return False
 
-	messages = export_messages(main_channel_id, last_msg_id)
-	if not messages:
-		logging.info(f"Can't export messages in {main_channel_id}, export skipped")
-		return False
+	def save_main_messages(messages: list):
+		for message in messages:
+			if message.empty or message.service:
+				continue
+			user_id = None
+			if message.author_signature:
+				user_id = user_utils.find_user_by_signature(message.author_signature)
 
-	for message in messages:
-		if message.empty or message.service:
-			continue
-		user_id = None
-		if message.author_signature:
-			user_id = user_utils.find_user_by_signature(message.author_signature)
+			db_utils.insert_main_channel_message(main_channel_id, message.id, user_id)
+			logging.info(f"Exported main message [{main_channel_id}, {message.id}, {user_id}]")
 
-		db_utils.insert_main_channel_message(main_channel_id, message.id, user_id)
-		logging.info(f"Exported main message [{main_channel_id}, {message.id}, {user_id}]")
+	if not export_chat_messages(main_channel_id, last_msg_id, save_main_messages):
+		logging.info(f"Can't export messages in {main_channel_id}, export skipped")
+		return False
 	return True
 
 
 def export_main_channels():
 	main_channel_ids = db_utils.get_main_channel_ids()
+	main_channel_ids = [channel_id for channel_id in main_channel_ids if channel_id not in EXPORTED_CHATS]
 	for channel_id in main_channel_ids:
-		if channel_id in EXPORTED_CHATS:
-			continue
 		logging.info(f"Exporting messages from {channel_id}")
-		if export_main_channel_messages(channel_id):
-			EXPORTED_CHATS.append(channel_id)
-			config_utils.update_config({"EXPORTED_CHATS": EXPORTED_CHATS})
+
+	results = _export_chats(main_channel_ids, export_main_channel_messages)
+	for channel_id, is_exported in zip(main_channel_ids, results):
+		if is_exported:
+			_mark_chat_exported(channel_id)
 			logging.info(f"Successfully exported messages from {channel_id}")
 
 
-def start_exporting():
-	export_comments_from_discussion_chats()
-	export_main_channels()
+def is_main_channels_exported() -> bool:
+	return all(channel_id in EXPORTED_CHATS for channel_id in db_utils.get_main_channel_ids())
+
+
+def _export_all(on_finished: Callable[[], None] = None):
+	start_time = time.time()
+	try:
+		export_comments_from_discussion_chats()
+		export_main_channels()
+		logging.info(f"Export finished in {time.time() - start_time:.0f} seconds")
+	except Exception as E:
+		logging.exception(f"Error during exporting messages - {E}")
+
+	# on_finished is called even if export failed, it should check which chats are exported
+	if on_finished:
+		on_finished()
+
+
+def start_exporting(on_finished: Callable[[], None] = None):
+	global _EXPORT_THREAD
+
+	if _EXPORT_THREAD and _EXPORT_THREAD.is_alive():
+		return
+
+	_EXPORT_THREAD = threading.Thread(target=_export_all, args=(on_finished,), name="export", daemon=True)
+	_EXPORT_THREAD.start()
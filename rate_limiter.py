@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import threading
+import time
+
+import requests
+from telebot import apihelper
+
+from config_utils import RATE_LIMIT_GLOBAL, RATE_LIMIT_PER_CHAT, RATE_LIMIT_CHAT_BURST
+
+# rate is lowered by this factor after each flood error
+_RATE_DECREASE_FACTOR = 0.5
+# share of the configured rate that is restored every second after the rate was lowered
+_RATE_RECOVERY_PER_SECOND = 0.01
+_MIN_RATE = 0.05
+
+# long polling requests are not counted, they don't send anything to chats
+_NOT_LIMITED_METHODS = ["getUpdates"]
+
+
+class TokenBucket:
+	def __init__(self, rate: float, capacity: float):
+		self.max_rate = rate
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		# tokens are not refilled before this time, it is moved forward on flood errors
+		self.updated_at = time.monotonic()
+
+	def _refill(self, now: float):
+		elapsed = now - self.updated_at
+		if elapsed <= 0:
+			return
+		self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+		self.rate = min(self.max_rate, self.rate + elapsed * self.max_rate * _RATE_RECOVERY_PER_SECOND)
+		self.updated_at = now
+
+	def reserve(self, now: float) -> float:
+		# takes one token and returns how long to wait before it can be used,
+		# tokens can go below zero, so concurrent callers are queued one after another
+		self._refill(now)
+		self.tokens -= 1
+		wait = max(self.updated_at - now, 0)
+		if self.tokens < 0:
+			wait += -self.tokens / self.rate
+		return wait
+
+	def penalize(self, now: float, retry_after: float):
+		self._refill(now)
+		self.rate = max(self.rate * _RATE_DECREASE_FACTOR, _MIN_RATE)
+		self.tokens = min(self.tokens, 0)
+		self.updated_at = max(self.updated_at, now + retry_after)
+
+
+class RateLimiter:
+	# shared by bot api and core api requests, every request takes a token from the global bucket
+	# and from the bucket of the chat it is sent to
+	def __init__(self, global_rate: float, chat_rate: float, chat_burst: float):
+		self._lock = threading.Lock()
+		self._chat_rate = chat_rate
+		self._chat_burst = chat_burst
+		self._global_bucket = TokenBucket(global_rate, global_rate)
+		self._chat_buckets = {}
+
+	def _get_chat_bucket(self, chat_id) -> TokenBucket:
+		key = str(chat_id)
+		if key not in self._chat_buckets:
+			self._chat_buckets[key] = TokenBucket(self._chat_rate, self._chat_burst)
+		return self._chat_buckets[key]
+
+	def reserve(self, chat_id=None) -> float:
+		with self._lock:
+			now = time.monotonic()
+			wait = self._global_bucket.reserve(now)
+			if chat_id is not None:
+				wait = max(wait, self._get_chat_bucket(chat_id).reserve(now))
+			return wait
+
+	def acquire(self, chat_id=None):
+		wait = self.reserve(chat_id)
+		if wait > 0:
+			time.sleep(wait)
+
+	async def acquire_async(self, chat_id=None):
+		wait = self.reserve(chat_id)
+		if wait > 0:
+			await asyncio.sleep(wait)
+
+	def report_retry_after(self, retry_after: float, chat_id=None):
+		# flood errors without a chat are applied to all requests
+		logging.warning(f"Too many requests{f' to {chat_id}' if chat_id is not None else ''}, retry after {retry_after}")
+		with self._lock:
+			now = time.monotonic()
+			if chat_id is None:
+				self._global_bucket.penalize(now, retry_after)
+			else:
+				self._get_chat_bucket(chat_id).penalize(now, retry_after)
+
+
+LIMITER = RateLimiter(RATE_LIMIT_GLOBAL, RATE_LIMIT_PER_CHAT, RATE_LIMIT_CHAT_BURST)
+
+
+def _get_retry_after(response: requests.Response) -> int | None:
+	try:
+		return response.json()["parameters"]["retry_after"]
+	except (ValueError, KeyError, TypeError):
+		return None
+
+
+def send_bot_api_request(method: str, request_url: str, **kwargs) -> requests.Response:
+	method_name = request_url.rsplit("/", 1)[-1]
+	params = kwargs.get("params") or {}
+	chat_id = params.get("chat_id")
+
+	if method_name not in _NOT_LIMITED_METHODS:
+		LIMITER.acquire(chat_id)
+
+	response = apihelper._get_req_session().request(method, request_url, **kwargs)
+	if response.status_code == 429:
+		retry_after = _get_retry_after(response)
+		if retry_after is not None:
+			LIMITER.report_retry_after(retry_after, chat_id)
+	return response
+
+
+def install_bot_api_limiter():
+	apihelper.CUSTOM_REQUEST_SENDER = send_bot_api_request
+
+
+def is_bot_api_limiter_installed() -> bool:
+	return apihelper.CUSTOM_REQUEST_SENDER is send_bot_api_request
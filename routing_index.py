@@ -0,0 +1,97 @@
+import json
+import threading
+
+import channel_manager
+import db_utils
+
+_PRIORITY_KEY = "priority"
+
+
+class RoutingIndex:
+	# individual channels grouped by the values that are used to route tickets to them:
+	# (priority, "1"), ("due",), ("deferred",), (role setting, user tag),
+	# changed channels are reindexed one by one before the next lookup
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._index = {}
+		self._channel_keys = {}
+		self._custom_hashtags = {}
+		self._rebuild_required = True
+		self._changed_channel_ids = set()
+
+	def on_channel_changed(self, channel_id=None):
+		# called by the channel registry while database lock is held, so it doesn't wait for the index lock
+		if channel_id is None:
+			self._rebuild_required = True
+		else:
+			self._changed_channel_ids.add(channel_id)
+
+	@staticmethod
+	def _get_channel_keys(channel_data: dict) -> list:
+		keys = []
+		if channel_data["priorities"]:
+			keys += [(_PRIORITY_KEY, priority) for priority in channel_data["priorities"].split(",")]
+
+		setting_types = channel_manager.SETTING_TYPES
+		settings = json.loads(channel_data["settings"]) if channel_data["settings"] else {}
+		keys += [(setting_type,) for setting_type in [setting_types.DUE, setting_types.DEFERRED] if settings.get(setting_type)]
+		for setting_type in [setting_types.ASSIGNED, setting_types.FOLLOWED, setting_types.REPORTED]:
+			keys += [(setting_type, user_tag) for user_tag in settings.get(setting_type) or []]
+		return keys
+
+	def _remove_channel(self, channel_id):
+		for key in self._channel_keys.pop(channel_id, []):
+			self._index[key].discard(channel_id)
+		self._custom_hashtags.pop(channel_id, None)
+
+	def _add_channel(self, channel_id, channel_data: dict, custom_hashtag: str):
+		keys = self._get_channel_keys(channel_data)
+		for key in keys:
+			self._index.setdefault(key, set()).add(channel_id)
+		self._channel_keys[channel_id] = keys
+		if custom_hashtag:
+			self._custom_hashtags[channel_id] = custom_hashtag
+
+	def _ensure_updated(self):
+		if self._rebuild_required:
+			self._rebuild_required = False
+			self._index, self._channel_keys, self._custom_hashtags = {}, {}, {}
+			self._changed_channel_ids.clear()
+			custom_hashtags = db_utils.get_custom_hashtags() or {}
+			for channel_id, channel_data in db_utils.CHANNEL_REGISTRY.get_individual_channels():
+				self._add_channel(channel_id, channel_data, custom_hashtags.get(channel_id))
+			return
+
+		while self._changed_channel_ids:
+			channel_id = self._changed_channel_ids.pop()
+			self._remove_channel(channel_id)
+			channel_data = db_utils.CHANNEL_REGISTRY.get_individual_channel(channel_id)
+			if channel_data:
+				self._add_channel(channel_id, channel_data, db_utils.get_custom_hashtag(channel_id))
+
+	def _get(self, *key) -> set:
+		return self._index.get(key, set())
+
+	def get_subchannel_ids(self, priority, is_deferred: bool, assigned_user: str, followed_users: list,
+						   creator_user_tags: list, ticket_hashtags: list) -> set:
+		with self._lock:
+			self._ensure_updated()
+
+			role_channels = set()
+			if assigned_user:
+				role_channels |= self._get(channel_manager.SETTING_TYPES.ASSIGNED, assigned_user)
+			for user_tag in followed_users or []:
+				role_channels |= self._get(channel_manager.SETTING_TYPES.FOLLOWED, user_tag)
+			for user_tag in creator_user_tags or []:
+				role_channels |= self._get(channel_manager.SETTING_TYPES.REPORTED, user_tag)
+
+			ticket_state = channel_manager.SETTING_TYPES.DEFERRED if is_deferred else channel_manager.SETTING_TYPES.DUE
+			subchannel_ids = role_channels & self._get(_PRIORITY_KEY, str(priority)) & self._get(ticket_state)
+
+			# channels with custom hashtag receive only tickets with this hashtag
+			return {channel_id for channel_id in subchannel_ids
+					if channel_id not in self._custom_hashtags or self._custom_hashtags[channel_id] in ticket_hashtags}
+
+
+ROUTING_INDEX = RoutingIndex()
+db_utils.CHANNEL_REGISTRY.add_listener(ROUTING_INDEX.on_channel_changed)
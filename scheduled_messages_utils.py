@@ -323,6 +323,8 @@ class ScheduledMessageDispatcher:
 					self.send_scheduled_message(bot, msg_info)
 				except Exception as E:
 					logging.error(f"Exception during sending deferred message: {E}")
+					# ticket will be updated during the next interval check
+					db_utils.mark_ticket_dirty(msg_info.main_channel_id, msg_info.main_message_id)
 			time.sleep(1)
 
 	def update_status_from_tags(self, bot: telebot.TeleBot, msg_data: telebot.types.Message, hashtag_data: HashtagData):
@@ -7,6 +7,7 @@ from telebot.types import CallbackQuery, User, InlineKeyboardMarkup, InlineKeybo
 import config_utils
 from tests import test_helper
 import channel_manager
+import utils
 
 
 @patch("telebot.types.CallbackQuery.__init__", return_value=None)
@@ -1866,5 +1867,18 @@ class DeleteIndividualSettingsForWorkspace(TestCase):
 		mock_delete_individual_channel.assert_not_called()
 
 
+@patch("channel_manager.generate_current_settings_text", return_value="settings")
+class UpdateSettingsMessageTest(TestCase):
+	def test_skip_unchanged(self, *args):
+		mock_bot = Mock(spec=TeleBot)
+		with patch("utils.KEYBOARD_MARKUP_STORE", utils.KeyboardMarkupStore(max_size=10, log_interval=60)):
+			channel_manager.update_settings_message(mock_bot, -1001, 10)
+			channel_manager.update_settings_message(mock_bot, -1001, 10)
+			mock_bot.edit_message_text.assert_called_once_with(text="settings", reply_markup=ANY, chat_id=-1001, message_id=10)
+
+			channel_manager.update_settings_message(mock_bot, -1001, 10, channel_manager.get_button_settings_keyboard("Edit"))
+			self.assertEqual(mock_bot.edit_message_text.call_count, 2)
+
+
 if __name__ == "__main__":
 	main()
@@ -1,16 +1,19 @@
+import threading
+import time
 from unittest import TestCase, main
 from unittest.mock import patch, AsyncMock, Mock, call, MagicMock
 
 from pyrogram import Client
+from pyrogram.errors import FloodWait
 
 import config_utils
 import core_api
 
 
 @patch("logging.info")
-@patch("asyncio.sleep")
+@patch("rate_limiter.LIMITER.acquire_async")
 class GetMessagesTest(TestCase):
-	def test_messages(self, mock_sleep, mock_info, *args):
+	def test_messages(self, mock_acquire_async, mock_info, *args):
 		channel_id = -10012345678
 		last_msg_id = 9
 		limit = 2
@@ -20,13 +23,14 @@ class GetMessagesTest(TestCase):
 		manager = Mock()
 		manager.attach_mock(mock_client.get_messages, "a")
 		manager.attach_mock(mock_info, "b")
-		manager.attach_mock(mock_sleep, "c")
+		manager.attach_mock(mock_acquire_async, "c")
 		expected_calls = []
 
 		for i in range(1, 5):
+			expected_calls.append(call.c(channel_id))
 			expected_calls.append(call.a(channel_id, [i * 2 - 1, i * 2]))
 			expected_calls.append(call.b(f"Exporting progress: {i * 2}/9"))
-			expected_calls.append(call.c(1))
+		expected_calls.append(call.c(channel_id))
 		expected_calls.append(call.a(channel_id, [9]))
 		expected_calls.append(call.b(f"Exporting progress: 9/9"))
 
@@ -34,7 +38,7 @@ class GetMessagesTest(TestCase):
 		self.assertEqual(expected_calls, manager.mock_calls)
 		self.assertEqual(result, [1, 2, 3, 4, 5, 6, 7, 8, 9])
 
-	def test_messages_50_limit_less(self, mock_sleep, mock_info, *args):
+	def test_messages_50_limit_less(self, mock_acquire_async, mock_info, *args):
 		channel_id = -10012345678
 		last_msg_id = 350
 		limit = 50
@@ -44,18 +48,18 @@ class GetMessagesTest(TestCase):
 		manager = Mock()
 		manager.attach_mock(mock_client.get_messages, "a")
 		manager.attach_mock(mock_info, "b")
-		manager.attach_mock(mock_sleep, "c")
+		manager.attach_mock(mock_acquire_async, "c")
 		expected_calls = []
 
 		for i in range(0, 7):
+			expected_calls.append(call.c(channel_id))
 			expected_calls.append(call.a(channel_id, [i * 50 + j for j in range(1, 51)]))
 			expected_calls.append(call.b(f"Exporting progress: {(i + 1) * 50}/350"))
-			if i < 6: expected_calls.append(call.c(1))
 
 		core_api.get_messages(channel_id, last_msg_id, limit, client=mock_client)
 		self.assertEqual(expected_calls, manager.mock_calls)
 
-	def test_messages_50_limit_more(self, mock_sleep, mock_info, *args):
+	def test_messages_50_limit_more(self, mock_acquire_async, mock_info, *args):
 		channel_id = -10012345678
 		last_msg_id = 360
 		limit = 50
@@ -65,20 +69,21 @@ class GetMessagesTest(TestCase):
 		manager = Mock()
 		manager.attach_mock(mock_client.get_messages, "a")
 		manager.attach_mock(mock_info, "b")
-		manager.attach_mock(mock_sleep, "c")
+		manager.attach_mock(mock_acquire_async, "c")
 		expected_calls = []
 
 		for i in range(0, 7):
+			expected_calls.append(call.c(channel_id))
 			expected_calls.append(call.a(channel_id, [i * 50 + j for j in range(1, 51)]))
 			expected_calls.append(call.b(f"Exporting progress: {(i + 1) * 50}/360"))
-			expected_calls.append(call.c(5))
+		expected_calls.append(call.c(channel_id))
 		expected_calls.append(call.a(channel_id, [351,352,353,354,355,356,357,358,359,360]))
 		expected_calls.append(call.b(f"Exporting progress: 360/360"))
 
 		core_api.get_messages(channel_id, last_msg_id, limit, client=mock_client)
 		self.assertEqual(expected_calls, manager.mock_calls)
 
-	def test_messages_65_limit(self, mock_sleep, mock_info, *args):
+	def test_messages_65_limit(self, mock_acquire_async, mock_info, *args):
 		channel_id = -10012345678
 		last_msg_id = 330
 		limit = 65
@@ -88,20 +93,21 @@ class GetMessagesTest(TestCase):
 		manager = Mock()
 		manager.attach_mock(mock_client.get_messages, "a")
 		manager.attach_mock(mock_info, "b")
-		manager.attach_mock(mock_sleep, "c")
+		manager.attach_mock(mock_acquire_async, "c")
 		expected_calls = []
 
 		for i in range(0, 5):
+			expected_calls.append(call.c(channel_id))
 			expected_calls.append(call.a(channel_id, [i * 65 + j for j in range(1, 66)]))
 			expected_calls.append(call.b(f"Exporting progress: {(i + 1) * 65}/330"))
-			expected_calls.append(call.c(6.5))
+		expected_calls.append(call.c(channel_id))
 		expected_calls.append(call.a(channel_id, [326,327,328,329,330]))
 		expected_calls.append(call.b(f"Exporting progress: 330/330"))
 
 		core_api.get_messages(channel_id, last_msg_id, limit, client=mock_client)
 		self.assertEqual(expected_calls, manager.mock_calls)
 
-	def test_messages_with_list(self, mock_sleep, mock_info, *args):
+	def test_messages_with_list(self, mock_acquire_async, mock_info, *args):
 		channel_id = -10012345678
 		last_msg_id = 9
 		message_ids = [1, 2, 3, 5, 7, 9]
@@ -112,19 +118,31 @@ class GetMessagesTest(TestCase):
 		manager = Mock()
 		manager.attach_mock(mock_client.get_messages, "a")
 		manager.attach_mock(mock_info, "b")
-		manager.attach_mock(mock_sleep, "c")
+		manager.attach_mock(mock_acquire_async, "c")
 		expected_calls = []
 
 		for i in range(0, 3):
+			expected_calls.append(call.c(channel_id))
 			expected_calls.append(call.a(channel_id, [message_ids[i * 2], message_ids[i * 2 + 1]]))
 			expected_calls.append(call.b(f"Exporting progress: {(i + 1) * 2}/6"))
-			if i < 2: expected_calls.append(call.c(1))
 
 		result = core_api.get_messages(channel_id, last_msg_id, limit, client=mock_client, message_ids=message_ids)
 		self.assertEqual(expected_calls, manager.mock_calls)
 		self.assertEqual(result, message_ids)
 
-	def test_messages_stop_flag(self, mock_sleep, mock_info, *args):
+	@patch("rate_limiter.LIMITER.report_retry_after")
+	def test_messages_flood_wait(self, mock_report_retry_after, mock_acquire_async, mock_info, *args):
+		channel_id = -10012345678
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=[FloodWait(value=7), [1, 2], [3]])
+
+		result = core_api.get_messages(channel_id, 3, 2, client=mock_client)
+		mock_report_retry_after.assert_called_once_with(7, channel_id)
+		mock_client.get_messages.assert_has_calls([call(channel_id, [1, 2]), call(channel_id, [1, 2]), call(channel_id, [3])])
+		self.assertEqual(mock_acquire_async.call_count, 3)
+		self.assertEqual(result, [1, 2, 3])
+
+	def test_messages_stop_flag(self, mock_acquire_async, mock_info, *args):
 		channel_id = -10012345678
 		last_msg_id = 9
 		message_ids = [1, 2, 3, 5, 7, 9]
@@ -136,15 +154,115 @@ class GetMessagesTest(TestCase):
 		result = core_api.get_messages(channel_id, last_msg_id, limit, client=mock_client,
 									   message_ids=message_ids, stop_flag={"stop": True})
 		mock_client.get_messages.assert_not_called()
-		mock_sleep.assert_not_called()
+		mock_acquire_async.assert_not_called()
 		mock_info.assert_called_once_with(f"Stopping export progress, count exported: 0")
 		self.assertEqual(result, None)
 
 
-@patch("asyncio.sleep")
+@patch("logging.info")
+@patch("rate_limiter.LIMITER.acquire_async")
+class StreamMessagesTest(TestCase):
+	def test_batches(self, *args):
+		channel_id = -10012345678
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=lambda chat_id, message_ids: message_ids)
+
+		result = list(core_api.stream_messages(channel_id, list(range(1, 8)), 3, client=mock_client))
+		self.assertEqual(result, [(3, [1, 2, 3]), (6, [4, 5, 6]), (7, [7])])
+
+	def test_cursor(self, *args):
+		channel_id = -10012345678
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=lambda chat_id, message_ids: message_ids)
+
+		result = list(core_api.stream_messages(channel_id, list(range(1, 8)), 3, client=mock_client, cursor=3))
+		self.assertEqual(result, [(6, [4, 5, 6]), (7, [7])])
+
+	def test_lazy_message_ids(self, mock_acquire_async, mock_info):
+		channel_id = -10012345678
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=lambda chat_id, message_ids: message_ids)
+		taken_ids = []
+
+		def generate_ids():
+			for message_id in range(1, 1_000_001):
+				taken_ids.append(message_id)
+				yield message_id
+
+		stream = core_api.stream_messages(channel_id, generate_ids(), 2, client=mock_client, cursor=2)
+		self.assertEqual(next(stream), (4, [3, 4]))
+		time.sleep(0.1)
+		stream.close()
+		# only ids of the fetched batches are taken from the iterator
+		self.assertEqual(len(taken_ids), (core_api._STREAM_PREFETCH_BATCHES + 2) * 2 + 2)
+		mock_info.assert_any_call("Exporting progress: 4")
+
+	def test_range(self, *args):
+		channel_id = -10012345678
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=lambda chat_id, message_ids: message_ids)
+
+		result = list(core_api.stream_messages(channel_id, range(1, 8), 3, client=mock_client, cursor=3))
+		self.assertEqual(result, [(6, [4, 5, 6]), (7, [7])])
+
+	def test_bounded_prefetch(self, *args):
+		channel_id = -10012345678
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=lambda chat_id, message_ids: message_ids)
+
+		stream = core_api.stream_messages(channel_id, list(range(1, 101)), 2, client=mock_client)
+		self.assertEqual(next(stream), (2, [1, 2]))
+		time.sleep(0.1)
+		# one batch is consumed, the next batches are waiting in the queue and one is waiting to be put there
+		self.assertEqual(mock_client.get_messages.await_count, core_api._STREAM_PREFETCH_BATCHES + 2)
+		stream.close()
+
+	def test_stop_flag(self, *args):
+		channel_id = -10012345678
+		stop_flag = {"stop": False}
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=lambda chat_id, message_ids: message_ids)
+
+		result = []
+		for _, messages in core_api.stream_messages(channel_id, list(range(1, 101)), 2, stop_flag=stop_flag, client=mock_client):
+			result += messages
+			stop_flag["stop"] = True
+		self.assertLess(len(result), 100)
+
+	@patch("logging.error")
+	def test_error(self, mock_error, *args):
+		channel_id = -10012345678
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=[[1, 2], ConnectionError("Test error")])
+
+		stream = core_api.stream_messages(channel_id, [1, 2, 3, 4], 2, client=mock_client)
+		self.assertEqual(next(stream), (2, [1, 2]))
+		with self.assertRaises(ConnectionError):
+			next(stream)
+		mock_error.assert_called_once_with(f"Core api stream_messages({channel_id}) exception - Test error")
+
+
+class GetMessagesByIdsTest(TestCase):
+	def test_default(self, *args):
+		mock_client = Mock(spec=Client)
+		mock_client.get_messages = AsyncMock(side_effect=lambda chat_id, message_ids: [Mock(id=i) for i in message_ids])
+		message_ids = list(range(1, 251))
+
+		result = core_api.get_messages_by_ids({-10012345678: message_ids, -10087654321: [5]}, client=mock_client)
+		mock_client.get_messages.assert_has_calls([
+			call(-10012345678, message_ids[:200]),
+			call(-10012345678, message_ids[200:]),
+			call(-10087654321, [5]),
+		])
+		self.assertEqual(mock_client.get_messages.call_count, 3)
+		self.assertEqual(len(result), 251)
+		self.assertEqual(result[(-10087654321, 5)].id, 5)
+
+
+@patch("rate_limiter.LIMITER.acquire_async")
 @patch("core_api.__get_members_for_chat")
 class GetMembersTest(TestCase):
-	def test_default(self, mock__get_members_for_chat, mock_sleep, *args):
+	def test_default(self, mock__get_members_for_chat, mock_acquire_async, *args):
 		chat_ids = [-10012345678, -10087654321]
 		mock_client = Mock(spec=Client)
 		mock__get_members_for_chat.side_effect = lambda chat_id, client: [1, 2, 3] if chat_id == -10087654321 else [4, 5, 6]
@@ -152,11 +270,11 @@ class GetMembersTest(TestCase):
 		result = core_api.get_members(chat_ids, client=mock_client)
 		mock__get_members_for_chat.assert_has_calls([call(-10012345678, client=mock_client), call(-10087654321, client=mock_client)])
 		self.assertEqual(mock__get_members_for_chat.call_count, 2)
-		mock_sleep.assert_has_calls([call(0.5), call(0.5)])
-		self.assertEqual(mock_sleep.call_count, 2)
+		mock_acquire_async.assert_has_calls([call(-10012345678), call(-10087654321)])
+		self.assertEqual(mock_acquire_async.call_count, 2)
 		self.assertEqual(result, {-10012345678: [4, 5, 6], -10087654321: [1, 2, 3]})
 
-	def test_with_none_users(self, mock__get_members_for_chat, mock_sleep, *args):
+	def test_with_none_users(self, mock__get_members_for_chat, mock_acquire_async, *args):
 		chat_ids = [-10012345678, -10087654321]
 		mock_client = Mock(spec=Client)
 		mock__get_members_for_chat.side_effect = lambda chat_id, client: [1, 2, 3] if chat_id == -10087654321 else None
@@ -164,11 +282,11 @@ class GetMembersTest(TestCase):
 		result = core_api.get_members(chat_ids, client=mock_client)
 		mock__get_members_for_chat.assert_has_calls([call(-10012345678, client=mock_client), call(-10087654321, client=mock_client)])
 		self.assertEqual(mock__get_members_for_chat.call_count, 2)
-		mock_sleep.assert_has_calls([call(0.5), call(0.5)])
-		self.assertEqual(mock_sleep.call_count, 2)
+		mock_acquire_async.assert_has_calls([call(-10012345678), call(-10087654321)])
+		self.assertEqual(mock_acquire_async.call_count, 2)
 		self.assertEqual(result, {-10012345678: [], -10087654321: [1, 2, 3]})
 
-	def test_with_empty_users(self, mock__get_members_for_chat, mock_sleep, *args):
+	def test_with_empty_users(self, mock__get_members_for_chat, mock_acquire_async, *args):
 		chat_ids = [-10012345678, -10087654321]
 		mock_client = Mock(spec=Client)
 		mock__get_members_for_chat.side_effect = lambda chat_id, client: [1, 2, 3] if chat_id == -10087654321 else []
@@ -176,11 +294,121 @@ class GetMembersTest(TestCase):
 		result = core_api.get_members(chat_ids, client=mock_client)
 		mock__get_members_for_chat.assert_has_calls([call(-10012345678, client=mock_client), call(-10087654321, client=mock_client)])
 		self.assertEqual(mock__get_members_for_chat.call_count, 2)
-		mock_sleep.assert_has_calls([call(0.5), call(0.5)])
-		self.assertEqual(mock_sleep.call_count, 2)
+		mock_acquire_async.assert_has_calls([call(-10012345678), call(-10087654321)])
+		self.assertEqual(mock_acquire_async.call_count, 2)
 		self.assertEqual(result, {-10012345678: [], -10087654321: [1, 2, 3]})
 
 
+def create_mock_client(name):
+	mock_client = Mock(spec=Client)
+	mock_client.name = name
+	mock_client.is_connected = False
+
+	async def start():
+		mock_client.is_connected = True
+
+	async def stop():
+		mock_client.is_connected = False
+
+	mock_client.start = AsyncMock(side_effect=start)
+	mock_client.stop = AsyncMock(side_effect=stop)
+	return mock_client
+
+
+@patch("core_api.create_client", side_effect=create_mock_client)
+class ClientPoolTest(TestCase):
+	def test_reuse_client(self, mock_create_client, *args):
+		pool = core_api.ClientPool(1)
+
+		async def use_pool():
+			async with pool.acquire() as client1:
+				pass
+			async with pool.acquire() as client2:
+				pass
+			return client1, client2
+
+		client1, client2 = core_api._run_in_event_loop(use_pool())
+		self.assertIs(client1, client2)
+		mock_create_client.assert_called_once_with("pool_0")
+		client1.start.assert_called_once_with()
+
+	@patch("logging.info")
+	def test_reconnect_after_connection_error(self, mock_create_client, *args):
+		pool = core_api.ClientPool(1)
+
+		async def use_pool():
+			with self.assertRaises(ConnectionError):
+				async with pool.acquire() as client:
+					raise ConnectionError()
+			self.assertFalse(client.is_connected)
+			async with pool.acquire() as client:
+				return client
+
+		client = core_api._run_in_event_loop(use_pool())
+		self.assertTrue(client.is_connected)
+		self.assertEqual(client.start.call_count, 2)
+		client.stop.assert_called_once_with()
+
+	@patch("logging.info")
+	def test_warm_up_and_close(self, mock_create_client, *args):
+		pool = core_api.ClientPool(2)
+
+		core_api._run_in_event_loop(pool.warm_up())
+		self.assertEqual(mock_create_client.call_count, 2)
+
+		async def get_clients():
+			async with pool.acquire() as client1, pool.acquire() as client2:
+				return [client1, client2]
+
+		clients = core_api._run_in_event_loop(get_clients())
+		for client in clients:
+			client.start.assert_called_once_with()
+
+		core_api._run_in_event_loop(pool.close())
+		for client in clients:
+			client.stop.assert_called_once_with()
+
+	def test_sync_wrapper_uses_pool(self, mock_create_client, *args):
+		mock_client = create_mock_client("pool_0")
+		mock_client.get_users = AsyncMock(return_value="user")
+		mock_create_client.side_effect = None
+		mock_create_client.return_value = mock_client
+
+		with patch("core_api._CLIENT_POOL", core_api.ClientPool(1)), patch("logging.info"):
+			self.assertEqual(core_api.get_user(12345), "user")
+			self.assertEqual(core_api.get_user(12345), "user")
+
+		mock_create_client.assert_called_once_with("pool_0")
+		mock_client.start.assert_called_once_with()
+		mock_client.get_users.assert_has_calls([call(12345), call(12345)])
+
+
+	@patch("rate_limiter.LIMITER.acquire_async")
+	@patch("logging.info")
+	def test_stream_releases_client(self, mock_info, mock_acquire_async, mock_create_client, *args):
+		mock_client = create_mock_client("pool_0")
+		mock_client.get_messages = AsyncMock(side_effect=lambda chat_id, message_ids: [Mock(id=i) for i in message_ids])
+		mock_create_client.side_effect = None
+		mock_create_client.return_value = mock_client
+		channel_id = -10012345678
+		result = []
+
+		def consume():
+			# consumer calls core api while the stream is running, it uses the only client of the pool
+			for _, messages in core_api.stream_messages(channel_id, list(range(1, 11)), 2):
+				ids = [message.id for message in messages]
+				result.append(list(core_api.get_messages_by_ids({channel_id: ids})))
+
+		with patch("core_api._CLIENT_POOL", core_api.ClientPool(1)):
+			consumer = threading.Thread(target=consume, daemon=True)
+			consumer.start()
+			consumer.join(5)
+
+		self.assertFalse(consumer.is_alive())
+		self.assertEqual(len(result), 5)
+		self.assertEqual(result[-1], [(channel_id, 9), (channel_id, 10)])
+
+
 @patch("pyrogram.client.Client.__init__", return_value=None)
 class CreateClientTest(TestCase):
 	def test_default(self, mock_init_client, *args):
@@ -0,0 +1,554 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from unittest import main, TestCase
+from unittest.mock import patch
+
+import db_utils
+
+
+def _get_index_names(connection, table_name):
+	cursor = connection.cursor()
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=(?)", (table_name,))
+	return [row[0] for row in cursor.fetchall()]
+
+
+def _get_column_names(connection, table_name):
+	cursor = connection.cursor()
+	cursor.execute("SELECT name FROM pragma_table_info(?)", (table_name,))
+	return [row[0] for row in cursor.fetchall()]
+
+
+class RunMigrationsTest(TestCase):
+	def setUp(self):
+		self.connection = sqlite3.connect(":memory:")
+
+	def tearDown(self):
+		self.connection.close()
+
+	def test_new_database(self):
+		db_utils.run_migrations(self.connection)
+
+		self.assertEqual(db_utils.get_schema_version(self.connection), len(db_utils._MIGRATIONS))
+		self.assertIn("idx_copied_messages_main", _get_index_names(self.connection, "copied_messages"))
+		self.assertIn("idx_copied_messages_copied", _get_index_names(self.connection, "copied_messages"))
+		self.assertIn("idx_comment_messages_message", _get_index_names(self.connection, "comment_messages"))
+
+	def test_target_version(self):
+		db_utils.run_migrations(self.connection, target_version=1)
+
+		self.assertEqual(db_utils.get_schema_version(self.connection), 1)
+		self.assertEqual(_get_index_names(self.connection, "copied_messages"), [])
+
+		db_utils.run_migrations(self.connection)
+		self.assertEqual(db_utils.get_schema_version(self.connection), len(db_utils._MIGRATIONS))
+		self.assertIn("idx_copied_messages_main", _get_index_names(self.connection, "copied_messages"))
+
+	def test_rerun_is_noop(self):
+		db_utils.run_migrations(self.connection)
+		db_utils.run_migrations(self.connection)
+
+		cursor = self.connection.cursor()
+		cursor.execute("SELECT version FROM schema_version ORDER BY version")
+		versions = [row[0] for row in cursor.fetchall()]
+		self.assertEqual(versions, list(range(1, len(db_utils._MIGRATIONS) + 1)))
+
+	def test_legacy_database(self):
+		cursor = self.connection.cursor()
+		cursor.execute('''CREATE TABLE "individual_channel_settings" ("id" INTEGER PRIMARY KEY AUTOINCREMENT,
+			"channel_id" INT NOT NULL, "main_channel_id" INT, "settings" TEXT, "priorities" TEXT, "user_id" INT)''')
+		cursor.execute('''CREATE TABLE "user_reminder_data" ("id" INTEGER PRIMARY KEY AUTOINCREMENT,
+			"user_tag" TEXT NOT NULL, "main_channel_id" INT, "last_interaction_time" INT)''')
+		cursor.execute("INSERT INTO individual_channel_settings (channel_id, main_channel_id) VALUES (?, ?)", (-10012, -10011))
+		self.connection.commit()
+
+		db_utils.run_migrations(self.connection)
+
+		self.assertNotIn("main_channel_id", _get_column_names(self.connection, "individual_channel_settings"))
+		self.assertNotIn("main_channel_id", _get_column_names(self.connection, "user_reminder_data"))
+		cursor.execute("SELECT channel_id FROM individual_channel_settings")
+		self.assertEqual(cursor.fetchall(), [(-10012,)])
+
+	def test_lookup_uses_index(self):
+		db_utils.run_migrations(self.connection)
+
+		cursor = self.connection.cursor()
+		sql = "EXPLAIN QUERY PLAN SELECT copied_message_id FROM copied_messages WHERE main_message_id=(?) AND main_channel_id=(?) AND copied_channel_id=(?)"
+		cursor.execute(sql, (1, 2, 3))
+		plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+		self.assertIn("COVERING INDEX idx_copied_messages_main", plan)
+
+
+class TemporaryDatabaseTestCase(TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.pool = db_utils.ConnectionPool(os.path.join(self.directory.name, "test.db"))
+		db_utils.run_migrations(self.pool.connection)
+		for target, value in [("db_utils._POOL", self.pool), ("db_utils.CHANNEL_REGISTRY", db_utils.ChannelRegistry())]:
+			patcher = patch(target, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		self.pool.close_all()
+		self.directory.cleanup()
+
+	def _count_rows(self, table_name):
+		connection = sqlite3.connect(self.pool.filename)
+		count = connection.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+		connection.close()
+		return count
+
+
+class ConnectionPoolTest(TemporaryDatabaseTestCase):
+
+	def test_connection_per_thread(self):
+		connections = []
+		thread = threading.Thread(target=lambda: connections.append(self.pool.connection))
+		thread.start()
+		thread.join()
+
+		self.assertIs(self.pool.connection, self.pool.connection)
+		self.assertIsNot(connections[0], self.pool.connection)
+		self.pool.cursor.execute("PRAGMA journal_mode")
+		self.assertEqual(self.pool.cursor.fetchone()[0], "wal")
+
+	def test_concurrent_writes(self):
+		writers_count = 8
+		messages_per_writer = 100
+		errors = []
+		stop_readers = threading.Event()
+
+		def writer(channel_id):
+			try:
+				for message_id in range(1, messages_per_writer + 1):
+					db_utils.insert_copied_message(message_id, -1001, message_id, channel_id)
+					db_utils.insert_or_update_last_msg_id(message_id, channel_id)
+			except Exception as E:
+				errors.append(E)
+
+		def reader():
+			try:
+				while not stop_readers.is_set():
+					db_utils.get_copied_message_data(1, -1001)
+					db_utils.get_last_message_id(-1)
+			except Exception as E:
+				errors.append(E)
+
+		with patch("logging.error") as mock_error:
+			readers = [threading.Thread(target=reader) for _ in range(4)]
+			writers = [threading.Thread(target=writer, args=(-i,)) for i in range(1, writers_count + 1)]
+			for thread in readers + writers:
+				thread.start()
+			for thread in writers:
+				thread.join()
+			stop_readers.set()
+			for thread in readers:
+				thread.join()
+
+			mock_error.assert_not_called()
+			self.assertEqual(errors, [])
+			for channel_id in range(1, writers_count + 1):
+				self.assertEqual(db_utils.get_last_message_id(-channel_id), messages_per_writer)
+
+		self.pool.cursor.execute("SELECT COUNT(*) FROM copied_messages")
+		self.assertEqual(self.pool.cursor.fetchone()[0], writers_count * messages_per_writer)
+
+
+class TransactionTest(TemporaryDatabaseTestCase):
+	def test_single_commit(self):
+		with db_utils.transaction():
+			db_utils.insert_copied_message(1, -1001, 2, -1002)
+			with db_utils.transaction():
+				db_utils.insert_copied_message(1, -1001, 3, -1003)
+			self.assertEqual(self._count_rows("copied_messages"), 0)
+
+		self.assertEqual(self._count_rows("copied_messages"), 2)
+
+	def test_rollback_on_exception(self):
+		with self.assertRaises(ValueError):
+			with db_utils.transaction():
+				db_utils.insert_copied_message(1, -1001, 2, -1002)
+				raise ValueError()
+
+		self.assertEqual(self._count_rows("copied_messages"), 0)
+		self.assertEqual(db_utils.get_copied_message_data(1, -1001), [])
+
+	@patch("logging.error")
+	def test_rollback_on_sqlite_error(self, mock_error):
+		with db_utils.transaction():
+			db_utils.insert_copied_message(1, -1001, 2, -1002)
+			db_utils.insert_copied_message(1, -1001, None, -1002)
+
+		mock_error.assert_called_once()
+		self.assertEqual(self._count_rows("copied_messages"), 0)
+
+
+class WriteBehindQueueTest(TemporaryDatabaseTestCase):
+	def setUp(self):
+		super().setUp()
+		self.queue = db_utils.WriteBehindQueue()
+		queue_patcher = patch("db_utils.WRITE_BEHIND_QUEUE", self.queue)
+		queue_patcher.start()
+		self.addCleanup(queue_patcher.stop)
+
+	def test_coalesce_last_message_id(self):
+		self.queue.start(3600)
+		db_utils.insert_or_update_last_msg_id(10, -1001)
+		db_utils.insert_or_update_last_msg_id(11, -1001)
+		db_utils.insert_or_update_last_msg_id(5, -1002)
+
+		self.assertEqual(db_utils.get_last_message_id(-1001), 11)
+		self.assertEqual(self._count_rows("last_message_ids"), 0)
+
+		self.queue.flush()
+		self.assertEqual(self._count_rows("last_message_ids"), 2)
+		self.assertEqual(db_utils.get_last_message_id(-1001), 11)
+		self.assertEqual(db_utils.get_last_message_id(-1002), 5)
+		self.queue.stop()
+
+	def test_flush_on_stop(self):
+		self.queue.start(3600)
+		db_utils.insert_or_update_last_msg_id(10, -1001)
+		self.queue.stop()
+
+		self.assertFalse(self.queue.is_running())
+		self.assertEqual(self._count_rows("last_message_ids"), 1)
+		db_utils.insert_or_update_last_msg_id(12, -1001)
+		self.assertEqual(self._count_rows("last_message_ids"), 1)
+		self.assertEqual(db_utils.get_last_message_id(-1001), 12)
+
+	def test_not_running(self):
+		db_utils.insert_or_update_last_msg_id(10, -1001)
+		self.assertEqual(self._count_rows("last_message_ids"), 1)
+
+
+class ChannelRegistryTest(TemporaryDatabaseTestCase):
+	def test_load_existing_channels(self):
+		cursor = self.pool.cursor
+		cursor.execute("INSERT INTO main_channels (channel_id) VALUES (?)", (-1001,))
+		cursor.execute("INSERT INTO individual_channel_settings (channel_id, settings, priorities, user_id) VALUES (?, ?, ?, ?)",
+					   (-1002, "{}", "1,2", 100))
+		cursor.executemany("INSERT INTO individual_channel_priorities (channel_id, priority) VALUES (?, ?)", [(-1002, "1"), (-1002, "2")])
+		self.pool.connection.commit()
+
+		self.assertTrue(db_utils.is_main_channel_exists(-1001))
+		self.assertFalse(db_utils.is_main_channel_exists(-1002))
+		self.assertTrue(db_utils.is_individual_channel_exists(-1002))
+		self.assertEqual(db_utils.get_individual_channel_settings(-1002), ("{}", "1,2"))
+		self.assertEqual(db_utils.get_individual_channel_user_id(-1002), (100,))
+		self.assertEqual(db_utils.get_individual_channels_by_priority(2), [(-1002, "{}")])
+		self.assertEqual(db_utils.get_individual_channels_by_priority(3), [])
+		self.assertEqual(db_utils.get_user_individual_channels(100), [(-1002, "{}")])
+
+	def test_write_through(self):
+		self.assertEqual(db_utils.get_main_channel_ids(), [])
+		self.assertEqual(db_utils.get_all_individual_channels(), [])
+
+		db_utils.insert_main_channel(-1001)
+		db_utils.insert_individual_channel(-1002, "{}", 100)
+		db_utils.update_individual_channel(-1002, '{"assigned": true}', "1")
+		db_utils.update_individual_channel_user(-1002, 200)
+
+		with patch("db_utils._POOL") as mock_pool:
+			self.assertEqual(db_utils.get_main_channel_ids(), [-1001])
+			self.assertEqual(db_utils.get_individual_channel_settings(-1002), ('{"assigned": true}', "1"))
+			self.assertEqual(db_utils.get_user_individual_channels(200), [(-1002, '{"assigned": true}')])
+			mock_pool.cursor.execute.assert_not_called()
+
+		db_utils.delete_main_channel(-1001)
+		db_utils.delete_individual_channel(-1002)
+		self.assertFalse(db_utils.is_main_channel_exists(-1001))
+		self.assertFalse(db_utils.is_individual_channel_exists(-1002))
+		self.assertIsNone(db_utils.get_individual_channel_settings(-1002))
+		self.assertEqual(self._count_rows("main_channels"), 0)
+
+	def test_reload_after_rollback(self):
+		self.assertFalse(db_utils.is_main_channel_exists(-1001))
+
+		with self.assertRaises(ValueError):
+			with db_utils.transaction():
+				db_utils.insert_main_channel(-1001)
+				raise ValueError()
+
+		self.assertFalse(db_utils.is_main_channel_exists(-1001))
+
+
+	def test_invalidated_after_loading(self):
+		db_utils.insert_main_channel(-1001)
+		db_utils.insert_individual_channel(-1002, "{}", 100)
+		registry = db_utils.CHANNEL_REGISTRY
+		ensure_loaded = registry._ensure_loaded
+
+		def load_and_invalidate():
+			# other thread invalidates the registry right after it was loaded
+			loaded = ensure_loaded()
+			registry.invalidate()
+			return loaded
+
+		with patch.object(registry, "_ensure_loaded", side_effect=load_and_invalidate):
+			self.assertTrue(registry.is_main_channel(-1001))
+			self.assertEqual(registry.get_main_channel_ids(), [-1001])
+			self.assertTrue(registry.is_individual_channel(-1002))
+			self.assertEqual(registry.get_individual_channel(-1002)["user_id"], 100)
+			self.assertEqual([channel_id for channel_id, _ in registry.get_individual_channels()], [-1002])
+
+
+class MainMessageContentTest(TemporaryDatabaseTestCase):
+	def test_insert_update_delete(self):
+		self.assertIsNone(db_utils.get_main_message_content(-1001, 10))
+
+		db_utils.insert_main_channel_message(-1001, 10, None)
+		db_utils.insert_or_update_main_message_content(-1001, 10, '{"text": "a"}', None)
+		db_utils.insert_or_update_main_message_content(-1001, 10, '{"text": "b"}', 1700000000)
+		self.assertEqual(db_utils.get_main_message_content(-1001, 10), '{"text": "b"}')
+		self.assertEqual(self._count_rows("main_message_contents"), 1)
+
+		db_utils.delete_main_channel_message(-1001, 10)
+		self.assertIsNone(db_utils.get_main_message_content(-1001, 10))
+
+	@patch("time.time")
+	def test_max_age(self, mock_time):
+		mock_time.return_value = 1000
+		db_utils.insert_or_update_main_message_content(-1001, 10, '{"text": "a"}', None)
+
+		mock_time.return_value = 1100
+		self.assertEqual(db_utils.get_main_message_content(-1001, 10, 200), '{"text": "a"}')
+		self.assertIsNone(db_utils.get_main_message_content(-1001, 10, 50))
+
+
+
+@patch("time.time")
+class DirtyTicketsTest(TemporaryDatabaseTestCase):
+	def test_mark_and_delete(self, mock_time):
+		mock_time.return_value = 1000
+		db_utils.mark_ticket_dirty(-1001, 10)
+		db_utils.mark_ticket_dirty(-1001, 11)
+		db_utils.mark_ticket_dirty(-1002, 10)
+		self.assertEqual(sorted(db_utils.get_dirty_ticket_ids(-1001)), [10, 11])
+
+		mock_time.return_value = 1100
+		db_utils.mark_ticket_dirty(-1001, 11)
+		db_utils.delete_dirty_ticket(-1001, 10, 1050)
+		db_utils.delete_dirty_ticket(-1001, 11, 1050)
+		self.assertEqual(db_utils.get_dirty_ticket_ids(-1001), [11])
+		self.assertEqual(db_utils.get_dirty_ticket_ids(-1002), [10])
+
+	def test_mark_channel(self, mock_time):
+		mock_time.return_value = 1000
+		db_utils.insert_main_channel_message(-1001, 10, None)
+		db_utils.insert_main_channel_message(-1001, 11, None)
+		db_utils.insert_main_channel_message(-1002, 12, None)
+		db_utils.mark_ticket_dirty(-1001, 10)
+
+		db_utils.mark_channel_tickets_dirty(-1001)
+		self.assertEqual(sorted(db_utils.get_dirty_ticket_ids(-1001)), [10, 11])
+		self.assertEqual(db_utils.get_dirty_ticket_ids(-1002), [])
+
+		db_utils.delete_main_channel_message(-1001, 11)
+		self.assertEqual(db_utils.get_dirty_ticket_ids(-1001), [10])
+
+	def test_delete_channel_tickets(self, mock_time):
+		mock_time.return_value = 1000
+		db_utils.mark_ticket_dirty(-1001, 10)
+		mock_time.return_value = 1100
+		db_utils.mark_ticket_dirty(-1001, 11)
+
+		db_utils.delete_dirty_tickets(-1001, 1050)
+		self.assertEqual(db_utils.get_dirty_ticket_ids(-1001), [11])
+
+
+class CommentDeletedRangesTest(TemporaryDatabaseTestCase):
+	def test_insert_merges_ranges(self):
+		for message_id in [1, 2, 3, 7, 5, 6, 10]:
+			db_utils.insert_comment_deleted_message(message_id, -1001)
+		db_utils.insert_comment_deleted_message(2, -1001)
+		db_utils.insert_comment_deleted_message(4, -1002)
+
+		self.assertEqual(sorted(db_utils.get_comment_deleted_ranges(-1001, 1, 100)), [(1, 3), (5, 7), (10, 10)])
+		self.assertEqual(db_utils.get_comment_deleted_ranges(-1002, 1, 100), [(4, 4)])
+		self.assertEqual(self._count_rows("comment_deleted_messages"), 4)
+
+		db_utils.insert_comment_deleted_message(4, -1001)
+		self.assertEqual(sorted(db_utils.get_comment_deleted_ranges(-1001, 1, 100)), [(1, 7), (10, 10)])
+
+	def test_comment_with_data(self):
+		db_utils.insert_comment_message(50, 2, -1001, 12345)
+		db_utils.insert_comment_deleted_message(1, -1001)
+		db_utils.delete_comment_message(2, -1001)
+		db_utils.insert_comment_deleted_message(3, -1001)
+
+		self.assertEqual(sorted(db_utils.get_comment_deleted_ranges(-1001, 1, 100)), [(1, 1), (2, 2), (3, 3)])
+		self.assertTrue(db_utils.is_comment_deleted_exist(2, -1001))
+		self.assertFalse(db_utils.is_comment_exist(2, -1001))
+
+	def test_range_query(self):
+		db_utils.insert_comment_deleted_range(-1001, 10, 20)
+		db_utils.insert_comment_deleted_range(-1001, 30, 40)
+
+		self.assertEqual(db_utils.get_comment_deleted_ranges(-1001, 15, 25), [(10, 20)])
+		self.assertEqual(db_utils.get_comment_deleted_ranges(-1001, 21, 29), [])
+		self.assertTrue(db_utils.is_comment_deleted_exist(35, -1001))
+		self.assertFalse(db_utils.is_comment_deleted_exist(25, -1001))
+
+	def test_check_progress(self):
+		self.assertIsNone(db_utils.get_discussion_check_progress(-1001))
+		db_utils.insert_or_update_discussion_check_progress(-1001, 100, 1000)
+		db_utils.insert_or_update_discussion_check_progress(-1001, 150, 1000)
+		self.assertEqual(db_utils.get_discussion_check_progress(-1001), (150, 1000))
+
+
+class CommentDeletedRangesMigrationTest(TestCase):
+	def test_compact_existing_rows(self):
+		connection = sqlite3.connect(":memory:")
+		db_utils.run_migrations(connection, target_version=db_utils._MIGRATIONS.index(db_utils._add_comment_deleted_ranges))
+		connection.executemany("INSERT INTO comment_deleted_messages (discussion_chat_id, message_id) VALUES (?, ?)",
+							   [(-1001, i) for i in [1, 2, 3, 5, 6]] + [(-1002, 2)])
+		connection.execute('''INSERT INTO comment_deleted_messages (discussion_chat_id, message_id, reply_to_message_id, sender_id)
+							  VALUES (-1001, 4, 50, 12345)''')
+		connection.commit()
+
+		db_utils.run_migrations(connection)
+		cursor = connection.execute('''SELECT discussion_chat_id, message_id, last_message_id, reply_to_message_id
+									  FROM comment_deleted_messages ORDER BY discussion_chat_id, message_id''')
+		self.assertEqual(cursor.fetchall(), [(-1002, 2, 2, None), (-1001, 1, 3, None), (-1001, 4, 4, 50), (-1001, 5, 6, None)])
+		connection.close()
+
+
+class IndividualChannelSettingsTablesTest(TemporaryDatabaseTestCase):
+	def _get_rows(self, sql):
+		connection = sqlite3.connect(self.pool.filename)
+		rows = sorted(connection.execute(sql).fetchall())
+		connection.close()
+		return rows
+
+	def test_write_through(self):
+		db_utils.insert_individual_channel(-1002, '{"assigned": ["AA"], "cc": ["BB", "CC"]}', 100)
+		self.assertEqual(self._get_rows("SELECT * FROM individual_channel_priorities"), [])
+
+		db_utils.update_individual_channel(-1002, '{"reported": ["AA"], "remind": ["assigned"]}', "1,12")
+		self.assertEqual(self._get_rows("SELECT channel_id, priority FROM individual_channel_priorities"),
+						 [(-1002, "1"), (-1002, "12")])
+
+		db_utils.update_individual_channel_settings(-1002, "{}")
+		self.assertEqual(self._get_rows("SELECT channel_id, priority FROM individual_channel_priorities"),
+						 [(-1002, "1"), (-1002, "12")])
+
+		db_utils.delete_individual_channel(-1002)
+		self.assertEqual(self._get_rows("SELECT * FROM individual_channel_priorities"), [])
+
+	def test_find_copied_message_from_main(self):
+		db_utils.insert_individual_channel(-1002, "{}", 100)
+		db_utils.update_individual_channel(-1002, "{}", "12")
+		db_utils.insert_individual_channel(-1003, "{}", 100)
+		db_utils.update_individual_channel(-1003, "{}", "2,3")
+		db_utils.insert_copied_message(10, -1001, 20, -1002)
+		db_utils.insert_copied_message(10, -1001, 30, -1003)
+
+		self.assertEqual(db_utils.find_copied_message_from_main(10, -1001, 100, 2), (30, -1003))
+		self.assertEqual(db_utils.find_copied_message_from_main(10, -1001, 100, 12), (20, -1002))
+		self.assertIsNone(db_utils.find_copied_message_from_main(10, -1001, 100, 1))
+		self.assertEqual(db_utils.get_individual_channels_by_priority(1), [])
+		self.assertEqual(db_utils.get_individual_channels_by_priority(2), [(-1003, "{}")])
+		self.assertEqual(db_utils.get_individual_channels_by_priority(12), [(-1002, "{}")])
+
+	def test_channels_by_priority_index(self):
+		connection = sqlite3.connect(self.pool.filename)
+		plan = connection.execute('''EXPLAIN QUERY PLAN SELECT s.channel_id, s.settings FROM individual_channel_priorities p
+									  JOIN individual_channel_settings s ON s.channel_id = p.channel_id
+									  WHERE p.priority = (?)''', ("1",)).fetchall()
+		connection.close()
+		self.assertIn("idx_individual_channel_priorities_priority", " ".join(row[-1] for row in plan))
+
+
+class IndividualChannelSettingsMigrationTest(TestCase):
+	def test_migrate_existing_settings(self):
+		connection = sqlite3.connect(":memory:")
+		db_utils.run_migrations(connection, target_version=db_utils._MIGRATIONS.index(db_utils._create_individual_channel_priorities_table))
+		connection.executemany("INSERT INTO individual_channel_settings (channel_id, settings, priorities, user_id) VALUES (?, ?, ?, ?)", [
+			(-1002, '{"assigned": ["AA"], "reported": ["AA", "BB"], "due": true}', "1,2", 100),
+			(-1003, None, None, 100),
+			(-1004, "not json", "3", 100),
+		])
+		connection.commit()
+
+		db_utils.run_migrations(connection)
+		self.assertEqual(sorted(connection.execute("SELECT * FROM individual_channel_priorities").fetchall()),
+						 [(-1004, "3"), (-1002, "1"), (-1002, "2")])
+		connection.close()
+
+
+class CopiedMessageContentHashTest(TemporaryDatabaseTestCase):
+	def test_content_hash(self):
+		db_utils.insert_copied_message(10, -1001, 20, -1002, "hash")
+		db_utils.insert_copied_message(10, -1001, 30, -1003)
+		self.assertEqual(sorted(db_utils.get_copied_messages_with_hash(10, -1001)), [(20, -1002, "hash"), (30, -1003, None)])
+
+		db_utils.update_copied_message_content_hash(30, -1003, "new hash")
+		db_utils.update_copied_message_content_hash(20, -1002, None)
+		self.assertEqual(sorted(db_utils.get_copied_messages_with_hash(10, -1001)), [(20, -1002, None), (30, -1003, "new hash")])
+
+
+class TicketUsersTest(TemporaryDatabaseTestCase):
+	def _get_ticket_users(self):
+		connection = sqlite3.connect(self.pool.filename)
+		rows = sorted(connection.execute("SELECT main_message_id, user_tag, role FROM ticket_users").fetchall())
+		connection.close()
+		return rows
+
+	def test_write_through(self):
+		db_utils.insert_or_update_ticket_data(10, -1001, True, "AA,BB,CC", "2")
+		self.assertEqual(self._get_ticket_users(), [(10, "AA", "assigned"), (10, "BB", "followed"), (10, "CC", "followed")])
+
+		db_utils.insert_or_update_ticket_data(10, -1001, True, "BB", "2")
+		self.assertEqual(self._get_ticket_users(), [(10, "BB", "assigned")])
+
+		db_utils.insert_or_update_ticket_data(10, -1001, True, None, "2")
+		self.assertEqual(self._get_ticket_users(), [])
+
+		db_utils.insert_or_update_ticket_data(10, -1001, True, "AA", "2")
+		db_utils.delete_ticket_data(10, -1001)
+		self.assertEqual(self._get_ticket_users(), [])
+
+	def test_user_highest_priority(self):
+		db_utils.insert_or_update_ticket_data(10, -1001, True, "AA,BB", "2")
+		db_utils.insert_or_update_ticket_data(11, -1001, True, "BB", "1")
+		db_utils.insert_or_update_ticket_data(12, -1001, True, "AAA", "1")
+
+		self.assertEqual(db_utils.get_user_highest_priority(-1001, "AA"), "2")
+		self.assertEqual(db_utils.get_user_highest_priority(-1001, "BB"), "1")
+		self.assertIsNone(db_utils.get_user_highest_priority(-1001, "A"))
+		self.assertIsNone(db_utils.get_user_highest_priority(-1002, "AA"))
+
+	def test_assigned_users_by_channel(self):
+		for main_message_id, user_tags in [(10, "AA,BB"), (11, "BB"), (12, "BB,AA"), (13, "AA"), (14, "CC")]:
+			db_utils.insert_main_channel_message(-1001, main_message_id, 100)
+			db_utils.insert_or_update_ticket_data(main_message_id, -1001, True, user_tags, "2")
+		db_utils.insert_or_update_ticket_data(15, -1001, True, "CC", "2")
+
+		self.assertEqual(db_utils.get_assigned_users_by_channel(-1001), [(2, "AA"), (2, "BB"), (1, "CC")])
+
+		db_utils.delete_invalid_ticket_data()
+		self.assertEqual(self._count_rows("ticket_users"), 7)
+
+
+class TicketUsersMigrationTest(TestCase):
+	def test_migrate_existing_tickets(self):
+		connection = sqlite3.connect(":memory:")
+		db_utils.run_migrations(connection, target_version=db_utils._MIGRATIONS.index(db_utils._create_ticket_users_table))
+		connection.executemany("INSERT INTO tickets_data (main_message_id, main_channel_id, is_opened, user_tags, priority) VALUES (?, ?, ?, ?, ?)", [
+			(10, -1001, 1, "AA,BB", "1"),
+			(11, -1001, 1, None, "2"),
+			(12, -1001, 0, "CC", "3"),
+		])
+		connection.commit()
+
+		db_utils.run_migrations(connection)
+		self.assertEqual(sorted(connection.execute("SELECT main_message_id, user_tag, role FROM ticket_users").fetchall()),
+						 [(10, "AA", "assigned"), (10, "BB", "followed"), (12, "CC", "assigned")])
+		connection.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -1,9 +1,11 @@
+import threading
+import time
 from unittest import TestCase, main
 from unittest.mock import patch, Mock, ANY, call
 
 from telebot import TeleBot
 from telebot.apihelper import ApiTelegramException
-from telebot.types import CallbackQuery, User, InlineKeyboardMarkup
+from telebot.types import CallbackQuery, User, InlineKeyboardMarkup, InlineKeyboardButton
 
 import channel_manager
 import config_utils
@@ -12,6 +14,8 @@ from tests import test_helper
 from hashtag_data import HashtagData
 
 import forwarding_utils
+import routing_index
+import utils
 
 
 @patch("db_utils.get_copied_messages_from_main", return_value=[(34, 12345678),])
@@ -149,7 +153,7 @@ class ForwardForSubchannelTest(TestCase):
 		mock_filter_subchannels_by_members.assert_called_once_with(main_chat_id, mock_get_subchannel_ids_from_hashtags.return_value)
 
 		expected_calls = [
-			call.a(main_message_id, main_chat_id, sub_message_id, sub_chat_id),
+			call.a(main_message_id, main_chat_id, sub_message_id, sub_chat_id, utils.get_post_content_hash(mock_message)),
 			call.d(sub_message_id, sub_chat_id),
 			call.b(mock_bot, mock_message, mock_generate_control_buttons.return_value, chat_id=sub_chat_id, message_id=sub_message_id),
 			call.c(mock_bot, sub_chat_id, 166),
@@ -245,6 +249,90 @@ class ForwardForSubchannelTest(TestCase):
 														   chat_id = sub_chat_id, message_id=sub_message_id)
 		mock_update_copied_message.assert_not_called()
 
+	@patch("forwarding_utils.generate_control_buttons")
+	@patch("utils.add_channel_id_to_post_data")
+	@patch("forwarding_utils.get_subchannel_ids_from_hashtags")
+	@patch("forwarding_utils.filter_subchannels_by_members")
+	@patch("channel_manager.get_ticket_settings_buttons")
+	@patch("db_utils.insert_copied_message")
+	@patch("db_utils.insert_or_update_last_msg_id")
+	@patch("forwarding_utils.update_copied_message")
+	@patch("utils.edit_message_keyboard")
+	def test_multiple_subchannels(self, mock_edit_message_keyboard, mock_update_copied_message,
+								  mock_insert_or_update_last_msg_id, mock_insert_copied_message, mock_get_ticket_settings_buttons,
+								  mock_filter_subchannels_by_members, *args):
+		main_chat_id = 12345678
+		main_message_id = 157
+		sub_chat_ids = [87654321, 87654322, 87654323]
+		mock_bot = Mock(spec=TeleBot)
+		mock_message = test_helper.create_mock_message("test item", [], main_chat_id, main_message_id)
+		mock_bot.send_message.side_effect = lambda chat_id, **kwargs: test_helper.create_mock_message("test item", [], chat_id, chat_id % 100)
+		mock_filter_subchannels_by_members.return_value = sub_chat_ids
+		mock_get_ticket_settings_buttons.return_value = InlineKeyboardMarkup()
+
+		calls_by_subchannel = {}
+		mock_insert_copied_message.side_effect = lambda *args: calls_by_subchannel.setdefault(args[3], []).append("insert")
+		mock_edit_message_keyboard.side_effect = lambda *args, chat_id, **kwargs: calls_by_subchannel.setdefault(chat_id, []).append("edit")
+		mock_update_copied_message.side_effect = lambda bot, chat_id, message_id: calls_by_subchannel.setdefault(chat_id, []).append("update")
+
+		with patch("config_utils.FORWARDING_CONCURRENCY", 3):
+			forwarding_utils.forward_to_subchannel(mock_bot, mock_message, HashtagData())
+
+		self.assertEqual(mock_bot.send_message.call_count, 3)
+		content_hash = utils.get_post_content_hash(mock_message)
+		mock_insert_copied_message.assert_has_calls([call(main_message_id, main_chat_id, sub_chat_id % 100, sub_chat_id, content_hash)
+													 for sub_chat_id in sub_chat_ids], any_order=True)
+		mock_insert_or_update_last_msg_id.assert_has_calls([call(sub_chat_id % 100, sub_chat_id) for sub_chat_id in sub_chat_ids], any_order=True)
+		self.assertEqual(calls_by_subchannel, {sub_chat_id: ["insert", "edit", "update"] for sub_chat_id in sub_chat_ids})
+
+	@patch("forwarding_utils.generate_control_buttons")
+	@patch("utils.add_channel_id_to_post_data")
+	@patch("forwarding_utils.get_subchannel_ids_from_hashtags")
+	@patch("forwarding_utils.filter_subchannels_by_members")
+	@patch("channel_manager.get_ticket_settings_buttons")
+	@patch("db_utils.transaction")
+	@patch("db_utils.insert_copied_message")
+	@patch("db_utils.insert_or_update_last_msg_id")
+	@patch("forwarding_utils.update_copied_message")
+	@patch("utils.edit_message_keyboard")
+	def test_save_copies_in_one_transaction(self, mock_edit_message_keyboard, mock_update_copied_message,
+											mock_insert_or_update_last_msg_id, mock_insert_copied_message, mock_transaction,
+											mock_get_ticket_settings_buttons, mock_filter_subchannels_by_members, *args):
+		main_chat_id = 12345678
+		main_message_id = 157
+		sub_chat_ids = [87654321, 87654322, 87654323]
+		mock_bot = Mock(spec=TeleBot)
+		mock_message = test_helper.create_mock_message("test item", [], main_chat_id, main_message_id)
+
+		def send_message(chat_id, **kwargs):
+			if chat_id == 87654322:
+				raise ApiTelegramException("sendMessage", None, {"error_code": 400, "description": "Bad Request"})
+			return test_helper.create_mock_message("test item", [], chat_id, chat_id % 100)
+
+		mock_bot.send_message.side_effect = send_message
+		mock_filter_subchannels_by_members.return_value = sub_chat_ids
+		mock_get_ticket_settings_buttons.return_value = InlineKeyboardMarkup()
+
+		manager = Mock()
+		manager.attach_mock(mock_transaction, "transaction")
+		manager.attach_mock(mock_insert_copied_message, "insert")
+		manager.attach_mock(mock_edit_message_keyboard, "edit")
+
+		with patch("config_utils.FORWARDING_CONCURRENCY", 3):
+			forwarding_utils.forward_to_subchannel(mock_bot, mock_message, HashtagData())
+
+		self.assertEqual(mock_bot.send_message.call_count, 3)
+		mock_transaction.assert_called_once_with()
+		content_hash = utils.get_post_content_hash(mock_message)
+		mock_insert_copied_message.assert_has_calls([call(main_message_id, main_chat_id, 21, 87654321, content_hash),
+													 call(main_message_id, main_chat_id, 23, 87654323, content_hash)])
+		self.assertEqual(mock_insert_copied_message.call_count, 2)
+		mock_insert_or_update_last_msg_id.assert_has_calls([call(21, 87654321), call(23, 87654323)])
+		self.assertEqual(mock_update_copied_message.call_count, 2)
+		# all copies are saved before the first keyboard is edited
+		call_names = [name for name, _, _ in manager.mock_calls if name in ["transaction", "insert", "edit"]]
+		self.assertEqual(call_names, ["transaction", "insert", "insert", "edit", "edit"])
+
 	@patch("db_utils.get_main_message_from_copied")
 	@patch("forwarding_utils.generate_control_buttons")
 	@patch("utils.add_channel_id_to_post_data")
@@ -293,72 +381,103 @@ class ForwardForSubchannelTest(TestCase):
 
 	@patch("user_utils.get_member_ids_channel", return_value=[5486154])
 	@patch("db_utils.get_main_message_sender")
-	def test_filter_creator_channels(self, mock_get_main_message_sender, *args):
+	def test_get_creator_user_tags(self, mock_get_main_message_sender, *args):
 		main_channel_id = -1006532516165
 		main_message_id = 453
 		user_id = 5486154
 		config_utils.USER_TAGS = {"AA": 358435, "CC": user_id, "DD": 5115684, "FF": user_id}
 		mock_get_main_message_sender.return_value = user_id
-		channel_data = [
-			(-10012345678, {channel_manager.SETTING_TYPES.REPORTED: ["CC", "DD"]}),
-			(-10087654321, {channel_manager.SETTING_TYPES.REPORTED: ["DD", "FF"]}),
-			(-10082165431, {channel_manager.SETTING_TYPES.REPORTED: ["dd", "ff"]}),
-		]
 
-		result_channels = forwarding_utils.filter_creator_channels(channel_data, main_channel_id, main_message_id)
+		result = forwarding_utils.get_creator_user_tags(main_channel_id, main_message_id)
 		mock_get_main_message_sender.assert_called_once_with(main_channel_id, main_message_id)
-		self.assertEqual(result_channels, [-10012345678, -10087654321])
+		self.assertEqual(result, ["CC", "FF"])
 
 	@patch("user_utils.get_member_ids_channel", return_value=[5486126])
 	@patch("db_utils.get_main_message_sender")
-	def test_filter_creator_channels_no_member(self, mock_get_main_message_sender, *args):
+	def test_get_creator_user_tags_no_member(self, mock_get_main_message_sender, *args):
 		main_channel_id = -1006532516165
 		main_message_id = 453
 		user_id = 5486154
 		config_utils.USER_TAGS = {"AA": 358435, "CC": user_id, "DD": 5115684, "FF": user_id}
 		mock_get_main_message_sender.return_value = user_id
-		channel_data = [
-			(-10012345678, {channel_manager.SETTING_TYPES.REPORTED: ["CC", "DD"]}),
-			(-10087654321, {channel_manager.SETTING_TYPES.REPORTED: ["DD", "FF"]}),
-			(-10082165431, {channel_manager.SETTING_TYPES.REPORTED: ["dd", "ff"]}),
-		]
 
-		result_channels = forwarding_utils.filter_creator_channels(channel_data, main_channel_id, main_message_id)
+		result = forwarding_utils.get_creator_user_tags(main_channel_id, main_message_id)
 		mock_get_main_message_sender.assert_called_once_with(main_channel_id, main_message_id)
-		self.assertEqual(result_channels, [])
+		self.assertEqual(result, [])
 
 
 @patch("hashtag_data.HashtagData.__init__", return_value=None)
-@patch("db_utils.get_scheduled_message_send_time", return_value=False)
+@patch("db_utils.get_scheduled_message_send_time")
 @patch("config_utils.USER_TAGS", {"AA": 123456, "BB": 516224})
 @patch("user_utils.get_member_ids_channel", return_value=[123456, 516224])
 @patch("db_utils.get_main_message_sender", return_value=123456)
-@patch("db_utils.get_custom_hashtag", return_value=None)
-@patch("db_utils.get_individual_channels_by_priority")
+@patch("db_utils.get_custom_hashtags")
+@patch("db_utils.CHANNEL_REGISTRY")
 class GetSubchannelIdsFromHashtags(TestCase):
-	def test_default(self, mock_get_individual_channel_by_priority, mock_get_custom_hashtag, *args):
-		main_channel_id = -10087654321
-		main_message_id = 216
-		priority = 2
-		channel_datum1 = [1, '{"due": true, "deferred": true, "assigned": ["AA", "BB"], "reported": ["BB", "CC"], "cc": ["CC", "DD", "FF"]}']
-		channel_datum2 = [2, '{"due": true, "deferred": true, "assigned": ["AA", "BB", "FF"], "reported": ["BB", "CC"], "cc": ["CC", "DD"]}']
-		channel_datum3 = [3, '{"due": false, "deferred": true, "assigned": ["AA", "BB", "FF"], "reported": ["BB", "CC"], "cc": ["CC", "DD"]}']
-		channel_datum4 = [4, '{"due": true, "deferred": true, "assigned": ["AA", "BB"], "reported": ["BB", "CC"], "cc": ["CC", "DD", "BB"]}']
-		channel_datum5 = [5, '{"due": false, "deferred": true, "assigned": ["AA", "BB"], "reported": ["BB", "CC"], "cc": ["CC", "DD", "BB"]}']
-		channel_datum6 = [6, '{"due": true, "deferred": true, "assigned": ["AA", "BB"], "reported": ["AA", "BB", "CC"], "cc": ["CC", "DD"]}']
-		channel_datum7 = [7, '{"due": false, "deferred": true, "assigned": ["AA", "BB"], "reported": ["AA", "BB", "CC"], "cc": ["CC", "DD"]}']
-		channel_data = [channel_datum1, channel_datum2, channel_datum3, channel_datum4, channel_datum5, channel_datum6, channel_datum7]
+	def setUp(self):
+		patcher = patch("routing_index.ROUTING_INDEX", routing_index.RoutingIndex())
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def create_hashtag_data(self, priority, assigned_user, followed_users, other_hashtags=None, is_scheduled=False):
 		mock_hashtag_data = Mock(spec=HashtagData)
-		mock_hashtag_data.get_assigned_user.return_value = "FF"
-		mock_hashtag_data.get_followed_users.return_value = ["AA", "BB"]
+		mock_hashtag_data.get_assigned_user.return_value = assigned_user
+		mock_hashtag_data.get_followed_users.return_value = followed_users
 		mock_hashtag_data.get_priority_number_or_default.return_value = priority
-		mock_get_individual_channel_by_priority.return_value = channel_data
+		mock_hashtag_data.is_scheduled.return_value = is_scheduled
+		mock_hashtag_data.other_hashtags = other_hashtags or []
+		return mock_hashtag_data
+
+	def test_default(self, mock_channel_registry, mock_get_custom_hashtags, *args):
+		main_channel_id = -10087654321
+		main_message_id = 216
+		channel_data = [
+			(1, '{"due": true, "deferred": true, "assigned": ["AA", "BB"], "reported": ["BB", "CC"], "cc": ["CC", "DD", "FF"]}', "2"),
+			(2, '{"due": true, "deferred": true, "assigned": ["AA", "BB", "FF"], "reported": ["BB", "CC"], "cc": ["CC", "DD"]}', "1,2"),
+			(3, '{"due": false, "deferred": true, "assigned": ["AA", "BB", "FF"], "reported": ["BB", "CC"], "cc": ["CC", "DD"]}', "2"),
+			(4, '{"due": true, "deferred": true, "assigned": ["AA", "BB"], "reported": ["BB", "CC"], "cc": ["CC", "DD", "BB"]}', "2,3"),
+			(5, '{"due": false, "deferred": true, "assigned": ["AA", "BB"], "reported": ["BB", "CC"], "cc": ["CC", "DD", "BB"]}', "2"),
+			(6, '{"due": true, "deferred": true, "assigned": ["AA", "BB"], "reported": ["AA", "BB", "CC"], "cc": ["CC", "DD"]}', "2"),
+			(7, '{"due": false, "deferred": true, "assigned": ["AA", "BB"], "reported": ["AA", "BB", "CC"], "cc": ["CC", "DD"]}', "2"),
+			(8, '{"due": true, "deferred": true, "assigned": ["FF"]}', "1"),
+		]
+		mock_channel_registry.get_individual_channels.return_value = [
+			(channel_id, {"settings": settings, "priorities": priorities, "user_id": None})
+			for channel_id, settings, priorities in channel_data
+		]
+		mock_get_custom_hashtags.return_value = {}
+		mock_hashtag_data = self.create_hashtag_data(2, "FF", ["AA", "BB"])
 
 		result = forwarding_utils.get_subchannel_ids_from_hashtags(main_channel_id, main_message_id, mock_hashtag_data)
 		mock_hashtag_data.get_priority_number_or_default.assert_called_once_with()
-		mock_get_individual_channel_by_priority.assert_called_once_with(priority)
 		self.assertEqual(result, {2, 4, 6})
 
+	def test_deferred_ticket(self, mock_channel_registry, mock_get_custom_hashtags, mock_get_main_message_sender,
+							 mock_get_member_ids_channel, mock_get_scheduled_message_send_time, *args):
+		mock_channel_registry.get_individual_channels.return_value = [
+			(1, {"settings": '{"due": true, "assigned": ["AA"]}', "priorities": "1", "user_id": None}),
+			(2, {"settings": '{"deferred": true, "assigned": ["AA"]}', "priorities": "1", "user_id": None}),
+		]
+		mock_get_custom_hashtags.return_value = {}
+		mock_get_scheduled_message_send_time.return_value = time.time() + 100
+		mock_hashtag_data = self.create_hashtag_data(1, "AA", [], is_scheduled=True)
+
+		result = forwarding_utils.get_subchannel_ids_from_hashtags(-10087654321, 216, mock_hashtag_data)
+		mock_get_scheduled_message_send_time.assert_called_once_with(216, -10087654321)
+		self.assertEqual(result, {2})
+
+	def test_custom_hashtag(self, mock_channel_registry, mock_get_custom_hashtags, *args):
+		mock_channel_registry.get_individual_channels.return_value = [
+			(1, {"settings": '{"due": true, "assigned": ["AA"]}', "priorities": "1", "user_id": None}),
+			(2, {"settings": '{"due": true, "assigned": ["AA"]}', "priorities": "1", "user_id": None}),
+			(3, {"settings": '{"due": true, "assigned": ["AA"]}', "priorities": "1", "user_id": None}),
+		]
+		mock_get_custom_hashtags.return_value = {2: "#project", 3: "#other"}
+		mock_hashtag_data = self.create_hashtag_data(1, "AA", [], other_hashtags=["#project"])
+
+		result = forwarding_utils.get_subchannel_ids_from_hashtags(-10087654321, 216, mock_hashtag_data)
+		self.assertEqual(result, {1, 2})
+
 
 @patch("user_utils.MEMBER_CACHE", {-10012345678: {"user_ids": [12345, 23465, 13508], "time": 1745924296},
 								   -10087654321: {"user_ids": [12345], "time": 1745924296},
@@ -391,7 +510,7 @@ class FilterSubchannelByMembersTest(TestCase):
 @patch("hashtag_data.HashtagData.__init__", return_value=None)
 @patch("db_utils.get_main_message_sender")
 @patch("hashtag_data.HashtagData.add_user")
-@patch("hashtag_data.HashtagData.get_updated_post_data")
+@patch("hashtag_data.HashtagData.get_updated_post_data", return_value=test_helper.create_mock_message("", []))
 @patch("forwarding_utils.update_main_message_content")
 @patch("comment_utils.CommentDispatcher.add_next_action_comment")
 @patch("forwarding_utils.generate_control_buttons")
@@ -937,6 +1056,9 @@ class TestHandleCallback(TestCase):
 @patch("hashtag_data.HashtagData.get_followed_users", return_value=["AA", "DD"])
 @patch("utils.create_callback_str")
 class GenerateCcButtonsTest(TestCase):
+	def setUp(self):
+		forwarding_utils.KEYBOARD_TEMPLATES.invalidate()
+
 	def test_default(self, mock_create_callback_str, mock_get_followed_users,
 					 mock_get_assigned_user, *args):
 		main_channel_id = -10012345678
@@ -974,6 +1096,9 @@ class GenerateCcButtonsTest(TestCase):
 @patch("forwarding_utils.get_subchannels_forwarding_data", return_value=["AA 1", "AA 2", "AA 3",
 																		 	   "BB 1", "BB 2", "BB 3"])
 class GenerateSubchannelButtonsTest(TestCase):
+	def setUp(self):
+		forwarding_utils.KEYBOARD_TEMPLATES.invalidate()
+
 	def test_default(self, mock_get_subchannels_forwarding_data, mock_get_assigned_user, mock_get_priority_number,
 					 mock_create_callback_str, *args):
 		channel_id = -10012345678
@@ -993,6 +1118,60 @@ class GenerateSubchannelButtonsTest(TestCase):
 		self.assertEqual(mock_create_callback_str.call_count, len(callback_calls))
 
 
+class KeyboardTemplateCacheTest(TestCase):
+	def test_get(self):
+		cache = forwarding_utils.KeyboardTemplateCache(max_size=10)
+		generate_keyboard = Mock(return_value=InlineKeyboardMarkup([[InlineKeyboardButton("#o", callback_data="s,1")]]))
+
+		keyboard_markup = cache.get((-10012345678, "control", True), generate_keyboard)
+		keyboard_markup.keyboard[0].append(InlineKeyboardButton("comments", url="https://t.me/c/1/1"))
+		keyboard_markup = cache.get((-10012345678, "control", True), generate_keyboard)
+
+		generate_keyboard.assert_called_once_with()
+		self.assertEqual(len(keyboard_markup.keyboard[0]), 1)
+		self.assertEqual(keyboard_markup.keyboard[0][0].text, "#o")
+		self.assertEqual(keyboard_markup.keyboard[0][0].callback_data, "s,1")
+
+	def test_get_none(self):
+		cache = forwarding_utils.KeyboardTemplateCache(max_size=10)
+		generate_keyboard = Mock(return_value=None)
+
+		self.assertIsNone(cache.get((-10012345678, "subchannels", None), generate_keyboard))
+		self.assertIsNone(cache.get((-10012345678, "subchannels", None), generate_keyboard))
+		self.assertEqual(generate_keyboard.call_count, 2)
+		self.assertEqual(len(cache), 0)
+
+	def test_invalidate(self):
+		cache = forwarding_utils.KeyboardTemplateCache(max_size=10)
+		generate_keyboard = Mock(return_value=InlineKeyboardMarkup([]))
+		cache.get((-10012345678, "priorities", "1"), generate_keyboard)
+		cache.get((-10012345678, "priorities", "2"), generate_keyboard)
+		cache.get((-10087654321, "priorities", "1"), generate_keyboard)
+
+		cache.invalidate(-10012345678)
+		self.assertEqual(len(cache), 1)
+		cache.get((-10087654321, "priorities", "1"), generate_keyboard)
+		self.assertEqual(generate_keyboard.call_count, 3)
+
+		cache.invalidate()
+		self.assertEqual(len(cache), 0)
+
+	def test_max_size(self):
+		cache = forwarding_utils.KeyboardTemplateCache(max_size=2)
+		generate_keyboard = Mock(return_value=InlineKeyboardMarkup([]))
+		cache.get((-10012345678, "priorities", "1"), generate_keyboard)
+		cache.get((-10012345678, "priorities", "2"), generate_keyboard)
+		cache.get((-10012345678, "priorities", "1"), generate_keyboard)
+		cache.get((-10012345678, "priorities", "3"), generate_keyboard)
+		self.assertEqual(len(cache), 2)
+
+		# least recently used template is removed
+		cache.get((-10012345678, "priorities", "1"), generate_keyboard)
+		self.assertEqual(generate_keyboard.call_count, 3)
+		cache.get((-10012345678, "priorities", "2"), generate_keyboard)
+		self.assertEqual(generate_keyboard.call_count, 4)
+
+
 @patch("user_utils.get_member_ids_channel", return_value=[1, 2, 3, 5])
 @patch("config_utils.USER_TAGS", {"AA": 1, "BB": 2, "FF": 3, "NN": 4, "DD": 5})
 class GetSubchannelsForwardingData(TestCase):
@@ -1143,7 +1322,7 @@ class TestSetGetChannelTicketKeyboard(TestCase):
 @patch("forwarding_utils.delete_forwarded_message")
 @patch("utils.update_forwarded_fields")
 @patch("utils.get_forwarded_from_id")
-@patch("core_api.get_messages")
+@patch("core_api.stream_messages")
 @patch("db_utils.get_copied_messages_existing_main_from_copied_channel")
 @patch("db_utils.get_main_message_ids")
 @patch("utils.get_last_message")
@@ -1151,7 +1330,7 @@ class TestSetGetChannelTicketKeyboard(TestCase):
 @patch("db_utils.delete_invalid_ticket_data")
 class GetInvalidTicketIdsTest(TestCase):
 	def test_default(self, mock_delete_invalid_ticket_data, mock_get_all_individual_channels, mock_get_last_message, mock_get_main_message_ids,
-					 mock_get_copied_messages_existing_main_from_copied_channel, mock_get_messages, mock_get_forwarded_from_id,
+					 mock_get_copied_messages_existing_main_from_copied_channel, mock_stream_messages, mock_get_forwarded_from_id,
 					 mock_update_forwarded_fields, mock_delete_forwarded_message, mock_sleep, mock_info, *args):
 		mock_bot = Mock(spec=TeleBot)
 		channels_data = [(-10012345678, "{\"settings_message_id\": 12}"), (-10087654321, "{}")]
@@ -1162,27 +1341,33 @@ class GetInvalidTicketIdsTest(TestCase):
 		mock_get_copied_messages_existing_main_from_copied_channel.side_effect = lambda channel_id: channel_messages[channel_id]["copied"]
 		mock_get_main_message_ids.side_effect = lambda channel_id: channel_messages[channel_id]['main']
 		get_message_calls = []
-		sleep_calls = []
 		info_calls = [call("Deleting invalid ticket ids"),]
 		delete_forwarded_message_calls = []
 		update_forwarded_fields_count_calls = 0
 		get_forwarded_from_id_calls = 0
-		mock_get_messages.side_effect = lambda channel_id, a, b, message_ids: [Mock(id=i, empty=(True if i in channel_messages[channel_id]["empty"] else None),
-																					   chat=Mock(id=channel_id),
-																					   service=(True if i in channel_messages[channel_id]["service"] else None),
-																					   reply_markup=(True if i not in channel_messages[channel_id]["no_keyboard"] else None)) for i in message_ids]
+		streamed_calls = []
+
+		def stream(channel_id, message_ids, limit):
+			# message ids are passed as a lazy iterator
+			message_ids = list(message_ids)
+			streamed_calls.append(call(channel_id, message_ids, limit))
+			return iter([(len(message_ids), [Mock(id=i, empty=(True if i in channel_messages[channel_id]["empty"] else None),
+												  chat=Mock(id=channel_id),
+												  service=(True if i in channel_messages[channel_id]["service"] else None),
+												  reply_markup=(True if i not in channel_messages[channel_id]["no_keyboard"] else None)) for i in message_ids])])
+
+		mock_stream_messages.side_effect = stream
 		mock_get_forwarded_from_id.side_effect = lambda message: True if message.id in channel_messages[message.chat.id]["forwarded"] else None
 		for ch_id in channel_messages:
 			count_calls = 0
 			message_ids = [i for i in range(1, channel_messages[ch_id]["last"] + 1) if i not in channel_messages[ch_id]["copied"] and i not in channel_messages[ch_id]["main"] and i != channel_messages[ch_id]["settings"]]
-			get_message_calls.append(call(ch_id, 0, 50, message_ids=message_ids))
+			get_message_calls.append(call(ch_id, message_ids, 50))
 			info_calls.append(call(f"Checking channel {ch_id}"))
 			for message_id in message_ids:
 				if (message_id not in channel_messages[ch_id]["empty"] and message_id not in channel_messages[ch_id]["service"]
 						and message_id not in channel_messages[ch_id]["no_keyboard"]):
 					get_forwarded_from_id_calls += 1
 					if message_id not in channel_messages[ch_id]["forwarded"]:
-						sleep_calls.append(call(config_utils.DELAY_AFTER_ONE_SCAN))
 						update_forwarded_fields_count_calls += 1
 						count_calls += 1
 						delete_forwarded_message_calls.append(call(mock_bot, ch_id, message_id))
@@ -1200,19 +1385,17 @@ class GetInvalidTicketIdsTest(TestCase):
 		self.assertEqual(mock_get_copied_messages_existing_main_from_copied_channel.call_count, len(channels_data))
 		mock_get_main_message_ids.assert_has_calls([call(-10012345678), call(-10087654321)])
 		self.assertEqual(mock_get_main_message_ids.call_count, len(channels_data))
-		mock_get_messages.assert_has_calls(get_message_calls)
-		self.assertEqual(mock_get_messages.call_count, len(get_message_calls))
+		self.assertEqual(streamed_calls, get_message_calls)
 		self.assertEqual(mock_get_forwarded_from_id.call_count, get_forwarded_from_id_calls)
 		self.assertEqual(mock_update_forwarded_fields.call_count, update_forwarded_fields_count_calls)
 		mock_delete_forwarded_message.assert_has_calls(delete_forwarded_message_calls)
 		self.assertEqual(mock_delete_forwarded_message.call_count, len(delete_forwarded_message_calls))
-		mock_sleep.assert_has_calls(sleep_calls)
-		self.assertEqual(mock_sleep.call_count, len(sleep_calls))
+		mock_sleep.assert_not_called()
 		mock_info.assert_has_calls(info_calls)
 		self.assertEqual(mock_info.call_count, len(info_calls))
 
 	def test_none_messages(self, mock_delete_invalid_ticket_data, mock_get_all_individual_channels, mock_get_last_message, mock_get_main_message_ids,
-					 mock_get_copied_messages_existing_main_from_copied_channel, mock_get_messages, mock_get_forwarded_from_id,
+					 mock_get_copied_messages_existing_main_from_copied_channel, mock_stream_messages, mock_get_forwarded_from_id,
 					 mock_update_forwarded_fields, mock_delete_forwarded_message, mock_sleep, mock_info, *args):
 		mock_bot = Mock(spec=TeleBot)
 		channels_data = [(-10012345678, "{\"settings_message_id\": 12}"), (-10087654321, "{}")]
@@ -1224,13 +1407,21 @@ class GetInvalidTicketIdsTest(TestCase):
 		mock_get_main_message_ids.side_effect = lambda channel_id: channel_messages[channel_id]['main']
 		get_message_calls = []
 		info_calls = [call("Deleting invalid ticket ids"),]
-		mock_get_messages.return_value = None
+		streamed_calls = []
+
+		def stream(channel_id, message_ids, limit):
+			streamed_calls.append(call(channel_id, list(message_ids), limit))
+			yield 0, []
+			raise ConnectionError("Test error")
+
+		mock_stream_messages.side_effect = stream
 		mock_get_forwarded_from_id.side_effect = lambda message: True if message.id in channel_messages[message.chat.id]["forwarded"] else None
 		for ch_id in channel_messages:
 			info_calls.append(call(f"Checking channel {ch_id}"))
 			message_ids = [i for i in range(1, channel_messages[ch_id]["last"] + 1) if i not in channel_messages[ch_id]["copied"] and i not in channel_messages[ch_id]["main"] and i != channel_messages[ch_id]["settings"]]
-			get_message_calls.append(call(ch_id, 0, 50, message_ids=message_ids))
-			info_calls.append(call(f"Can't get messages in channel {ch_id}, scanning of invalid tickets is skipped"))
+			get_message_calls.append(call(ch_id, message_ids, 50))
+			info_calls.append(call(f"Can't get messages in channel {ch_id}, scanning of invalid tickets is stopped - Test error"))
+			info_calls.append(call(f"Count deleted invalid tickets in channel {ch_id} is 0"))
 
 		forwarding_utils.get_invalid_ticket_ids(mock_bot)
 		mock_delete_invalid_ticket_data.assert_called_once_with()
@@ -1241,8 +1432,7 @@ class GetInvalidTicketIdsTest(TestCase):
 		self.assertEqual(mock_get_copied_messages_existing_main_from_copied_channel.call_count, len(channels_data))
 		mock_get_main_message_ids.assert_has_calls([call(-10012345678), call(-10087654321)])
 		self.assertEqual(mock_get_main_message_ids.call_count, len(channels_data))
-		mock_get_messages.assert_has_calls(get_message_calls)
-		self.assertEqual(mock_get_messages.call_count, len(get_message_calls))
+		self.assertEqual(streamed_calls, get_message_calls)
 		mock_get_forwarded_from_id.assert_not_called()
 		mock_update_forwarded_fields.assert_not_called()
 		mock_delete_forwarded_message.assert_not_called()
@@ -1251,7 +1441,7 @@ class GetInvalidTicketIdsTest(TestCase):
 		self.assertEqual(mock_info.call_count, len(info_calls))
 
 	def test_none_last_msg(self, mock_delete_invalid_ticket_data, mock_get_all_individual_channels, mock_get_last_message, mock_get_main_message_ids,
-					 mock_get_copied_messages_existing_main_from_copied_channel, mock_get_messages, mock_get_forwarded_from_id,
+					 mock_get_copied_messages_existing_main_from_copied_channel, mock_stream_messages, mock_get_forwarded_from_id,
 					 mock_update_forwarded_fields, mock_delete_forwarded_message, mock_sleep, mock_info, *args):
 		mock_bot = Mock(spec=TeleBot)
 		channels_data = [(-10012345678, "{\"settings_message_id\": 12}"), (-10087654321, "{}")]
@@ -1269,7 +1459,7 @@ class GetInvalidTicketIdsTest(TestCase):
 		self.assertEqual(mock_get_last_message.call_count, len(channels_data))
 		mock_get_copied_messages_existing_main_from_copied_channel.assert_not_called()
 		mock_get_main_message_ids.assert_not_called()
-		mock_get_messages.assert_not_called()
+		mock_stream_messages.assert_not_called()
 		mock_get_forwarded_from_id.assert_not_called()
 		mock_update_forwarded_fields.assert_not_called()
 		mock_delete_forwarded_message.assert_not_called()
@@ -1277,7 +1467,31 @@ class GetInvalidTicketIdsTest(TestCase):
 		mock_info.assert_has_calls(info_calls)
 		self.assertEqual(mock_info.call_count, len(info_calls))
 
+	@patch("logging.exception")
+	def test_delete_error(self, mock_exception, mock_delete_invalid_ticket_data, mock_get_all_individual_channels, mock_get_last_message,
+						  mock_get_main_message_ids, mock_get_copied_messages_existing_main_from_copied_channel, mock_stream_messages,
+						  mock_get_forwarded_from_id, mock_update_forwarded_fields, mock_delete_forwarded_message, mock_sleep, mock_info, *args):
+		mock_bot = Mock(spec=TeleBot)
+		channel_id = -10012345678
+		mock_get_all_individual_channels.return_value = [(channel_id, "{}")]
+		mock_get_last_message.return_value = 2
+		mock_get_copied_messages_existing_main_from_copied_channel.return_value = []
+		mock_get_main_message_ids.return_value = []
+		mock_get_forwarded_from_id.return_value = None
+		messages = [Mock(id=i, empty=None, service=None, reply_markup=True) for i in [1, 2]]
+		mock_stream_messages.return_value = iter([(2, messages)])
+		mock_delete_forwarded_message.side_effect = [ApiTelegramException("deleteMessage", None, {"error_code": 400, "description": "Bad Request"}), None]
 
+		forwarding_utils.get_invalid_ticket_ids(mock_bot)
+		mock_delete_forwarded_message.assert_has_calls([call(mock_bot, channel_id, 1), call(mock_bot, channel_id, 2)])
+		mock_exception.assert_called_once_with(f"Can't delete invalid ticket 1 in channel {channel_id}")
+		mock_info.assert_has_calls([
+			call(f"Deleted invalid ticket 2 in channel {channel_id}"),
+			call(f"Count deleted invalid tickets in channel {channel_id} is 1"),
+		])
+
+
+@patch("db_utils.update_copied_message_content_hash")
 @patch("hashtag_data.HashtagData.__init__", return_value=None)
 @patch("channel_manager.set_settings_message_id")
 @patch("channel_manager.update_settings_message")
@@ -1699,13 +1913,14 @@ class UpdateMainMessageContentTest(TestCase):
 		mock_info.assert_not_called()
 
 
+@patch("db_utils.mark_ticket_dirty")
 @patch("forwarding_utils.forward_and_add_inline_keyboard")
 @patch("post_link_utils.update_post_link")
 @patch("interval_updating_utils.set_updating_message")
 @patch("utils.add_comment_to_ticket")
 class EditedPostTest(TestCase):
 	def test_default(self, mock_add_comment_to_ticket, mock_set_updating_message, mock_update_post_link,
-					 mock_forward_and_add_inline_keyboard):
+					 mock_forward_and_add_inline_keyboard, mock_mark_ticket_dirty):
 		mock_bot = Mock(spec=TeleBot)
 		channel_id = -10012345678
 		message_id = 12345
@@ -1717,11 +1932,12 @@ class EditedPostTest(TestCase):
 		forwarding_utils.handle_edited_post(mock_bot, mock_message)
 		mock_add_comment_to_ticket.assert_called_once_with(mock_bot, mock_message, "A user edited the ticket.")
 		mock_set_updating_message.assert_called_once_with(channel_id, message_id)
+		mock_mark_ticket_dirty.assert_called_once_with(channel_id, message_id)
 		mock_update_post_link.assert_called_once_with(mock_bot, mock_message)
 		mock_forward_and_add_inline_keyboard.assert_called_once_with(mock_bot, mock_message)
 
 	def test_edit_date_less_5_seconds(self, mock_add_comment_to_ticket, mock_set_updating_message, mock_update_post_link,
-									  mock_forward_and_add_inline_keyboard):
+									  mock_forward_and_add_inline_keyboard, mock_mark_ticket_dirty):
 		mock_bot = Mock(spec=TeleBot)
 		channel_id = -10012345678
 		message_id = 12345
@@ -1733,11 +1949,12 @@ class EditedPostTest(TestCase):
 		forwarding_utils.handle_edited_post(mock_bot, mock_message)
 		mock_add_comment_to_ticket.assert_not_called()
 		mock_set_updating_message.assert_not_called()
+		mock_mark_ticket_dirty.assert_not_called()
 		mock_update_post_link.assert_called_once_with(mock_bot, mock_message)
 		mock_forward_and_add_inline_keyboard.assert_called_once_with(mock_bot, mock_message)
 
 	def test_with_media_group_id(self, mock_add_comment_to_ticket, mock_set_updating_message, mock_update_post_link,
-									  mock_forward_and_add_inline_keyboard):
+									  mock_forward_and_add_inline_keyboard, mock_mark_ticket_dirty):
 		mock_bot = Mock(spec=TeleBot)
 		channel_id = -10012345678
 		message_id = 12345
@@ -1751,6 +1968,148 @@ class EditedPostTest(TestCase):
 		mock_forward_and_add_inline_keyboard.assert_not_called()
 
 
+@patch("utils.prefetch_message_contents")
+@patch("db_utils.get_newest_copied_message", return_value=None)
+@patch("db_utils.update_copied_message_content_hash")
+@patch("utils.get_message_content_by_id")
+@patch("forwarding_utils.delete_forwarded_message")
+@patch("db_utils.get_copied_messages_with_hash")
+class GetUnchangedPostsTest(TestCase):
+	def test_saved_hashes(self, mock_get_copied_messages_with_hash, mock_delete_forwarded_message,
+						  mock_get_message_content_by_id, mock_update_copied_message_content_hash, *args):
+		mock_bot = Mock(spec=TeleBot)
+		post_data = test_helper.create_mock_message("test", [], -1001, 10)
+		content_hash = utils.get_post_content_hash(post_data)
+		mock_get_copied_messages_with_hash.return_value = [(20, -1002, content_hash), (30, -1003, "changed"), (40, -1004, content_hash)]
+
+		result = forwarding_utils.get_unchanged_posts(mock_bot, post_data, [-1002, -1003])
+		self.assertEqual(result, {-1002: 20})
+		mock_delete_forwarded_message.assert_has_calls([call(mock_bot, -1003, 30), call(mock_bot, -1004, 40)])
+		mock_get_message_content_by_id.assert_not_called()
+		mock_update_copied_message_content_hash.assert_not_called()
+
+	def test_copies_without_hash(self, mock_get_copied_messages_with_hash, mock_delete_forwarded_message,
+								 mock_get_message_content_by_id, mock_update_copied_message_content_hash,
+								 mock_get_newest_copied_message, mock_prefetch_message_contents):
+		mock_bot = Mock(spec=TeleBot)
+		post_data = test_helper.create_mock_message("test", [], -1001, 10)
+		mock_get_copied_messages_with_hash.return_value = [(20, -1002, None), (30, -1003, None), (40, -1004, None)]
+		mock_get_message_content_by_id.side_effect = lambda bot, chat_id, message_id: \
+			test_helper.create_mock_message("test" if chat_id == -1002 else "old", [], chat_id, message_id)
+
+		result = forwarding_utils.get_unchanged_posts(mock_bot, post_data, [-1002, -1003])
+		self.assertEqual(result, {-1002: 20})
+		mock_prefetch_message_contents.assert_called_once_with([(-1002, 20), (-1003, 30), (-1002, None), (-1003, None)])
+		mock_update_copied_message_content_hash.assert_called_once_with(20, -1002, utils.get_post_content_hash(post_data))
+		mock_delete_forwarded_message.assert_has_calls([call(mock_bot, -1003, 30), call(mock_bot, -1004, 40)])
+		self.assertEqual(mock_get_message_content_by_id.call_count, 2)
+
+
+class DeleteForwardedMessageLockTest(TestCase):
+	def test_subchannel_lock(self):
+		held_keys = []
+		ticket_lock_key = forwarding_utils.get_ticket_lock_key(-1001, 10)
+
+		def delete(bot, chat_id, message_id):
+			held_keys.extend(forwarding_utils._FORWARDING_LOCKS._get_held_keys())
+
+		with patch("forwarding_utils._delete_locked_forwarded_message", side_effect=delete) as mock_delete:
+			with forwarding_utils._FORWARDING_LOCKS.lock(ticket_lock_key):
+				forwarding_utils.delete_forwarded_message(None, -1002, 20)
+		mock_delete.assert_called_once_with(None, -1002, 20)
+		self.assertEqual(held_keys, [ticket_lock_key, forwarding_utils.get_subchannel_lock_key(-1002)])
+		self.assertEqual(len(forwarding_utils._FORWARDING_LOCKS), 0)
+
+	def test_locked_subchannel(self):
+		subchannel_lock_key = forwarding_utils.get_subchannel_lock_key(-1002)
+
+		with patch("forwarding_utils._delete_locked_forwarded_message") as mock_delete:
+			with forwarding_utils._FORWARDING_LOCKS.lock(subchannel_lock_key):
+				forwarding_utils.delete_forwarded_message(None, -1002, 20)
+		mock_delete.assert_called_once_with(None, -1002, 20)
+		self.assertEqual(len(forwarding_utils._FORWARDING_LOCKS), 0)
+
+
+class ForwardingThreadLockTest(TestCase):
+	def test_different_tickets(self):
+		barrier = threading.Barrier(2, timeout=5)
+		forward = forwarding_utils.forwarding_thread_lock(lambda bot, post_data: barrier.wait())
+
+		threads = [threading.Thread(target=forward, args=(None, test_helper.create_mock_message("", [], -1001, message_id)))
+				   for message_id in [10, 11]]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertFalse(barrier.broken)
+
+	def test_same_ticket(self):
+		active_calls = []
+		overlapped_calls = []
+
+		def forward(bot, post_data):
+			overlapped_calls.append(len(active_calls))
+			active_calls.append(post_data.message_id)
+			time.sleep(0.01)
+			active_calls.remove(post_data.message_id)
+
+		forward = forwarding_utils.forwarding_thread_lock(forward)
+		threads = [threading.Thread(target=forward, args=(None, test_helper.create_mock_message("", [], -1001, 10))) for _ in range(5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(overlapped_calls, [0] * 5)
+
+	@patch("logging.exception")
+	def test_error(self, mock_exception):
+		forward = forwarding_utils.forwarding_thread_lock(Mock(side_effect=ValueError("error"), __name__="forward"))
+		self.assertIsNone(forward(None, test_helper.create_mock_message("", [], -1001, 10)))
+		mock_exception.assert_called_once()
+		self.assertEqual(len(forwarding_utils._FORWARDING_LOCKS), 0)
+
+
+@patch("hashtag_data.HashtagData.is_closed", return_value=False)
+@patch("hashtag_data.HashtagData.__init__", return_value=None)
+@patch("db_utils.is_individual_channel_exists", return_value=False)
+@patch("daily_reminder.update_ticket_data")
+@patch("utils.add_channel_id_to_post_data")
+@patch("forwarding_utils.get_subchannel_ids_from_hashtags")
+@patch("forwarding_utils.filter_subchannels_by_members", return_value=[-1002])
+@patch("forwarding_utils.get_unchanged_posts", return_value={-1002: 20})
+@patch("forwarding_utils.get_keyboard")
+class UnchangedCopyKeyboardTest(TestCase):
+	def setUp(self):
+		utils.KEYBOARD_MARKUP_STORE.invalidate(-1002, 20)
+
+	def create_keyboard(self, text):
+		keyboard_markup = InlineKeyboardMarkup()
+		keyboard_markup.add(InlineKeyboardButton(text, callback_data=text))
+		return keyboard_markup
+
+	def test_changed_keyboard(self, mock_get_keyboard, *args):
+		mock_bot = Mock(spec=TeleBot)
+		utils.KEYBOARD_MARKUP_STORE.save(-1002, 20, self.create_keyboard("old"))
+		mock_get_keyboard.return_value = self.create_keyboard("new")
+
+		forwarding_utils.forward_to_subchannel(mock_bot, test_helper.create_mock_message("text", [], -1001, 10), HashtagData())
+		mock_bot.send_message.assert_not_called()
+		mock_bot.edit_message_reply_markup.assert_called_once_with(chat_id=-1002, message_id=20,
+																   reply_markup=mock_get_keyboard.return_value)
+
+	@patch("logging.exception")
+	def test_same_keyboard(self, mock_exception, mock_get_keyboard, *args):
+		mock_bot = Mock(spec=TeleBot)
+		utils.KEYBOARD_MARKUP_STORE.save(-1002, 20, self.create_keyboard("old"))
+		mock_get_keyboard.return_value = self.create_keyboard("old")
+
+		forwarding_utils.forward_to_subchannel(mock_bot, test_helper.create_mock_message("text", [], -1001, 10), HashtagData())
+		mock_get_keyboard.assert_called_once_with(ANY, -1002, 20)
+		mock_exception.assert_not_called()
+		mock_bot.send_message.assert_not_called()
+		mock_bot.edit_message_reply_markup.assert_not_called()
+
+
 if __name__ == "__main__":
 	main()
 
@@ -9,7 +9,11 @@ from hashtag_data import HashtagData
 from tests import test_helper
 
 
-@patch("copy.deepcopy", side_effect=lambda c: c)
+TEXT_HASHTAGS = [("aa", True), ("tag", False)]
+
+
+@patch("hashtag_data.HashtagData.parse_text_hashtags", return_value=TEXT_HASHTAGS)
+@patch("utils.copy_post_data", side_effect=lambda c: c)
 @patch("hashtag_data.HashtagData.copy_tags_from_other_hashtags")
 @patch("hashtag_data.HashtagData.remove_found_hashtags")
 @patch("hashtag_data.HashtagData.insert_default_tags")
@@ -23,6 +27,9 @@ from tests import test_helper
 @patch("hashtag_data.HashtagData.check_last_line")
 @patch("hashtag_data.HashtagData.update_scheduled_tag_entities")
 class InitTest(TestCase):
+	def setUp(self):
+		hashtag_data_module.PARSED_TICKETS.invalidate()
+
 	def test_default(self, mock_update_scheduled_tag_entities, mock_check_last_line, mock_remove_strikethrough_entities,
 					 mock_extract_hashtags, mock_extract_other_hashtags, mock_copy_users_from_text,
 					 mock_get_assigned_user, mock_get_priority_number, mock_is_status_missing, mock_insert_default_tags,
@@ -36,8 +43,8 @@ class InitTest(TestCase):
 		mock_check_last_line.assert_called_once_with()
 		mock_remove_strikethrough_entities.assert_called_once_with()
 		mock_extract_hashtags.assert_called_once_with(mock_message, main_channel_id, False)
-		mock_extract_other_hashtags.assert_called_once_with()
-		mock_copy_users_from_text.assert_called_once_with()
+		mock_extract_other_hashtags.assert_called_once_with(TEXT_HASHTAGS)
+		mock_copy_users_from_text.assert_called_once_with(TEXT_HASHTAGS)
 		mock_get_assigned_user.assert_called_once_with()
 		mock_get_priority_number.assert_called_once_with()
 		mock_is_status_missing.assert_called_once_with()
@@ -58,8 +65,8 @@ class InitTest(TestCase):
 		mock_check_last_line.assert_called_once_with()
 		mock_remove_strikethrough_entities.assert_called_once_with()
 		mock_extract_hashtags.assert_called_once_with(mock_message, main_channel_id, True)
-		mock_extract_other_hashtags.assert_called_once_with()
-		mock_copy_users_from_text.assert_called_once_with()
+		mock_extract_other_hashtags.assert_called_once_with(TEXT_HASHTAGS)
+		mock_copy_users_from_text.assert_called_once_with(TEXT_HASHTAGS)
 		mock_get_assigned_user.assert_called_once_with()
 		mock_get_priority_number.assert_called_once_with()
 		mock_is_status_missing.assert_called_once_with()
@@ -83,8 +90,8 @@ class InitTest(TestCase):
 		mock_check_last_line.assert_called_once_with()
 		mock_remove_strikethrough_entities.assert_called_once_with()
 		mock_extract_hashtags.assert_called_once_with(mock_message, main_channel_id, False)
-		mock_extract_other_hashtags.assert_called_once_with()
-		mock_copy_users_from_text.assert_called_once_with()
+		mock_extract_other_hashtags.assert_called_once_with(TEXT_HASHTAGS)
+		mock_copy_users_from_text.assert_called_once_with(TEXT_HASHTAGS)
 		mock_get_assigned_user.assert_called_once_with()
 		mock_get_priority_number.assert_not_called()
 		mock_is_status_missing.assert_not_called()
@@ -107,8 +114,8 @@ class InitTest(TestCase):
 		mock_check_last_line.assert_called_once_with()
 		mock_remove_strikethrough_entities.assert_called_once_with()
 		mock_extract_hashtags.assert_called_once_with(mock_message, main_channel_id, False)
-		mock_extract_other_hashtags.assert_called_once_with()
-		mock_copy_users_from_text.assert_called_once_with()
+		mock_extract_other_hashtags.assert_called_once_with(TEXT_HASHTAGS)
+		mock_copy_users_from_text.assert_called_once_with(TEXT_HASHTAGS)
 		mock_get_assigned_user.assert_called_once_with()
 		mock_get_priority_number.assert_called_once_with()
 		mock_is_status_missing.assert_not_called()
@@ -129,8 +136,8 @@ class InitTest(TestCase):
 		mock_check_last_line.assert_called_once_with()
 		mock_remove_strikethrough_entities.assert_called_once_with()
 		mock_extract_hashtags.assert_called_once_with(mock_message, main_channel_id, False)
-		mock_extract_other_hashtags.assert_called_once_with()
-		mock_copy_users_from_text.assert_called_once_with()
+		mock_extract_other_hashtags.assert_called_once_with(TEXT_HASHTAGS)
+		mock_copy_users_from_text.assert_called_once_with(TEXT_HASHTAGS)
 		mock_get_assigned_user.assert_called_once_with()
 		mock_get_priority_number.assert_called_once_with()
 		mock_is_status_missing.assert_called_once_with()
@@ -154,8 +161,8 @@ class InitTest(TestCase):
 		mock_check_last_line.assert_called_once_with()
 		mock_remove_strikethrough_entities.assert_called_once_with()
 		mock_extract_hashtags.assert_called_once_with(mock_message, main_channel_id, False)
-		mock_extract_other_hashtags.assert_called_once_with()
-		mock_copy_users_from_text.assert_called_once_with()
+		mock_extract_other_hashtags.assert_called_once_with(TEXT_HASHTAGS)
+		mock_copy_users_from_text.assert_called_once_with(TEXT_HASHTAGS)
 		mock_get_assigned_user.assert_called_once_with()
 		mock_get_priority_number.assert_not_called()
 		mock_is_status_missing.assert_not_called()
@@ -178,8 +185,8 @@ class InitTest(TestCase):
 		mock_check_last_line.assert_called_once_with()
 		mock_remove_strikethrough_entities.assert_called_once_with()
 		mock_extract_hashtags.assert_called_once_with(mock_message, main_channel_id, False)
-		mock_extract_other_hashtags.assert_called_once_with()
-		mock_copy_users_from_text.assert_called_once_with()
+		mock_extract_other_hashtags.assert_called_once_with(TEXT_HASHTAGS)
+		mock_copy_users_from_text.assert_called_once_with(TEXT_HASHTAGS)
 		mock_get_assigned_user.assert_called_once_with()
 		mock_get_priority_number.assert_called_once_with()
 		mock_is_status_missing.assert_not_called()
@@ -189,6 +196,120 @@ class InitTest(TestCase):
 
 
 
+@patch("hashtag_data.PRIORITY_TAG", "p")
+@patch("hashtag_data.OPENED_TAG", "o")
+@patch("config_utils.USER_TAGS", {"aa": 1, "bb": 2, "cc": 3})
+@patch("config_utils.DEFAULT_USER_DATA", {})
+@patch("user_utils.get_member_ids_channel", return_value=[1, 2, 3])
+class ParseTicketTest(TestCase):
+	def setUp(self):
+		hashtag_data_module.PARSED_TICKETS.invalidate()
+
+	def test_original_message_unchanged(self, mock_get_member_ids_channel, *args):
+		text = "text #aa test\n#o #bb #p2"
+		entities = test_helper.create_hashtag_entity_list(text)
+		post_data = test_helper.create_mock_message(text, entities, -10012345678, 125)
+		original_entities = [(e.type, e.offset, e.length) for e in entities]
+
+		hashtag_data = HashtagData(post_data, -10012345678)
+		mock_get_member_ids_channel.assert_called_once_with(-10012345678)
+		self.assertEqual(hashtag_data.user_tags, ["bb", "aa"])
+		self.assertEqual(hashtag_data.get_priority_number(), "2")
+
+		hashtag_data.set_status_tag(None)
+		updated_post_data = hashtag_data.get_updated_post_data()
+		self.assertEqual(updated_post_data.text, "text #aa test\n#bb #aa #p2")
+		self.assertEqual(post_data.text, text)
+		self.assertIs(post_data.entities, entities)
+		self.assertEqual([(e.type, e.offset, e.length) for e in entities], original_entities)
+
+
+@patch("hashtag_data.PRIORITY_TAG", "p")
+@patch("hashtag_data.OPENED_TAG", "o")
+@patch("config_utils.HASHTAGS_BEFORE_UPDATE", None)
+@patch("config_utils.USER_TAGS", {"aa": 1, "bb": 2, "cc": 3})
+@patch("config_utils.DEFAULT_USER_DATA", {})
+@patch("user_utils.get_member_ids_channel", return_value=[1, 2, 3])
+class ParsedTicketCacheTest(TestCase):
+	def setUp(self):
+		hashtag_data_module.PARSED_TICKETS.invalidate()
+		self.text = "text #cc test\n#o #aa #p2"
+		self.main_channel_id = -10012345678
+
+	def create_message(self, message_id=125):
+		return test_helper.create_mock_message(self.text, test_helper.create_hashtag_entity_list(self.text),
+											   self.main_channel_id, message_id)
+
+	def test_cached(self, mock_get_member_ids_channel, *args):
+		parsed_tickets = hashtag_data_module.PARSED_TICKETS
+		hit_count, miss_count = parsed_tickets.hit_count, parsed_tickets.miss_count
+
+		first = HashtagData(self.create_message(), self.main_channel_id)
+		first.assign_to_user("bb")
+		first.set_status_tag(False)
+		first.get_updated_post_data()
+		mock_get_member_ids_channel.reset_mock()
+
+		post_data = self.create_message()
+		post_data.reply_markup = telebot.types.InlineKeyboardMarkup([[telebot.types.InlineKeyboardButton("#o", callback_data="s,1")]])
+		second = HashtagData(post_data, self.main_channel_id)
+		mock_get_member_ids_channel.assert_not_called()
+		self.assertEqual((parsed_tickets.hit_count - hit_count, parsed_tickets.miss_count - miss_count), (1, 1))
+		self.assertEqual(second.user_tags, ["aa", "cc"])
+		self.assertTrue(second.is_opened())
+		self.assertEqual(second.post_data.text, "text #cc test\n")
+		self.assertEqual(second.post_data.reply_markup.to_dict(), post_data.reply_markup.to_dict())
+		self.assertEqual(second.get_updated_post_data().text, "text #cc test\n#o #aa #cc #p2")
+		self.assertEqual(post_data.text, self.text)
+
+	def test_key(self, mock_get_member_ids_channel, *args):
+		HashtagData(self.create_message(), self.main_channel_id)
+		HashtagData(self.create_message(126), self.main_channel_id)
+		HashtagData(self.create_message(), self.main_channel_id, insert_default_tags=True)
+		with patch("hashtag_data.OPENED_TAG", "op"):
+			HashtagData(self.create_message(), self.main_channel_id)
+		self.assertEqual(len(hashtag_data_module.PARSED_TICKETS), 4)
+
+		# default user is taken from the database and old hashtags are replaced during renaming
+		HashtagData(self.create_message(), self.main_channel_id, invalid_user_tag_to_default=True)
+		with patch("config_utils.HASHTAGS_BEFORE_UPDATE", {"OPENED": "o"}):
+			HashtagData(self.create_message(), self.main_channel_id)
+		self.assertEqual(len(hashtag_data_module.PARSED_TICKETS), 4)
+
+	def test_invalidate(self, mock_get_member_ids_channel, *args):
+		HashtagData(self.create_message(), self.main_channel_id)
+		HashtagData(self.create_message(), -10087654321)
+		hashtag_data_module.PARSED_TICKETS.invalidate(self.main_channel_id)
+		self.assertEqual(len(hashtag_data_module.PARSED_TICKETS), 1)
+
+		mock_get_member_ids_channel.return_value = [2, 3]
+		self.assertEqual(HashtagData(self.create_message(), self.main_channel_id).user_tags, ["cc"])
+
+	def test_max_size(self, *args):
+		parsed_tickets = hashtag_data_module.ParsedTicketCache(max_size=2, log_interval=3600)
+		with patch("hashtag_data.PARSED_TICKETS", parsed_tickets):
+			for message_id in [125, 126, 125, 127]:
+				HashtagData(self.create_message(message_id), self.main_channel_id)
+			self.assertEqual(len(parsed_tickets), 2)
+			self.assertEqual((parsed_tickets.hit_count, parsed_tickets.miss_count), (1, 3))
+
+			HashtagData(self.create_message(126), self.main_channel_id)
+			self.assertEqual(parsed_tickets.miss_count, 4)
+
+	@patch("logging.info")
+	@patch("time.monotonic", return_value=0)
+	def test_log_counters(self, mock_monotonic, mock_info, *args):
+		parsed_tickets = hashtag_data_module.ParsedTicketCache(max_size=2, log_interval=3600)
+		parsed_tickets.get((1,))
+		mock_info.assert_not_called()
+
+		mock_monotonic.return_value = 3600
+		parsed_tickets.save((1,), {"content": ("", []), "hashtag_indexes": [], "user_tags": [], "other_hashtags": [],
+								   "mentioned_users": []})
+		parsed_tickets.get((1,))
+		mock_info.assert_called_once_with("Parsed tickets cache hits: 1, misses: 1, hit rate: 50.0%")
+
+
 @patch("hashtag_data.PRIORITY_TAG", "p")
 @patch("hashtag_data.OPENED_TAG", "o")
 @patch("hashtag_data.HashtagData.__init__", return_value=None)
@@ -244,6 +365,41 @@ class FindCopyUsersFromText(TestCase):
 		self.assertEqual(hashtag_data.user_tags, ["bb"])
 
 
+@patch("hashtag_data.PRIORITY_TAG", "p")
+@patch("hashtag_data.OPENED_TAG", "o")
+@patch("hashtag_data.SCHEDULED_TAG", "sch")
+@patch("hashtag_data.HashtagData.__init__", return_value=None)
+@patch("user_utils.get_member_ids_channel", return_value=[1, 2, 3])
+class ParseTextHashtagsTest(TestCase):
+	def test_parse_text_hashtags(self, *args):
+		config_utils.USER_TAGS = {"aa": 1, "cc": 3}
+		text = f"text #aa #tag #sch 2024-03-15 10:00\n#o #cc #p"
+		entities = test_helper.create_hashtag_entity_list(text)
+		entities[2].length = len("#sch 2024-03-15")
+		post_data = test_helper.create_mock_message(text, entities)
+
+		hashtag_data = HashtagData(post_data, 123)
+		hashtag_data.hashtag_indexes = [None, 3, [4], 5]
+		hashtag_data.main_channel_id = 123
+		hashtag_data.post_data = post_data
+		result = hashtag_data.parse_text_hashtags()
+		self.assertEqual(result, [("aa", True), ("tag", False), ("sch 2024-03-15 10:00", False)])
+
+	def test_read_parsed_hashtags(self, *args):
+		hashtag_data = HashtagData(None, 123)
+		hashtag_data.user_tags = ["cc"]
+		text_hashtags = [("aa", True), ("tag", False), ("sch 2024-03-15 10:00", False)]
+
+		with patch("hashtag_data.HashtagData.parse_text_hashtags") as mock_parse_text_hashtags:
+			other_hashtags = hashtag_data.extract_other_hashtags(text_hashtags)
+			mentioned_users = hashtag_data.copy_users_from_text(text_hashtags)
+			mock_parse_text_hashtags.assert_not_called()
+
+		self.assertEqual(other_hashtags, ["#aa", "#tag", "#sch 2024-03-15 10:00"])
+		self.assertEqual(mentioned_users, ["aa"])
+		self.assertEqual(hashtag_data.user_tags, ["cc", "aa"])
+
+
 class GetEntitiesToIgnoreTest(TestCase):
 	@patch("hashtag_data.HashtagData.__init__", return_value=None)
 	@patch("hashtag_data.HashtagData.is_service_tag", return_value=True)
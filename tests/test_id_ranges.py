@@ -0,0 +1,54 @@
+from unittest import TestCase, main
+
+from id_ranges import IdRangeSet
+
+
+class IdRangeSetTest(TestCase):
+	def test_init(self):
+		id_ranges = IdRangeSet([7, 1, 2, 3, 5, 6, 10, 2])
+		self.assertEqual(id_ranges.ranges(), [(1, 3), (5, 7), (10, 10)])
+		self.assertEqual(len(id_ranges), 7)
+
+	def test_contains(self):
+		id_ranges = IdRangeSet([1, 2, 3, 10])
+		self.assertEqual([i for i in range(0, 12) if i in id_ranges], [1, 2, 3, 10])
+
+	def test_add(self):
+		id_ranges = IdRangeSet([1, 2, 5, 9])
+		id_ranges.add(3)
+		self.assertEqual(id_ranges.ranges(), [(1, 3), (5, 5), (9, 9)])
+		id_ranges.add(4)
+		self.assertEqual(id_ranges.ranges(), [(1, 5), (9, 9)])
+		id_ranges.add(2)
+		self.assertEqual(id_ranges.ranges(), [(1, 5), (9, 9)])
+		id_ranges.add(7)
+		self.assertEqual(id_ranges.ranges(), [(1, 5), (7, 7), (9, 9)])
+
+	def test_add_range(self):
+		id_ranges = IdRangeSet([1, 5, 9, 20])
+		id_ranges.add_range(4, 10)
+		self.assertEqual(id_ranges.ranges(), [(1, 1), (4, 10), (20, 20)])
+		id_ranges.add_range(0, 30)
+		self.assertEqual(id_ranges.ranges(), [(0, 30)])
+		id_ranges.add_range(5, 4)
+		self.assertEqual(id_ranges.ranges(), [(0, 30)])
+
+	def test_from_ranges(self):
+		id_ranges = IdRangeSet.from_ranges([(10, 20), (1, 5), (6, 8)])
+		self.assertEqual(id_ranges.ranges(), [(1, 8), (10, 20)])
+
+	def test_missing_ranges(self):
+		id_ranges = IdRangeSet([3, 4, 5, 8, 12, 13])
+		self.assertEqual(id_ranges.missing_ranges(1, 15), [(1, 2), (6, 7), (9, 11), (14, 15)])
+		self.assertEqual(id_ranges.missing_ranges(4, 12), [(6, 7), (9, 11)])
+		self.assertEqual(id_ranges.missing_ranges(3, 5), [])
+		self.assertEqual(IdRangeSet().missing_ranges(1, 3), [(1, 3)])
+
+	def test_missing_ids(self):
+		id_ranges = IdRangeSet([2, 3, 6])
+		self.assertEqual(list(id_ranges.missing_ids(1, 7)), [1, 4, 5, 7])
+		self.assertEqual(list(id_ranges.missing_ids(1, 7, reverse=True)), [7, 5, 4, 1])
+
+
+if __name__ == "__main__":
+	main()
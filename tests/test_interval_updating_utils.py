@@ -11,17 +11,28 @@ from tests import test_helper
 
 
 # TODO: tests
+@patch("db_utils.insert_or_update_discussion_check_progress")
+@patch("db_utils.get_discussion_check_progress", return_value=None)
 @patch("utils.get_last_message")
-@patch("core_api.get_messages")
-@patch("db_utils.get_comment_deleted_message_ids", return_value=[])
+@patch("core_api.stream_messages")
+@patch("db_utils.get_comment_deleted_ranges", return_value=[])
 @patch("logging.error")
 @patch("logging.info")
 @patch("interval_updating_utils._store_discussion_message")
 class CheckDiscussionMessagesTest(TestCase):
+	def _assert_streamed(self, mock_stream_messages, chat_id, message_ids, stop_flag):
+		# message ids are passed to stream_messages as a lazy iterator
+		mock_stream_messages.assert_called_once()
+		args, kwargs = mock_stream_messages.call_args
+		self.assertEqual((args[0], list(args[1]), args[2]), (chat_id, message_ids, interval_updating_utils._EXPORT_BATCH_SIZE))
+		self.assertEqual(kwargs, {"stop_flag": stop_flag})
+
+	@patch("time.time", return_value=1000)
 	@patch("interval_updating_utils._STATUS", {"stop": False})
-	def test_check_discussion_messages(self, mock__store_discussion_message, mock_info, mock_error,
-									   mock_get_comment_deleted_message_ids, mock_get_messages,
-									   mock_get_last_message, *args):
+	def test_check_discussion_messages(self, mock_time, mock__store_discussion_message, mock_info, mock_error,
+									   mock_get_comment_deleted_ranges, mock_stream_messages,
+									   mock_get_last_message, mock_get_discussion_check_progress,
+									   mock_insert_or_update_discussion_check_progress, *args):
 		main_channel_id = -10012345678
 		discussion_chat_id = -10087541256
 		message_id = 125
@@ -32,23 +43,24 @@ class CheckDiscussionMessagesTest(TestCase):
 		calls = []
 		message_ids = list(range(125, 0, -1))
 		messages = [Mock(id=i) for i in message_ids]
-		mock_get_messages.return_value = messages
+		mock_stream_messages.return_value = iter([(len(messages), messages)])
 		for i in messages:
 			calls.append(call.a(mock_bot, main_channel_id, i, discussion_chat_id))
 
-		interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id)
+		list(interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id))
 		mock_get_last_message.assert_called_once_with(mock_bot, discussion_chat_id)
-		mock_get_comment_deleted_message_ids.assert_called_once_with(discussion_chat_id, list(range(1, 126)))
-		mock_get_messages.assert_called_once_with(discussion_chat_id, 0, interval_updating_utils._EXPORT_BATCH_SIZE,
-												  message_ids=message_ids, stop_flag={"stop": False})
+		mock_get_comment_deleted_ranges.assert_called_once_with(discussion_chat_id, 1, 125)
+		self._assert_streamed(mock_stream_messages, discussion_chat_id, message_ids, {"stop": False})
 		mock_info.assert_has_calls([call(f"Starting to check discussion channel: {discussion_chat_id}"),
 									call(f"Discussion channel check completed in {discussion_chat_id}")])
 		mock_error.assert_not_called()
+		mock_get_discussion_check_progress.assert_called_once_with(discussion_chat_id)
+		mock_insert_or_update_discussion_check_progress.assert_called_once_with(discussion_chat_id, message_id, 1000)
 		self.assertEqual(manager.mock_calls, calls)
 
 	@patch("interval_updating_utils._STATUS", {"stop": False})
 	def test_check_discussion_messages_with_deleted(self, mock__store_discussion_message, mock_info, mock_error,
-													mock_get_comment_deleted_message_ids, mock_get_messages,
+													mock_get_comment_deleted_ranges, mock_stream_messages,
 													mock_get_last_message, *args):
 		main_channel_id = -10012345678
 		discussion_chat_id = -10087541256
@@ -56,23 +68,22 @@ class CheckDiscussionMessagesTest(TestCase):
 		deleted_message =  [5, 10, 15, 20, 25]
 		mock_bot = Mock(spec=TeleBot)
 		mock_get_last_message.return_value = message_id
-		mock_get_comment_deleted_message_ids.return_value = deleted_message
+		mock_get_comment_deleted_ranges.return_value = [(i, i) for i in deleted_message]
 		manager = Mock()
 		manager.attach_mock(mock__store_discussion_message, 'a')
 		calls = []
 		message_ids = [i for i in range(125, 0, -1) if i not in deleted_message]
 		messages = [Mock(id=i) for i in message_ids]
-		mock_get_messages.return_value = messages
+		mock_stream_messages.return_value = iter([(len(messages), messages)])
 		for i in messages:
 			if i not in deleted_message:
 				calls.append(call.a(mock_bot, main_channel_id, i, discussion_chat_id))
 
 
-		interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id)
+		list(interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id))
 		mock_get_last_message.assert_called_once_with(mock_bot, discussion_chat_id)
-		mock_get_comment_deleted_message_ids.assert_called_once_with(discussion_chat_id, list(range(1, 126)))
-		mock_get_messages.assert_called_once_with(discussion_chat_id, 0, interval_updating_utils._EXPORT_BATCH_SIZE,
-												  message_ids=message_ids, stop_flag={"stop": False})
+		mock_get_comment_deleted_ranges.assert_called_once_with(discussion_chat_id, 1, 125)
+		self._assert_streamed(mock_stream_messages, discussion_chat_id, message_ids, {"stop": False})
 		mock_info.assert_has_calls([call(f"Starting to check discussion channel: {discussion_chat_id}"),
 									call(f"Discussion channel check completed in {discussion_chat_id}")])
 		mock_error.assert_not_called()
@@ -80,7 +91,7 @@ class CheckDiscussionMessagesTest(TestCase):
 
 	@patch("interval_updating_utils._STATUS", {"stop": True})
 	def test_check_discussion_messages_not_interval_check(self, mock__store_discussion_message, mock_info, mock_error,
-														  mock_get_comment_deleted_message_ids, mock_get_messages,
+														  mock_get_comment_deleted_ranges, mock_stream_messages,
 														  mock_get_last_message, *args):
 		main_channel_id = -10012345678
 		discussion_chat_id = -10087541256
@@ -89,20 +100,19 @@ class CheckDiscussionMessagesTest(TestCase):
 		mock_get_last_message.return_value = message_id
 		message_ids = list(range(125, 0, -1))
 		messages = [Mock(id=i) for i in message_ids]
-		mock_get_messages.return_value = messages
+		mock_stream_messages.return_value = iter([(len(messages), messages)])
 
-		interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id)
+		list(interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id))
 		mock_get_last_message.assert_called_once_with(mock_bot, discussion_chat_id)
-		mock_get_comment_deleted_message_ids.assert_called_once_with(discussion_chat_id, list(range(1, 126)))
+		mock_get_comment_deleted_ranges.assert_called_once_with(discussion_chat_id, 1, 125)
 		mock_info.assert_called_once_with(f"Starting to check discussion channel: {discussion_chat_id}")
-		mock_get_messages.assert_called_once_with(discussion_chat_id, 0, interval_updating_utils._EXPORT_BATCH_SIZE,
-												  message_ids=message_ids, stop_flag={"stop": True})
+		self._assert_streamed(mock_stream_messages, discussion_chat_id, message_ids, {"stop": True})
 		mock_error.assert_called_once_with(f"Discussion channel check stopped ({discussion_chat_id, message_id}) - Interval update stop requested")
 		mock__store_discussion_message.assert_not_called()
 
 	@patch("interval_updating_utils._STATUS", {"stop": False})
 	def test_check_discussion_messages_empty_chat(self, mock__store_discussion_message, mock_info, mock_error,
-												  mock_get_comment_deleted_message_ids, mock_get_messages,
+												  mock_get_comment_deleted_ranges, mock_stream_messages,
 												  mock_get_last_message, *args):
 		main_channel_id = -10012345678
 		discussion_chat_id = -10087541256
@@ -110,17 +120,17 @@ class CheckDiscussionMessagesTest(TestCase):
 		mock_bot = Mock(spec=TeleBot)
 		mock_get_last_message.return_value = message_id
 
-		interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id)
+		list(interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id))
 		mock_get_last_message.assert_called_once_with(mock_bot, discussion_chat_id)
-		mock_get_comment_deleted_message_ids.assert_not_called()
+		mock_get_comment_deleted_ranges.assert_not_called()
 		mock_info.assert_not_called()
-		mock_get_messages.assert_not_called()
+		mock_stream_messages.assert_not_called()
 		mock_error.assert_not_called()
 		mock__store_discussion_message.assert_not_called()
 
 	@patch("interval_updating_utils._STATUS", {"stop": False})
-	def test_check_discussion_messages_with_none_messages(self, mock__store_discussion_message, mock_info, mock_error,
-									   mock_get_comment_deleted_message_ids, mock_get_messages,
+	def test_check_discussion_messages_with_fetch_error(self, mock__store_discussion_message, mock_info, mock_error,
+									   mock_get_comment_deleted_ranges, mock_stream_messages,
 									   mock_get_last_message, *args):
 		main_channel_id = -10012345678
 		discussion_chat_id = -10087541256
@@ -128,38 +138,129 @@ class CheckDiscussionMessagesTest(TestCase):
 		mock_bot = Mock(spec=TeleBot)
 		mock_get_last_message.return_value = message_id
 		message_ids = list(range(125, 0, -1))
-		mock_get_messages.return_value = None
+		mock_stream_messages.side_effect = ConnectionError("Test error")
 
-		interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id)
+		list(interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id))
 		mock_get_last_message.assert_called_once_with(mock_bot, discussion_chat_id)
-		mock_get_comment_deleted_message_ids.assert_called_once_with(discussion_chat_id, list(range(1, 126)))
-		mock_get_messages.assert_called_once_with(discussion_chat_id, 0, interval_updating_utils._EXPORT_BATCH_SIZE,
-												  message_ids=message_ids, stop_flag={"stop": False})
+		mock_get_comment_deleted_ranges.assert_called_once_with(discussion_chat_id, 1, 125)
+		self._assert_streamed(mock_stream_messages, discussion_chat_id, message_ids, {"stop": False})
 		mock_info.assert_has_calls([call(f"Starting to check discussion channel: {discussion_chat_id}"),
 									call(f"Check chat {discussion_chat_id} was skipped because can't get messages")])
 		mock__store_discussion_message.assert_not_called()
 		mock_error.assert_not_called()
 
 	@patch("interval_updating_utils._STATUS", {"stop": True})
-	def test_check_discussion_messages_with_none_messages_not_update(self, mock__store_discussion_message, mock_info, mock_error,
-									   mock_get_comment_deleted_message_ids, mock_get_messages,
-									   mock_get_last_message, *args):
+	def test_check_discussion_messages_stopped_during_fetch(self, mock__store_discussion_message, mock_info, mock_error,
+									   mock_get_comment_deleted_ranges, mock_stream_messages,
+									   mock_get_last_message, mock_get_discussion_check_progress,
+									   mock_insert_or_update_discussion_check_progress, *args):
 		main_channel_id = -10012345678
 		discussion_chat_id = -10087541256
 		message_id = 125
 		mock_bot = Mock(spec=TeleBot)
 		mock_get_last_message.return_value = message_id
 		message_ids = list(range(125, 0, -1))
-		mock_get_messages.return_value = None
+		mock_stream_messages.return_value = iter([])
 
-		interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id)
+		list(interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id))
 		mock_get_last_message.assert_called_once_with(mock_bot, discussion_chat_id)
-		mock_get_comment_deleted_message_ids.assert_called_once_with(discussion_chat_id, list(range(1, 126)))
-		mock_get_messages.assert_called_once_with(discussion_chat_id, 0, interval_updating_utils._EXPORT_BATCH_SIZE,
-												  message_ids=message_ids, stop_flag={"stop": True})
-		mock_info.assert_has_calls([call(f"Starting to check discussion channel: {discussion_chat_id}")])
+		mock_get_comment_deleted_ranges.assert_called_once_with(discussion_chat_id, 1, 125)
+		self._assert_streamed(mock_stream_messages, discussion_chat_id, message_ids, {"stop": True})
+		mock_info.assert_called_once_with(f"Starting to check discussion channel: {discussion_chat_id}")
 		mock__store_discussion_message.assert_not_called()
 		mock_error.assert_not_called()
+		mock_insert_or_update_discussion_check_progress.assert_not_called()
+
+	@patch("time.time", return_value=1000)
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_check_discussion_messages_after_verified(self, mock_time, mock__store_discussion_message, mock_info, mock_error,
+													  mock_get_comment_deleted_ranges, mock_stream_messages,
+													  mock_get_last_message, mock_get_discussion_check_progress,
+													  mock_insert_or_update_discussion_check_progress, *args):
+		main_channel_id = -10012345678
+		discussion_chat_id = -10087541256
+		mock_bot = Mock(spec=TeleBot)
+		mock_get_last_message.return_value = 125
+		mock_get_discussion_check_progress.return_value = (110, 900)
+		mock_get_comment_deleted_ranges.return_value = [(100, 115), (120, 120)]
+		messages = [Mock(id=i) for i in [125, 124, 123, 122, 121, 119, 118, 117, 116]]
+		mock_stream_messages.return_value = iter([(len(messages), messages)])
+
+		list(interval_updating_utils._check_discussion_messages(mock_bot, main_channel_id, discussion_chat_id))
+		mock_get_comment_deleted_ranges.assert_called_once_with(discussion_chat_id, 111, 125)
+		self._assert_streamed(mock_stream_messages, discussion_chat_id, [125, 124, 123, 122, 121, 119, 118, 117, 116], {"stop": False})
+		self.assertEqual(mock__store_discussion_message.call_count, len(messages))
+		mock_insert_or_update_discussion_check_progress.assert_called_once_with(discussion_chat_id, 125, 900)
+
+	@patch("time.time", return_value=1000)
+	@patch("config_utils.DISCUSSION_RECHECK_INTERVAL", 1)
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_check_discussion_messages_recheck(self, mock_time, mock__store_discussion_message, mock_info, mock_error,
+											   mock_get_comment_deleted_ranges, mock_stream_messages,
+											   mock_get_last_message, mock_get_discussion_check_progress,
+											   mock_insert_or_update_discussion_check_progress, *args):
+		discussion_chat_id = -10087541256
+		mock_get_last_message.return_value = 125
+		mock_get_discussion_check_progress.return_value = (110, 900)
+		mock_stream_messages.return_value = iter([])
+
+		list(interval_updating_utils._check_discussion_messages(Mock(spec=TeleBot), -10012345678, discussion_chat_id))
+		mock_get_comment_deleted_ranges.assert_called_once_with(discussion_chat_id, 1, 125)
+		mock_insert_or_update_discussion_check_progress.assert_called_once_with(discussion_chat_id, 125, 1000)
+
+	@patch("time.time", return_value=1000)
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_check_discussion_messages_no_new_messages(self, mock_time, mock__store_discussion_message, mock_info, mock_error,
+													   mock_get_comment_deleted_ranges, mock_stream_messages,
+													   mock_get_last_message, mock_get_discussion_check_progress,
+													   mock_insert_or_update_discussion_check_progress, *args):
+		mock_get_last_message.return_value = 125
+		mock_get_discussion_check_progress.return_value = (125, 900)
+
+		list(interval_updating_utils._check_discussion_messages(Mock(spec=TeleBot), -10012345678, -10087541256))
+		mock_info.assert_not_called()
+		mock_stream_messages.assert_not_called()
+		mock_insert_or_update_discussion_check_progress.assert_not_called()
+
+	@patch("logging.warning")
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_check_discussion_messages_too_many_requests(self, mock_warning, mock__store_discussion_message, mock_info,
+														 mock_error, mock_get_comment_deleted_ranges, mock_stream_messages,
+														 mock_get_last_message, mock_get_discussion_check_progress,
+														 mock_insert_or_update_discussion_check_progress, *args):
+		discussion_chat_id = -10087541256
+		mock_get_last_message.return_value = 125
+		messages = [Mock(id=i) for i in range(125, 0, -1)]
+		mock_stream_messages.return_value = iter([(len(messages), messages)])
+		mock__store_discussion_message.side_effect = [None, ApiTelegramException("send_message", "", {
+			"error_code": 429, "description": "Too Many Requests: retry after 10"})]
+
+		list(interval_updating_utils._check_discussion_messages(Mock(spec=TeleBot), -10012345678, discussion_chat_id))
+		self.assertEqual(mock__store_discussion_message.call_count, 2)
+		mock_warning.assert_called_once()
+		mock_insert_or_update_discussion_check_progress.assert_not_called()
+
+	@patch("interval_updating_utils._CHECK_SLICE_SIZE", 2)
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_check_discussion_messages_in_slices(self, mock__store_discussion_message, mock_info, mock_error,
+												 mock_get_comment_deleted_ranges, mock_stream_messages,
+												 mock_get_last_message, mock_get_discussion_check_progress,
+												 mock_insert_or_update_discussion_check_progress, *args):
+		discussion_chat_id = -10087541256
+		mock_get_last_message.return_value = 5
+		messages = [Mock(id=i) for i in range(5, 0, -1)]
+		mock_stream_messages.return_value = iter([(len(messages), messages)])
+
+		check = interval_updating_utils._check_discussion_messages(Mock(spec=TeleBot), -10012345678, discussion_chat_id)
+		next(check)
+		self.assertEqual(mock__store_discussion_message.call_count, 2)
+		next(check)
+		self.assertEqual(mock__store_discussion_message.call_count, 4)
+		mock_insert_or_update_discussion_check_progress.assert_not_called()
+
+		self.assertEqual(list(check), [])
+		self.assertEqual(mock__store_discussion_message.call_count, 5)
+		mock_insert_or_update_discussion_check_progress.assert_called_once()
 
 
 @patch("utils.get_main_message_content_by_id")
@@ -202,7 +303,7 @@ class StoreDiscussionMessageTest(TestCase):
 		interval_updating_utils._store_discussion_message(mock_bot, main_channel_id, mock_message, discussion_chat_id)
 		mock_get_main_message_content_by_id.assert_not_called()
 		mock_delete_comment.assert_called_once_with(mock_bot, main_channel_id, discussion_chat_id, message_id)
-		mock_sleep.assert_called_once_with(interval_updating_utils.DELAY_AFTER_ONE_SCAN)
+		mock_sleep.assert_not_called()
 		mock_get_forwarded_from_id.assert_not_called()
 		mock_insert_or_update_discussion_message.assert_not_called()
 
@@ -226,6 +327,8 @@ class StoreDiscussionMessageTest(TestCase):
 		mock_insert_or_update_discussion_message.assert_not_called()
 
 
+@patch("time.time", return_value=1745994296)
+@patch("db_utils.delete_dirty_tickets")
 @patch("logging.info")
 @patch("db_utils.insert_or_update_channel_update_progress")
 @patch("interval_updating_utils.update_by_bot")
@@ -234,7 +337,7 @@ class StoreDiscussionMessageTest(TestCase):
 @patch('db_utils.get_main_message_ids')
 class CheckMainMessagesTest(TestCase):
 	def test_five_messages(self, mock_get_main_message_ids, mock__clear_updating_channel, mock_update_by_core, mock_update_by_bot,
-						mock_insert_or_update_channel_update_progress, mock_info, *args):
+						mock_insert_or_update_channel_update_progress, mock_info, mock_delete_dirty_tickets, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		main_message_ids = [1, 2, 3, 5, 10]
@@ -242,16 +345,17 @@ class CheckMainMessagesTest(TestCase):
 		mock_get_main_message_ids.return_value = main_message_ids.copy()
 
 
-		interval_updating_utils._check_main_messages(mock_bot, main_channel_id)
+		list(interval_updating_utils._check_main_messages(mock_bot, main_channel_id))
 		mock_get_main_message_ids.assert_called_once_with(main_channel_id)
 		mock__clear_updating_channel.assert_called_once_with(main_channel_id)
 		mock_update_by_core.assert_not_called()
-		mock_update_by_bot.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted)
+		mock_update_by_bot.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted, dirty_before=None)
 		mock_insert_or_update_channel_update_progress.assert_called_once_with(main_channel_id, 0)
+		mock_delete_dirty_tickets.assert_called_once_with(main_channel_id, 1745994296)
 		mock_info.assert_called_once_with(f"Main channel check completed in {main_channel_id}")
 
 	def test_messages_with_start_from_messages(self, mock_get_main_message_ids, mock__clear_updating_channel, mock_update_by_core, mock_update_by_bot,
-						mock_insert_or_update_channel_update_progress, mock_info, *args):
+						mock_insert_or_update_channel_update_progress, mock_info, mock_delete_dirty_tickets, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		start_from_message = 7
@@ -260,16 +364,17 @@ class CheckMainMessagesTest(TestCase):
 		mock_get_main_message_ids.return_value = main_message_ids.copy()
 
 
-		interval_updating_utils._check_main_messages(mock_bot, main_channel_id, start_from_message)
+		list(interval_updating_utils._check_main_messages(mock_bot, main_channel_id, start_from_message))
 		mock_get_main_message_ids.assert_called_once_with(main_channel_id)
 		mock__clear_updating_channel.assert_called_once_with(main_channel_id)
 		mock_update_by_core.assert_not_called()
-		mock_update_by_bot.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted)
+		mock_update_by_bot.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted, dirty_before=None)
 		mock_insert_or_update_channel_update_progress.assert_called_once_with(main_channel_id, 0)
+		mock_delete_dirty_tickets.assert_not_called()
 		mock_info.assert_called_once_with(f"Main channel check completed in {main_channel_id}")
 
 	def test_six_messages(self, mock_get_main_message_ids, mock__clear_updating_channel, mock_update_by_core, mock_update_by_bot,
-						mock_insert_or_update_channel_update_progress, mock_info, *args):
+						mock_insert_or_update_channel_update_progress, mock_info, mock_delete_dirty_tickets, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		main_message_ids = [1, 2, 3, 5, 7, 10]
@@ -277,16 +382,17 @@ class CheckMainMessagesTest(TestCase):
 		mock_get_main_message_ids.return_value = main_message_ids.copy()
 
 
-		interval_updating_utils._check_main_messages(mock_bot, main_channel_id)
+		list(interval_updating_utils._check_main_messages(mock_bot, main_channel_id))
 		mock_get_main_message_ids.assert_called_once_with(main_channel_id)
 		mock__clear_updating_channel.assert_called_once_with(main_channel_id)
-		mock_update_by_core.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted)
+		mock_update_by_core.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted, dirty_before=None)
 		mock_update_by_bot.assert_not_called()
 		mock_insert_or_update_channel_update_progress.assert_called_once_with(main_channel_id, 0)
+		mock_delete_dirty_tickets.assert_called_once_with(main_channel_id, 1745994296)
 		mock_info.assert_called_once_with(f"Main channel check completed in {main_channel_id}")
 
 	def test_false_bot_update(self, mock_get_main_message_ids, mock__clear_updating_channel, mock_update_by_core, mock_update_by_bot,
-						mock_insert_or_update_channel_update_progress, mock_info, *args):
+						mock_insert_or_update_channel_update_progress, mock_info, mock_delete_dirty_tickets, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		start_from_message = 7
@@ -296,16 +402,17 @@ class CheckMainMessagesTest(TestCase):
 		mock_update_by_bot.return_value = False
 
 
-		interval_updating_utils._check_main_messages(mock_bot, main_channel_id, start_from_message)
+		list(interval_updating_utils._check_main_messages(mock_bot, main_channel_id, start_from_message))
 		mock_get_main_message_ids.assert_called_once_with(main_channel_id)
 		mock__clear_updating_channel.assert_called_once_with(main_channel_id)
 		mock_update_by_core.assert_not_called()
-		mock_update_by_bot.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted)
+		mock_update_by_bot.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted, dirty_before=None)
 		mock_insert_or_update_channel_update_progress.assert_not_called()
+		mock_delete_dirty_tickets.assert_not_called()
 		mock_info.assert_not_called()
 
 	def test_false_core_update(self, mock_get_main_message_ids, mock__clear_updating_channel, mock_update_by_core, mock_update_by_bot,
-						mock_insert_or_update_channel_update_progress, mock_info, *args):
+						mock_insert_or_update_channel_update_progress, mock_info, mock_delete_dirty_tickets, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		main_message_ids = [1, 2, 3, 5, 7, 10]
@@ -314,28 +421,30 @@ class CheckMainMessagesTest(TestCase):
 		mock_update_by_core.return_value = False
 
 
-		interval_updating_utils._check_main_messages(mock_bot, main_channel_id)
+		list(interval_updating_utils._check_main_messages(mock_bot, main_channel_id))
 		mock_get_main_message_ids.assert_called_once_with(main_channel_id)
 		mock__clear_updating_channel.assert_called_once_with(main_channel_id)
-		mock_update_by_core.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted)
+		mock_update_by_core.assert_called_once_with(mock_bot, main_channel_id, main_message_sorted, dirty_before=None)
 		mock_update_by_bot.assert_not_called()
 		mock_insert_or_update_channel_update_progress.assert_not_called()
+		mock_delete_dirty_tickets.assert_not_called()
 		mock_info.assert_not_called()
 
 	def test_empty_messages(self, mock_get_main_message_ids, mock__clear_updating_channel, mock_update_by_core, mock_update_by_bot,
-						mock_insert_or_update_channel_update_progress, mock_info, *args):
+						mock_insert_or_update_channel_update_progress, mock_info, mock_delete_dirty_tickets, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		main_message_ids = []
 		mock_get_main_message_ids.return_value = main_message_ids
 
 
-		interval_updating_utils._check_main_messages(mock_bot, main_channel_id)
+		list(interval_updating_utils._check_main_messages(mock_bot, main_channel_id))
 		mock_get_main_message_ids.assert_called_once_with(main_channel_id)
 		mock__clear_updating_channel.assert_not_called()
 		mock_update_by_core.assert_not_called()
 		mock_update_by_bot.assert_not_called()
 		mock_insert_or_update_channel_update_progress.assert_not_called()
+		mock_delete_dirty_tickets.assert_not_called()
 		mock_info.assert_not_called()
 
 
@@ -343,60 +452,76 @@ class CheckMainMessagesTest(TestCase):
 @patch("interval_updating_utils._update_interval_message", return_value=True)
 @patch("logging.info")
 @patch("core_api.get_messages")
+@patch("core_api.stream_messages")
 class UpdateMessagesTest(TestCase):
 	@patch("interval_updating_utils._STATUS", {"stop": False})
-	def test_update_by_core(self, mock_get_messages, mock_info, mock__update_interval_message, *args):
+	def test_update_by_core(self, mock_stream_messages, mock_get_messages, mock_info, mock__update_interval_message, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		message_ids = [1, 2, 3, 4, 5, 7, 9, 10]
 		messages = [Mock(id=id) for id in message_ids]
-		mock_get_messages.return_value = messages
+		mock_stream_messages.return_value = iter([(5, messages[:5]), (8, messages[5:])])
 
 		manager = Mock()
 		manager.attach_mock(mock__update_interval_message, "a")
 		expected_calls = []
 
 		for message in messages:
-			expected_calls.append(call.a(mock_bot, main_channel_id, message.id, message=message))
+			expected_calls.append(call.a(mock_bot, main_channel_id, message.id, message=message, dirty_before=None))
 
 		result = interval_updating_utils.update_by_core(mock_bot, main_channel_id, message_ids)
-		mock_get_messages.assert_called_once_with(main_channel_id, 0, interval_updating_utils._EXPORT_BATCH_SIZE,
-												  message_ids=message_ids, stop_flag={"stop": False})
+		mock_stream_messages.assert_called_once_with(main_channel_id, message_ids, interval_updating_utils._EXPORT_BATCH_SIZE,
+													 stop_flag={"stop": False})
+		mock_get_messages.assert_not_called()
 		mock_info.assert_not_called()
 		self.assertEqual(expected_calls, manager.mock_calls)
 		self.assertTrue(result)
 
 	@patch("interval_updating_utils._STATUS", {"stop": False})
-	def test_update_by_core_with_false_message(self, mock_get_messages, mock_info, mock__update_interval_message, *args):
+	def test_update_by_core_with_false_message(self, mock_stream_messages, mock_get_messages, mock_info, mock__update_interval_message, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		message_ids = [1, 2, 3, 4, 5, 7, 9, 10]
 		messages = [Mock(id=id) for id in message_ids]
-		mock_get_messages.return_value = messages
+		mock_stream_messages.return_value = iter([(5, messages[:5]), (8, messages[5:])])
 		mock__update_interval_message.return_value = False
 
 		result = interval_updating_utils.update_by_core(mock_bot, main_channel_id, message_ids)
-		mock_get_messages.assert_called_once_with(main_channel_id, 0, interval_updating_utils._EXPORT_BATCH_SIZE,
-												  message_ids=message_ids, stop_flag={"stop": False})
+		mock_stream_messages.assert_called_once_with(main_channel_id, message_ids, interval_updating_utils._EXPORT_BATCH_SIZE,
+													 stop_flag={"stop": False})
 		mock_info.assert_not_called()
-		mock__update_interval_message.assert_called_once_with(mock_bot, main_channel_id, 1, message=messages[0])
+		mock__update_interval_message.assert_called_once_with(mock_bot, main_channel_id, 1, message=messages[0], dirty_before=None)
 		self.assertFalse(result)
 
 	@patch("interval_updating_utils._STATUS", {"stop": False})
-	def test_update_by_core_with_none_get_messages(self, mock_get_messages, mock_info, mock__update_interval_message, *args):
+	def test_update_by_core_with_fetch_error(self, mock_stream_messages, mock_get_messages, mock_info, mock__update_interval_message, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		message_ids = [1, 2, 3, 4, 5, 7, 9, 10]
-		mock_get_messages.return_value = None
+		messages = [Mock(id=id) for id in message_ids]
+
+		def stream(*args, **kwargs):
+			yield 5, messages[:5]
+			raise ConnectionError("Test error")
+
+		mock_stream_messages.side_effect = stream
 
 		result = interval_updating_utils.update_by_core(mock_bot, main_channel_id, message_ids)
-		mock_get_messages.assert_called_once_with(main_channel_id, 0, interval_updating_utils._EXPORT_BATCH_SIZE,
-												  message_ids=message_ids, stop_flag={"stop": False})
 		mock_info.assert_called_once_with(f"Check chat {main_channel_id} was skipped because can't get messages")
+		self.assertEqual(mock__update_interval_message.call_count, 5)
+		self.assertFalse(result)
+
+	@patch("interval_updating_utils._STATUS", {"stop": True})
+	def test_update_by_core_stopped(self, mock_stream_messages, mock_get_messages, mock_info, mock__update_interval_message, *args):
+		mock_bot = Mock(spec=TeleBot)
+		mock_stream_messages.return_value = iter([])
+
+		result = interval_updating_utils.update_by_core(mock_bot, -10012345678, [1, 2, 3, 4, 5, 7])
 		mock__update_interval_message.assert_not_called()
+		mock_info.assert_not_called()
 		self.assertFalse(result)
 
-	def test_update_by_bot(self, mock_get_messages, mock_info, mock__update_interval_message, *args):
+	def test_update_by_bot(self, mock_stream_messages, mock_get_messages, mock_info, mock__update_interval_message, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		main_message_ids = [1, 2, 3, 4, 5, 7, 9, 10]
@@ -406,14 +531,14 @@ class UpdateMessagesTest(TestCase):
 		expected_calls = []
 
 		for main_message_id in main_message_ids:
-			expected_calls.append(call.a(mock_bot, main_channel_id, main_message_id))
+			expected_calls.append(call.a(mock_bot, main_channel_id, main_message_id, dirty_before=None))
 
 		interval_updating_utils.update_by_bot(mock_bot, main_channel_id, main_message_ids)
 		mock_get_messages.assert_not_called()
 		mock_info.assert_not_called()
 		self.assertEqual(expected_calls, manager.mock_calls)
 
-	def test_update_by_bot_with_false_message(self, mock_get_messages, mock_info, mock__update_interval_message, *args):
+	def test_update_by_bot_with_false_message(self, mock_stream_messages, mock_get_messages, mock_info, mock__update_interval_message, *args):
 		mock_bot = Mock(spec=TeleBot)
 		main_channel_id = -10012345678
 		main_message_ids = [1, 2, 3, 4, 5, 7, 9, 10]
@@ -422,7 +547,7 @@ class UpdateMessagesTest(TestCase):
 		interval_updating_utils.update_by_bot(mock_bot, main_channel_id, main_message_ids)
 		mock_get_messages.assert_not_called()
 		mock_info.assert_not_called()
-		mock__update_interval_message.assert_called_once_with(mock_bot, main_channel_id, 1)
+		mock__update_interval_message.assert_called_once_with(mock_bot, main_channel_id, 1, dirty_before=None)
 
 
 @patch("db_utils.insert_or_update_channel_update_progress")
@@ -437,7 +562,7 @@ class UpdateIntervalMessageTest(TestCase):
 		current_msg_id = 4
 
 		result = interval_updating_utils._update_interval_message(mock_bot, main_channel_id, current_msg_id)
-		mock_sleep(interval_updating_utils.DELAY_AFTER_ONE_SCAN)
+		mock_sleep.assert_not_called()
 		mock_update_older_message.assert_called_once_with(mock_bot, main_channel_id, current_msg_id, forwarded_message=None)
 		mock_insert_or_update_channel_update_progress.assert_called_once_with(main_channel_id, current_msg_id)
 		self.assertEqual(result, True)
@@ -451,11 +576,25 @@ class UpdateIntervalMessageTest(TestCase):
 		mock_message = Mock(spec=Message)
 
 		result = interval_updating_utils._update_interval_message(mock_bot, main_channel_id, current_msg_id, mock_message)
-		mock_sleep(interval_updating_utils.DELAY_AFTER_ONE_SCAN)
+		mock_sleep.assert_not_called()
 		mock_update_older_message.assert_called_once_with(mock_bot, main_channel_id, current_msg_id, forwarded_message=mock_message)
 		mock_insert_or_update_channel_update_progress.assert_called_once_with(main_channel_id, current_msg_id)
 		self.assertEqual(result, True)
 
+	@patch("db_utils.delete_dirty_ticket")
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_update_interval_message_dirty(self, mock_delete_dirty_ticket, mock_sleep, mock_update_older_message,
+									 mock_insert_or_update_channel_update_progress, *args):
+		mock_bot = Mock(spec=TeleBot)
+		main_channel_id = -10012345678
+		current_msg_id = 4
+
+		result = interval_updating_utils._update_interval_message(mock_bot, main_channel_id, current_msg_id, dirty_before=1745994296)
+		mock_update_older_message.assert_called_once_with(mock_bot, main_channel_id, current_msg_id, forwarded_message=None)
+		mock_insert_or_update_channel_update_progress.assert_not_called()
+		mock_delete_dirty_ticket.assert_called_once_with(main_channel_id, current_msg_id, 1745994296)
+		self.assertEqual(result, True)
+
 	@patch("logging.error")
 	@patch("interval_updating_utils._STATUS", {"stop": True})
 	def test_update_interval_message_error(self, mock_error, mock_sleep, mock_update_older_message,
@@ -465,7 +604,7 @@ class UpdateIntervalMessageTest(TestCase):
 		current_msg_id = 4
 
 		result = interval_updating_utils._update_interval_message(mock_bot, main_channel_id, current_msg_id)
-		mock_sleep(interval_updating_utils.DELAY_AFTER_ONE_SCAN)
+		mock_sleep.assert_not_called()
 		mock_update_older_message.assert_not_called()
 		mock_insert_or_update_channel_update_progress.assert_not_called()
 		mock_error.assert_called_once_with(f"Main channel check stopped ({main_channel_id, current_msg_id}) - Interval update stop requested")
@@ -760,7 +899,7 @@ class CheckAllMessagesTest(TestCase):
 		interval_updating_utils._check_all_messages(mock_bot)
 		mock_get_unfinished_update_channels.assert_called_once_with()
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, None),
-												   call(mock_bot, -10087456321, None)])
+												   call(mock_bot, -10087456321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 2)
 		mock_get_finished_update_channels.assert_called_once_with()
 		mock_get_main_channel_ids.assert_called_once_with()
@@ -769,7 +908,7 @@ class CheckAllMessagesTest(TestCase):
 																 call(mock_bot, -10087456321), call(mock_bot, -10087456321, True)])
 		self.assertEqual(mock_check_invalid_default_user_member.call_count, 4)
 		mock__check_discussion_messages.assert_has_calls([call(mock_bot, -10012345678, -10032165487),
-														  call(mock_bot, -10087456321, -10036258147)])
+														  call(mock_bot, -10087456321, -10036258147)], any_order=True)
 		self.assertEqual(mock__check_discussion_messages.call_count, 2)
 		mock_info.assert_called_once_with("Interval check completed")
 		mock_clear_updates_in_progress.assert_called_once_with()
@@ -791,7 +930,7 @@ class CheckAllMessagesTest(TestCase):
 		interval_updating_utils._check_all_messages(mock_bot)
 		mock_get_unfinished_update_channels.assert_called_once_with()
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, None),
-												   call(mock_bot, -10087654321, None)])
+												   call(mock_bot, -10087654321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 2)
 		mock_get_finished_update_channels.assert_called_once_with()
 		mock_get_main_channel_ids.assert_called_once_with()
@@ -819,17 +958,17 @@ class CheckAllMessagesTest(TestCase):
 		mock_get_unfinished_update_channels.assert_called_once_with()
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, None),
 												   call(mock_bot, -10087654321, None),
-												   call(mock_bot, -10087456321, None)])
+												   call(mock_bot, -10087456321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 3)
 		mock_get_finished_update_channels.assert_called_once_with()
 		mock_get_main_channel_ids.assert_called_once_with()
 		self.assertEqual(mock_time.call_count, 3)
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, None),
 												   call(mock_bot, -10087654321, None),
-												   call(mock_bot, -10087456321, None)])
+												   call(mock_bot, -10087456321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 3)
 		mock__check_discussion_messages.assert_has_calls([call(mock_bot, -10012345678, -10032165487),
-														  call(mock_bot, -10087456321, -10036258147)])
+														  call(mock_bot, -10087456321, -10036258147)], any_order=True)
 		self.assertEqual(mock__check_discussion_messages.call_count, 2)
 		mock_info.assert_called_once_with("Interval check completed")
 		mock_clear_updates_in_progress.assert_called_once_with()
@@ -856,7 +995,7 @@ class CheckAllMessagesTest(TestCase):
 		mock_get_unfinished_update_channels.assert_called_once_with()
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, None),
 												   call(mock_bot, -10087654321, None),
-												   call(mock_bot, -10087456321, None)])
+												   call(mock_bot, -10087456321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 3)
 		mock_get_finished_update_channels.assert_called_once_with()
 		mock_get_main_channel_ids.assert_called_once_with()
@@ -866,7 +1005,7 @@ class CheckAllMessagesTest(TestCase):
 																 call(mock_bot, -10087456321)])
 		self.assertEqual(mock_check_invalid_default_user_member.call_count, 3)
 		mock__check_discussion_messages.assert_has_calls([call(mock_bot, -10012345678, -10032165487),
-														  call(mock_bot, -10087456321, -10036258147)])
+														  call(mock_bot, -10087456321, -10036258147)], any_order=True)
 		self.assertEqual(mock__check_discussion_messages.call_count, 2)
 		mock_info.assert_called_once_with("Interval check completed")
 		mock_clear_updates_in_progress.assert_called_once_with()
@@ -888,7 +1027,7 @@ class CheckAllMessagesTest(TestCase):
 		mock_get_unfinished_update_channels.assert_called_once_with()
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, None),
 												   call(mock_bot, -10087456321, None),
-												   call(mock_bot, -10087654321, None)])
+												   call(mock_bot, -10087654321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 3)
 		mock_get_finished_update_channels.assert_called_once_with()
 		mock_get_main_channel_ids.assert_called_once_with()
@@ -898,7 +1037,7 @@ class CheckAllMessagesTest(TestCase):
 																 call(mock_bot, -10087654321), call(mock_bot, -10087654321, True)])
 		self.assertEqual(mock_check_invalid_default_user_member.call_count, 6)
 		mock__check_discussion_messages.assert_has_calls([call(mock_bot, -10012345678, -10032165487),
-														  call(mock_bot, -10087456321, -10036258147)])
+														  call(mock_bot, -10087456321, -10036258147)], any_order=True)
 		self.assertEqual(mock__check_discussion_messages.call_count, 2)
 		mock_info.assert_called_once_with("Interval check completed")
 		mock_clear_updates_in_progress.assert_called_once_with()
@@ -918,7 +1057,7 @@ class CheckAllMessagesTest(TestCase):
 		interval_updating_utils._check_all_messages(mock_bot)
 		mock_get_unfinished_update_channels.assert_called_once_with()
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, None),
-												   call(mock_bot, -10087456321, None)])
+												   call(mock_bot, -10087456321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 2)
 		mock_get_finished_update_channels.assert_called_once_with()
 		mock_get_main_channel_ids.assert_called_once_with()
@@ -927,7 +1066,7 @@ class CheckAllMessagesTest(TestCase):
 																 call(mock_bot, -10087456321), call(mock_bot, -10087456321, True)])
 		self.assertEqual(mock_check_invalid_default_user_member.call_count, 4)
 		mock__check_discussion_messages.assert_has_calls([call(mock_bot, -10012345678, -10032165487),
-														  call(mock_bot, -10087456321, -10036258147)])
+														  call(mock_bot, -10087456321, -10036258147)], any_order=True)
 		self.assertEqual(mock__check_discussion_messages.call_count, 2)
 		mock_info.assert_called_once_with("Interval check completed")
 		mock_clear_updates_in_progress.assert_called_once_with()
@@ -947,7 +1086,7 @@ class CheckAllMessagesTest(TestCase):
 		interval_updating_utils._check_all_messages(mock_bot)
 		mock_get_unfinished_update_channels.assert_called_once_with()
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, None),
-												   call(mock_bot, -10087456321, None)])
+												   call(mock_bot, -10087456321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 2)
 		mock_get_finished_update_channels.assert_called_once_with()
 		mock_get_main_channel_ids.assert_called_once_with()
@@ -956,7 +1095,7 @@ class CheckAllMessagesTest(TestCase):
 																 call(mock_bot, -10087456321), call(mock_bot, -10087456321, True)])
 		self.assertEqual(mock_check_invalid_default_user_member.call_count, 4)
 		mock__check_discussion_messages.assert_has_calls([call(mock_bot, -10012345678, -10032165487),
-														  call(mock_bot, -10087456321, -10036258147)])
+														  call(mock_bot, -10087456321, -10036258147)], any_order=True)
 		self.assertEqual(mock__check_discussion_messages.call_count, 2)
 		mock_info.assert_called_once_with("Interval check completed")
 		mock_clear_updates_in_progress.assert_called_once_with()
@@ -1027,7 +1166,7 @@ class CheckAllMessagesTest(TestCase):
 		interval_updating_utils._check_all_messages(mock_bot)
 		mock_get_unfinished_update_channels.assert_called_once_with()
 		mock__check_main_messages.assert_has_calls([call(mock_bot, -10012345678, 123),
-												    call(mock_bot, -10087456321, None)])
+												    call(mock_bot, -10087456321, None)], any_order=True)
 		self.assertEqual(mock__check_main_messages.call_count, 2)
 		mock_get_finished_update_channels.assert_called_once_with()
 		mock_get_main_channel_ids.assert_called_once_with()
@@ -1036,7 +1175,7 @@ class CheckAllMessagesTest(TestCase):
 																 call(mock_bot, -10087456321), call(mock_bot, -10087456321, True)])
 		self.assertEqual(mock_check_invalid_default_user_member.call_count, 4)
 		mock__check_discussion_messages.assert_has_calls([call(mock_bot, -10012345678, -10032165487),
-														  call(mock_bot, -10087456321, -10036258147)])
+														  call(mock_bot, -10087456321, -10036258147)], any_order=True)
 		self.assertEqual(mock__check_discussion_messages.call_count, 2)
 		mock_info.assert_called_once_with("Interval check completed")
 		mock_clear_updates_in_progress.assert_called_once_with()
@@ -1098,5 +1237,162 @@ class UpdatedMessagesTest(TestCase):
 		self.assertEqual(interval_updating_utils._UPDATED_MESSAGES, {-10012345678: [1, 3, 5, 6, 7], -10087654321: [3]})
 
 
+
+@patch("logging.info")
+@patch("time.time", return_value=1745994296)
+@patch("interval_updating_utils.update_by_bot", return_value=True)
+@patch("interval_updating_utils.update_by_core", return_value=True)
+@patch("interval_updating_utils._clear_updating_channel")
+@patch("db_utils.get_dirty_ticket_ids")
+class CheckChangedMainMessagesTest(TestCase):
+	def test_few_messages(self, mock_get_dirty_ticket_ids, mock__clear_updating_channel, mock_update_by_core,
+						  mock_update_by_bot, mock_time, mock_info, *args):
+		mock_bot = Mock(spec=TeleBot)
+		main_channel_id = -10012345678
+		mock_get_dirty_ticket_ids.return_value = [3, 10, 5]
+
+		list(interval_updating_utils._check_changed_main_messages(mock_bot, main_channel_id))
+		mock_get_dirty_ticket_ids.assert_called_once_with(main_channel_id)
+		mock__clear_updating_channel.assert_called_once_with(main_channel_id)
+		mock_update_by_core.assert_not_called()
+		mock_update_by_bot.assert_called_once_with(mock_bot, main_channel_id, [10, 5, 3], dirty_before=1745994296)
+		mock_info.assert_called_once_with(f"Changed tickets check completed in {main_channel_id}, checked: 3")
+
+	def test_many_messages(self, mock_get_dirty_ticket_ids, mock__clear_updating_channel, mock_update_by_core,
+						   mock_update_by_bot, mock_time, mock_info, *args):
+		mock_bot = Mock(spec=TeleBot)
+		main_channel_id = -10012345678
+		mock_get_dirty_ticket_ids.return_value = [1, 2, 3, 5, 7, 10]
+		mock_update_by_core.return_value = False
+
+		list(interval_updating_utils._check_changed_main_messages(mock_bot, main_channel_id))
+		mock_update_by_core.assert_called_once_with(mock_bot, main_channel_id, [10, 7, 5, 3, 2, 1], dirty_before=1745994296)
+		mock_update_by_bot.assert_not_called()
+		mock_info.assert_not_called()
+
+	def test_no_messages(self, mock_get_dirty_ticket_ids, mock__clear_updating_channel, mock_update_by_core,
+						 mock_update_by_bot, mock_time, mock_info, *args):
+		mock_bot = Mock(spec=TeleBot)
+		mock_get_dirty_ticket_ids.return_value = []
+
+		list(interval_updating_utils._check_changed_main_messages(mock_bot, -10012345678))
+		mock__clear_updating_channel.assert_not_called()
+		mock_update_by_core.assert_not_called()
+		mock_update_by_bot.assert_not_called()
+		mock_info.assert_not_called()
+
+
+
+class RunChannelChecksTest(TestCase):
+	@staticmethod
+	def _create_check(name: str, parts: int, order: list):
+		for i in range(parts):
+			order.append(f"{name}{i}")
+			yield
+
+	@patch("config_utils.INTERVAL_UPDATE_CONCURRENCY", 1)
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_channels_in_turns(self):
+		order = []
+		checks = [self._create_check("a", 3, order), self._create_check("b", 1, order), self._create_check("c", 2, order)]
+
+		interval_updating_utils._run_channel_checks(checks)
+		self.assertEqual(order, ["a0", "b0", "c0", "a1", "c1", "a2"])
+
+	@patch("config_utils.INTERVAL_UPDATE_CONCURRENCY", 3)
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_concurrent(self):
+		order = []
+		checks = [self._create_check(name, 50, order) for name in "abcd"]
+
+		interval_updating_utils._run_channel_checks(checks)
+		for name in "abcd":
+			self.assertEqual([part for part in order if part[0] == name], [f"{name}{i}" for i in range(50)])
+
+	@patch("logging.exception")
+	@patch("config_utils.INTERVAL_UPDATE_CONCURRENCY", 1)
+	@patch("interval_updating_utils._STATUS", {"stop": False})
+	def test_error_in_check(self, mock_exception):
+		order = []
+
+		def failed_check():
+			order.append("failed")
+			yield
+			raise Exception("Test error")
+
+		interval_updating_utils._run_channel_checks([failed_check(), self._create_check("a", 3, order)])
+		self.assertEqual(order, ["failed", "a0", "a1", "a2"])
+		mock_exception.assert_called_once_with("Error during interval check - Test error")
+
+	@patch("config_utils.INTERVAL_UPDATE_CONCURRENCY", 2)
+	@patch("interval_updating_utils._STATUS", {"stop": True})
+	def test_stopped(self):
+		order = []
+
+		interval_updating_utils._run_channel_checks([self._create_check("a", 3, order)])
+		self.assertEqual(order, [])
+
+
+@patch("interval_updating_utils._CHECK_SLICE_SIZE", 8)
+@patch("interval_updating_utils.update_by_bot", return_value=True)
+@patch("interval_updating_utils.update_by_core", return_value=True)
+class UpdateInSlicesTest(TestCase):
+	def test_slices(self, mock_update_by_core, mock_update_by_bot, *args):
+		mock_bot = Mock(spec=TeleBot)
+		main_channel_id = -10012345678
+		main_message_ids = list(range(20, 0, -1))
+
+		update = interval_updating_utils._update_in_slices(mock_bot, main_channel_id, main_message_ids, dirty_before=5)
+		next(update)
+		mock_update_by_core.assert_called_once_with(mock_bot, main_channel_id, main_message_ids[:8], dirty_before=5)
+		with self.assertRaises(StopIteration) as context:
+			while True:
+				next(update)
+
+		self.assertTrue(context.exception.value)
+		mock_update_by_core.assert_has_calls([call(mock_bot, main_channel_id, main_message_ids[:8], dirty_before=5),
+											  call(mock_bot, main_channel_id, main_message_ids[8:16], dirty_before=5)])
+		mock_update_by_bot.assert_called_once_with(mock_bot, main_channel_id, main_message_ids[16:], dirty_before=5)
+
+	def test_failed_slice(self, mock_update_by_core, mock_update_by_bot, *args):
+		mock_bot = Mock(spec=TeleBot)
+		main_message_ids = list(range(20, 0, -1))
+		mock_update_by_core.return_value = False
+
+		update = interval_updating_utils._update_in_slices(mock_bot, -10012345678, main_message_ids)
+		with self.assertRaises(StopIteration) as context:
+			next(update)
+
+		self.assertFalse(context.exception.value)
+		mock_update_by_core.assert_called_once()
+		mock_update_by_bot.assert_not_called()
+
+
+@patch("config_utils.FULL_UPDATE_INTERVAL", 60 * 24)
+@patch("time.time", return_value=1745994296)
+@patch("db_utils.get_unfinished_update_channels", return_value={})
+class IsFullUpdateRequiredTest(TestCase):
+	@patch("config_utils.HASHTAGS_BEFORE_UPDATE", None)
+	@patch("config_utils.LAST_FULL_UPDATE_TIME", 1745994296 - 60 * 60)
+	def test_not_required(self, *args):
+		self.assertFalse(interval_updating_utils._is_full_update_required())
+
+	@patch("config_utils.HASHTAGS_BEFORE_UPDATE", None)
+	@patch("config_utils.LAST_FULL_UPDATE_TIME", 1745994296 - 60 * 60 * 25)
+	def test_interval_passed(self, *args):
+		self.assertTrue(interval_updating_utils._is_full_update_required())
+
+	@patch("config_utils.HASHTAGS_BEFORE_UPDATE", {"OPENED": "о"})
+	@patch("config_utils.LAST_FULL_UPDATE_TIME", 1745994296 - 60 * 60)
+	def test_hashtags_changed(self, *args):
+		self.assertTrue(interval_updating_utils._is_full_update_required())
+
+	@patch("config_utils.HASHTAGS_BEFORE_UPDATE", None)
+	@patch("config_utils.LAST_FULL_UPDATE_TIME", 1745994296 - 60 * 60)
+	def test_unfinished_update(self, mock_get_unfinished_update_channels, *args):
+		mock_get_unfinished_update_channels.return_value = {-10012345678: 25}
+		self.assertTrue(interval_updating_utils._is_full_update_required())
+
+
 if __name__ == "__main__":
 	main()
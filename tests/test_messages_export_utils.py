@@ -7,6 +7,13 @@ import messages_export_utils
 from tests import test_helper
 
 
+def failed_export(*args):
+	raise ConnectionError("Test error")
+	yield
+
+
+@patch("db_utils.insert_or_update_export_checkpoint")
+@patch("db_utils.get_export_checkpoint", return_value=None)
 @patch("db_utils.get_last_message_id")
 @patch("messages_export_utils.export_messages")
 @patch("db_utils.delete_comment_message")
@@ -47,9 +54,10 @@ class ExportChatCommentsTest(TestCase):
 		mock_message6.sender_chat = mock_message8.sender_chat = None
 		mock_message9.empty = mock_message10.empty = mock_message11.empty = mock_message12.empty = mock_message13.empty = True
 		mock_message6.from_user = mock_message8.from_user = mock_user
-		mock_export_messages.return_value = [mock_message1, mock_message2, mock_message3, mock_message4,
-											 mock_message5, mock_message6, mock_message7, mock_message8,
-											 mock_message9, mock_message10, mock_message11, mock_message12, mock_message13]
+		mock_export_messages.return_value = iter([(last_message_id, [mock_message1, mock_message2, mock_message3, mock_message4,
+																	 mock_message5, mock_message6, mock_message7, mock_message8,
+																	 mock_message9, mock_message10, mock_message11, mock_message12,
+																	 mock_message13])])
 		manager = Mock()
 		manager.attach_mock(mock_delete_comment_message, 'a')
 		manager.attach_mock(mock_insert_comment_message, 'b')
@@ -73,7 +81,7 @@ class ExportChatCommentsTest(TestCase):
 
 		result = messages_export_utils.export_chat_comments(discussion_chat_id)
 		mock_get_last_message_id.assert_called_once_with(discussion_chat_id)
-		mock_export_messages.assert_called_once_with(discussion_chat_id, last_message_id)
+		mock_export_messages.assert_called_once_with(discussion_chat_id, last_message_id, 1)
 		self.assertEqual(manager.mock_calls, expected_calls)
 		self.assertTrue(result)
 
@@ -97,17 +105,19 @@ class ExportChatCommentsTest(TestCase):
 		discussion_chat_id = -10012345678
 		last_message_id = 124
 		mock_get_last_message_id.return_value = last_message_id
-		mock_export_messages.return_value = None
+		mock_export_messages.side_effect = failed_export
 
 		result = messages_export_utils.export_chat_comments(discussion_chat_id)
 		mock_get_last_message_id.assert_called_once_with(discussion_chat_id)
-		mock_export_messages.assert_called_once_with(discussion_chat_id, last_message_id)
+		mock_export_messages.assert_called_once_with(discussion_chat_id, last_message_id, 1)
 		mock_insert_comment_deleted_message.assert_not_called()
 		mock_insert_comment_message.assert_not_called()
 		mock_info.assert_called_once_with(f"Can't export messages in {discussion_chat_id}, export skipped")
 		self.assertFalse(result)
 
 
+@patch("db_utils.insert_or_update_export_checkpoint")
+@patch("db_utils.get_export_checkpoint", return_value=None)
 @patch("db_utils.insert_main_channel_message")
 @patch("user_utils.find_user_by_signature", side_effect=lambda auth: auth)
 @patch("messages_export_utils.export_messages")
@@ -125,11 +135,11 @@ class ExportMainChannelMessages(TestCase):
 		for message_id in message_ids:
 			messages.append(Mock(id=message_id, author_signature=message_id * 2 if not message_id % 2 else None,
 								 empty=None if message_id != 35 else True, service=None if message_id != 24 else True))
-		mock_export_messages.return_value = messages
+		mock_export_messages.return_value = iter([(last_message_id, messages)])
 
 		result = messages_export_utils.export_main_channel_messages(channel_id)
 		mock_get_last_message_id.assert_called_once_with(channel_id)
-		mock_export_messages.assert_called_once_with(channel_id, last_message_id)
+		mock_export_messages.assert_called_once_with(channel_id, last_message_id, 1)
 		mock_find_user_by_signature.assert_has_calls([call(24), call(244), call(248)])
 		self.assertEqual(mock_find_user_by_signature.call_count, 3)
 		mock_insert_main_channel_message.assert_has_calls([call(channel_id, 12, 24), call(channel_id, 25, None),
@@ -159,16 +169,17 @@ class ExportMainChannelMessages(TestCase):
 		channel_id = -10012345678
 		last_message_id = 124
 		mock_get_last_message_id.return_value = last_message_id
-		mock_export_messages.return_value = None
+		mock_export_messages.side_effect = failed_export
 
 		result = messages_export_utils.export_main_channel_messages(channel_id)
 		mock_get_last_message_id.assert_called_once_with(channel_id)
-		mock_export_messages.assert_called_once_with(channel_id, last_message_id)
+		mock_export_messages.assert_called_once_with(channel_id, last_message_id, 1)
 		mock_find_user_by_signature.assert_not_called()
 		mock_insert_main_channel_message.assert_not_called()
 		self.assertFalse(result)
 
 
+@patch("db_utils.delete_export_checkpoint")
 @patch("config_utils.update_config")
 @patch("messages_export_utils.export_main_channel_messages")
 @patch("logging.info")
@@ -181,11 +192,11 @@ class ExportMainChannels(TestCase):
 		messages_export_utils.export_main_channels()
 		mock_get_main_channel_ids.assert_called_once()
 		mock_info.assert_has_calls([call("Exporting messages from -10012345678"),
-									call("Successfully exported messages from -10012345678"),
 									call("Exporting messages from -10012378456"),
+									call("Successfully exported messages from -10012345678"),
 									call("Successfully exported messages from -10012378456")])
 		self.assertEqual(mock_info.call_count, 4)
-		mock_export_main_channel_messages.assert_has_calls([call(-10012345678), call(-10012378456)])
+		mock_export_main_channel_messages.assert_has_calls([call(-10012345678), call(-10012378456)], any_order=True)
 		self.assertEqual(mock_export_main_channel_messages.call_count, 2)
 		mock_update_config.assert_has_calls([call({"EXPORTED_CHATS": [-10087654321, -10012345678, -10012378456]}),
 											 call({"EXPORTED_CHATS": [-10087654321, -10012345678, -10012378456]})])
@@ -201,29 +212,156 @@ class ExportMainChannels(TestCase):
 		mock_info.assert_has_calls([call("Exporting messages from -10012345678"),
 									call("Exporting messages from -10012378456")])
 		self.assertEqual(mock_info.call_count, 2)
-		mock_export_main_channel_messages.assert_has_calls([call(-10012345678), call(-10012378456)])
+		mock_export_main_channel_messages.assert_has_calls([call(-10012345678), call(-10012378456)], any_order=True)
 		self.assertEqual(mock_export_main_channel_messages.call_count, 2)
 		mock_update_config.assert_not_called()
 		self.assertEqual(messages_export_utils.EXPORTED_CHATS, [-10087654321])
 
 
-@patch("core_api.get_messages")
+@patch("db_utils.delete_export_checkpoint")
+@patch("config_utils.update_config")
+@patch("messages_export_utils.export_chat_comments")
+@patch("logging.info")
+@patch("messages_export_utils.DISCUSSION_CHAT_DATA", {"-10012345678": -10011111111, "-10087654321": -10022222222,
+													  "-10012378456": None})
+class ExportCommentsFromDiscussionChats(TestCase):
+	@patch("messages_export_utils.EXPORTED_CHATS", [])
+	def test_partially_exported(self, mock_info, mock_export_chat_comments, mock_update_config,
+								mock_delete_export_checkpoint, *args):
+		mock_export_chat_comments.side_effect = lambda chat_id: chat_id == -10022222222
+
+		messages_export_utils.export_comments_from_discussion_chats()
+		mock_export_chat_comments.assert_has_calls([call(-10011111111), call(-10022222222)], any_order=True)
+		self.assertEqual(mock_export_chat_comments.call_count, 2)
+		mock_info.assert_has_calls([call("Exporting comments from -10011111111"),
+									call("Exporting comments from -10022222222"),
+									call("Successfully exported comments from -10022222222")])
+		self.assertEqual(mock_info.call_count, 3)
+		mock_update_config.assert_called_once_with({"EXPORTED_CHATS": [-10022222222]})
+		mock_delete_export_checkpoint.assert_called_once_with(-10022222222)
+		self.assertEqual(messages_export_utils.EXPORTED_CHATS, [-10022222222])
+
+
+@patch("core_api.stream_messages")
 class ExportMessagesTest(TestCase):
-	def test_default(self, mock_get_messages, *args):
+	def test_default(self, mock_stream_messages, *args):
 		channel_id = -10012345678
-		last_message_id = 12
+		mock_stream_messages.return_value = iter([(5, [1, 2, 3, 4, 5]), (12, [6, 7, 8, 9, 10, 11, 12])])
+
+		result = list(messages_export_utils.export_messages(channel_id, 12))
+		mock_stream_messages.assert_called_once_with(channel_id, range(1, 13), messages_export_utils._EXPORT_BATCH_SIZE)
+		self.assertEqual(result, [(5, [1, 2, 3, 4, 5]), (12, [6, 7, 8, 9, 10, 11, 12])])
+
+	def test_first_message_id(self, mock_stream_messages, *args):
+		channel_id = -10012345678
+		mock_stream_messages.return_value = iter([(2, [10, 11]), (3, [12])])
+
+		result = list(messages_export_utils.export_messages(channel_id, 12, 10))
+		mock_stream_messages.assert_called_once_with(channel_id, range(10, 13), messages_export_utils._EXPORT_BATCH_SIZE)
+		self.assertEqual(result, [(11, [10, 11]), (12, [12])])
+
+
+@patch("db_utils.insert_or_update_export_checkpoint")
+@patch("db_utils.get_export_checkpoint")
+@patch("messages_export_utils.export_messages")
+@patch("logging.info")
+class ExportChatMessagesTest(TestCase):
+	def test_resume_from_checkpoint(self, mock_info, mock_export_messages, mock_get_export_checkpoint,
+									mock_insert_or_update_export_checkpoint, *args):
+		chat_id = -10012345678
+		mock_get_export_checkpoint.return_value = 500
+		mock_export_messages.return_value = iter([(550, [501]), (600, [551])])
+		mock_save_messages = Mock()
+
+		manager = Mock()
+		manager.attach_mock(mock_save_messages, "a")
+		manager.attach_mock(mock_insert_or_update_export_checkpoint, "b")
+
+		result = messages_export_utils.export_chat_messages(chat_id, 600, mock_save_messages)
+		self.assertTrue(result)
+		mock_export_messages.assert_called_once_with(chat_id, 600, 501)
+		self.assertEqual(manager.mock_calls, [
+			call.a([501]),
+			call.b(chat_id, 550),
+			call.a([551]),
+			call.b(chat_id, 600),
+		])
+		mock_info.assert_called_once_with(f"Continuing export of {chat_id} from message 501")
+
+	@patch("logging.error")
+	def test_interrupted(self, mock_error, mock_info, mock_export_messages, mock_get_export_checkpoint,
+						 mock_insert_or_update_export_checkpoint, *args):
+		chat_id = -10012345678
+		mock_get_export_checkpoint.return_value = None
+
+		def stream(*args):
+			yield 50, [1]
+			raise ConnectionError("Test error")
+
+		mock_export_messages.side_effect = stream
+		mock_save_messages = Mock()
+
+		result = messages_export_utils.export_chat_messages(chat_id, 1200, mock_save_messages)
+		self.assertFalse(result)
+		mock_export_messages.assert_called_once_with(chat_id, 1200, 1)
+		mock_save_messages.assert_called_once_with([1])
+		mock_insert_or_update_export_checkpoint.assert_called_once_with(chat_id, 50)
+		mock_info.assert_not_called()
+		mock_error.assert_called_once_with(f"Export of {chat_id} is interrupted - Test error")
+
+	def test_save_error(self, mock_info, mock_export_messages, mock_get_export_checkpoint,
+						mock_insert_or_update_export_checkpoint, *args):
+		chat_id = -10012345678
+		mock_get_export_checkpoint.return_value = None
+		mock_export_messages.return_value = iter([(50, [1])])
+		mock_save_messages = Mock(side_effect=ValueError("Test error"))
+
+		with self.assertRaises(ValueError):
+			messages_export_utils.export_chat_messages(chat_id, 1200, mock_save_messages)
+		mock_insert_or_update_export_checkpoint.assert_not_called()
 
-		result = messages_export_utils.export_messages(channel_id, last_message_id)
-		mock_get_messages.assert_called_once_with(channel_id, last_message_id, messages_export_utils._EXPORT_BATCH_SIZE)
-		self.assertEqual(result, mock_get_messages.return_value)
 
 @patch("messages_export_utils.export_comments_from_discussion_chats")
 @patch("messages_export_utils.export_main_channels")
 class StartExportingTest(TestCase):
 	def test_default(self, mock_export_comments_from_discussion_chats, mock_export_main_channels):
 		messages_export_utils.start_exporting()
+		messages_export_utils._EXPORT_THREAD.join()
 		mock_export_comments_from_discussion_chats.assert_called_once_with()
 		mock_export_main_channels.assert_called_once_with()
 
+	def test_on_finished(self, mock_export_comments_from_discussion_chats, mock_export_main_channels):
+		manager = Mock()
+		manager.attach_mock(mock_export_comments_from_discussion_chats, "a")
+		manager.attach_mock(mock_export_main_channels, "b")
+		mock_on_finished = Mock()
+		manager.attach_mock(mock_on_finished, "c")
+
+		messages_export_utils.start_exporting(mock_on_finished)
+		messages_export_utils._EXPORT_THREAD.join()
+		self.assertEqual(manager.mock_calls, [call.b(), call.a(), call.c()])
+
+	@patch("logging.exception")
+	def test_on_finished_after_error(self, mock_exception, mock_export_comments_from_discussion_chats,
+									 mock_export_main_channels):
+		mock_export_main_channels.side_effect = ValueError("Test error")
+		mock_on_finished = Mock()
+
+		messages_export_utils.start_exporting(mock_on_finished)
+		messages_export_utils._EXPORT_THREAD.join()
+		mock_exception.assert_called_once_with("Error during exporting messages - Test error")
+		mock_on_finished.assert_called_once_with()
+
+
+@patch("db_utils.get_main_channel_ids", return_value=[-10012345678, -10087654321])
+class IsMainChannelsExportedTest(TestCase):
+	@patch("messages_export_utils.EXPORTED_CHATS", [-10087654321, -10012345678, -10012378456])
+	def test_exported(self, *args):
+		self.assertTrue(messages_export_utils.is_main_channels_exported())
+
+	@patch("messages_export_utils.EXPORTED_CHATS", [-10087654321, -10012378456])
+	def test_not_exported(self, *args):
+		self.assertFalse(messages_export_utils.is_main_channels_exported())
+
 if __name__ == "__main__":
 	main()
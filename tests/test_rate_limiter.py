@@ -0,0 +1,151 @@
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+
+import rate_limiter
+
+
+@patch("time.monotonic", return_value=100)
+class TokenBucketTest(TestCase):
+	def test_burst(self, mock_monotonic, *args):
+		bucket = rate_limiter.TokenBucket(2, 3)
+
+		waits = [bucket.reserve(100) for _ in range(5)]
+		self.assertEqual(waits, [0, 0, 0, 0.5, 1])
+
+	def test_refill(self, mock_monotonic, *args):
+		bucket = rate_limiter.TokenBucket(2, 3)
+		for _ in range(3):
+			bucket.reserve(100)
+
+		self.assertEqual(bucket.reserve(101), 0)
+		self.assertEqual(bucket.reserve(101), 0)
+		self.assertEqual(bucket.reserve(101), 0.5)
+
+	def test_refill_is_limited_by_capacity(self, mock_monotonic, *args):
+		bucket = rate_limiter.TokenBucket(2, 3)
+		bucket.reserve(100)
+
+		bucket.reserve(200)
+		self.assertEqual(bucket.tokens, 2)
+
+	def test_penalize(self, mock_monotonic, *args):
+		bucket = rate_limiter.TokenBucket(2, 3)
+
+		bucket.penalize(100, 10)
+		self.assertEqual(bucket.rate, 1)
+		self.assertEqual(bucket.reserve(100), 11)
+		self.assertEqual(bucket.reserve(105), 7)
+
+	def test_penalize_min_rate(self, mock_monotonic, *args):
+		bucket = rate_limiter.TokenBucket(0.06, 1)
+
+		bucket.penalize(100, 0)
+		self.assertEqual(bucket.rate, rate_limiter._MIN_RATE)
+
+	def test_rate_recovery(self, mock_monotonic, *args):
+		bucket = rate_limiter.TokenBucket(2, 3)
+		bucket.penalize(100, 0)
+
+		bucket.reserve(110)
+		self.assertAlmostEqual(bucket.rate, 1.2)
+		bucket.reserve(1000)
+		self.assertEqual(bucket.rate, 2)
+
+
+@patch("time.monotonic", return_value=100)
+class RateLimiterTest(TestCase):
+	def test_chat_limit(self, *args):
+		limiter = rate_limiter.RateLimiter(30, 1, 2)
+
+		waits = [limiter.reserve(-10012345678) for _ in range(3)]
+		self.assertEqual(waits, [0, 0, 1])
+		self.assertEqual(limiter.reserve(-10087654321), 0)
+
+	def test_global_limit(self, *args):
+		limiter = rate_limiter.RateLimiter(2, 1, 20)
+
+		waits = [limiter.reserve(chat_id) for chat_id in range(1, 5)]
+		self.assertEqual(waits, [0, 0, 0.5, 1])
+
+	def test_chat_id_types(self, *args):
+		limiter = rate_limiter.RateLimiter(30, 1, 1)
+
+		limiter.reserve(-10012345678)
+		self.assertEqual(limiter.reserve("-10012345678"), 1)
+
+	@patch("logging.warning")
+	def test_report_retry_after_chat(self, mock_warning, *args):
+		limiter = rate_limiter.RateLimiter(30, 1, 20)
+
+		limiter.report_retry_after(15, -10012345678)
+		self.assertEqual(limiter.reserve(-10012345678), 15 + 2)
+		self.assertEqual(limiter.reserve(-10087654321), 0)
+		mock_warning.assert_called_once_with("Too many requests to -10012345678, retry after 15")
+
+	@patch("logging.warning")
+	def test_report_retry_after_global(self, mock_warning, *args):
+		limiter = rate_limiter.RateLimiter(30, 1, 20)
+
+		limiter.report_retry_after(15)
+		self.assertAlmostEqual(limiter.reserve(-10087654321), 15 + 1 / 15)
+		mock_warning.assert_called_once_with("Too many requests, retry after 15")
+
+	@patch("time.sleep")
+	def test_acquire(self, mock_sleep, *args):
+		limiter = rate_limiter.RateLimiter(30, 1, 1)
+
+		limiter.acquire(-10012345678)
+		mock_sleep.assert_not_called()
+		limiter.acquire(-10012345678)
+		mock_sleep.assert_called_once_with(1)
+
+
+@patch("telebot.apihelper._get_req_session")
+@patch("rate_limiter.LIMITER")
+class SendBotApiRequestTest(TestCase):
+	def test_default(self, mock_limiter, mock__get_req_session, *args):
+		mock_response = Mock(status_code=200)
+		mock__get_req_session.return_value.request.return_value = mock_response
+		url = "https://api.telegram.org/bot123:token/sendMessage"
+		params = {"chat_id": -10012345678, "text": "text"}
+
+		result = rate_limiter.send_bot_api_request("post", url, params=params, files=None)
+		mock_limiter.acquire.assert_called_once_with(-10012345678)
+		mock__get_req_session.return_value.request.assert_called_once_with("post", url, params=params, files=None)
+		mock_limiter.report_retry_after.assert_not_called()
+		self.assertEqual(result, mock_response)
+
+	def test_too_many_requests(self, mock_limiter, mock__get_req_session, *args):
+		mock_response = Mock(status_code=429)
+		mock_response.json.return_value = {"ok": False, "error_code": 429, "parameters": {"retry_after": 12}}
+		mock__get_req_session.return_value.request.return_value = mock_response
+		url = "https://api.telegram.org/bot123:token/editMessageReplyMarkup"
+
+		result = rate_limiter.send_bot_api_request("post", url, params={"chat_id": -10012345678})
+		mock_limiter.acquire.assert_called_once_with(-10012345678)
+		mock_limiter.report_retry_after.assert_called_once_with(12, -10012345678)
+		self.assertEqual(result, mock_response)
+
+	def test_without_chat(self, mock_limiter, mock__get_req_session, *args):
+		url = "https://api.telegram.org/bot123:token/answerCallbackQuery"
+
+		rate_limiter.send_bot_api_request("post", url, params=None)
+		mock_limiter.acquire.assert_called_once_with(None)
+
+	def test_get_updates(self, mock_limiter, mock__get_req_session, *args):
+		url = "https://api.telegram.org/bot123:token/getUpdates"
+
+		rate_limiter.send_bot_api_request("get", url, params={"timeout": 20})
+		mock_limiter.acquire.assert_not_called()
+
+
+class InstallBotApiLimiterTest(TestCase):
+	@patch("telebot.apihelper.CUSTOM_REQUEST_SENDER", None)
+	def test_install(self):
+		self.assertFalse(rate_limiter.is_bot_api_limiter_installed())
+		rate_limiter.install_bot_api_limiter()
+		self.assertTrue(rate_limiter.is_bot_api_limiter_installed())
+
+
+if __name__ == "__main__":
+	main()
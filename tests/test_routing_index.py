@@ -0,0 +1,81 @@
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import db_utils
+import routing_index
+
+
+def create_channel_data(settings, priorities):
+	return {"settings": settings, "priorities": priorities, "user_id": None}
+
+
+@patch("db_utils.get_custom_hashtag", return_value=None)
+@patch("db_utils.get_custom_hashtags", return_value={})
+@patch("db_utils.CHANNEL_REGISTRY")
+class RoutingIndexTest(TestCase):
+	def test_lookup(self, mock_channel_registry, *args):
+		mock_channel_registry.get_individual_channels.return_value = [
+			(1, create_channel_data('{"due": true, "assigned": ["AA"], "cc": ["BB"]}', "1,2")),
+			(2, create_channel_data('{"due": true, "reported": ["CC"]}', "2")),
+			(3, create_channel_data('{"deferred": true, "assigned": ["AA"]}', "2")),
+			(4, create_channel_data(None, None)),
+		]
+		index = routing_index.RoutingIndex()
+
+		self.assertEqual(index.get_subchannel_ids(2, False, "AA", [], [], []), {1})
+		self.assertEqual(index.get_subchannel_ids(2, False, "DD", ["BB"], ["CC"], []), {1, 2})
+		self.assertEqual(index.get_subchannel_ids(2, True, "AA", [], [], []), {3})
+		self.assertEqual(index.get_subchannel_ids(3, False, "AA", ["BB"], ["CC"], []), set())
+		self.assertEqual(index.get_subchannel_ids(None, False, None, [], [], []), set())
+		mock_channel_registry.get_individual_channels.assert_called_once_with()
+
+	def test_channel_changed(self, mock_channel_registry, mock_get_custom_hashtags, mock_get_custom_hashtag, *args):
+		mock_channel_registry.get_individual_channels.return_value = [
+			(1, create_channel_data('{"due": true, "assigned": ["AA"]}', "1")),
+			(2, create_channel_data('{"due": true, "assigned": ["AA"]}', "1")),
+		]
+		index = routing_index.RoutingIndex()
+		self.assertEqual(index.get_subchannel_ids(1, False, "AA", [], [], []), {1, 2})
+
+		mock_channel_registry.get_individual_channel.side_effect = lambda channel_id: {
+			1: create_channel_data('{"due": true, "assigned": ["BB"]}', "1"),
+			2: create_channel_data('{"due": true, "assigned": ["AA"]}', "1"),
+		}.get(channel_id)
+		mock_get_custom_hashtag.side_effect = lambda channel_id: "#project" if channel_id == 2 else None
+		index.on_channel_changed(1)
+		index.on_channel_changed(2)
+		self.assertEqual(index.get_subchannel_ids(1, False, "AA", [], [], []), set())
+		self.assertEqual(index.get_subchannel_ids(1, False, "AA", [], [], ["#project"]), {2})
+		self.assertEqual(index.get_subchannel_ids(1, False, "BB", [], [], []), {1})
+
+		mock_channel_registry.get_individual_channel.side_effect = lambda channel_id: None
+		index.on_channel_changed(1)
+		self.assertEqual(index.get_subchannel_ids(1, False, "BB", [], [], []), set())
+		mock_channel_registry.get_individual_channels.assert_called_once_with()
+
+	def test_rebuild(self, mock_channel_registry, *args):
+		mock_channel_registry.get_individual_channels.return_value = [(1, create_channel_data('{"due": true, "assigned": ["AA"]}', "1"))]
+		index = routing_index.RoutingIndex()
+		self.assertEqual(index.get_subchannel_ids(1, False, "AA", [], [], []), {1})
+
+		mock_channel_registry.get_individual_channels.return_value = [(2, create_channel_data('{"due": true, "assigned": ["AA"]}', "1"))]
+		index.on_channel_changed()
+		self.assertEqual(index.get_subchannel_ids(1, False, "AA", [], [], []), {2})
+		self.assertEqual(mock_channel_registry.get_individual_channels.call_count, 2)
+
+
+class ChannelRegistryListenerTest(TestCase):
+	def test_notify(self):
+		registry = db_utils.ChannelRegistry()
+		changed_channel_ids = []
+		registry.add_listener(changed_channel_ids.append)
+
+		registry.add_individual_channel(-1001, "{}", None)
+		registry.update_individual_channel(-1001, settings='{"due": true}')
+		registry.remove_individual_channel(-1001)
+		registry.invalidate()
+		self.assertEqual(changed_channel_ids, [-1001, -1001, -1001, None])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,151 @@
+import random
+import threading
+import time
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+
+from telebot.apihelper import ApiTelegramException
+
+import threading_utils
+
+
+class FanOutTest(TestCase):
+  def test_results_order(self):
+    result = threading_utils.fan_out(lambda item: item * 2, [3, 1, 2], 3)
+    self.assertEqual(result, [6, 2, 4])
+
+  def test_concurrent_calls(self):
+    barrier = threading.Barrier(3, timeout=5)
+    result = threading_utils.fan_out(lambda item: barrier.wait() is not None and item, [1, 2, 3], 3)
+    self.assertEqual(result, [1, 2, 3])
+
+  def test_single_worker(self):
+    thread_names = threading_utils.fan_out(lambda item: threading.current_thread().name, [1, 2], 1)
+    self.assertEqual(thread_names, [threading.current_thread().name] * 2)
+    self.assertEqual(threading_utils.fan_out(lambda item: item, [], 4), [])
+
+  def test_error_after_all_calls(self):
+    finished_items = []
+
+    def func(item):
+      if item == 1:
+        raise ValueError("error")
+      time.sleep(0.05)
+      finished_items.append(item)
+
+    with self.assertRaises(ValueError):
+      threading_utils.fan_out(func, [1, 2, 3], 3)
+    self.assertEqual(sorted(finished_items), [2, 3])
+
+
+class KeyedLockManagerTest(TestCase):
+  def test_reentrant(self):
+    locks = threading_utils.KeyedLockManager()
+    with locks.lock((0, 1)):
+      with locks.lock((0, 1), (1, 5)):
+        self.assertEqual(len(locks), 2)
+      self.assertEqual(len(locks), 1)
+    self.assertEqual(len(locks), 0)
+
+  def test_acquisition_order(self):
+    locks = threading_utils.KeyedLockManager()
+    with locks.lock((1, 5)):
+      with self.assertRaises(RuntimeError):
+        with locks.lock((0, 1)):
+          pass
+      with locks.lock((1, 5), (1, 6)):
+        pass
+    self.assertEqual(len(locks), 0)
+
+  def test_independent_keys(self):
+    locks = threading_utils.KeyedLockManager()
+    barrier = threading.Barrier(2, timeout=5)
+
+    def hold_lock(key):
+      with locks.lock(key):
+        barrier.wait()
+
+    threads = [threading.Thread(target=hold_lock, args=((0, key),)) for key in [1, 2]]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertFalse(barrier.broken)
+
+  def test_stress(self):
+    locks = threading_utils.KeyedLockManager()
+    counters = {key: 0 for key in range(5)}
+    expected = {key: 0 for key in range(5)}
+    expected_lock = threading.Lock()
+
+    def worker(seed):
+      rng = random.Random(seed)
+      for _ in range(200):
+        keys = rng.sample(sorted(counters), rng.randint(1, 3))
+        with locks.lock(*keys):
+          for key in keys:
+            value = counters[key]
+            time.sleep(0)
+            counters[key] = value + 1
+        with expected_lock:
+          for key in keys:
+            expected[key] += 1
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(timeout=30)
+      self.assertFalse(thread.is_alive())
+    self.assertEqual(counters, expected)
+    self.assertEqual(len(locks), 0)
+
+
+def create_too_many_requests_error(description):
+  return ApiTelegramException("sendMessage", None, {"error_code": 429, "description": description})
+
+
+@patch("time.sleep")
+class TimeoutErrorLockTest(TestCase):
+  @patch("rate_limiter.is_bot_api_limiter_installed", return_value=True)
+  def test_wait_in_limiter(self, mock_limiter_installed, mock_sleep):
+    func = Mock(__name__="func", side_effect=[create_too_many_requests_error("Too Many Requests: retry after 3"), 1])
+
+    self.assertEqual(threading_utils.timeout_error_lock(func)(), 1)
+    self.assertEqual(func.call_count, 2)
+    mock_sleep.assert_not_called()
+
+  @patch("rate_limiter.is_bot_api_limiter_installed", return_value=False)
+  def test_limiter_not_installed(self, mock_limiter_installed, mock_sleep):
+    func = Mock(__name__="func", side_effect=[create_too_many_requests_error("Too Many Requests: retry after 3"), 1])
+
+    self.assertEqual(threading_utils.timeout_error_lock(func)(), 1)
+    mock_sleep.assert_called_once_with(3)
+
+  @patch("rate_limiter.is_bot_api_limiter_installed", return_value=True)
+  def test_missing_retry_time(self, mock_limiter_installed, mock_sleep):
+    func = Mock(__name__="func", side_effect=[create_too_many_requests_error("Too Many Requests"), 1])
+
+    self.assertEqual(threading_utils.timeout_error_lock(func)(), 1)
+    mock_sleep.assert_called_once_with(threading_utils._DEFAULT_RETRY_AFTER)
+
+  @patch("rate_limiter.is_bot_api_limiter_installed", return_value=True)
+  def test_retries_limit(self, mock_limiter_installed, mock_sleep):
+    func = Mock(__name__="func", side_effect=create_too_many_requests_error("Too Many Requests"))
+
+    with self.assertRaises(ApiTelegramException):
+      threading_utils.timeout_error_lock(func)()
+    self.assertEqual(func.call_count, threading_utils._TOO_MANY_REQUESTS_RETRIES + 1)
+
+  def test_other_error(self, mock_sleep):
+    error = ApiTelegramException("sendMessage", None, {"error_code": 400, "description": "Bad Request"})
+    func = Mock(__name__="func", side_effect=error)
+
+    with self.assertRaises(ApiTelegramException):
+      threading_utils.timeout_error_lock(func)()
+    func.assert_called_once_with()
+    mock_sleep.assert_not_called()
+
+
+if __name__ == "__main__":
+  main()
@@ -135,6 +135,21 @@ class MembersChannelTest(TestCase):
 		mock_get_members.assert_called_once_with(channel_ids)
 		self.assertEqual(user_utils.MEMBER_CACHE[channel_ids[0]]["user_ids"], ids)
 
+	@patch("user_utils.MEMBER_CACHE", {-10012345678: {"user_ids": [12345, 23465], "time": 1745923296}})
+	@patch("user_utils._MEMBERS_LISTENERS", [])
+	def test_set_members_channel_listeners(self, mock_get_members, *args):
+		channel_ids = [-10012345678]
+		changed_channel_ids = []
+		user_utils.add_members_listener(changed_channel_ids.append)
+
+		mock_get_members.return_value = {channel_ids[0]: [Mock(id=i) for i in [23465, 12345]]}
+		user_utils.set_member_ids_channels(channel_ids)
+		self.assertEqual(changed_channel_ids, [])
+
+		mock_get_members.return_value = {channel_ids[0]: [Mock(id=i) for i in [12345]]}
+		user_utils.set_member_ids_channels(channel_ids)
+		self.assertEqual(changed_channel_ids, channel_ids)
+
 	@patch("user_utils.MEMBER_CACHE", {-10012345678: {"user_ids": [12345, 23465, 13508], "time": 1745923296}})
 	def test_set_members_channel_no_members(self, mock_get_members, *args):
 		channel_ids = [-10012345678]
@@ -277,6 +292,7 @@ class CheckMembersOnMainChannelsTest(TestCase):
 
 @patch("config_utils.DISCUSSION_CHAT_DATA", {"-10012345678": -10087654321})
 @patch("config_utils.USER_TAGS", {"AA": 12345, "BB": 48615, "CC": 189735, "DD": 48615})
+@patch("db_utils.mark_channel_tickets_dirty")
 @patch("db_utils.is_main_channel_exists", side_effect=lambda channel: channel in [-10012345678, -10012345654])
 @patch("db_utils.is_individual_channel_exists", side_effect=lambda channel: channel == -10012378456)
 @patch("user_utils.insert_user_reference")
@@ -519,12 +535,13 @@ class CheckNewMemberTest(TestCase):
 		mock_insert_user_reference.assert_not_called()
 
 
+@patch("db_utils.mark_channel_tickets_dirty")
 @patch("db_utils.is_main_channel_exists", side_effect=lambda channel: channel == -10012345678)
 @patch("db_utils.is_individual_channel_exists", side_effect=lambda channel: channel == -10087654321)
 @patch("user_utils.set_member_ids_channels")
 class UpdateDataOnMemberChangeTest(TestCase):
 	def test_workspace_add(self, mock_set_member_ids_channels, mock_is_individual_channel_exists,
-						   mock_is_main_channel_exists, *args):
+						   mock_is_main_channel_exists, mock_mark_channel_tickets_dirty, *args):
 		channel_id = -10012345678
 		user_id = 123487
 		mock_user = Mock(id=user_id)
@@ -539,9 +556,10 @@ class UpdateDataOnMemberChangeTest(TestCase):
 		mock_is_main_channel_exists.assert_called_once_with(channel_id)
 		mock_is_individual_channel_exists.assert_not_called()
 		mock_set_member_ids_channels.assert_called_once_with([channel_id])
+		mock_mark_channel_tickets_dirty.assert_called_once_with(channel_id)
 
 	def test_private_channel_add(self, mock_set_member_ids_channels, mock_is_individual_channel_exists,
-								 mock_is_main_channel_exists, *args):
+								 mock_is_main_channel_exists, mock_mark_channel_tickets_dirty, *args):
 		channel_id = -10087654321
 		user_id = 123487
 		mock_user = Mock(id=user_id)
@@ -556,6 +574,7 @@ class UpdateDataOnMemberChangeTest(TestCase):
 		mock_is_main_channel_exists.assert_called_once_with(channel_id)
 		mock_is_individual_channel_exists.assert_called_once_with(channel_id)
 		mock_set_member_ids_channels.assert_called_once_with([channel_id])
+		mock_mark_channel_tickets_dirty.assert_not_called()
 
 	def test_other_channel_add(self, mock_set_member_ids_channels, mock_is_individual_channel_exists,
 							   mock_is_main_channel_exists, *args):
@@ -626,7 +645,7 @@ class UpdateDataOnMemberChangeTest(TestCase):
 		mock_set_member_ids_channels.assert_not_called()
 
 	def test_workspace_remove(self, mock_set_member_ids_channels, mock_is_individual_channel_exists,
-							  mock_is_main_channel_exists, *args):
+							  mock_is_main_channel_exists, mock_mark_channel_tickets_dirty, *args):
 		channel_id = -10012345678
 		user_id = 123487
 		mock_user = Mock(id=user_id)
@@ -642,6 +661,7 @@ class UpdateDataOnMemberChangeTest(TestCase):
 		mock_is_main_channel_exists.assert_called_once_with(channel_id)
 		mock_is_individual_channel_exists.assert_not_called()
 		mock_set_member_ids_channels.assert_called_once_with([channel_id])
+		mock_mark_channel_tickets_dirty.assert_called_once_with(channel_id)
 
 	def test_private_channel_remove(self, mock_set_member_ids_channels, mock_is_individual_channel_exists,
 									mock_is_main_channel_exists, *args):
@@ -844,6 +864,18 @@ class GetUserTagsTest(TestCase):
 		mock_get_member_ids_channel.assert_called_once_with(channel_id)
 		self.assertEqual(result, {"AA": 1234, "BB": 38485, "EE": 1564, "NN": 6546})
 
+	def test_snapshot(self, mock_get_member_ids_channel, *args):
+		channel_id = -10012345678
+		with user_utils.user_tags_snapshot():
+			result = user_utils.get_user_tags(channel_id)
+			with user_utils.user_tags_snapshot():
+				self.assertIs(user_utils.get_user_tags(channel_id), result)
+			self.assertIs(user_utils.get_user_tags(channel_id), result)
+		mock_get_member_ids_channel.assert_called_once_with(channel_id)
+
+		self.assertEqual(user_utils.get_user_tags(channel_id), result)
+		self.assertEqual(mock_get_member_ids_channel.call_count, 2)
+
 	def test_get_with_channel_and_empty_tags(self, mock_get_member_ids_channel, *args):
 		config_utils.USER_TAGS = {}
 		channel_id = -10012345678
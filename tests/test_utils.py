@@ -1,9 +1,16 @@
+import datetime
+import json
+import threading
 from unittest import TestCase, main
 from unittest.mock import Mock, patch, call
 
+import pyrogram
+from pyrogram.enums import ChatType, MessageEntityType
 from pyrogram.types import InlineKeyboardMarkup
 from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
 from telebot.types import MessageEntity, Message, InlineKeyboardButton, Chat
+from telebot.types import InlineKeyboardMarkup as TelebotInlineKeyboardMarkup
 
 import config_utils
 from tests import test_helper
@@ -113,6 +120,34 @@ class IsPostDataEqualTest(TestCase):
 		self.assertFalse(utils.is_post_data_equal(post_data1, post_data2))
 
 
+class GetPostContentHashTest(TestCase):
+	def test_equal_posts(self):
+		scheduled_tag = "#s 2024-08-05 18:00"
+		text = f"test 0991234567 test\n#o #bb #p2 {scheduled_tag}"
+		entities1 = test_helper.create_hashtag_entity_list(text)
+		entities2 = [MessageEntity(type="phone_number", offset=5, length=10)] + test_helper.create_hashtag_entity_list(text)
+		entities2[-1].length = len(scheduled_tag)
+
+		post_data1 = test_helper.create_mock_message(text, entities1)
+		post_data2 = test_helper.create_mock_message(text, entities2)
+
+		self.assertEqual(utils.get_post_content_hash(post_data1), utils.get_post_content_hash(post_data2))
+
+	def test_different_posts(self):
+		text = "test test\n#o #bb #p2"
+		entities = test_helper.create_hashtag_entity_list(text)
+		content_hash = utils.get_post_content_hash(test_helper.create_mock_message(text, entities))
+
+		other_text = "asdf asdf\n#o #bb #p2"
+		other_posts = [
+			test_helper.create_mock_message(other_text, test_helper.create_hashtag_entity_list(other_text)),
+			test_helper.create_mock_message(text, entities[:-1]),
+			test_helper.create_mock_message(text, [MessageEntity(type="bold", offset=0, length=4)] + entities),
+		]
+		for post_data in other_posts:
+			self.assertNotEqual(utils.get_post_content_hash(post_data), content_hash)
+
+
 class ReplaceWhitespacesTest(TestCase):
 	def test_replace_whitespaces(self):
 		text = "test 0991234567 test\n#o\xa0#bb\xa0#p2"
@@ -124,6 +159,28 @@ class ReplaceWhitespacesTest(TestCase):
 		result = utils.replace_whitespaces(text)
 		self.assertEqual(result, text)
 
+class CopyPostDataTest(TestCase):
+	def test_copy(self):
+		raw_message = {"message_id": 125, "date": 1700000000, "text": "125. test #o",
+					   "entities": [{"type": "text_link", "offset": 0, "length": 3, "url": "https://t.me/c/12345678/125"},
+									{"type": "hashtag", "offset": 10, "length": 2}],
+					   "chat": {"id": -10012345678, "type": "channel", "title": "Main"},
+					   "reply_markup": {"inline_keyboard": [[{"text": "#o", "callback_data": "s,1"}]]}}
+		post_data = Message.de_json(json.dumps(raw_message))
+
+		post_data_copy = utils.copy_post_data(post_data)
+		post_data_copy.chat.id = -10087654321
+		post_data_copy.entities[1].offset = 5
+		post_data_copy.reply_markup.keyboard[0][0].text = "#x"
+		utils.set_post_content(post_data_copy, "test", [])
+
+		self.assertEqual(post_data.chat.id, -10012345678)
+		self.assertEqual(post_data.entities[1].offset, 10)
+		self.assertEqual(post_data.reply_markup.keyboard[0][0].text, "#o")
+		self.assertEqual(post_data.text, "125. test #o")
+		self.assertIs(post_data_copy.json, post_data.json)
+
+
 class MergeKeyboardMarkupTest(TestCase):
 	def test_merge_empty_keyboards(self):
 		mock_keyboard = Mock(spec=InlineKeyboardMarkup)
@@ -262,6 +319,227 @@ class GetMessageContentByIdTest(TestCase):
 		self.assertEqual(result.chat, mock_chat)
 
 
+
+def create_keyboard(*texts):
+	return TelebotInlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=text) for text in texts]])
+
+
+class KeyboardMarkupStoreTest(TestCase):
+	def test_sent_keyboard(self):
+		store = utils.KeyboardMarkupStore(max_size=10, log_interval=60)
+		self.assertFalse(store.is_sent(-1001, 10, create_keyboard("a")))
+		store.save(-1001, 10, create_keyboard("a"))
+
+		self.assertTrue(store.is_sent(-1001, 10, create_keyboard("a")))
+		self.assertFalse(store.is_sent(-1001, 10, create_keyboard("a", "b")))
+		self.assertFalse(store.is_sent(-1001, 10, None))
+		self.assertFalse(store.is_sent(-1001, 10, create_keyboard("a"), "text"))
+		self.assertFalse(store.is_sent(-1001, 11, create_keyboard("a")))
+		self.assertEqual((store.sent_count, store.skipped_count), (5, 1))
+
+		store.invalidate(-1001, 10)
+		self.assertFalse(store.is_sent(-1001, 10, create_keyboard("a")))
+
+	def test_text(self):
+		store = utils.KeyboardMarkupStore(max_size=10, log_interval=60)
+		store.save(-1001, 10, None, "text")
+		self.assertTrue(store.is_sent(-1001, 10, None, "text"))
+		self.assertFalse(store.is_sent(-1001, 10, None, "new text"))
+
+	def test_unknown_keyboard(self):
+		store = utils.KeyboardMarkupStore(max_size=10, log_interval=60)
+		store.save(-1001, 10, create_keyboard("a"))
+		store.save(-1001, 10, Mock())
+		self.assertFalse(store.is_sent(-1001, 10, create_keyboard("a")))
+		self.assertFalse(store.is_sent(-1001, 10, Mock()))
+
+	def test_max_size(self):
+		store = utils.KeyboardMarkupStore(max_size=2, log_interval=60)
+		for message_id in [10, 11, 12]:
+			store.save(-1001, message_id, create_keyboard("a"))
+		self.assertFalse(store.is_sent(-1001, 10, create_keyboard("a")))
+		self.assertTrue(store.is_sent(-1001, 11, create_keyboard("a")))
+		self.assertTrue(store.is_sent(-1001, 12, create_keyboard("a")))
+
+	@patch("logging.info")
+	def test_log_counters(self, mock_info):
+		store = utils.KeyboardMarkupStore(max_size=10, log_interval=0)
+		store.is_sent(-1001, 10, create_keyboard("a"))
+		mock_info.assert_called_once_with("Keyboard edits sent: 1, skipped because keyboard wasn't changed: 0")
+
+
+@patch("utils.store_main_message_content")
+@patch("db_utils.is_individual_channel_exists", return_value=False)
+class EditMessageKeyboardTest(TestCase):
+	def test_skip_unchanged_keyboard(self, *args):
+		mock_bot = Mock(spec=TeleBot)
+		post_data = test_helper.create_mock_message("test", [], -1001, 10)
+		with patch("utils.KEYBOARD_MARKUP_STORE", utils.KeyboardMarkupStore(max_size=10, log_interval=60)):
+			utils.edit_message_keyboard(mock_bot, post_data, create_keyboard("a"))
+			utils.edit_message_keyboard(mock_bot, post_data, create_keyboard("a"))
+			self.assertEqual(mock_bot.edit_message_reply_markup.call_count, 1)
+
+			utils.edit_message_keyboard(mock_bot, post_data, create_keyboard("b"))
+			self.assertEqual(mock_bot.edit_message_reply_markup.call_count, 2)
+
+			utils.edit_message_content(mock_bot, post_data, text="edited")
+			utils.edit_message_keyboard(mock_bot, post_data, create_keyboard("b"))
+			self.assertEqual(mock_bot.edit_message_reply_markup.call_count, 3)
+
+	def test_edit_error(self, *args):
+		mock_bot = Mock(spec=TeleBot)
+		mock_bot.edit_message_reply_markup.side_effect = ApiTelegramException("edit", "", {"error_code": 400, "description": "Bad Request: error"})
+		post_data = test_helper.create_mock_message("test", [], -1001, 10)
+		with patch("utils.KEYBOARD_MARKUP_STORE", utils.KeyboardMarkupStore(max_size=10, log_interval=60)):
+			utils.edit_message_keyboard(mock_bot, post_data, create_keyboard("a"))
+			utils.edit_message_keyboard(mock_bot, post_data, create_keyboard("a"))
+			self.assertEqual(mock_bot.edit_message_reply_markup.call_count, 2)
+
+
+
+@patch("core_api.get_messages_by_ids")
+class MessageContentCacheTest(TestCase):
+	def test_prefetch(self, mock_get_messages_by_ids):
+		mock_bot = Mock(spec=TeleBot)
+		chat_id = -10012345678
+		message = pyrogram.types.Message(id=125, chat=pyrogram.types.Chat(id=chat_id, type=ChatType.CHANNEL),
+										 date=datetime.datetime(2024, 1, 1), text="test #aa",
+										 entities=[pyrogram.types.MessageEntity(type=MessageEntityType.HASHTAG, offset=5, length=3)])
+		mock_empty_message = Mock(empty=True)
+		mock_get_messages_by_ids.return_value = {(chat_id, 125): message, (chat_id, 126): mock_empty_message}
+
+		with utils.message_content_cache():
+			utils.prefetch_message_contents([(chat_id, 125), (chat_id, 126), (chat_id, 125), (chat_id, None)])
+			mock_get_messages_by_ids.assert_called_once_with({chat_id: [125, 126]})
+
+			result = utils.get_message_content_by_id(mock_bot, chat_id, 125)
+			self.assertIsInstance(result, Message)
+			self.assertEqual((result.message_id, result.text), (125, "test #aa"))
+			self.assertEqual([(e.type, e.offset, e.length) for e in result.entities], [("hashtag", 5, 3)])
+			result.chat.id = -100
+			self.assertEqual(utils.get_message_content_by_id(mock_bot, chat_id, 125).chat.id, chat_id)
+			self.assertIsNone(utils.get_message_content_by_id(mock_bot, chat_id, 126))
+			mock_bot.forward_message.assert_not_called()
+
+			utils.prefetch_message_contents([(chat_id, 125)])
+			mock_get_messages_by_ids.assert_called_once()
+
+	def test_convert_pyrogram_message(self, *args):
+		keyboard = InlineKeyboardMarkup([[pyrogram.types.InlineKeyboardButton("a", callback_data=b"cb"),
+										   pyrogram.types.InlineKeyboardButton("b", url="https://t.me/c/1/2")]])
+		message = pyrogram.types.Message(id=125, chat=pyrogram.types.Chat(id=-10012345678, type=ChatType.CHANNEL, title="main"),
+										 date=datetime.datetime(2024, 1, 1), caption="test", caption_entities=[
+											 pyrogram.types.MessageEntity(type=MessageEntityType.TEXT_LINK, offset=0, length=4, url="https://t.me")],
+										 photo=Mock(), reply_markup=keyboard)
+
+		result = utils.convert_pyrogram_message(message)
+		self.assertIsInstance(result, Message)
+		self.assertEqual((result.message_id, result.chat.id, result.content_type), (125, -10012345678, "photo"))
+		self.assertIsNone(result.text)
+		self.assertEqual(result.caption, "test")
+		self.assertEqual([(e.type, e.url) for e in result.caption_entities], [("text_link", "https://t.me")])
+		self.assertEqual([(b.text, b.callback_data, b.url) for b in result.reply_markup.keyboard[0]],
+						 [("a", "cb", None), ("b", None, "https://t.me/c/1/2")])
+		self.assertEqual(result.json["chat"], {"id": -10012345678, "type": "channel", "title": "main"})
+
+	def test_without_context(self, mock_get_messages_by_ids):
+		utils.prefetch_message_contents([(-10012345678, 125)])
+		mock_get_messages_by_ids.assert_not_called()
+
+	@patch("utils._forward_message_content")
+	def test_invalidate_after_edit(self, mock_forward_message_content, mock_get_messages_by_ids):
+		mock_bot = Mock(spec=TeleBot)
+		chat_id = -10012345678
+		mock_forward_message_content.return_value = test_helper.create_mock_message("test", [], chat_id, 125)
+
+		with utils.message_content_cache():
+			utils.get_message_content_by_id(mock_bot, chat_id, 125)
+			utils.get_message_content_by_id(mock_bot, chat_id, 125)
+			mock_forward_message_content.assert_called_once_with(mock_bot, chat_id, 125)
+
+			utils.delete_message(mock_bot, chat_id, 125)
+			utils.get_message_content_by_id(mock_bot, chat_id, 125)
+			self.assertEqual(mock_forward_message_content.call_count, 2)
+
+		utils.get_message_content_by_id(mock_bot, chat_id, 125)
+		self.assertEqual(mock_forward_message_content.call_count, 3)
+		mock_get_messages_by_ids.assert_not_called()
+
+	@patch("utils._forward_message_content")
+	def test_share_with_thread(self, mock_forward_message_content, mock_get_messages_by_ids):
+		mock_bot = Mock(spec=TeleBot)
+		chat_id = -10012345678
+		mock_forward_message_content.return_value = test_helper.create_mock_message("test", [], chat_id, 125)
+
+		with utils.message_content_cache():
+			utils.get_message_content_by_id(mock_bot, chat_id, 125)
+			get_message = utils.share_message_content_cache(lambda: utils.get_message_content_by_id(mock_bot, chat_id, 125))
+			thread = threading.Thread(target=get_message)
+			thread.start()
+			thread.join()
+			mock_forward_message_content.assert_called_once_with(mock_bot, chat_id, 125)
+
+			get_message()
+			utils.get_message_content_by_id(mock_bot, chat_id, 125)
+			mock_forward_message_content.assert_called_once_with(mock_bot, chat_id, 125)
+
+
+class MainMessageContentStorageTest(TestCase):
+	raw_message = {"message_id": 125, "date": 1700000000, "edit_date": 1700000100, "text": "#о test",
+				   "entities": [{"type": "hashtag", "offset": 0, "length": 2}],
+				   "chat": {"id": -10012345678, "type": "channel", "title": "Main"}}
+
+	@patch("db_utils.is_main_channel_exists", return_value=True)
+	@patch("db_utils.insert_or_update_main_message_content")
+	def test_store(self, mock_insert_or_update_main_message_content, *args):
+		post_data = Message.de_json(self.raw_message.copy())
+		utils.store_main_message_content(post_data)
+		mock_insert_or_update_main_message_content.assert_called_once()
+		call_args = mock_insert_or_update_main_message_content.call_args.args
+		self.assertEqual(call_args[:2], (-10012345678, 125))
+		self.assertEqual(call_args[3], 1700000100)
+
+	@patch("db_utils.is_main_channel_exists", return_value=False)
+	@patch("db_utils.insert_or_update_main_message_content")
+	def test_store_not_main_channel(self, mock_insert_or_update_main_message_content, *args):
+		utils.store_main_message_content(Message.de_json(self.raw_message.copy()))
+		utils.store_main_message_content(test_helper.create_mock_message("test", [], -10012345678, 125))
+		mock_insert_or_update_main_message_content.assert_not_called()
+
+	@patch("db_utils.get_main_message_content")
+	def test_get_stored_content(self, mock_get_main_message_content):
+		mock_get_main_message_content.return_value = json.dumps(self.raw_message)
+		mock_bot = Mock(spec=TeleBot)
+
+		result = utils.get_main_message_content_by_id(mock_bot, -10012345678, 125)
+		mock_get_main_message_content.assert_called_once_with(-10012345678, 125, config_utils.MAIN_MESSAGE_CACHE_TTL)
+		mock_bot.forward_message.assert_not_called()
+		self.assertEqual(result.chat.id, -10012345678)
+		self.assertEqual(result.message_id, 125)
+		self.assertEqual(result.text, "#о test")
+		self.assertEqual(result.entities[0].type, "hashtag")
+
+	@patch("db_utils.is_main_channel_exists", return_value=True)
+	@patch("db_utils.delete_main_message_content")
+	@patch("db_utils.is_individual_channel_exists", return_value=False)
+	def test_invalidate_after_failed_edit(self, mock_is_individual_channel_exists, mock_delete_main_message_content, *args):
+		mock_bot = Mock(spec=TeleBot)
+		mock_bot.edit_message_reply_markup.side_effect = ApiTelegramException("edit_message_reply_markup", "", {
+			"error_code": 400, "description": "Bad Request: message to edit not found"})
+		post_data = test_helper.create_mock_message("test", [], -10012345678, 125)
+
+		utils.edit_message_keyboard(mock_bot, post_data, TelebotInlineKeyboardMarkup([]))
+		mock_delete_main_message_content.assert_called_once_with(-10012345678, 125)
+
+	@patch("db_utils.is_main_channel_exists", return_value=True)
+	@patch("db_utils.delete_main_message_content")
+	def test_keep_after_other_error(self, mock_delete_main_message_content, *args):
+		error = ApiTelegramException("edit_message_text", "", {"error_code": 400, "description": "Bad Request: chat not found"})
+
+		utils.invalidate_stored_main_message_content(-10012345678, 125, error)
+		mock_delete_main_message_content.assert_not_called()
+
+
 @patch("utils.set_post_content")
 @patch("utils.offset_entities")
 @patch("utils.get_post_content", side_effect=lambda post_data:
@@ -1,10 +1,17 @@
+import contextlib
 import logging
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from telebot.apihelper import ApiTelegramException
 
-_TIMEOUT_LOCK = threading.Lock()
+import rate_limiter
+
+# attempts after "Too many requests" errors before the error is raised
+_TOO_MANY_REQUESTS_RETRIES = 5
+# seconds to wait before the next attempt when the error has no retry time
+_DEFAULT_RETRY_AFTER = 1
 
 
 def get_timeout_retry(e: ApiTelegramException):
@@ -23,17 +30,88 @@ def get_timeout_retry(e: ApiTelegramException):
 
 
 def timeout_error_lock(func):
+  # requests sent through the bot api limiter wait in the limiter until the retry time is over,
+  # otherwise the retry time is waited here, the amount of attempts is limited
   def inner_function(*args, **kwargs):
-    with _TIMEOUT_LOCK:
-      while True:
-        try:
-          return func(*args, **kwargs)
-        except ApiTelegramException as E:
-          if E.error_code == 429:
-            timeout = get_timeout_retry(E)
-            logging.exception(
-                f"Too many requests error in {func.__name__}, retry in: {timeout}")
-            time.sleep(timeout)
-            continue
+    for attempt in range(_TOO_MANY_REQUESTS_RETRIES + 1):
+      try:
+        return func(*args, **kwargs)
+      except ApiTelegramException as E:
+        if E.error_code != 429 or attempt == _TOO_MANY_REQUESTS_RETRIES:
           raise E
+        timeout = get_timeout_retry(E)
+        logging.warning(f"Too many requests error in {func.__name__}, retry in: {timeout}")
+        if not timeout or not rate_limiter.is_bot_api_limiter_installed():
+          time.sleep(timeout or _DEFAULT_RETRY_AFTER)
   return inner_function
+
+
+def fan_out(func, items, max_workers, thread_name_prefix="fan_out"):
+  # calls func for every item in separate threads, requests are still paced by the rate limiter,
+  # results are returned in order of items, the first error is raised after all calls are finished
+  items = list(items)
+  max_workers = min(max(max_workers, 1), len(items))
+  if max_workers <= 1:
+    return [func(item) for item in items]
+
+  with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix) as executor:
+    futures = [executor.submit(func, item) for item in items]
+  return [future.result() for future in futures]
+
+
+class KeyedLockManager:
+  # reentrant lock for every key, locks are created on demand and removed when nobody holds or waits for them,
+  # keys are acquired in ascending order, acquiring a key that is lower than a key held by the same thread
+  # raises RuntimeError, so two threads can't wait for each other
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._locks = {}
+    self._local = threading.local()
+
+  def _get_held_keys(self) -> list:
+    if not hasattr(self._local, "keys"):
+      self._local.keys = []
+    return self._local.keys
+
+  def _acquire(self, key):
+    held_keys = self._get_held_keys()
+    if key not in held_keys and held_keys and max(held_keys) > key:
+      raise RuntimeError(f"Lock {key} is acquired after {max(held_keys)}")
+
+    with self._lock:
+      entry = self._locks.setdefault(key, [threading.RLock(), 0])
+      entry[1] += 1
+    try:
+      entry[0].acquire()
+    except BaseException:
+      self._remove_user(key)
+      raise
+    held_keys.append(key)
+
+  def _remove_user(self, key):
+    with self._lock:
+      entry = self._locks[key]
+      entry[1] -= 1
+      if entry[1] == 0:
+        del self._locks[key]
+
+  def _release(self, key):
+    self._get_held_keys().remove(key)
+    self._locks[key][0].release()
+    self._remove_user(key)
+
+  @contextlib.contextmanager
+  def lock(self, *keys):
+    acquired_keys = []
+    try:
+      for key in sorted(set(keys)):
+        self._acquire(key)
+        acquired_keys.append(key)
+      yield
+    finally:
+      for key in reversed(acquired_keys):
+        self._release(key)
+
+  def __len__(self) -> int:
+    with self._lock:
+      return len(self._locks)
@@ -1,4 +1,6 @@
+import contextlib
 import logging
+import threading
 import time
 from typing import Union
 
@@ -20,6 +22,14 @@ class MEMBER_CACHE_KEYS:
 
 USER_DATA: dict = {}
 MEMBER_CACHE = {}
+_MEMBERS_LISTENERS = []
+_USER_TAGS_SNAPSHOT = threading.local()
+
+
+def add_members_listener(listener):
+	# listener is called with channel id when members of the channel are changed
+	_MEMBERS_LISTENERS.append(listener)
+
 
 def get_signature(user: Union[telebot.types.User, telebot.types.Chat]):
 	if user.first_name and user.last_name:
@@ -80,14 +90,35 @@ def get_user(bot: telebot.TeleBot, user: Union[str, int]):
 	logging.error(f"Error during loading info about user {user} using core api")
 
 
+@contextlib.contextmanager
+def user_tags_snapshot():
+	# user tags of every channel are computed once inside the block, used while one ticket is parsed
+	if getattr(_USER_TAGS_SNAPSHOT, "tags", None) is not None:
+		yield
+		return
+
+	_USER_TAGS_SNAPSHOT.tags = {}
+	try:
+		yield
+	finally:
+		_USER_TAGS_SNAPSHOT.tags = None
+
+
 def get_user_tags(channel_id: int = None) -> dict:
+	snapshot = getattr(_USER_TAGS_SNAPSHOT, "tags", None)
+	if snapshot is not None and channel_id in snapshot:
+		return snapshot[channel_id]
+
 	tags = config_utils.USER_TAGS
 	if tags and channel_id:
 		all_tags, tags = tags, {}
-		member_ids = get_member_ids_channel(channel_id)
+		member_ids = set(get_member_ids_channel(channel_id))
 		for tag in all_tags:
 			if all_tags[tag] in member_ids:
 				tags[tag] = all_tags[tag]
+
+	if snapshot is not None:
+		snapshot[channel_id] = tags
 	return tags
 
 
@@ -123,10 +154,14 @@ def set_member_ids_channels(channel_ids: list) -> None:
 		if channel_users and channel_id in channel_users:
 			users = list(map(lambda user: user.id, channel_users[channel_id]))
 
+		previous_users = MEMBER_CACHE[channel_id][MEMBER_CACHE_KEYS.USER] if channel_id in MEMBER_CACHE else None
 		MEMBER_CACHE[channel_id] = {
 			MEMBER_CACHE_KEYS.USER: users,
 			MEMBER_CACHE_KEYS.TIME: now
 		}
+		if previous_users is not None and set(previous_users) != set(users):
+			for listener in _MEMBERS_LISTENERS:
+				listener(channel_id)
 
 
 def update_all_channel_members():
@@ -203,7 +238,11 @@ def update_data_on_member_change(member_update: telebot.types.ChatMemberUpdated,
 	channel_id = member_update.chat.id
 
 	if old_status in ["left", "kicked"] or new_status in ["left", "kicked"] and user_id != bot.user.id:
-		if db_utils.is_main_channel_exists(channel_id) or db_utils.is_individual_channel_exists(channel_id):
+		if db_utils.is_main_channel_exists(channel_id):
+			user_utils.set_member_ids_channels([member_update.chat.id])
+			# user buttons of all tickets depend on the workspace members
+			db_utils.mark_channel_tickets_dirty(channel_id)
+		elif db_utils.is_individual_channel_exists(channel_id):
 			user_utils.set_member_ids_channels([member_update.chat.id])
 
 
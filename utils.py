@@ -1,4 +1,11 @@
+import collections
+import contextlib
+import copy
+import hashlib
+import json
 import logging
+import re
+import threading
 from typing import List, Optional, Union
 import time
 import datetime
@@ -9,6 +16,7 @@ from telebot.apihelper import ApiTelegramException
 from telebot.types import MessageEntity
 
 import config_utils
+import core_api
 import db_utils
 import post_link_utils
 import threading_utils
@@ -19,8 +27,13 @@ from config_utils import MAX_BUTTONS_IN_ROW
 SAME_MSG_CONTENT_ERROR = "Bad Request: message is not modified: specified new message content and reply markup are exactly the same as a current content and reply markup of the message"
 MSG_CANT_BE_DELETED_ERROR = "message can't be deleted"
 MSG_NOT_FOUND_ERROR = "message to delete not found"
+MSG_TO_EDIT_NOT_FOUND_ERROR = "message to edit not found"
 KICKED_FROM_CHANNEL_ERROR = "Forbidden: bot was kicked from the channel chat"
 
+_MESSAGE_CONTENT_CACHE = threading.local()
+_ASTRAL_CHARACTERS = re.compile("[\U00010000-\U0010ffff]")
+_WHITESPACES_TO_REPLACE = re.compile(r"[^\S\n\t]")
+
 
 def align_entities_to_utf8(text: str, entities: List[telebot.types.MessageEntity]):
 	if not entities:
@@ -28,13 +41,13 @@ def align_entities_to_utf8(text: str, entities: List[telebot.types.MessageEntity
 
 	aligned_entities = []
 	remained_entities = [e for e in entities if not getattr(e, "aligned_to_utf8", False)]
-	for i, c in enumerate(text):
-		if ord(c) > 0xffff:
-			remained_entities = [e for e in remained_entities if e.offset > i]
-			for entity in remained_entities:
-				entity.offset -= 1
-				if entity not in aligned_entities:
-					aligned_entities.append(entity)
+	for match in _ASTRAL_CHARACTERS.finditer(text):
+		i = match.start()
+		remained_entities = [e for e in remained_entities if e.offset > i]
+		for entity in remained_entities:
+			entity.offset -= 1
+			if entity not in aligned_entities:
+				aligned_entities.append(entity)
 
 	for entity in aligned_entities:
 		entity.aligned_to_utf8 = True
@@ -48,13 +61,13 @@ def align_entities_to_utf16(text: str, entities: List[telebot.types.MessageEntit
 
 	aligned_entities = []
 	remained_entities = [e for e in entities if getattr(e, "aligned_to_utf8", False)]
-	for i, c in enumerate(text):
-		if ord(c) > 0xffff:
-			remained_entities = [e for e in remained_entities if e.offset > i]
-			for entity in remained_entities:
-				entity.offset += 1
-				if entity not in aligned_entities:
-					aligned_entities.append(entity)
+	for match in _ASTRAL_CHARACTERS.finditer(text):
+		i = match.start()
+		remained_entities = [e for e in remained_entities if e.offset > i]
+		for entity in remained_entities:
+			entity.offset += 1
+			if entity not in aligned_entities:
+				aligned_entities.append(entity)
 
 	for entity in aligned_entities:
 		entity.aligned_to_utf8 = False
@@ -103,10 +116,8 @@ def get_forwarded_from_id(message_data: Union[pyrogram.types.Message, telebot.ty
 
 
 def replace_whitespaces(text):
-	result = ""
-	for c in text:
-		result += " " if (c not in ['\n', '\t'] and c.isspace()) else c
-	return result
+	# every whitespace character except new lines and tabs is replaced with a regular space
+	return _WHITESPACES_TO_REPLACE.sub(" ", text)
 
 
 def get_post_content(post_data: telebot.types.Message):
@@ -143,19 +154,23 @@ def edit_message_content(bot: telebot.TeleBot, post_data: telebot.types.Message,
 		kwargs["entities"] = post_data.entities if post_data.entities else post_data.caption_entities
 
 	kwargs["entities"] = align_entities_to_utf16(kwargs["text"], kwargs["entities"])
+	invalidate_cached_message_content(kwargs["chat_id"], kwargs["message_id"])
+	KEYBOARD_MARKUP_STORE.invalidate(kwargs["chat_id"], kwargs["message_id"])
 
 	try:
 		if post_data.text is not None:
-			bot.edit_message_text(**kwargs)
+			edited_message = bot.edit_message_text(**kwargs)
 		else:
 			kwargs["caption"] = kwargs.pop("text")
 			kwargs["caption_entities"] = kwargs.pop("entities")
-			bot.edit_message_caption(**kwargs)
+			edited_message = bot.edit_message_caption(**kwargs)
+		store_main_message_content(edited_message)
 	except ApiTelegramException as E:
 		if E.error_code == 429:
 			raise E
 		if E.description == SAME_MSG_CONTENT_ERROR:
 			return
+		invalidate_stored_main_message_content(kwargs["chat_id"], kwargs["message_id"], E)
 
 
 def is_post_data_equal(post_data: telebot.types.Message, post_data_original: telebot.types.Message):
@@ -188,6 +203,17 @@ def is_post_data_equal(post_data: telebot.types.Message, post_data_original: tel
 	return True
 
 
+def get_post_content_hash(post_data: telebot.types.Message) -> str:
+	# posts with equal hashes are equal for is_post_data_equal, hashtag lengths are ignored in the same way,
+	# keyboards aren't hashed, because they differ in every subchannel, keyboard of an unchanged copy
+	# is compared separately by edit_message_keyboard before its edit is skipped
+	text, entities = get_post_content(post_data)
+	entities = [[e.type, e.offset, None if e.type == "hashtag" else e.length, e.url]
+				for e in entities or [] if e.type != "phone_number"]
+	content = json.dumps([text, entities], ensure_ascii=False)
+	return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
 def add_channel_id_to_post_data(post_data: telebot.types.Message):
 	channel_id = post_data.chat.id
 
@@ -218,6 +244,61 @@ def place_buttons_in_rows(buttons: List[telebot.types.InlineKeyboardButton]):
 	return rows
 
 
+class KeyboardMarkupStore:
+	# keyboards that were last sent to messages, so the same keyboard isn't sent again,
+	# messages that weren't edited since the start are always edited the first time
+	def __init__(self, max_size: int, log_interval: int):
+		self._lock = threading.Lock()
+		self._markups = collections.OrderedDict()
+		self._max_size = max_size
+		self._log_interval = log_interval
+		self._last_log_time = time.monotonic()
+		self.sent_count = 0
+		self.skipped_count = 0
+
+	@staticmethod
+	def _serialize(keyboard_markup: telebot.types.InlineKeyboardMarkup, text: str = None) -> str | None:
+		if keyboard_markup is not None and not isinstance(keyboard_markup, telebot.types.InlineKeyboardMarkup):
+			return None
+		keyboard = keyboard_markup.to_dict() if keyboard_markup else None
+		return json.dumps([text, keyboard], sort_keys=True, ensure_ascii=False)
+
+	def is_sent(self, chat_id: int, message_id: int, keyboard_markup: telebot.types.InlineKeyboardMarkup, text: str = None) -> bool:
+		markup = self._serialize(keyboard_markup, text)
+		with self._lock:
+			is_sent = markup is not None and self._markups.get((chat_id, message_id)) == markup
+			if is_sent:
+				self._markups.move_to_end((chat_id, message_id))
+				self.skipped_count += 1
+			else:
+				self.sent_count += 1
+			self._log_counters()
+		return is_sent
+
+	def save(self, chat_id: int, message_id: int, keyboard_markup: telebot.types.InlineKeyboardMarkup, text: str = None):
+		markup = self._serialize(keyboard_markup, text)
+		with self._lock:
+			self._markups.pop((chat_id, message_id), None)
+			if markup is None:
+				return
+			self._markups[(chat_id, message_id)] = markup
+			if len(self._markups) > self._max_size:
+				self._markups.popitem(last=False)
+
+	def invalidate(self, chat_id: int, message_id: int):
+		with self._lock:
+			self._markups.pop((chat_id, message_id), None)
+
+	def _log_counters(self):
+		now = time.monotonic()
+		if now - self._last_log_time >= self._log_interval:
+			self._last_log_time = now
+			logging.info(f"Keyboard edits sent: {self.sent_count}, skipped because keyboard wasn't changed: {self.skipped_count}")
+
+
+KEYBOARD_MARKUP_STORE = KeyboardMarkupStore(max_size=50_000, log_interval=60 * 60)
+
+
 @threading_utils.timeout_error_lock
 def edit_message_keyboard(bot: telebot.TeleBot, post_data: telebot.types.Message,
                           keyboard_markup: telebot.types.InlineKeyboardMarkup = None, chat_id: int = None, message_id: int = None):
@@ -236,13 +317,22 @@ def edit_message_keyboard(bot: telebot.TeleBot, post_data: telebot.types.Message
 			keyboard_markup = merge_keyboard_markup(keyboard_markup,
 								channel_manager.get_ticket_settings_buttons(chat_id))
 
+	if KEYBOARD_MARKUP_STORE.is_sent(chat_id, message_id, keyboard_markup):
+		return
+
+	invalidate_cached_message_content(chat_id, message_id)
 	try:
-		bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=keyboard_markup)
+		edited_message = bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=keyboard_markup)
+		KEYBOARD_MARKUP_STORE.save(chat_id, message_id, keyboard_markup)
+		store_main_message_content(edited_message)
 	except ApiTelegramException as E:
 		if E.error_code == 429:
 			raise E
 		if E.description == SAME_MSG_CONTENT_ERROR:
+			KEYBOARD_MARKUP_STORE.save(chat_id, message_id, keyboard_markup)
 			return
+		KEYBOARD_MARKUP_STORE.invalidate(chat_id, message_id)
+		invalidate_stored_main_message_content(chat_id, message_id, E)
 		logging.info(f"Exception during adding keyboard - {E}")
 
 
@@ -288,6 +378,8 @@ def get_keys_by_value(d: dict[object, object], search: object) -> list[object]:
 
 @threading_utils.timeout_error_lock
 def delete_message(bot: telebot.TeleBot, chat_id: int, message_id: int):
+	invalidate_cached_message_content(chat_id, message_id)
+	KEYBOARD_MARKUP_STORE.invalidate(chat_id, message_id)
 	try:
 		return bot.delete_message(chat_id=chat_id, message_id=message_id)
 	except ApiTelegramException as E:
@@ -352,8 +444,98 @@ def add_comment_to_ticket(bot: telebot.TeleBot, post_data: telebot.types.Message
 		db_utils.set_ticket_update_time(main_message_id, main_channel_id, int(time.time()))
 
 
-@threading_utils.timeout_error_lock
+@contextlib.contextmanager
+def message_content_cache():
+	# messages read inside this context are cached until the outermost context exits,
+	# so the same message is fetched only once while handling one update
+	if getattr(_MESSAGE_CONTENT_CACHE, "messages", None) is not None:
+		yield
+		return
+
+	_MESSAGE_CONTENT_CACHE.messages = {}
+	try:
+		yield
+	finally:
+		_MESSAGE_CONTENT_CACHE.messages = None
+
+
+def _get_message_content_cache() -> Optional[dict]:
+	return getattr(_MESSAGE_CONTENT_CACHE, "messages", None)
+
+
+def share_message_content_cache(func):
+	# func will use message cache of the current thread when it is called from another thread
+	messages = _get_message_content_cache()
+
+	def inner_function(*args, **kwargs):
+		previous_messages = _get_message_content_cache()
+		_MESSAGE_CONTENT_CACHE.messages = messages
+		try:
+			return func(*args, **kwargs)
+		finally:
+			_MESSAGE_CONTENT_CACHE.messages = previous_messages
+	return inner_function
+
+
+def copy_post_data(post_data: telebot.types.Message):
+	# copies only the fields that are changed by callers: chat, ids, content, entities and keyboard,
+	# raw json, media and sender data of the message are shared with the original
+	post_data_copy = copy.copy(post_data)
+	post_data_copy.chat = copy.copy(post_data.chat)
+	for field in ["entities", "caption_entities"]:
+		entities = getattr(post_data, field, None)
+		if entities:
+			setattr(post_data_copy, field, [copy.copy(entity) for entity in entities])
+	post_data_copy.reply_markup = copy.deepcopy(getattr(post_data, "reply_markup", None))
+	return post_data_copy
+
+
+def invalidate_cached_message_content(chat_id: int, message_id: int):
+	cache = _get_message_content_cache()
+	if cache is not None:
+		cache.pop((chat_id, message_id), None)
+
+
+def prefetch_message_contents(message_keys: list):
+	cache = _get_message_content_cache()
+	if cache is None:
+		return
+
+	message_ids_by_chat = {}
+	for chat_id, message_id in message_keys:
+		if message_id is None or (chat_id, message_id) in cache:
+			continue
+		chat_message_ids = message_ids_by_chat.setdefault(chat_id, [])
+		if message_id not in chat_message_ids:
+			chat_message_ids.append(message_id)
+
+	if not message_ids_by_chat:
+		return
+
+	messages = core_api.get_messages_by_ids(message_ids_by_chat)
+	if messages is None:
+		logging.info(f"Can't prefetch messages {message_ids_by_chat}, they will be fetched one by one")
+		return
+
+	for key, message in messages.items():
+		cache[key] = None if message.empty else convert_pyrogram_message(message)
+
+
 def get_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: int):
+	cache = _get_message_content_cache()
+	if cache is not None and (chat_id, message_id) in cache:
+		message = cache[(chat_id, message_id)]
+		return copy_post_data(message) if message else None
+
+	message = _forward_message_content(bot, chat_id, message_id)
+	if cache is not None:
+		cache[(chat_id, message_id)] = message
+		return copy_post_data(message) if message else None
+	return message
+
+
+@threading_utils.timeout_error_lock
+def _forward_message_content(bot: telebot.TeleBot, chat_id: int, message_id: int):
 	try:
 		forwarded_message = bot.forward_message(chat_id=config_utils.DUMP_CHAT_ID, from_chat_id=chat_id,
 												message_id=message_id)
@@ -368,8 +550,50 @@ def get_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: in
 	return forwarded_message
 
 
-@threading_utils.timeout_error_lock
+def store_main_message_content(post_data: telebot.types.Message):
+	# only messages received from the bot api are stored, their raw json is used to restore them later
+	if not isinstance(post_data, telebot.types.Message) or not isinstance(getattr(post_data, "json", None), dict):
+		return
+	if not db_utils.is_main_channel_exists(post_data.chat.id):
+		return
+
+	content = json.dumps(post_data.json, ensure_ascii=False)
+	db_utils.insert_or_update_main_message_content(post_data.chat.id, post_data.message_id, content, post_data.edit_date)
+
+
+def invalidate_stored_main_message_content(chat_id: int, message_id: int, error: ApiTelegramException):
+	# edit of deleted ticket fails, so its stored content isn't used anymore
+	if not error.description.endswith(MSG_TO_EDIT_NOT_FOUND_ERROR):
+		return
+	if not db_utils.is_main_channel_exists(chat_id):
+		return
+
+	db_utils.delete_main_message_content(chat_id, message_id)
+	logging.info(f"Stored content of {[message_id, chat_id]} is removed, message to edit not found")
+
+
+def get_stored_main_message_content(chat_id: int, message_id: int):
+	content = db_utils.get_main_message_content(chat_id, message_id, config_utils.MAIN_MESSAGE_CACHE_TTL)
+	if content:
+		return telebot.types.Message.de_json(content)
+
+
 def get_main_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: int):
+	# stored content of deleted ticket is removed after the failed edit of this ticket,
+	# then ApiTelegramException is raised by the forward as before
+	cache = _get_message_content_cache()
+	if cache is not None and cache.get((chat_id, message_id)):
+		return copy_post_data(cache[(chat_id, message_id)])
+
+	stored_message = get_stored_main_message_content(chat_id, message_id)
+	if stored_message:
+		return stored_message
+
+	return _forward_main_message_content(bot, chat_id, message_id)
+
+
+@threading_utils.timeout_error_lock
+def _forward_main_message_content(bot: telebot.TeleBot, chat_id: int, message_id: int):
 	try:
 		forwarded_message = bot.forward_message(chat_id=config_utils.DUMP_CHAT_ID, from_chat_id=chat_id,
 												message_id=message_id)
@@ -406,6 +630,7 @@ def copy_message(bot: telebot.TeleBot, **kwargs):
 
 @threading_utils.timeout_error_lock
 def remove_keyboard(bot: telebot.TeleBot, chat_id: int, message_id: int):
+	KEYBOARD_MARKUP_STORE.invalidate(chat_id, message_id)
 	bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
 
 
@@ -428,6 +653,7 @@ def parse_datetime(datetime_str, template_str):
 
 @threading_utils.timeout_error_lock
 def mark_message_for_deletion(bot: telebot.TeleBot, chat_id: int, message_id: int):
+	KEYBOARD_MARKUP_STORE.invalidate(chat_id, message_id)
 	try:
 		bot.edit_message_text(text=config_utils.TO_DELETE_MSG_TEXT, chat_id=chat_id, message_id=message_id)
 	except ApiTelegramException as E:
@@ -456,6 +682,52 @@ def update_forwarded_fields(message: pyrogram.types.Message) -> None:
 	message.content_type = __get_content_type_pyrogram_message(message)
 	message.message_id = message.id
 
+def convert_pyrogram_message(message: pyrogram.types.Message) -> telebot.types.Message:
+	# converts message to the same shape as messages forwarded by the bot, fields that aren't used by readers are skipped
+	message_json = {
+		"message_id": message.id,
+		"date": int(message.date.timestamp()) if message.date else 0,
+		"chat": {"id": message.chat.id, "type": message.chat.type.name.lower() if message.chat.type else "channel"},
+	}
+	if message.chat.title:
+		message_json["chat"]["title"] = message.chat.title
+	if message.from_user:
+		message_json["from"] = __convert_pyrogram_user(message.from_user)
+	if message.text is not None:
+		message_json["text"] = str(message.text)
+		message_json["entities"] = [__convert_pyrogram_entity(e) for e in message.entities or []]
+	elif message.caption is not None:
+		message_json["caption"] = str(message.caption)
+		message_json["caption_entities"] = [__convert_pyrogram_entity(e) for e in message.caption_entities or []]
+	if isinstance(message.reply_markup, pyrogram.types.InlineKeyboardMarkup):
+		message_json["reply_markup"] = {"inline_keyboard": [[__convert_pyrogram_button(b) for b in row]
+															for row in message.reply_markup.inline_keyboard]}
+
+	converted_message = telebot.types.Message.de_json(message_json)
+	converted_message.content_type = __get_content_type_pyrogram_message(message)
+	return converted_message
+
+def __convert_pyrogram_user(user: pyrogram.types.User) -> dict:
+	return {"id": user.id, "is_bot": bool(user.is_bot), "first_name": user.first_name or ""}
+
+def __convert_pyrogram_entity(entity: pyrogram.types.MessageEntity) -> dict:
+	result = {"type": entity.type.name.lower(), "offset": entity.offset, "length": entity.length}
+	for field in ["url", "language", "custom_emoji_id"]:
+		if getattr(entity, field, None) is not None:
+			result[field] = getattr(entity, field)
+	if getattr(entity, "user", None) is not None:
+		result["user"] = __convert_pyrogram_user(entity.user)
+	return result
+
+def __convert_pyrogram_button(button: pyrogram.types.InlineKeyboardButton) -> dict:
+	result = {"text": button.text}
+	callback_data = button.callback_data
+	if callback_data is not None:
+		result["callback_data"] = callback_data.decode() if isinstance(callback_data, bytes) else callback_data
+	if button.url is not None:
+		result["url"] = button.url
+	return result
+
 def __update_entities(entities: list) -> list:
 	result = []
 	for ent in entities: